@@ -1,10 +1,38 @@
+import os
 from rest_framework import serializers
+from django.conf import settings
+from django.db import models
+from django.urls import reverse
 from django.contrib.auth.models import User
 from django.contrib.contenttypes.models import ContentType
 from music.models import (
     Artist, Album, Track, Mixtape, Genre, UserProfile, 
     Follow, Like, Comment, Share, FeedItem, TrendingMusic, Compilation
 )
+from hls_utils import hls_root
+from image_utils import image_sources, load_renditions, rendition_srcset
+
+
+class RenditionListSerializer(serializers.ListSerializer):
+    """Looks up the renditions of every image on the page in one query before serializing it"""
+
+    def to_representation(self, data):
+        items = list(data.all() if isinstance(data, models.Manager) else data)
+        renditions = self.context.setdefault('renditions', {})
+        missing = image_sources(items) - renditions.keys()
+        if missing:
+            renditions.update(load_renditions(missing))
+        return super().to_representation(items)
+
+
+class RenditionsMixin:
+    """Image rendition URLs from the renditions loaded for the page (see RenditionListSerializer)"""
+
+    def get_renditions(self, image_field):
+        renditions = self.context.setdefault('renditions', {})
+        if image_field and image_field.name not in renditions:
+            renditions.update(load_renditions([image_field.name]))
+        return rendition_srcset(image_field, self.context.get('request'), renditions)
 
 
 class UserSerializer(serializers.ModelSerializer):
@@ -30,16 +58,18 @@ class GenreSerializer(serializers.ModelSerializer):
         fields = ['id', 'name', 'slug']
 
 
-class ArtistSerializer(serializers.ModelSerializer):
+class ArtistSerializer(RenditionsMixin, serializers.ModelSerializer):
     user = UserSerializer(read_only=True)
     followers_count = serializers.ReadOnlyField()
     is_following = serializers.SerializerMethodField()
     image = serializers.SerializerMethodField()
+    image_renditions = serializers.SerializerMethodField()
     
     class Meta:
         model = Artist
+        list_serializer_class = RenditionListSerializer
         fields = [
-            'id', 'name', 'slug', 'bio', 'image', 'user', 'is_verified',
+            'id', 'name', 'slug', 'bio', 'image', 'image_renditions', 'user', 'is_verified',
             'followers_count', 'is_following', 'created_at', 'updated_at'
         ]
 
@@ -51,6 +81,9 @@ class ArtistSerializer(serializers.ModelSerializer):
             return obj.image.url
         return None
 
+    def get_image_renditions(self, obj):
+        return self.get_renditions(obj.image)
+
     def get_is_following(self, obj):
         request = self.context.get('request')
         if request and request.user.is_authenticated and obj.user:
@@ -90,19 +123,27 @@ class TrackSerializer(serializers.ModelSerializer):
     is_liked = serializers.SerializerMethodField()
     audio_file = serializers.SerializerMethodField()
     optimized_file = serializers.SerializerMethodField()
+    hls_url = serializers.SerializerMethodField()
+    waveform_url = serializers.SerializerMethodField()
+    preview_url = serializers.SerializerMethodField()
 
     class Meta:
         model = Track
+        list_serializer_class = RenditionListSerializer
         fields = [
             'id', 'title', 'slug', 'artist', 'album', 'genre', 'featuring_artists',
-            'track_number', 'duration', 'audio_file', 'optimized_file', 'file_size', 'bitrate',
-            'format', 'is_explicit', 'download_count', 'likes_count',
+            'track_number', 'duration', 'audio_file', 'optimized_file', 'hls_url', 'waveform_url', 'preview_url', 'file_size', 'bitrate',
+            'format', 'is_explicit', 'download_count', 'play_count', 'likes_count',
             'comments_count', 'is_liked', 'created_at', 'updated_at',
             # Metadata fields
             'original_filename', 'extracted_title', 'extracted_artist', 'extracted_album',
             'extracted_year', 'extracted_genre', 'extracted_track_number',
+            # Audio properties read from the file headers
+            'duration_ms', 'bitrate_kbps', 'sample_rate', 'channels', 'codec', 'file_size_bytes',
             # Processing info
-            'is_processed', 'processed_at', 'has_site_branding', 'is_optimized'
+            'is_processed', 'processed_at', 'has_site_branding', 'is_optimized',
+            # Loudness, for gain applied at playback
+            'loudness_integrated', 'loudness_range', 'true_peak', 'replaygain_track_gain'
         ]
 
     def get_audio_file(self, obj):
@@ -121,6 +162,33 @@ class TrackSerializer(serializers.ModelSerializer):
             return obj.optimized_file.url
         return None
 
+    def get_hls_url(self, obj):
+        if obj.hls_playlist:
+            name = os.path.relpath(os.path.join(settings.MEDIA_ROOT, obj.hls_playlist), hls_root(obj.id))
+            url = reverse('track_hls', args=[obj.id, name.replace(os.sep, '/')])
+            request = self.context.get('request')
+            if request:
+                return request.build_absolute_uri(url)
+            return url
+        return None
+
+    def get_waveform_url(self, obj):
+        if obj.waveform:
+            url = reverse('track_waveform', args=[obj.id, os.path.basename(obj.waveform.name)])
+            request = self.context.get('request')
+            if request:
+                return request.build_absolute_uri(url)
+            return url
+        return None
+
+    def get_preview_url(self, obj):
+        if obj.preview_file:
+            request = self.context.get('request')
+            if request:
+                return request.build_absolute_uri(obj.preview_file.url)
+            return obj.preview_file.url
+        return None
+
     def get_likes_count(self, obj):
         return Like.objects.filter(
             content_type=ContentType.objects.get_for_model(Track),
@@ -156,7 +224,7 @@ class TrackDetailSerializer(TrackSerializer):
         return None
 
 
-class AlbumSerializer(serializers.ModelSerializer):
+class AlbumSerializer(RenditionsMixin, serializers.ModelSerializer):
     artist = ArtistSerializer(read_only=True)
     genre = GenreSerializer(read_only=True)
     tracks_count = serializers.SerializerMethodField()
@@ -164,12 +232,14 @@ class AlbumSerializer(serializers.ModelSerializer):
     comments_count = serializers.SerializerMethodField()
     is_liked = serializers.SerializerMethodField()
     cover_art = serializers.SerializerMethodField()
+    cover_art_renditions = serializers.SerializerMethodField()
 
     class Meta:
         model = Album
+        list_serializer_class = RenditionListSerializer
         fields = [
             'id', 'title', 'slug', 'artist', 'genre', 'release_date',
-            'cover_art', 'description', 'is_explicit', 'bitrate', 'format',
+            'cover_art', 'cover_art_renditions', 'description', 'is_explicit', 'bitrate', 'format',
             'download_count', 'tracks_count', 'likes_count', 'comments_count',
             'is_liked', 'created_at', 'updated_at'
         ]
@@ -182,6 +252,9 @@ class AlbumSerializer(serializers.ModelSerializer):
             return obj.cover_art.url
         return None
 
+    def get_cover_art_renditions(self, obj):
+        return self.get_renditions(obj.cover_art)
+
     def get_tracks_count(self, obj):
         return obj.tracks.count()
 
@@ -215,20 +288,25 @@ class AlbumDetailSerializer(AlbumSerializer):
         fields = AlbumSerializer.Meta.fields + ['tracks']
 
 
-class MixtapeSerializer(serializers.ModelSerializer):
+class MixtapeSerializer(RenditionsMixin, serializers.ModelSerializer):
     artist = ArtistSerializer(read_only=True)
     likes_count = serializers.SerializerMethodField()
     comments_count = serializers.SerializerMethodField()
     is_liked = serializers.SerializerMethodField()
+    cover_art_renditions = serializers.SerializerMethodField()
     
     class Meta:
         model = Mixtape
+        list_serializer_class = RenditionListSerializer
         fields = [
-            'id', 'title', 'slug', 'artist', 'cover_art', 'description',
+            'id', 'title', 'slug', 'artist', 'cover_art', 'cover_art_renditions', 'description',
             'release_date', 'download_count', 'likes_count', 'comments_count',
             'is_liked', 'created_at', 'updated_at'
         ]
 
+    def get_cover_art_renditions(self, obj):
+        return self.get_renditions(obj.cover_art)
+
     def get_likes_count(self, obj):
         return Like.objects.filter(
             content_type=ContentType.objects.get_for_model(Mixtape),
@@ -253,10 +331,20 @@ class MixtapeSerializer(serializers.ModelSerializer):
 
 
 class MixtapeDetailSerializer(MixtapeSerializer):
-    tracks = TrackSerializer(many=True, read_only=True)
+    tracks = TrackSerializer(source='tracklist', many=True, read_only=True)
+    mix_url = serializers.SerializerMethodField()
 
     class Meta(MixtapeSerializer.Meta):
-        fields = MixtapeSerializer.Meta.fields + ['tracks']
+        fields = MixtapeSerializer.Meta.fields + ['tracks', 'mix_url']
+
+    def get_mix_url(self, obj):
+        if not obj.mixtape_tracks.exists():
+            return None
+        url = reverse('mixtape-mix', kwargs={'slug': obj.slug})
+        request = self.context.get('request')
+        if request:
+            return request.build_absolute_uri(url)
+        return url
 
 
 class CompilationSerializer(serializers.ModelSerializer):
@@ -281,7 +369,7 @@ class CompilationDetailSerializer(CompilationSerializer):
         fields = CompilationSerializer.Meta.fields + ['tracks']
 
 
-class UserProfileSerializer(serializers.ModelSerializer):
+class UserProfileSerializer(RenditionsMixin, serializers.ModelSerializer):
     user = UserSerializer(read_only=True)
     followers_count = serializers.SerializerMethodField()
     following_count = serializers.SerializerMethodField()
@@ -290,12 +378,14 @@ class UserProfileSerializer(serializers.ModelSerializer):
     favorite_albums = AlbumSerializer(many=True, read_only=True)
     download_history = TrackSerializer(many=True, read_only=True)
     avatar = serializers.SerializerMethodField()
+    avatar_renditions = serializers.SerializerMethodField()
     profile_image = serializers.SerializerMethodField()
     
     class Meta:
         model = UserProfile
+        list_serializer_class = RenditionListSerializer
         fields = [
-            'id', 'user', 'bio', 'profile_image', 'avatar', 'is_artist',
+            'id', 'user', 'bio', 'profile_image', 'avatar', 'avatar_renditions', 'is_artist',
             'followers_count', 'following_count', 'is_following',
             'favorite_tracks', 'favorite_albums', 'download_history',
             'created_at', 'updated_at'
@@ -309,6 +399,9 @@ class UserProfileSerializer(serializers.ModelSerializer):
             return obj.avatar.url
         return None
 
+    def get_avatar_renditions(self, obj):
+        return self.get_renditions(obj.avatar)
+
     def get_profile_image(self, obj):
         if obj.profile_image:
             request = self.context.get('request')
@@ -0,0 +1,207 @@
+"""
+HTTP byte range (RFC 7233) file serving for audio streams.
+
+Single ranges and full bodies are returned as FileResponse over a file seeked to the
+first byte, so WSGI servers with a file_wrapper (gunicorn) hand the descriptor to
+os.sendfile and only the requested bytes leave the kernel page cache.
+"""
+import os
+import mimetypes
+import secrets
+from django.http import FileResponse, HttpResponse, StreamingHttpResponse
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, parse_http_date_safe
+
+# More ranges than this in one request is treated as abuse and answered with the full body
+MAX_RANGES = 16
+
+BLOCK_SIZE = 64 * 1024
+
+
+class RangeNotSatisfiable(Exception):
+    pass
+
+
+def parse_range_header(header, size):
+    """
+    Parse a Range header into a sorted list of inclusive (start, end) byte ranges.
+
+    Returns None when the header is missing, malformed or not worth honouring, in
+    which case the full body should be sent. Raises RangeNotSatisfiable when the
+    header is valid but no range overlaps the file.
+    """
+    if not header:
+        return None
+    unit, _, specs = header.partition('=')
+    if unit.strip().lower() != 'bytes' or not specs.strip():
+        return None
+
+    ranges = []
+    for spec in specs.split(','):
+        spec = spec.strip()
+        if not spec:
+            continue
+        first, dash, last = spec.partition('-')
+        first, last = first.strip(), last.strip()
+        if not dash or not (first.isdigit() or (not first and last.isdigit())):
+            return None
+        if last and not last.isdigit():
+            return None
+
+        if not first:
+            # Suffix range: the last N bytes
+            length = int(last)
+            if length == 0:
+                continue
+            ranges.append((max(0, size - length), size - 1))
+            continue
+
+        start = int(first)
+        if last and int(last) < start:
+            return None
+        if start >= size:
+            continue
+        end = int(last) if last else size - 1
+        ranges.append((start, min(end, size - 1)))
+
+    if not ranges:
+        raise RangeNotSatisfiable()
+    if len(ranges) > MAX_RANGES:
+        return None
+
+    # Coalesce overlapping and adjacent ranges
+    ranges.sort()
+    merged = [ranges[0]]
+    for start, end in ranges[1:]:
+        last_start, last_end = merged[-1]
+        if start <= last_end + 1:
+            merged[-1] = (last_start, max(last_end, end))
+        else:
+            merged.append((start, end))
+    return merged
+
+
+def file_etag(stat):
+    """Strong validator from size and modification time"""
+    return f'"{stat.st_size:x}-{stat.st_mtime_ns:x}"'
+
+
+def if_range_matches(header, etag, last_modified):
+    """Whether an If-Range precondition still allows a partial response"""
+    if not header:
+        return True
+    header = header.strip()
+    if header.startswith('"'):
+        return header == etag
+    if header.startswith('W/'):
+        return False
+    return parse_http_date_safe(header) == last_modified
+
+
+class _RangeFile:
+    """File wrapper that stops reading at the end of a byte range"""
+
+    def __init__(self, file, start, length):
+        self.file = file
+        self.file.seek(start)
+        self.remaining = length
+
+    def read(self, size=-1):
+        if self.remaining <= 0:
+            return b''
+        if size is None or size < 0 or size > self.remaining:
+            size = self.remaining
+        data = self.file.read(size)
+        self.remaining -= len(data)
+        return data
+
+    def fileno(self):
+        return self.file.fileno()
+
+    def close(self):
+        self.file.close()
+
+
+def _multipart_body(path, ranges, size, content_type, boundary):
+    with open(path, 'rb') as f:
+        for start, end in ranges:
+            yield (
+                f"\r\n--{boundary}\r\n"
+                f"Content-Type: {content_type}\r\n"
+                f"Content-Range: bytes {start}-{end}/{size}\r\n\r\n"
+            ).encode('ascii')
+            f.seek(start)
+            remaining = end - start + 1
+            while remaining > 0:
+                chunk = f.read(min(BLOCK_SIZE, remaining))
+                if not chunk:
+                    break
+                remaining -= len(chunk)
+                yield chunk
+        yield f"\r\n--{boundary}--\r\n".encode('ascii')
+
+
+def serve_file(request, path, content_type=None, filename=None, as_attachment=False, byte_range=None):
+    """
+    Serve a file with conditional request and byte range support.
+
+    ``byte_range`` is an inclusive (start, end) pair chosen by the server, e.g. from a seek
+    index, that is sent instead of whatever the Range header asks for.
+
+    Returns a 200, 206, 304, 412 or 416 response. The response carries a
+    ``served_ranges`` attribute with the byte ranges sent (None for no body).
+    """
+    stat = os.stat(path)
+    size = stat.st_size
+    etag = file_etag(stat)
+    last_modified = int(stat.st_mtime)
+    content_type = content_type or mimetypes.guess_type(path)[0] or 'application/octet-stream'
+
+    response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if response is not None:
+        response.served_ranges = None
+        return _with_validators(response, etag, last_modified)
+
+    if byte_range is not None:
+        ranges = [(byte_range[0], min(byte_range[1], size - 1))]
+    else:
+        try:
+            ranges = parse_range_header(request.META.get('HTTP_RANGE'), size)
+        except RangeNotSatisfiable:
+            response = HttpResponse(status=416)
+            response['Content-Range'] = f'bytes */{size}'
+            response.served_ranges = None
+            return _with_validators(response, etag, last_modified)
+
+        if ranges and not if_range_matches(request.META.get('HTTP_IF_RANGE'), etag, last_modified):
+            ranges = None
+
+    if ranges is None or ranges == [(0, size - 1)]:
+        response = FileResponse(open(path, 'rb'), content_type=content_type,
+                                as_attachment=as_attachment, filename=filename or os.path.basename(path))
+        response['Content-Length'] = size
+        response.served_ranges = [(0, size - 1)] if size else []
+    elif len(ranges) == 1:
+        start, end = ranges[0]
+        response = FileResponse(_RangeFile(open(path, 'rb'), start, end - start + 1), status=206,
+                                content_type=content_type, as_attachment=as_attachment,
+                                filename=filename or os.path.basename(path))
+        response['Content-Length'] = end - start + 1
+        response['Content-Range'] = f'bytes {start}-{end}/{size}'
+        response.served_ranges = ranges
+    else:
+        boundary = secrets.token_hex(16)
+        response = StreamingHttpResponse(
+            _multipart_body(path, ranges, size, content_type, boundary), status=206,
+            content_type=f'multipart/byteranges; boundary={boundary}'
+        )
+        response.served_ranges = ranges
+
+    response['Accept-Ranges'] = 'bytes'
+    return _with_validators(response, etag, last_modified)
+
+
+def _with_validators(response, etag, last_modified):
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(last_modified)
+    return response
@@ -0,0 +1,496 @@
+import os
+import io
+import hashlib
+import shutil
+import wave
+import pytest
+import numpy as np
+from mutagen.mp3 import MP3
+from django.contrib.auth.models import User
+from django.core.files.base import ContentFile
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.utils import timezone
+from rest_framework import status
+from music.models import Artist, Track, ProcessingJob, UploadSession
+from audio_jobs import claim_next_job, run_job, requeue_stale_jobs, BlockHasher, CONTENT_HASH_BLOCK_SIZE
+from fingerprint_utils import store_fingerprint
+
+
+@pytest.fixture
+def media_root(settings, tmp_path):
+    """Point media and spool storage at a temporary directory"""
+    settings.MEDIA_ROOT = str(tmp_path / 'media')
+    settings.AUDIO_PROCESSING_SPOOL_DIR = str(tmp_path / 'spool')
+    settings.AUDIO_PIPELINE_CACHE_DIR = str(tmp_path / 'pipeline')
+    return tmp_path
+
+
+@pytest.fixture
+def uploader(api_client):
+    """Authenticated API client for upload tests"""
+    user = User.objects.create_user(username='uploader', password='testpass123')
+    api_client.force_authenticate(user=user)
+    return api_client, user
+
+
+def make_wav(seconds=1.0, frame_rate=44100, channels=2, amplitude=12000, offset=0):
+    """Build a 16-bit sine wave WAV file in memory; samples beyond full scale are clipped"""
+    wave_samples = amplitude * np.sin(2 * np.pi * 440 * np.arange(int(seconds * frame_rate)) / frame_rate) + offset
+    samples = np.repeat(np.clip(wave_samples, -32768, 32767).astype('<i2')[:, None], channels, axis=1)
+    buffer = io.BytesIO()
+    with wave.open(buffer, 'wb') as wav:
+        wav.setnchannels(channels)
+        wav.setsampwidth(2)
+        wav.setframerate(frame_rate)
+        wav.writeframes(samples.tobytes())
+    return buffer.getvalue()
+
+
+def content_hash(content):
+    """Block hash of some bytes, as computed for uploads"""
+    hasher = BlockHasher()
+    hasher.update(content)
+    return hasher.hexdigest()
+
+
+@pytest.fixture
+def artist():
+    return Artist.objects.create(name='Queue Artist')
+
+
+@pytest.mark.django_db
+@pytest.mark.integration
+class TestAudioProcessingQueue:
+    """Test the asynchronous audio processing queue"""
+
+    def _upload(self, client, artist, name='song.wav', content=None, content_type='audio/wav'):
+        audio_file = SimpleUploadedFile(name, make_wav() if content is None else content, content_type=content_type)
+        return client.post('/api/tracks/upload-process/', {
+            'title': 'Queued Song',
+            'artist': artist.id,
+            'audio_file': audio_file,
+        }, format='multipart')
+
+    def test_upload_returns_accepted_and_records_job(self, uploader, artist, media_root):
+        """Test uploading queues a job instead of processing inline"""
+        client, user = uploader
+        response = self._upload(client, artist)
+        assert response.status_code == status.HTTP_202_ACCEPTED
+        assert response.data['status'] == ProcessingJob.STATUS_QUEUED
+
+        job = ProcessingJob.objects.get(id=response.data['job_id'])
+        assert job.user == user
+        assert job.track.is_processed is False
+        assert os.path.exists(job.source_path)
+        assert all(state == 'pending' for state in job.stages.values())
+
+    def _processed_track(self, artist, content):
+        track = Track.objects.create(
+            title='Earlier Upload', artist=artist, is_processed=True, processed_at=timezone.now(),
+            content_hash=content_hash(content), extracted_title='Tagged Title', duration_ms=1000
+        )
+        track.audio_file.save('processed_song.mp3', ContentFile(b'processed'), save=False)
+        track.optimized_file.save('optimized_song.mp3', ContentFile(b'optimized'), save=False)
+        track.save()
+        return track
+
+    def test_upload_records_content_hash(self, uploader, artist, media_root):
+        """Test the content hash is computed while the upload is spooled"""
+        client, _ = uploader
+        content = make_wav()
+        response = self._upload(client, artist, content=content)
+        track = Track.objects.get(id=response.data['track']['id'])
+        assert track.content_hash == content_hash(content)
+
+    def test_duplicate_upload_reuses_processed_files(self, uploader, artist, media_root):
+        """Test identical bytes reuse the earlier outputs without queueing a job"""
+        client, _ = uploader
+        content = make_wav()
+        original = self._processed_track(artist, content)
+
+        response = self._upload(client, artist, content=content)
+        assert response.status_code == status.HTTP_201_CREATED
+        assert response.data['duplicate_of'] == original.id
+        assert response.data['job_id'] is None
+
+        track = Track.objects.get(id=response.data['track']['id'])
+        assert track.title == 'Queued Song'
+        assert track.is_processed
+        assert track.audio_file.name == original.audio_file.name
+        assert track.optimized_file.name == original.optimized_file.name
+        assert track.extracted_title == 'Tagged Title'
+        assert not track.processing_jobs.exists()
+        assert os.listdir(media_root / 'spool') == []
+
+    def test_queued_duplicate_skips_processing(self, uploader, artist, media_root):
+        """Test a job whose bytes were processed meanwhile reuses the results"""
+        client, _ = uploader
+        content = make_wav()
+        self._upload(client, artist, content=content)
+        original = self._processed_track(artist, content)
+
+        job = claim_next_job()
+        assert run_job(job.id) == ProcessingJob.STATUS_DONE
+        job.track.refresh_from_db()
+        assert job.track.audio_file.name == original.audio_file.name
+        assert not os.path.exists(job.source_path)
+
+    def test_processing_status_reports_job(self, uploader, artist, media_root):
+        """Test processing status is read from the job record"""
+        client, _ = uploader
+        upload = self._upload(client, artist)
+        response = client.get(upload.data['status_url'])
+        assert response.status_code == status.HTTP_200_OK
+        assert response.data['status'] == 'queued'
+        assert response.data['job']['progress'] == 0
+
+    @pytest.mark.skipif(shutil.which('ffmpeg') is None, reason='ffmpeg is required to encode MP3')
+    def test_claim_and_run_job(self, uploader, artist, media_root):
+        """Test a worker claims the job and records per-stage progress"""
+        client, _ = uploader
+        upload = self._upload(client, artist, name='song.wav', content=make_wav(), content_type='audio/wav')
+        assert upload.data['track']['codec'] == 'pcm'
+        assert upload.data['track']['duration_ms'] == 1000
+
+        job = claim_next_job()
+        assert job.id == upload.data['job_id']
+        assert job.status == ProcessingJob.STATUS_RUNNING
+        assert job.attempts == 1
+        assert claim_next_job() is None
+
+        assert run_job(job.id) == ProcessingJob.STATUS_DONE
+        job.refresh_from_db()
+        assert job.progress == 100
+        assert all(state == 'done' for state in job.stages.values())
+        assert not os.path.exists(job.source_path)
+
+        track = Track.objects.get(id=upload.data['track']['id'])
+        assert track.is_processed
+        assert track.audio_file
+        assert track.duration.total_seconds() >= 1.0
+        assert track.duration_ms >= 1000
+        assert track.codec == 'mp3'
+        assert track.bitrate_kbps == 320
+        assert track.file_size_bytes == track.audio_file.size
+        assert track.hls_playlist.endswith('master.m3u8')
+        assert track.loudness_integrated is not None
+        assert track.replaygain_track_gain == pytest.approx(-18.0 - track.loudness_integrated)
+        assert 'TXXX:REPLAYGAIN_TRACK_GAIN' in MP3(track.optimized_file.path).tags
+        assert MP3(track.audio_file.path).tags['TXXX:BRAND'].text == ['Ghettoselebu - Your Music Platform']
+        assert track.preview_file.name.startswith('tracks/previews/')
+        assert track.seek_index
+        assert set(job.timings) == set(job.stages)
+        assert not job.timings['brand']['cached']
+
+        master = client.get(client.get(f'/api/tracks/{track.slug}/').data['hls_url'])
+        assert master.status_code == status.HTTP_200_OK
+        assert b'64k/index.m3u8' in b''.join(master.streaming_content)
+
+        waveform = client.get(client.get(f'/api/tracks/{track.slug}/').data['waveform_url'])
+        assert waveform.status_code == status.HTTP_200_OK
+        assert b''.join(waveform.streaming_content).startswith(b'GSPK')
+
+    @pytest.mark.skipif(shutil.which('ffmpeg') is None, reason='ffmpeg is required to encode MP3')
+    def test_reprocess_retags_in_place(self, uploader, artist, media_root):
+        """Test reprocessing a branded track rewrites its tags and leaves the audio alone"""
+        from mutagen.id3 import ID3
+
+        client, _ = uploader
+        upload = self._upload(client, artist, name='song.wav', content=make_wav(), content_type='audio/wav')
+        run_job(claim_next_job().id)
+        track = Track.objects.get(id=upload.data['track']['id'])
+        path = track.audio_file.path
+
+        def audio_bytes():
+            with open(path, 'rb') as f:
+                return f.read()[ID3(path).size:]
+
+        before = audio_bytes()
+        upload_date = MP3(path).tags['TXXX:UPLOAD_DATE'].text
+        Track.objects.filter(pk=track.pk).update(title='Renamed Song')
+
+        response = client.post(f'/api/tracks/{track.id}/reprocess/')
+        assert response.status_code == status.HTTP_200_OK
+        assert response.data['mode'] == 'tags'
+        tags = MP3(path).tags
+        assert tags['TIT2'].text == ['Renamed Song']
+        assert tags['TXXX:UPLOAD_DATE'].text == upload_date
+        assert audio_bytes() == before
+
+        response = client.post(f'/api/tracks/{track.id}/reprocess/', {'mode': 'full'})
+        assert response.status_code == status.HTTP_409_CONFLICT
+
+    @pytest.mark.skipif(shutil.which('ffmpeg') is None, reason='ffmpeg is required to encode MP3')
+    def test_reprocess_copies_shared_files(self, uploader, artist, media_root):
+        """Test retagging a duplicate upload leaves the file it shares with the original alone"""
+        client, _ = uploader
+        content = make_wav()
+        first = self._upload(client, artist, content=content)
+        run_job(claim_next_job().id)
+        second = self._upload(client, artist, content=content)
+        assert second.data['duplicate_of'] == first.data['track']['id']
+
+        original = Track.objects.get(id=first.data['track']['id'])
+        duplicate = Track.objects.get(id=second.data['track']['id'])
+        Track.objects.filter(pk=duplicate.pk).update(title='Cover Version')
+        response = client.post(f'/api/tracks/{duplicate.id}/reprocess/')
+        assert response.status_code == status.HTTP_200_OK
+
+        duplicate.refresh_from_db()
+        assert duplicate.audio_file.name != original.audio_file.name
+        assert MP3(duplicate.audio_file.path).tags['TIT2'].text == ['Cover Version']
+        assert MP3(original.audio_file.path).tags['TIT2'].text == ['Queued Song']
+
+    @pytest.mark.skipif(shutil.which('ffmpeg') is None, reason='ffmpeg is required to encode MP3')
+    def test_rerun_with_changed_profile(self, uploader, artist, media_root):
+        """Test a rerun recomputes only the stages downstream of a changed parameter"""
+        from django.core.management import call_command
+
+        client, _ = uploader
+        upload = self._upload(client, artist, name='song.wav', content=make_wav(), content_type='audio/wav')
+        run_job(claim_next_job().id)
+        track = Track.objects.get(id=upload.data['track']['id'])
+
+        call_command('rerun_pipeline', '--track', str(track.id), '--profile', '{"optimize": {"bitrate": "128k"}}')
+        job = claim_next_job()
+        assert job.source_path == ''
+        assert run_job(job.id) == ProcessingJob.STATUS_DONE
+        job.refresh_from_db()
+        cached = {stage: timing['cached'] for stage, timing in job.timings.items() if 'cached' in timing}
+        assert cached == {
+            'fingerprint': True, 'brand': True, 'analyse': True,
+            'optimize': False, 'preview': False, 'seek_index': False,
+        }
+
+        track.refresh_from_db()
+        assert round(MP3(track.optimized_file.path).info.bitrate / 1000) == 128
+        assert track.fingerprint_hashes.exists()
+
+        # The reference tag follows the reference the gain was computed against
+        call_command('rerun_pipeline', '--track', str(track.id), '--profile', '{"analyse": {"replaygain_reference": -14.0}}')
+        assert run_job(claim_next_job().id) == ProcessingJob.STATUS_DONE
+        track.refresh_from_db()
+        assert track.replaygain_track_gain == pytest.approx(-14.0 - track.loudness_integrated)
+        for path in (track.audio_file.path, track.optimized_file.path):
+            assert MP3(path).tags['TXXX:REPLAYGAIN_REFERENCE_LOUDNESS'].text == ['-14.0 LUFS']
+
+    @pytest.mark.skipif(shutil.which('ffmpeg') is None, reason='ffmpeg is required to encode MP3')
+    def test_rerun_skips_tracks_that_need_their_upload(self, uploader, artist, media_root):
+        """Test tracks without a content hash or cached upload stages are reported, not queued"""
+        import io
+        from django.core.management import call_command
+
+        client, _ = uploader
+        upload = self._upload(client, artist, name='song.wav', content=make_wav(), content_type='audio/wav')
+        run_job(claim_next_job().id)
+        track = Track.objects.get(id=upload.data['track']['id'])
+        unhashed = Track.objects.create(title='Legacy', artist=artist, is_processed=True)
+
+        output = io.StringIO()
+        call_command('rerun_pipeline', '--profile', '{"brand": {"bitrate": "256k"}}', stdout=output)
+        assert f"Track {unhashed.id}: skipped, no content hash" in output.getvalue()
+        assert f"Track {track.id}: skipped, the stages reading the upload are not cached" in output.getvalue()
+        assert 'Queued 0 tracks, skipped 2' in output.getvalue()
+        assert claim_next_job() is None
+
+        output = io.StringIO()
+        call_command('rerun_pipeline', '--profile', '{"optimize": {"bitrate": "128k"}}', stdout=output)
+        assert 'Queued 1 tracks, skipped 1' in output.getvalue()
+        assert claim_next_job().track_id == track.id
+
+    def test_run_job_records_failure(self, uploader, artist, media_root):
+        """Test a job whose upload has gone missing fails at the first pipeline stage"""
+        client, _ = uploader
+        self._upload(client, artist)
+        job = claim_next_job()
+        os.unlink(job.source_path)
+
+        assert run_job(job.id) == ProcessingJob.STATUS_FAILED
+        job.refresh_from_db()
+        assert job.stages['extract_metadata'] == 'done'
+        assert job.stages['fingerprint'] == 'failed'
+        assert 'extract_metadata' in job.timings
+        assert job.error
+
+    def test_upload_rejects_files_that_are_not_audio(self, uploader, artist, media_root):
+        """Test the sniffed header, not the claimed content type, decides whether a file is accepted"""
+        client, _ = uploader
+        response = self._upload(client, artist, name='song.mp3', content=b'not audio' * 100, content_type='audio/mpeg')
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
+        assert response.data['reason'] == 'unsupported_format'
+        assert not Track.objects.exists()
+        # Stopped while streaming, before anything reached the spool
+        assert not (media_root / 'spool').exists()
+
+        response = self._upload(client, artist, name='song.bin', content=make_wav(), content_type='application/octet-stream')
+        assert response.status_code == status.HTTP_202_ACCEPTED
+
+    @pytest.mark.parametrize('wav, reason', [
+        ({'amplitude': 0}, 'silent'),
+        ({'amplitude': 60000}, 'clipped'),
+        ({'amplitude': 3000, 'offset': 8000}, 'dc_offset'),
+    ])
+    def test_upload_rejects_unusable_audio(self, uploader, artist, media_root, wav, reason):
+        """Test silent, clipped and off-centre uploads are rejected before they are queued"""
+        client, _ = uploader
+        response = self._upload(client, artist, content=make_wav(seconds=5, **wav))
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
+        assert response.data['reason'] == reason
+        assert 'rms_dbfs' in response.data['details']
+        assert not ProcessingJob.objects.exists()
+        assert os.listdir(media_root / 'spool') == []
+
+    def test_requeue_stale_jobs(self, uploader, artist, media_root):
+        """Test running jobs without a recent heartbeat go back to the queue"""
+        client, _ = uploader
+        self._upload(client, artist)
+        job = claim_next_job()
+
+        assert requeue_stale_jobs(stale_after=3600) == (0, 0)
+        ProcessingJob.objects.filter(pk=job.pk).update(heartbeat_at=job.heartbeat_at.replace(year=2000))
+        assert requeue_stale_jobs(stale_after=3600) == (1, 0)
+        job.refresh_from_db()
+        assert job.status == ProcessingJob.STATUS_QUEUED
+
+
+@pytest.mark.django_db
+@pytest.mark.integration
+class TestFingerprintIndex:
+    """Test near-duplicate lookup through the fingerprint index"""
+
+    def test_duplicates_endpoint_reports_aligned_match(self, uploader, artist):
+        """Test a track sharing time-aligned hashes is returned with its offset"""
+        client, _ = uploader
+        original = Track.objects.create(title='Original', artist=artist)
+        reencode = Track.objects.create(title='Re-encode', artist=artist)
+        other = Track.objects.create(title='Other', artist=artist)
+
+        hashes = np.arange(100, 400, dtype=np.int64)
+        offsets = np.arange(300, dtype=np.int64)
+        store_fingerprint(original, (hashes, offsets + 10))
+        store_fingerprint(reencode, (hashes[:200], offsets[:200]))
+        store_fingerprint(other, (hashes[:5], offsets[:5] * 7))
+
+        response = client.get(f'/api/tracks/{reencode.id}/duplicates/')
+        assert response.status_code == status.HTTP_200_OK
+        assert response.data['fingerprinted']
+        candidates = response.data['candidates']
+        assert [c['track_id'] for c in candidates] == [original.id]
+        assert candidates[0]['matches'] == 200
+        assert candidates[0]['confidence'] == 1.0
+        assert candidates[0]['offset'] == pytest.approx(10 * 512 / 11025)
+        assert candidates[0]['title'] == 'Original'
+
+
+@pytest.mark.django_db
+@pytest.mark.integration
+class TestResumableUpload:
+    """Test the chunked, resumable upload sessions"""
+
+    def _start(self, client, content, name='long_mix.mp3'):
+        return client.post('/api/uploads/', {
+            'filename': name, 'content_type': 'audio/mpeg', 'size': len(content)
+        }, format='json')
+
+    def _patch(self, client, url, content, offset, length):
+        return client.patch(url, content[offset:offset + length],
+                            content_type='application/offset+octet-stream', HTTP_UPLOAD_OFFSET=str(offset))
+
+    def test_block_hash_combines_block_digests(self):
+        """Test the content hash is the SHA-256 of the per-block digests"""
+        content = bytes(range(256)) * (CONTENT_HASH_BLOCK_SIZE // 256) + b'tail'
+        hasher = BlockHasher()
+        for start in range(0, len(content), 100000):
+            hasher.update(content[start:start + 100000])
+        digests = [hashlib.sha256(content[:CONTENT_HASH_BLOCK_SIZE]).digest(),
+                   hashlib.sha256(b'tail').digest()]
+        assert hasher.hexdigest() == hashlib.sha256(b''.join(digests)).hexdigest()
+
+    def test_out_of_order_chunks_finalize_into_job(self, uploader, artist, media_root, settings):
+        """Test chunks sent out of order are assembled, hashed and queued"""
+        settings.AUDIO_UPLOAD_CHUNK_SIZE = CONTENT_HASH_BLOCK_SIZE
+        client, user = uploader
+        content = make_wav(seconds=48)
+        block = CONTENT_HASH_BLOCK_SIZE
+        assert 2 * block < len(content) < 3 * block
+
+        session = self._start(client, content)
+        assert session.status_code == status.HTTP_201_CREATED
+        assert session.data['offset'] == 0
+        url = session.data['upload_url']
+        assert os.path.getsize(next((media_root / 'spool').iterdir())) == len(content)
+
+        response = self._patch(client, url, content, block, block)
+        assert response.status_code == status.HTTP_200_OK
+        assert response['Upload-Offset'] == '0'
+
+        early = client.post(session.data['finalize_url'], {'title': 'Long Mix', 'artist': artist.id})
+        assert early.status_code == status.HTTP_409_CONFLICT
+
+        self._patch(client, url, content, 0, block)
+        assert client.get(url)['Upload-Offset'] == str(2 * block)
+        head = client.head(url)
+        assert head.status_code == status.HTTP_200_OK
+        assert (head['Upload-Offset'], head['Upload-Length']) == (str(2 * block), str(len(content)))
+        assert head.content == b''
+        response = self._patch(client, url, content, 2 * block, len(content) - 2 * block)
+        assert response.data['complete']
+
+        response = client.post(session.data['finalize_url'], {'title': 'Long Mix', 'artist': artist.id})
+        assert response.status_code == status.HTTP_202_ACCEPTED
+        track = Track.objects.get(id=response.data['track']['id'])
+        assert track.content_hash == content_hash(content)
+        assert track.original_filename == 'long_mix.mp3'
+
+        job = ProcessingJob.objects.get(id=response.data['job_id'])
+        with open(job.source_path, 'rb') as f:
+            assert f.read() == content
+
+        again = client.post(session.data['finalize_url'], {'title': 'Long Mix', 'artist': artist.id})
+        assert again.status_code == status.HTTP_409_CONFLICT
+
+    def test_first_chunk_that_is_not_audio_ends_the_session(self, uploader, media_root):
+        """Test the header in the first chunk is checked and a bad file is discarded"""
+        client, _ = uploader
+        content = b'\x00' * 1000
+        session = self._start(client, content)
+        response = self._patch(client, session.data['upload_url'], content, 0, len(content))
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
+        assert response.data['reason'] == 'unsupported_format'
+        assert client.get(session.data['upload_url']).status_code == status.HTTP_404_NOT_FOUND
+        assert os.listdir(media_root / 'spool') == []
+
+    def test_open_sessions_are_capped_and_expire(self, uploader, media_root, settings):
+        """Test a user cannot hold more open sessions than allowed and stale ones are discarded"""
+        from django.core.management import call_command
+
+        settings.AUDIO_UPLOAD_MAX_OPEN_SESSIONS = 2
+        client, _ = uploader
+        sessions = [self._start(client, b'\x00' * 100) for _ in range(2)]
+        assert self._start(client, b'\x00' * 100).status_code == status.HTTP_429_TOO_MANY_REQUESTS
+
+        UploadSession.objects.filter(id=sessions[0].data['id']).update(expires_at=timezone.now())
+        call_command('expire_upload_sessions')
+        assert client.get(sessions[0].data['upload_url']).status_code == status.HTTP_404_NOT_FOUND
+        assert len(os.listdir(media_root / 'spool')) == 1
+        assert self._start(client, b'\x00' * 100).status_code == status.HTTP_201_CREATED
+
+    def test_misaligned_chunk_is_rejected(self, uploader, media_root):
+        """Test chunks must start on a hash block boundary"""
+        client, _ = uploader
+        content = b'\x00' * (CONTENT_HASH_BLOCK_SIZE + 10)
+        session = self._start(client, content)
+        response = self._patch(client, session.data['upload_url'], content, 10, CONTENT_HASH_BLOCK_SIZE)
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
+
+    def test_sessions_are_private_and_can_be_abandoned(self, uploader, media_root):
+        """Test another user cannot see a session and the owner can delete it"""
+        client, _ = uploader
+        session = self._start(client, b'\x00' * 100)
+        other = User.objects.create_user(username='other', password='testpass123')
+        outsider = type(client)()
+        outsider.force_authenticate(user=other)
+        assert outsider.get(session.data['upload_url']).status_code == status.HTTP_404_NOT_FOUND
+
+        assert client.delete(session.data['upload_url']).status_code == status.HTTP_204_NO_CONTENT
+        assert os.listdir(media_root / 'spool') == []
@@ -1,7 +1,12 @@
+import io
 import pytest
+from PIL import Image
 from django.contrib.auth.models import User
+from django.core.files.base import ContentFile
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
 from rest_framework.test import APIRequestFactory
-from music.models import Genre, Artist, Album, Track, UserProfile, Like, Comment
+from music.models import Genre, Artist, Album, Track, UserProfile, Like, Comment, ImageRendition
 from api.serializers import (
     UserSerializer, GenreSerializer, ArtistSerializer, TrackSerializer,
     AlbumSerializer, UserProfileSerializer, CommentSerializer
@@ -345,3 +350,84 @@ class TestSerializerValidation:
         serializer = GenreSerializer(data=data)
         # This might pass validation depending on model constraints
         # You might need to add unique constraints at the model level
+
+
+def png_bytes(size, mode='RGB'):
+    buffer = io.BytesIO()
+    Image.new(mode, size, (200, 40, 40, 128) if mode == 'RGBA' else (200, 40, 40)).save(buffer, 'PNG')
+    return buffer.getvalue()
+
+
+@pytest.mark.django_db
+@pytest.mark.unit
+class TestImageRenditions:
+    """Test sized renditions of cover art and avatars"""
+
+    @pytest.fixture(autouse=True)
+    def media_root(self, settings, tmp_path):
+        settings.MEDIA_ROOT = str(tmp_path)
+        settings.IMAGE_RENDITIONS = {'thumbnail': 200, 'card': 480, 'hero': 1200}
+
+    def test_upload_renders_every_size_and_format(self):
+        """Test saving cover art stores WebP and JPEG renditions that fit each box"""
+        artist = Artist.objects.create(name='Cover Artist')
+        album = Album.objects.create(title='Wide Cover', artist=artist)
+        album.cover_art.save('wide.png', ContentFile(png_bytes((1600, 800))))
+        assert ImageRendition.objects.filter(source=album.cover_art.name).count() == 6
+
+        renditions = AlbumSerializer(album).data['cover_art_renditions']
+        assert renditions['hero']['width'] == 1200 and renditions['hero']['height'] == 600
+        assert renditions['thumbnail']['width'] == 200 and renditions['thumbnail']['height'] == 100
+        assert renditions['card']['webp'].endswith('.webp')
+        assert renditions['card']['jpeg'].endswith('.jpg')
+
+    def test_small_images_are_not_enlarged(self):
+        """Test an image smaller than a box keeps its size"""
+        artist = Artist.objects.create(name='Small Artist')
+        artist.image.save('small.png', ContentFile(png_bytes((300, 300), mode='RGBA')))
+        renditions = ArtistSerializer(artist).data['image_renditions']
+        assert (renditions['hero']['width'], renditions['card']['width'], renditions['thumbnail']['width']) == (300, 300, 200)
+
+    def test_names_are_content_hashed_and_shared(self):
+        """Test identical images share rendition files"""
+        artist = Artist.objects.create(name='Twin Artist')
+        first = Album.objects.create(title='First', artist=artist)
+        second = Album.objects.create(title='Second', artist=artist)
+        for album in (first, second):
+            album.cover_art.save('cover.png', ContentFile(png_bytes((640, 640))))
+        assert first.cover_art.name != second.cover_art.name
+
+        urls = [AlbumSerializer(album).data['cover_art_renditions']['card']['webp'] for album in (first, second)]
+        assert urls[0] == urls[1]
+        assert '/renditions/' in urls[0]
+
+    def test_serializing_never_renders(self):
+        """Test images uploaded before renditions existed are left to the backfill"""
+        user = User.objects.create_user(username='lazy', password='testpass123')
+        profile = user.userprofile
+        profile.avatar.save('avatar.png', ContentFile(png_bytes((500, 400))))
+        ImageRendition.objects.all().delete()
+
+        assert UserProfileSerializer(profile).data['avatar_renditions'] == {}
+        assert ImageRendition.objects.count() == 0
+
+    def test_page_looks_up_renditions_once(self):
+        """Test a page of albums and their artists looks up every rendition in one query"""
+        for number in range(3):
+            artist = Artist.objects.create(name=f'Page Artist {number}')
+            artist.image.save(f'artist{number}.png', ContentFile(png_bytes((300, 300))))
+            album = Album.objects.create(title=f'Page Album {number}', artist=artist)
+            album.cover_art.save(f'album{number}.png', ContentFile(png_bytes((300, 300))))
+
+        albums = list(Album.objects.select_related('artist'))
+        with CaptureQueriesContext(connection) as captured:
+            data = AlbumSerializer(albums, many=True).data
+        lookups = [query for query in captured.captured_queries if 'music_imagerendition' in query['sql']]
+        assert len(lookups) == 1
+        assert all(album['cover_art_renditions']['card']['webp'] and album['artist']['image_renditions']['card']['jpeg']
+                   for album in data)
+
+    def test_no_image(self):
+        """Test objects without an image have no renditions"""
+        artist = Artist.objects.create(name='Imageless')
+        assert ArtistSerializer(artist).data['image_renditions'] is None
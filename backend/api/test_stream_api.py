@@ -0,0 +1,571 @@
+import io
+import os
+import time
+import zipfile
+import shutil
+import threading
+import pytest
+import numpy as np
+from django.core.files.base import ContentFile
+from rest_framework import status
+from music.models import Artist, Album, Track, Mixtape, MixtapeTrack
+from api.streaming import parse_range_header, RangeNotSatisfiable
+from hls_utils import hls_root
+from transcode_cache import TranscodeCache
+from mix_utils import MixRenderer, crossfade
+from probe_utils import probe_audio
+from tts_utils import SiteAnnouncementGenerator
+from zip_stream import ZipEntry, ZipStream
+
+
+@pytest.fixture
+def streamed_track(settings, tmp_path):
+    """Track with a 1000 byte audio file under a temporary media root"""
+    settings.MEDIA_ROOT = str(tmp_path)
+    artist = Artist.objects.create(name='Stream Artist')
+    track = Track.objects.create(title='Stream Song', artist=artist)
+    track.audio_file.save('stream.mp3', ContentFile(bytes(range(250)) * 4))
+    return track
+
+
+def body(response):
+    return b''.join(response.streaming_content)
+
+
+def silent_mp3(frames, tag_padding=0):
+    """MPEG-1 Layer III stream of empty 128 kbps frames (417 bytes each), optionally behind an ID3v2 tag"""
+    tag = b'ID3\x04\x00\x00' + bytes([0, 0, tag_padding >> 7, tag_padding & 0x7F]) + bytes(tag_padding) if tag_padding else b''
+    return tag + (b'\xff\xfb\x90\x64' + bytes(413)) * frames
+
+
+@pytest.mark.unit
+class TestRangeParsing:
+    """Test RFC 7233 Range header parsing"""
+
+    def test_single_and_open_ranges(self):
+        """Test bounded, open-ended and suffix ranges"""
+        assert parse_range_header('bytes=0-99', 1000) == [(0, 99)]
+        assert parse_range_header('bytes=900-', 1000) == [(900, 999)]
+        assert parse_range_header('bytes=-100', 1000) == [(900, 999)]
+        assert parse_range_header('bytes=990-2000', 1000) == [(990, 999)]
+
+    def test_ranges_are_coalesced(self):
+        """Test overlapping and adjacent ranges are merged"""
+        assert parse_range_header('bytes=0-9, 5-19, 20-29, 50-59', 1000) == [(0, 29), (50, 59)]
+
+    def test_malformed_header_is_ignored(self):
+        """Test invalid headers fall back to a full response"""
+        assert parse_range_header('bytes=abc', 1000) is None
+        assert parse_range_header('bytes=10-5', 1000) is None
+        assert parse_range_header('items=0-5', 1000) is None
+
+    def test_unsatisfiable_range(self):
+        """Test ranges past the end of the file are rejected"""
+        with pytest.raises(RangeNotSatisfiable):
+            parse_range_header('bytes=1000-', 1000)
+        with pytest.raises(RangeNotSatisfiable):
+            parse_range_header('bytes=-0', 1000)
+
+
+@pytest.mark.django_db
+@pytest.mark.integration
+class TestTrackStreaming:
+    """Test the byte range stream endpoint"""
+
+    def url(self, track):
+        return f'/api/tracks/{track.slug}/stream/'
+
+    def test_full_response_counts_play(self, api_client, streamed_track):
+        """Test a plain GET returns the whole file and counts one play"""
+        response = api_client.get(self.url(streamed_track))
+        assert response.status_code == status.HTTP_200_OK
+        assert response['Accept-Ranges'] == 'bytes'
+        assert response['Content-Length'] == '1000'
+        assert len(body(response)) == 1000
+
+        streamed_track.refresh_from_db()
+        assert streamed_track.play_count == 1
+        assert streamed_track.download_count == 0
+
+    def test_partial_content(self, api_client, streamed_track):
+        """Test a seek returns only the requested bytes without counting a play"""
+        response = api_client.get(self.url(streamed_track), HTTP_RANGE='bytes=100-199')
+        assert response.status_code == status.HTTP_206_PARTIAL_CONTENT
+        assert response['Content-Range'] == 'bytes 100-199/1000'
+        assert response['Content-Length'] == '100'
+        assert body(response) == (bytes(range(250)) * 4)[100:200]
+
+        streamed_track.refresh_from_db()
+        assert streamed_track.play_count == 0
+
+    def test_multiple_ranges(self, api_client, streamed_track):
+        """Test several ranges are returned as multipart/byteranges"""
+        response = api_client.get(self.url(streamed_track), HTTP_RANGE='bytes=0-9,500-509')
+        assert response.status_code == status.HTTP_206_PARTIAL_CONTENT
+        assert response['Content-Type'].startswith('multipart/byteranges; boundary=')
+        content = body(response)
+        assert b'Content-Range: bytes 0-9/1000' in content
+        assert b'Content-Range: bytes 500-509/1000' in content
+
+    def test_unsatisfiable_range(self, api_client, streamed_track):
+        """Test a range past the end returns 416"""
+        response = api_client.get(self.url(streamed_track), HTTP_RANGE='bytes=5000-')
+        assert response.status_code == status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE
+        assert response['Content-Range'] == 'bytes */1000'
+
+    def test_conditional_requests(self, api_client, streamed_track):
+        """Test ETag revalidation and a stale If-Range"""
+        etag = api_client.get(self.url(streamed_track))['ETag']
+
+        response = api_client.get(self.url(streamed_track), HTTP_IF_NONE_MATCH=etag)
+        assert response.status_code == status.HTTP_304_NOT_MODIFIED
+
+        response = api_client.get(self.url(streamed_track), HTTP_RANGE='bytes=0-9', HTTP_IF_RANGE='"stale"')
+        assert response.status_code == status.HTTP_200_OK
+
+    def test_time_seek_returns_frame_range(self, api_client, streamed_track):
+        """Test ?t= answers with the range starting at the frame playing at that time"""
+        streamed_track.optimized_file.save('optimized.mp3', ContentFile(silent_mp3(400, tag_padding=100)))
+        size = 110 + 400 * 417
+        # 1152-sample frames at 44.1 kHz: 2 s falls in frame 76
+        response = api_client.get(self.url(streamed_track), {'t': '2'})
+        assert response.status_code == status.HTTP_206_PARTIAL_CONTENT
+        assert response['Content-Range'] == f'bytes {110 + 76 * 417}-{size - 1}/{size}'
+        assert body(response).startswith(b'\xff\xfb\x90\x64')
+
+        streamed_track.refresh_from_db()
+        assert streamed_track.seek_index
+        assert streamed_track.play_count == 0
+
+        # A bigger tag after retagging shifts the audio, not the index
+        with open(streamed_track.optimized_file.path, 'wb') as f:
+            f.write(silent_mp3(400, tag_padding=300))
+        response = api_client.get(self.url(streamed_track), {'t': '2'})
+        assert response['Content-Range'].startswith(f'bytes {310 + 76 * 417}-')
+
+    def test_time_seek_rebuilds_stale_index(self, api_client, streamed_track):
+        """Test an index of a replaced file is rebuilt before answering"""
+        streamed_track.optimized_file.save('optimized.mp3', ContentFile(silent_mp3(400)))
+        api_client.get(self.url(streamed_track), {'t': '1'})
+        with open(streamed_track.optimized_file.path, 'wb') as f:
+            f.write(b'\xff\xfb\xe0\x64' + bytes(1040) + silent_mp3(100))
+
+        response = api_client.get(self.url(streamed_track), {'t': '0.5'})
+        # A 1044 byte 320 kbps frame, then 128 kbps ones: 0.5 s falls in frame 19
+        assert response['Content-Range'].startswith(f'bytes {1044 + 18 * 417}-')
+
+    def test_time_seek_rejections(self, api_client, streamed_track):
+        """Test bad times and files that are not MP3 are refused"""
+        assert api_client.get(self.url(streamed_track), {'t': 'soon'}).status_code == status.HTTP_400_BAD_REQUEST
+        assert api_client.get(self.url(streamed_track), {'t': '-1'}).status_code == status.HTTP_400_BAD_REQUEST
+        # The fixture's file is not MP3
+        assert api_client.get(self.url(streamed_track), {'t': '1'}).status_code == status.HTTP_400_BAD_REQUEST
+
+    def test_prefers_optimized_file(self, api_client, streamed_track):
+        """Test the optimized rendition is streamed when present"""
+        streamed_track.optimized_file.save('optimized.mp3', ContentFile(b'x' * 10))
+        response = api_client.get(self.url(streamed_track))
+        assert body(response) == b'x' * 10
+        assert os.path.basename(streamed_track.optimized_file.name) in response['Content-Disposition']
+
+
+@pytest.mark.django_db
+@pytest.mark.integration
+class TestTrackHLS:
+    """Test serving packaged HLS output"""
+
+    def test_segments_served_with_immutable_cache(self, api_client, streamed_track):
+        """Test playlists and segments are served with long-lived cache headers"""
+        version_dir = os.path.join(hls_root(streamed_track.id), 'v1', '64k')
+        os.makedirs(version_dir)
+        with open(os.path.join(version_dir, 'segment_00000.ts'), 'wb') as f:
+            f.write(b'\x47' * 188)
+
+        response = api_client.get(f'/api/tracks/{streamed_track.id}/hls/v1/64k/segment_00000.ts')
+        assert response.status_code == status.HTTP_200_OK
+        assert response['Content-Type'] == 'video/mp2t'
+        assert 'immutable' in response['Cache-Control']
+
+    def test_superseded_versions_outlive_the_grace_period(self, streamed_track, settings):
+        """Test old versions are pruned only once the current one has been live long enough"""
+        from django.core.management import call_command
+
+        root = hls_root(streamed_track.id)
+        for version, age in (('old', 7200), ('current', 600)):
+            os.makedirs(os.path.join(root, version))
+            master = os.path.join(root, version, 'master.m3u8')
+            open(master, 'w').close()
+            os.utime(master, (time.time() - age, time.time() - age))
+        playlist = os.path.relpath(os.path.join(root, 'current', 'master.m3u8'), settings.MEDIA_ROOT)
+        Track.objects.filter(pk=streamed_track.pk).update(hls_playlist=playlist)
+
+        call_command('prune_hls_versions', '--grace', '3600')
+        assert sorted(os.listdir(root)) == ['current', 'old']
+        call_command('prune_hls_versions', '--grace', '300')
+        assert os.listdir(root) == ['current']
+
+    def test_paths_outside_track_are_rejected(self, api_client, streamed_track):
+        """Test traversal and non-HLS files return 404"""
+        response = api_client.get(f'/api/tracks/{streamed_track.id}/hls/../../stream.mp3')
+        assert response.status_code == status.HTTP_404_NOT_FOUND
+        response = api_client.get(f'/api/tracks/{streamed_track.id}/hls/v1/missing.m3u8')
+        assert response.status_code == status.HTTP_404_NOT_FOUND
+
+
+@pytest.mark.django_db
+@pytest.mark.integration
+class TestTrackWaveform:
+    """Test serving precomputed waveform peaks"""
+
+    def test_waveform_served_with_immutable_cache(self, api_client, streamed_track):
+        """Test the current peak file is served with long-lived cache headers"""
+        streamed_track.waveform.save('abc123.peaks', ContentFile(b'GSPK' + bytes(12)))
+        name = os.path.basename(streamed_track.waveform.name)
+
+        response = api_client.get(f'/api/tracks/{streamed_track.id}/waveform/{name}')
+        assert response.status_code == status.HTTP_200_OK
+        assert response['Content-Type'] == 'application/octet-stream'
+        assert 'immutable' in response['Cache-Control']
+        assert body(response).startswith(b'GSPK')
+
+    def test_stale_or_missing_waveform_is_rejected(self, api_client, streamed_track):
+        """Test names other than the current peak file return 404"""
+        response = api_client.get(f'/api/tracks/{streamed_track.id}/waveform/old.peaks')
+        assert response.status_code == status.HTTP_404_NOT_FOUND
+
+        streamed_track.waveform.save('abc123.peaks', ContentFile(b'GSPK'))
+        response = api_client.get(f'/api/tracks/{streamed_track.id}/waveform/old.peaks')
+        assert response.status_code == status.HTTP_404_NOT_FOUND
+
+
+class FakeTranscoder:
+    """Writes ``bitrate`` bytes per variant and counts calls, slowly enough to overlap"""
+
+    def __init__(self):
+        self.calls = []
+
+    def __call__(self, source_path, output_path, codec, bitrate):
+        self.calls.append((codec, bitrate))
+        time.sleep(0.1)
+        with open(output_path, 'wb') as f:
+            f.write(bytes(bitrate))
+
+
+@pytest.mark.unit
+class TestTranscodeCache:
+    """Test the LRU transcode cache"""
+
+    @pytest.fixture
+    def source(self, tmp_path):
+        path = tmp_path / 'source.mp3'
+        path.write_bytes(b'source audio')
+        return str(path)
+
+    def test_concurrent_misses_transcode_once(self, tmp_path, source):
+        """Test requests racing for one variant share a single transcode"""
+        transcoder = FakeTranscoder()
+        cache = TranscodeCache(str(tmp_path / 'cache'), 1000, transcoder=transcoder)
+        threads = [threading.Thread(target=cache.get, args=(1, source, 'mp3', 96)) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        assert transcoder.calls == [('mp3', 96)]
+        stats = cache.stats()
+        assert (stats['misses'], stats['coalesced'], stats['hits']) == (1, 3, 0)
+        assert stats['bytes'] == 96
+
+    def test_least_recently_used_is_evicted(self, tmp_path, source):
+        """Test the size bound evicts the entry read longest ago"""
+        transcoder = FakeTranscoder()
+        cache = TranscodeCache(str(tmp_path / 'cache'), 250, transcoder=transcoder)
+        first = cache.get(1, source, 'mp3', 96)
+        second = cache.get(1, source, 'ogg', 128)
+        os.utime(first, ns=(1, 1))
+        os.utime(second, ns=(2, 2))
+        assert cache.get(1, source, 'mp3', 96) == first
+
+        cache.get(2, source, 'opus', 64)
+        assert os.path.exists(first)
+        assert not os.path.exists(second)
+        stats = cache.stats()
+        assert stats['evictions'] == 1
+        assert stats['evicted_bytes'] == 128
+        assert stats['bytes'] == 96 + 64
+        assert stats['hits'] == 1
+
+    def test_lock_files_are_bounded(self, tmp_path, source):
+        """Test variant locks come from a fixed set of stripes rather than one file per variant"""
+        from transcode_cache import LOCK_STRIPES
+
+        cache = TranscodeCache(str(tmp_path / 'cache'), 100, transcoder=lambda s, o, c, b: open(o, 'wb').close())
+        for track_id in range(3 * LOCK_STRIPES):
+            cache.get(track_id, source, 'mp3', 64)
+        assert len(os.listdir(tmp_path / 'cache' / 'locks')) <= LOCK_STRIPES
+
+    def test_changed_source_is_a_new_variant(self, tmp_path, source):
+        """Test reprocessed audio is not served from a stale entry"""
+        transcoder = FakeTranscoder()
+        cache = TranscodeCache(str(tmp_path / 'cache'), 1000, transcoder=transcoder)
+        before = cache.get(1, source, 'mp3', 96)
+        with open(source, 'ab') as f:
+            f.write(b'reprocessed')
+        assert cache.get(1, source, 'mp3', 96) != before
+        assert len(transcoder.calls) == 2
+
+
+@pytest.mark.django_db
+@pytest.mark.integration
+class TestTrackTranscode:
+    """Test the transcode-on-request endpoint"""
+
+    def test_unsupported_variant_is_rejected(self, api_client, streamed_track, settings, tmp_path):
+        """Test unknown codecs and bitrates outside the allowed list"""
+        settings.AUDIO_TRANSCODE_CACHE_DIR = str(tmp_path / 'transcodes')
+        assert api_client.get(f'/api/tracks/{streamed_track.id}/transcode/flac/96/').status_code == 400
+        assert api_client.get(f'/api/tracks/{streamed_track.id}/transcode/mp3/97/').status_code == 400
+
+    def test_stats_are_admin_only(self, api_client, settings, tmp_path):
+        """Test cache counters are not public"""
+        settings.AUDIO_TRANSCODE_CACHE_DIR = str(tmp_path / 'transcodes')
+        assert api_client.get('/api/transcode-cache/stats/').status_code in (401, 403)
+
+    @pytest.mark.skipif(shutil.which('ffmpeg') is None, reason='ffmpeg is required for transcoding')
+    def test_transcode_then_hit(self, api_client, settings, tmp_path):
+        """Test the first request transcodes and the second is served from the cache"""
+        from pydub.generators import Sine
+        from django.contrib.auth.models import User
+
+        settings.MEDIA_ROOT = str(tmp_path)
+        settings.AUDIO_TRANSCODE_CACHE_DIR = str(tmp_path / 'transcodes')
+        track = Track.objects.create(title='Data Saver', artist=Artist.objects.create(name='Transcode Artist'))
+        source = tmp_path / 'source.mp3'
+        Sine(440).to_audio_segment(duration=2000).export(str(source), format='mp3', bitrate='320k')
+        track.audio_file.save('source.mp3', ContentFile(source.read_bytes()))
+
+        for _ in range(2):
+            response = api_client.get(f'/api/tracks/{track.id}/transcode/ogg/96/')
+            assert response.status_code == 200
+            assert response['Content-Type'] == 'audio/ogg'
+            assert body(response).startswith(b'OggS')
+
+        admin = User.objects.create_superuser(username='admin', password='adminpass123')
+        api_client.force_authenticate(user=admin)
+        stats = api_client.get('/api/transcode-cache/stats/').data
+        assert (stats['misses'], stats['hits']) == (1, 1)
+        assert stats['hit_ratio'] == 0.5
+
+
+@pytest.mark.unit
+class TestCrossfade:
+    """Test the equal-power crossfade between mix segments"""
+
+    def test_equal_power_curve(self):
+        """Test the outgoing track fades out as the incoming one fades in"""
+        ones = np.full((1000, 2), 10000, dtype=np.int16)
+        silence = np.zeros_like(ones)
+        fade_in = crossfade(silence, ones, 0, 1000)
+        fade_out = crossfade(ones, silence, 0, 1000)
+        assert fade_in[0, 0] < 100 and fade_in[-1, 0] > 9900
+        assert fade_out[0, 0] > 9900 and fade_out[-1, 0] < 100
+        assert abs(int(crossfade(ones, ones, 0, 1000)[500, 0]) - 14142) < 50
+
+    def test_blocks_join_seamlessly(self):
+        """Test a crossfade computed in two blocks equals one computed at once"""
+        rng = np.random.default_rng(0)
+        tail = rng.integers(-20000, 20000, (1000, 2)).astype(np.int16)
+        head = rng.integers(-20000, 20000, (1000, 2)).astype(np.int16)
+        split = np.concatenate([crossfade(tail[:300], head[:300], 0, 1000), crossfade(tail[300:], head[300:], 300, 1000)])
+        assert np.array_equal(split, crossfade(tail, head, 0, 1000))
+
+
+@pytest.fixture
+def mixtape(settings, tmp_path):
+    """Mixtape of three one-minute tracks with small placeholder files"""
+    settings.MEDIA_ROOT = str(tmp_path / 'media')
+    settings.AUDIO_MIX_CACHE_DIR = str(tmp_path / 'mixes')
+    settings.AUDIO_ANNOUNCEMENT_CACHE_DIR = str(tmp_path / 'announcements')
+    artist = Artist.objects.create(name='Mix Artist')
+    mixtape = Mixtape.objects.create(title='Continuous', artist=artist)
+    for position in range(3):
+        track = Track.objects.create(title=f'Part {position}', artist=artist, duration_ms=60000)
+        track.audio_file.save(f'part{position}.mp3', ContentFile(bytes([position]) * 100))
+        MixtapeTrack.objects.create(mixtape=mixtape, track=track, position=position)
+    return mixtape
+
+
+@pytest.mark.django_db
+@pytest.mark.integration
+class TestMixtapeMix:
+    """Test continuous mixtape rendering"""
+
+    def test_segments_follow_the_running_order(self, mixtape):
+        """Test only the first segment has no fade in and only the last has no fade out"""
+        segments = MixRenderer(mixtape, crossfade_ms=4000).segments
+        assert [segment.fade_in for segment in segments] == [0, 4 * 44100, 4 * 44100]
+        assert [segment.fade_out for segment in segments] == [4 * 44100, 4 * 44100, 0]
+        assert mixtape.tracklist[0].title == 'Part 0'
+
+    def test_changed_track_invalidates_only_its_neighbourhood(self, mixtape):
+        """Test replacing one track's audio changes its segment and the next one"""
+        before = MixRenderer(mixtape)
+        middle = mixtape.tracklist[1]
+        middle.audio_file.save('part1_remaster.mp3', ContentFile(b'remastered' * 20))
+
+        after = MixRenderer(mixtape)
+        changed = [old.key != new.key for old, new in zip(before.segments, after.segments)]
+        assert changed == [False, True, True]
+        assert after.path != before.path
+
+    def test_track_without_duration(self, api_client, mixtape):
+        """Test a track whose length is neither recorded nor readable is refused, not hard cut"""
+        Track.objects.filter(pk=mixtape.tracklist[1].pk).update(duration_ms=None)
+        with pytest.raises(ValueError, match='no known duration'):
+            MixRenderer(mixtape)
+        response = api_client.get(f'/api/mixtapes/{mixtape.slug}/mix/')
+        assert response.status_code == status.HTTP_409_CONFLICT
+
+    @pytest.mark.skipif(shutil.which('ffmpeg') is None, reason='ffmpeg is required for mix rendering')
+    def test_segment_cache_is_bounded(self, api_client, mixtape, settings, tmp_path):
+        """Test a missing duration is probed and old segments are evicted past the cache size"""
+        from pydub.generators import Sine
+
+        settings.AUDIO_MIX_CROSSFADE_MS = 1000
+        settings.AUDIO_MIX_SEGMENT_CACHE_SIZE = 1
+        for entry, frequency in zip(mixtape.mixtape_tracks.select_related('track'), (330, 440, 550)):
+            source = tmp_path / f'{frequency}.mp3'
+            Sine(frequency).to_audio_segment(duration=3000, volume=-10).export(str(source), format='mp3')
+            entry.track.audio_file.save(f'{frequency}.mp3', ContentFile(source.read_bytes()))
+            entry.track.duration_ms = None
+            entry.track.save()
+
+        renderer = MixRenderer(mixtape)
+        assert [segment.fade_out for segment in renderer.segments] == [44100, 44100, 0]
+        response = api_client.get(f'/api/mixtapes/{mixtape.slug}/mix/')
+        assert response.status_code == 200
+        body(response)
+        segments = os.listdir(os.path.dirname(renderer.segment_path(renderer.segments[0])))
+        assert segments == [f"{renderer.segments[-1].key}.flac"]
+
+    def test_mixtape_without_tracks(self, api_client, mixtape):
+        """Test an empty mixtape has no mix"""
+        mixtape.mixtape_tracks.all().delete()
+        response = api_client.get(f'/api/mixtapes/{mixtape.slug}/mix/')
+        assert response.status_code == status.HTTP_404_NOT_FOUND
+
+    @pytest.mark.skipif(shutil.which('ffmpeg') is None, reason='ffmpeg is required for mix rendering')
+    def test_mix_is_streamed_then_served_from_cache(self, api_client, mixtape, settings, tmp_path):
+        """Test the first request streams the render and the second serves the cached file"""
+        from pydub.generators import Sine
+
+        settings.AUDIO_MIX_CROSSFADE_MS = 1000
+        for entry, frequency in zip(mixtape.mixtape_tracks.select_related('track'), (330, 440, 550)):
+            source = tmp_path / f'{frequency}.mp3'
+            Sine(frequency).to_audio_segment(duration=3000, volume=-10).export(str(source), format='mp3')
+            entry.track.audio_file.save(f'{frequency}.mp3', ContentFile(source.read_bytes()))
+            entry.track.duration_ms = 3000
+            entry.track.save()
+
+        response = api_client.get(f'/api/mixtapes/{mixtape.slug}/mix/')
+        assert response.status_code == 200
+        assert not response.has_header('Content-Length')
+        streamed = body(response)
+
+        renderer = MixRenderer(mixtape)
+        assert os.path.exists(renderer.path)
+        with open(renderer.path, 'rb') as f:
+            assert f.read() == streamed
+        announcement_ms = SiteAnnouncementGenerator().get_announcement_duration() * 1000
+        # Three 3s tracks overlapping twice by 1s, after the announcement
+        assert abs(probe_audio(renderer.path)['duration_ms'] - (announcement_ms + 7000)) < 300
+
+        cached = api_client.get(f'/api/mixtapes/{mixtape.slug}/mix/')
+        assert int(cached['Content-Length']) == len(streamed)
+
+
+@pytest.mark.unit
+class TestZipStream:
+    """Test the streamed stored ZIP writer"""
+
+    @pytest.fixture
+    def files(self, tmp_path):
+        paths = []
+        for index, size in enumerate((0, 1, 100000, 300001)):
+            path = tmp_path / f'{index}.mp3'
+            path.write_bytes(os.urandom(size))
+            paths.append(path)
+        return paths
+
+    @pytest.mark.parametrize('force_zip64', [False, True])
+    def test_archive_matches_declared_size_and_contents(self, files, force_zip64):
+        """Test the archive is exactly ``size`` bytes and reads back with zipfile"""
+        archive = ZipStream([ZipEntry(f'Album/{path.name}', str(path)) for path in files], force_zip64=force_zip64)
+        data = b''.join(archive)
+        assert len(data) == archive.size
+
+        with zipfile.ZipFile(io.BytesIO(data)) as zf:
+            assert zf.testzip() is None
+            for path in files:
+                info = zf.getinfo(f'Album/{path.name}')
+                assert info.compress_type == zipfile.ZIP_STORED
+                assert zf.read(info) == path.read_bytes()
+
+    def test_large_entry_switches_to_zip64(self, files):
+        """Test an entry past 4 GiB gets ZIP64 records without touching the others"""
+        small, large = ZipEntry('a.mp3', str(files[1])), ZipEntry('b.mp3', str(files[2]))
+        large.size = 5 * 1024 ** 3
+        archive = ZipStream([small, large])
+        assert not small.zip64() and large.zip64()
+        assert archive.zip64()
+        assert archive.size > large.size
+
+
+@pytest.mark.django_db
+@pytest.mark.integration
+class TestContainerDownload:
+    """Test ZIP downloads of albums, mixtapes and compilations"""
+
+    @pytest.fixture
+    def album(self, settings, tmp_path):
+        settings.MEDIA_ROOT = str(tmp_path)
+        artist = Artist.objects.create(name='Zip Artist')
+        album = Album.objects.create(title='Zipped', artist=artist)
+        for number in (2, 1):
+            track = Track.objects.create(title=f'Song {number}', artist=artist, album=album, track_number=number)
+            track.audio_file.save(f'song{number}.mp3', ContentFile(bytes([number]) * 5000))
+        return album
+
+    def test_album_zip(self, api_client, album):
+        """Test GET streams every track in album order with an exact Content-Length"""
+        response = api_client.get(f'/api/albums/{album.slug}/download/')
+        assert response.status_code == 200
+        assert response['Content-Type'] == 'application/zip'
+        data = body(response)
+        assert int(response['Content-Length']) == len(data)
+
+        with zipfile.ZipFile(io.BytesIO(data)) as zf:
+            assert zf.namelist() == [
+                'Zip Artist - Zipped/01 - Zip Artist - Song 1.mp3',
+                'Zip Artist - Zipped/02 - Zip Artist - Song 2.mp3',
+            ]
+            assert zf.read(zf.namelist()[1]) == bytes([2]) * 5000
+        album.refresh_from_db()
+        assert album.download_count == 1
+
+    def test_post_still_counts_only(self, api_client, album):
+        """Test POST keeps returning the counter"""
+        response = api_client.post(f'/api/albums/{album.slug}/download/')
+        assert response.status_code == 200
+        assert response.data == {'download_count': 1}
+
+    def test_missing_files_are_left_out(self, api_client, album):
+        """Test tracks without a file on disk are skipped and an empty archive is a 404"""
+        first = album.tracks.get(track_number=1)
+        os.unlink(first.audio_file.path)
+        with zipfile.ZipFile(io.BytesIO(body(api_client.get(f'/api/albums/{album.slug}/download/')))) as zf:
+            assert len(zf.namelist()) == 1
+
+        album.tracks.update(audio_file='')
+        response = api_client.get(f'/api/albums/{album.slug}/download/')
+        assert response.status_code == status.HTTP_404_NOT_FOUND
@@ -12,7 +12,11 @@ from api.views_auth import (
     add_favorite_track, remove_favorite_track, add_favorite_album, remove_favorite_album,
     add_download_history
 )
-from api.views_audio import upload_and_process_track, get_audio_processing_status, reprocess_track
+from api.views_audio import (
+    upload_and_process_track, get_audio_processing_status, reprocess_track, get_track_duplicates,
+    start_upload_session, upload_session, finalize_upload_session
+)
+from api.views_stream import serve_track_hls, serve_track_waveform, serve_track_transcode, transcode_cache_stats
 from api.views_upload import FileUploadViewSet, BulkFileUploadViewSet
 from api.views_notifications import (
     get_notifications, get_notification_counts, mark_notification_read,
@@ -43,6 +47,19 @@ router.register(r'upload/single', FileUploadViewSet, basename='file-upload')
 router.register(r'upload/bulk', BulkFileUploadViewSet, basename='bulk-upload')
 
 urlpatterns = [
+    # Audio processing endpoints (ahead of the router so tracks/<slug>/ does not shadow them)
+    path('tracks/upload-process/', upload_and_process_track, name='upload_process_track'),
+    path('tracks/<int:track_id>/processing-status/', get_audio_processing_status, name='track_processing_status'),
+    path('tracks/<int:track_id>/reprocess/', reprocess_track, name='reprocess_track'),
+    path('tracks/<int:track_id>/duplicates/', get_track_duplicates, name='track_duplicates'),
+    path('tracks/<int:track_id>/hls/<path:name>', serve_track_hls, name='track_hls'),
+    path('tracks/<int:track_id>/waveform/<str:name>', serve_track_waveform, name='track_waveform'),
+    path('tracks/<int:track_id>/transcode/<str:codec>/<int:bitrate>/', serve_track_transcode, name='track_transcode'),
+    path('transcode-cache/stats/', transcode_cache_stats, name='transcode_cache_stats'),
+    # Resumable uploads: create a session, PATCH chunks at offsets, then finalize into a track
+    path('uploads/', start_upload_session, name='start_upload_session'),
+    path('uploads/<uuid:session_id>/', upload_session, name='upload_session'),
+    path('uploads/<uuid:session_id>/finalize/', finalize_upload_session, name='finalize_upload_session'),
     path('', include(router.urls)),
     path('auth/register/', UserCreateView.as_view(), name='user-register'),
     path('auth/', include([
@@ -59,10 +76,6 @@ urlpatterns = [
         path('download-history/add/<int:track_id>/', add_download_history, name='add_download_history'),
     ])),
     path('upload/music/', upload_music, name='upload_music'),
-    # Audio processing endpoints
-    path('tracks/upload-process/', upload_and_process_track, name='upload_process_track'),
-    path('tracks/<int:track_id>/processing-status/', get_audio_processing_status, name='track_processing_status'),
-    path('tracks/<int:track_id>/reprocess/', reprocess_track, name='reprocess_track'),
     # Notification endpoints
     path('notifications/', get_notifications, name='get_notifications'),
     path('notifications/counts/', get_notification_counts, name='get_notification_counts'),
@@ -5,7 +5,8 @@ from rest_framework.generics import CreateAPIView, RetrieveUpdateAPIView
 from django_filters.rest_framework import DjangoFilterBackend
 from django.shortcuts import get_object_or_404
 from django.conf import settings
-from django.http import FileResponse
+from django.http import FileResponse, StreamingHttpResponse
+from django.db.models import F
 from django.contrib.contenttypes.models import ContentType
 from django.utils import timezone
 from datetime import timedelta
@@ -15,6 +16,10 @@ from music.models import (
     Artist, Genre, Album, Track, Mixtape, Compilation, UserProfile, 
     Follow, Like, Comment, Share, FeedItem, TrendingMusic
 )
+from api.streaming import serve_file
+from mix_utils import MixRenderer
+from seek_index import seek_offset, index_track
+from zip_stream import ZipStream, safe_name, track_entries
 from api.serializers import (
     ArtistSerializer, ArtistDetailSerializer, GenreSerializer,
     AlbumSerializer, AlbumDetailSerializer, TrackSerializer, TrackDetailSerializer,
@@ -24,6 +29,18 @@ from api.serializers import (
 )
 
 
+def zip_download(name, tracks, numbered=True):
+    """Stream the tracks' files as a stored ZIP archive with an exact Content-Length"""
+    entries = track_entries(tracks, name, numbered=numbered)
+    if not entries:
+        return Response({'error': 'No track files to download'}, status=status.HTTP_404_NOT_FOUND)
+    archive = ZipStream(entries)
+    response = StreamingHttpResponse(archive, content_type='application/zip')
+    response['Content-Length'] = archive.size
+    response['Content-Disposition'] = f'attachment; filename="{safe_name(name)}.zip"'
+    return response
+
+
 class GenreViewSet(viewsets.ReadOnlyModelViewSet):
     queryset = Genre.objects.all()
     serializer_class = GenreSerializer
@@ -67,13 +84,13 @@ class ArtistViewSet(viewsets.ReadOnlyModelViewSet):
 
 
 class TrackViewSet(viewsets.ReadOnlyModelViewSet):
-    queryset = Track.objects.all()
+    queryset = Track.objects.select_related('artist').prefetch_related('featuring_artists')
     serializer_class = TrackSerializer
     lookup_field = 'slug'
     filter_backends = [DjangoFilterBackend, filters.SearchFilter, filters.OrderingFilter]
     search_fields = ['title', 'artist__name']
     filterset_fields = ['artist', 'album', 'genre', 'is_explicit']
-    ordering_fields = ['title', 'created_at', 'download_count']
+    ordering_fields = ['title', 'created_at', 'download_count', 'play_count']
     ordering = ['-created_at']
 
     def retrieve(self, request, slug=None):
@@ -84,8 +101,8 @@ class TrackViewSet(viewsets.ReadOnlyModelViewSet):
     @action(detail=True, methods=['post'])
     def download(self, request, slug=None):
         track = get_object_or_404(Track, slug=slug)
-        track.download_count += 1
-        track.save()
+        Track.objects.filter(pk=track.pk).update(download_count=F('download_count') + 1)
+        track.refresh_from_db(fields=['download_count'])
         
         if track.audio_file:
             # Return the audio file for download
@@ -97,6 +114,41 @@ class TrackViewSet(viewsets.ReadOnlyModelViewSet):
         
         return Response({'download_count': track.download_count})
 
+    @action(detail=True, methods=['get'])
+    def stream(self, request, slug=None):
+        track = get_object_or_404(Track, slug=slug)
+
+        # Prefer the streaming-optimized rendition when it is on disk
+        file_path = track.stream_path()
+        if file_path is None:
+            return Response({'error': 'Audio file not available'}, status=status.HTTP_404_NOT_FOUND)
+
+        byte_range = None
+        if 't' in request.query_params:
+            # Time-based seek: answer with the range starting at the frame playing at ``t``
+            try:
+                seconds = float(request.query_params['t'])
+            except ValueError:
+                seconds = -1
+            if not 0 <= seconds < float('inf'):
+                return Response({'error': 't must be a number of seconds'}, status=status.HTTP_400_BAD_REQUEST)
+            offset = seek_offset(track.seek_index, file_path, seconds) if track.seek_index else None
+            if offset is None:
+                # No index yet, or one for a file that has since been replaced
+                index = index_track(track, file_path)
+                offset = seek_offset(index, file_path, seconds) if index else None
+            if offset is None:
+                return Response({'error': 'Seeking by time needs an MP3 stream'}, status=status.HTTP_400_BAD_REQUEST)
+            byte_range = (offset, os.path.getsize(file_path) - 1)
+
+        response = serve_file(request, file_path, byte_range=byte_range)
+
+        # Count a play once per playback start, not for every seek or HEAD probe
+        if request.method == 'GET' and response.served_ranges and response.served_ranges[0][0] == 0:
+            Track.objects.filter(pk=track.pk).update(play_count=F('play_count') + 1)
+
+        return response
+
     @action(detail=False, methods=['get'])
     def latest(self, request):
         latest_tracks = self.queryset[:20]
@@ -111,7 +163,7 @@ class TrackViewSet(viewsets.ReadOnlyModelViewSet):
 
 
 class AlbumViewSet(viewsets.ReadOnlyModelViewSet):
-    queryset = Album.objects.all()
+    queryset = Album.objects.select_related('artist')
     serializer_class = AlbumSerializer
     lookup_field = 'slug'
     filter_backends = [DjangoFilterBackend, filters.SearchFilter, filters.OrderingFilter]
@@ -125,11 +177,15 @@ class AlbumViewSet(viewsets.ReadOnlyModelViewSet):
         serializer = AlbumDetailSerializer(album)
         return Response(serializer.data)
 
-    @action(detail=True, methods=['post'])
+    @action(detail=True, methods=['get', 'post'])
     def download(self, request, slug=None):
+        """GET streams the album as a ZIP; POST only counts the download"""
         album = get_object_or_404(Album, slug=slug)
-        album.download_count += 1
-        album.save()
+        Album.objects.filter(pk=album.pk).update(download_count=F('download_count') + 1)
+        if request.method == 'GET':
+            tracks = album.tracks.select_related('artist').order_by(F('track_number').asc(nulls_last=True), 'title')
+            return zip_download(f"{album.artist.name} - {album.title}", tracks)
+        album.refresh_from_db(fields=['download_count'])
         return Response({'download_count': album.download_count})
 
     @action(detail=False, methods=['get'])
@@ -140,7 +196,7 @@ class AlbumViewSet(viewsets.ReadOnlyModelViewSet):
 
 
 class MixtapeViewSet(viewsets.ReadOnlyModelViewSet):
-    queryset = Mixtape.objects.all()
+    queryset = Mixtape.objects.select_related('artist')
     serializer_class = MixtapeSerializer
     lookup_field = 'slug'
     filter_backends = [DjangoFilterBackend, filters.SearchFilter, filters.OrderingFilter]
@@ -151,16 +207,39 @@ class MixtapeViewSet(viewsets.ReadOnlyModelViewSet):
 
     def retrieve(self, request, slug=None):
         mixtape = get_object_or_404(Mixtape, slug=slug)
-        serializer = MixtapeDetailSerializer(mixtape)
+        serializer = MixtapeDetailSerializer(mixtape, context={'request': request})
         return Response(serializer.data)
 
-    @action(detail=True, methods=['post'])
+    @action(detail=True, methods=['get', 'post'])
     def download(self, request, slug=None):
+        """GET streams the mixtape's tracks as a ZIP; POST only counts the download"""
         mixtape = get_object_or_404(Mixtape, slug=slug)
-        mixtape.download_count += 1
-        mixtape.save()
+        Mixtape.objects.filter(pk=mixtape.pk).update(download_count=F('download_count') + 1)
+        if request.method == 'GET':
+            return zip_download(f"{mixtape.artist.name} - {mixtape.title}", mixtape.tracklist)
+        mixtape.refresh_from_db(fields=['download_count'])
         return Response({'download_count': mixtape.download_count})
 
+    @action(detail=True, methods=['get'])
+    def mix(self, request, slug=None):
+        """The mixtape as one continuous crossfaded MP3, streamed while it renders the first time"""
+        mixtape = get_object_or_404(Mixtape, slug=slug)
+        try:
+            renderer = MixRenderer(mixtape)
+        except ValueError as e:
+            return Response({'error': str(e)}, status=status.HTTP_409_CONFLICT)
+        if not renderer.segments:
+            return Response({'error': 'Mixtape has no tracks'}, status=status.HTTP_404_NOT_FOUND)
+
+        filename = f"{mixtape.slug}.mp3"
+        if os.path.exists(renderer.path):
+            return serve_file(request, renderer.path, content_type='audio/mpeg', filename=filename)
+
+        response = StreamingHttpResponse(renderer.stream(), content_type='audio/mpeg')
+        response['Content-Disposition'] = f'inline; filename="{filename}"'
+        response['Cache-Control'] = 'no-store'
+        return response
+
 
 class CompilationViewSet(viewsets.ReadOnlyModelViewSet):
     queryset = Compilation.objects.all()
@@ -177,11 +256,14 @@ class CompilationViewSet(viewsets.ReadOnlyModelViewSet):
         serializer = CompilationDetailSerializer(compilation)
         return Response(serializer.data)
 
-    @action(detail=True, methods=['post'])
+    @action(detail=True, methods=['get', 'post'])
     def download(self, request, slug=None):
+        """GET streams the compilation as a ZIP; POST only counts the download"""
         compilation = get_object_or_404(Compilation, slug=slug)
-        compilation.download_count += 1
-        compilation.save()
+        Compilation.objects.filter(pk=compilation.pk).update(download_count=F('download_count') + 1)
+        if request.method == 'GET':
+            return zip_download(compilation.title, compilation.tracks.select_related('artist'))
+        compilation.refresh_from_db(fields=['download_count'])
         return Response({'download_count': compilation.download_count})
 
     @action(detail=False, methods=['get'])
@@ -1,173 +1,185 @@
 import os
-import tempfile
+from django.conf import settings
+from django.core.files import File
+from django.urls import reverse
 from django.utils import timezone
 from rest_framework import status
 from rest_framework.decorators import api_view, permission_classes
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
-from django.core.files.uploadedfile import UploadedFile
-from music.models import Track, Artist, Album, Genre
+from music.models import Track, Artist, Album, Genre, UploadSession
 from .serializers import TrackSerializer
 from audio_utils import AudioProcessor
+from audio_jobs import (
+    spool_upload, enqueue_track_processing, find_processed_duplicate, reuse_processing_results,
+    shares_file, own_file,
+    CONTENT_HASH_BLOCK_SIZE
+)
+from probe_utils import probe_track, PROBE_FIELDS
+from fingerprint_utils import track_candidates
+from upload_validation import AudioUploadHandler, UploadRejected, sniff_file, validate_upload
+from resumable_upload import (
+    UploadIncomplete, TooManyUploads, create_upload_session, write_chunk, received_blocks,
+    upload_offset, session_content_hash, claim_upload_session, discard_upload_session
+)
 import logging
 
 logger = logging.getLogger(__name__)
 
+ALLOWED_AUDIO_TYPES = ['audio/mpeg', 'audio/mp3', 'audio/wav', 'audio/flac', 'audio/ogg']
+INVALID_AUDIO_TYPE = 'Invalid file type. Please upload MP3, WAV, FLAC, or OGG files.'
+
+
+def _track_fields(data):
+    """
+    Validate the track form shared by direct and resumable uploads.
+    Returns (fields, None) or (None, error response).
+    """
+    title = data.get('title', '')
+    artist_id = data.get('artist')
+    album_id = data.get('album')
+    genre_id = data.get('genre')
+    track_number = data.get('track_number')
+    is_explicit = str(data.get('is_explicit', 'false')).lower() == 'true'
+    
+    # Validate required fields
+    if not title or not artist_id:
+        return None, Response(
+            {'error': 'Title and artist are required'}, 
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    
+    # Get artist
+    try:
+        artist = Artist.objects.get(id=artist_id)
+    except Artist.DoesNotExist:
+        return None, Response(
+            {'error': 'Artist not found'}, 
+            status=status.HTTP_404_NOT_FOUND
+        )
+    
+    # Get album if provided
+    album = None
+    if album_id:
+        try:
+            album = Album.objects.get(id=album_id)
+        except Album.DoesNotExist:
+            return None, Response(
+                {'error': 'Album not found'}, 
+                status=status.HTTP_404_NOT_FOUND
+            )
+    
+    # Get genre if provided
+    genre = None
+    if genre_id:
+        try:
+            genre = Genre.objects.get(id=genre_id)
+        except Genre.DoesNotExist:
+            return None, Response(
+                {'error': 'Genre not found'}, 
+                status=status.HTTP_404_NOT_FOUND
+            )
+    
+    return {
+        'title': title,
+        'artist': artist,
+        'album': album,
+        'genre': genre,
+        'track_number': int(track_number) if track_number else None,
+        'is_explicit': is_explicit,
+    }, None
+
+
+def _queue_spooled_track(request, fields, spool_path, content_hash, original_filename):
+    """Create a track for a spooled upload and queue it, or reuse an identical processed upload"""
+    try:
+        # Create the track now so clients can poll its processing status
+        track = Track.objects.create(
+            **fields,
+            original_filename=original_filename,
+            content_hash=content_hash,
+            is_processed=False
+        )
+        
+        # The same bytes were processed before: reuse those files instead of queueing
+        original = find_processed_duplicate(content_hash, exclude=track.pk)
+        if original:
+            reuse_processing_results(track, original)
+            os.unlink(spool_path)
+            serializer = TrackSerializer(track, context={'request': request})
+            return Response({
+                'message': 'Track uploaded; identical audio was already processed',
+                'track': serializer.data,
+                'job_id': None,
+                'status': 'done',
+                'duplicate_of': original.id,
+                'status_url': reverse('track_processing_status', args=[track.id])
+            }, status=status.HTTP_201_CREATED)
+        
+        # Header-only probe, so duration and format are known before processing
+        if probe_track(track, spool_path):
+            track.save(update_fields=PROBE_FIELDS)
+        
+        # Hand the heavy lifting over to the processing workers
+        job = enqueue_track_processing(
+            track,
+            spool_path,
+            original_filename=original_filename,
+            user=request.user
+        )
+        
+    except Exception as e:
+        logger.error(f"Error queueing audio file: {e}")
+        # Clean up spooled file on error
+        if os.path.exists(spool_path):
+            os.unlink(spool_path)
+        return Response(
+            {'error': f'Error queueing audio file: {str(e)}'}, 
+            status=status.HTTP_500_INTERNAL_SERVER_ERROR
+        )
+    
+    serializer = TrackSerializer(track, context={'request': request})
+    return Response({
+        'message': 'Track uploaded and queued for processing',
+        'track': serializer.data,
+        'job_id': job.id,
+        'status': job.status,
+        'status_url': reverse('track_processing_status', args=[track.id])
+    }, status=status.HTTP_202_ACCEPTED)
+
+
 @api_view(['POST'])
 @permission_classes([IsAuthenticated])
 def upload_and_process_track(request):
     """
-    Upload and process audio track with metadata extraction and site branding
+    Upload an audio track and queue it for metadata extraction and site branding
     """
+    # The file's own header decides its format, checked while it streams in; a file that
+    # fails stops the upload before any more of it is stored
+    validator = AudioUploadHandler(request)
+    request.upload_handlers.insert(0, validator)
     try:
         audio_file = request.FILES.get('audio_file')
+        if validator.rejection:
+            return Response(validator.rejection.as_dict(), status=status.HTTP_400_BAD_REQUEST)
         if not audio_file:
             return Response(
                 {'error': 'No audio file provided'}, 
                 status=status.HTTP_400_BAD_REQUEST
             )
         
-        # Validate file type
-        allowed_types = ['audio/mpeg', 'audio/mp3', 'audio/wav', 'audio/flac', 'audio/ogg']
-        if audio_file.content_type not in allowed_types:
-            return Response(
-                {'error': 'Invalid file type. Please upload MP3, WAV, FLAC, or OGG files.'}, 
-                status=status.HTTP_400_BAD_REQUEST
-            )
+        fields, error = _track_fields(request.POST)
+        if error:
+            return error
         
-        # Get form data
-        title = request.POST.get('title', '')
-        artist_id = request.POST.get('artist')
-        album_id = request.POST.get('album')
-        genre_id = request.POST.get('genre')
-        track_number = request.POST.get('track_number')
-        is_explicit = request.POST.get('is_explicit', 'false').lower() == 'true'
-        
-        # Validate required fields
-        if not title or not artist_id:
-            return Response(
-                {'error': 'Title and artist are required'}, 
-                status=status.HTTP_400_BAD_REQUEST
-            )
-        
-        # Get artist
+        # Save uploaded file into the processing spool, hashing it on the way
+        spool_path, content_hash = spool_upload(audio_file)
         try:
-            artist = Artist.objects.get(id=artist_id)
-        except Artist.DoesNotExist:
-            return Response(
-                {'error': 'Artist not found'}, 
-                status=status.HTTP_404_NOT_FOUND
-            )
-        
-        # Get album if provided
-        album = None
-        if album_id:
-            try:
-                album = Album.objects.get(id=album_id)
-            except Album.DoesNotExist:
-                return Response(
-                    {'error': 'Album not found'}, 
-                    status=status.HTTP_404_NOT_FOUND
-                )
-        
-        # Get genre if provided
-        genre = None
-        if genre_id:
-            try:
-                genre = Genre.objects.get(id=genre_id)
-            except Genre.DoesNotExist:
-                return Response(
-                    {'error': 'Genre not found'}, 
-                    status=status.HTTP_404_NOT_FOUND
-                )
-        
-        # Initialize audio processor
-        processor = AudioProcessor()
-        
-        # Save uploaded file temporarily
-        with tempfile.NamedTemporaryFile(delete=False, suffix=os.path.splitext(audio_file.name)[1]) as temp_file:
-            for chunk in audio_file.chunks():
-                temp_file.write(chunk)
-            temp_file_path = temp_file.name
-        
-        try:
-            # Extract metadata from uploaded file
-            extracted_metadata = processor.extract_metadata(temp_file_path)
-            
-            # Process audio file with site branding
-            processed_file_path = processor.embed_metadata(
-                temp_file_path, 
-                {'title': title, 'album': album.title if album else ''},
-                {'name': artist.name}
-            )
-            
-            # Optimize for streaming
-            optimized_file_path = processor.optimize_for_streaming(processed_file_path)
-            
-            # Create track record
-            track = Track.objects.create(
-                title=title,
-                artist=artist,
-                album=album,
-                genre=genre,
-                track_number=int(track_number) if track_number else None,
-                is_explicit=is_explicit,
-                original_filename=audio_file.name,
-                extracted_title=extracted_metadata.get('title', ''),
-                extracted_artist=extracted_metadata.get('artist', ''),
-                extracted_album=extracted_metadata.get('album', ''),
-                extracted_year=str(extracted_metadata.get('year', '')),
-                extracted_genre=extracted_metadata.get('genre', ''),
-                extracted_track_number=str(extracted_metadata.get('track_number', '')),
-                is_processed=True,
-                processed_at=timezone.now(),
-                has_site_branding=True,
-                is_optimized=True
-            )
-            
-            # Save processed audio files
-            with open(processed_file_path, 'rb') as f:
-                track.audio_file.save(f"processed_{audio_file.name}", UploadedFile(f))
-            
-            with open(optimized_file_path, 'rb') as f:
-                track.optimized_file.save(f"optimized_{audio_file.name}", UploadedFile(f))
-            
-            # Set file size and duration
-            audio_info = processor.get_audio_info(optimized_file_path)
-            track.file_size = f"{audio_info.get('file_size', 0)} bytes"
-            track.duration = timezone.timedelta(seconds=audio_info.get('duration_seconds', 0))
-            track.save()
-            
-            # Clean up temporary files
-            os.unlink(temp_file_path)
-            if processed_file_path != temp_file_path:
-                os.unlink(processed_file_path)
-            if optimized_file_path != processed_file_path:
-                os.unlink(optimized_file_path)
-            
-            # Return serialized track data
-            serializer = TrackSerializer(track, context={'request': request})
-            return Response({
-                'message': 'Track uploaded and processed successfully',
-                'track': serializer.data,
-                'extracted_metadata': extracted_metadata,
-                'processing_info': {
-                    'is_processed': track.is_processed,
-                    'has_site_branding': track.has_site_branding,
-                    'is_optimized': track.is_optimized,
-                    'processed_at': track.processed_at
-                }
-            }, status=status.HTTP_201_CREATED)
-            
-        except Exception as e:
-            logger.error(f"Error processing audio file: {e}")
-            # Clean up temporary file on error
-            if os.path.exists(temp_file_path):
-                os.unlink(temp_file_path)
-            return Response(
-                {'error': f'Error processing audio file: {str(e)}'}, 
-                status=status.HTTP_500_INTERNAL_SERVER_ERROR
-            )
+            validate_upload(spool_path, validator.info)
+        except UploadRejected as e:
+            os.unlink(spool_path)
+            return Response(e.as_dict(), status=status.HTTP_400_BAD_REQUEST)
+        return _queue_spooled_track(request, fields, spool_path, content_hash, audio_file.name)
             
     except Exception as e:
         logger.error(f"Error in upload_and_process_track: {e}")
@@ -184,67 +196,121 @@ def get_audio_processing_status(request, track_id):
     """
     try:
         track = Track.objects.get(id=track_id)
-        return Response({
-            'is_processed': track.is_processed,
-            'has_site_branding': track.has_site_branding,
-            'is_optimized': track.is_optimized,
-            'processed_at': track.processed_at,
-            'original_filename': track.original_filename,
-            'extracted_metadata': {
-                'title': track.extracted_title,
-                'artist': track.extracted_artist,
-                'album': track.extracted_album,
-                'year': track.extracted_year,
-                'genre': track.extracted_genre,
-                'track_number': track.extracted_track_number
-            }
-        })
     except Track.DoesNotExist:
         return Response(
             {'error': 'Track not found'}, 
             status=status.HTTP_404_NOT_FOUND
         )
+    
+    job = track.processing_jobs.order_by('-created_at').first()
+    if job:
+        job_status = {
+            'id': job.id,
+            'status': job.status,
+            'stage': job.stage,
+            'progress': job.progress,
+            'stages': job.stages,
+            'timings': job.timings,
+            'attempts': job.attempts,
+            'error': job.error,
+            'created_at': job.created_at,
+            'started_at': job.started_at,
+            'finished_at': job.finished_at
+        }
+        processing_status = job.status
+    else:
+        # Tracks processed before the job queue existed
+        job_status = None
+        processing_status = 'done' if track.is_processed else None
+    
+    return Response({
+        'status': processing_status,
+        'job': job_status,
+        'is_processed': track.is_processed,
+        'has_site_branding': track.has_site_branding,
+        'is_optimized': track.is_optimized,
+        'processed_at': track.processed_at,
+        'original_filename': track.original_filename,
+        'extracted_metadata': {
+            'title': track.extracted_title,
+            'artist': track.extracted_artist,
+            'album': track.extracted_album,
+            'year': track.extracted_year,
+            'genre': track.extracted_genre,
+            'track_number': track.extracted_track_number
+        }
+    })
 
 @api_view(['POST'])
 @permission_classes([IsAuthenticated])
 def reprocess_track(request, track_id):
     """
-    Re-process an existing track with updated settings
+    Re-process an existing track with updated settings.
+
+    Branded tracks are retagged in place (``mode=tags``): only their ID3 frames are
+    rewritten and the audio is left untouched. ``mode=full`` brands a track that has not
+    been branded yet, re-encoding it with the site announcement.
     """
     try:
-        track = Track.objects.get(id=track_id)
+        track = Track.objects.select_related('artist', 'album').get(id=track_id)
         
         if not track.audio_file:
             return Response(
                 {'error': 'No audio file found for this track'}, 
                 status=status.HTTP_400_BAD_REQUEST
             )
+
+        mode = request.data.get('mode') or ('tags' if track.has_site_branding else 'full')
+        if mode not in ('tags', 'full'):
+            return Response({'error': "mode must be 'tags' or 'full'"}, status=status.HTTP_400_BAD_REQUEST)
+        if mode == 'full' and track.has_site_branding:
+            # Re-encoding would put a second announcement in front of the first
+            return Response(
+                {'error': 'Track is already branded; use mode=tags to update its metadata'},
+                status=status.HTTP_409_CONFLICT
+            )
         
         # Initialize processor
         processor = AudioProcessor()
         
         # Get current audio file path
         audio_file_path = track.audio_file.path
-        
-        # Re-process the file
-        processed_file_path = processor.embed_metadata(
-            audio_file_path,
-            {'title': track.title, 'album': track.album.title if track.album else ''},
-            {'name': track.artist.name}
-        )
-        
-        # Update track
-        track.is_processed = True
-        track.processed_at = timezone.now()
-        track.has_site_branding = True
-        track.save()
-        
-        # Clean up
-        if processed_file_path != audio_file_path:
-            os.unlink(processed_file_path)
+        track_data = {'title': track.title, 'album': track.album.title if track.album else ''}
+        artist_data = {'name': track.artist.name}
+
+        if mode == 'tags':
+            # Identical uploads share one stored file; tag a copy rather than the other tracks' audio
+            audio_file_path = own_file(track, 'audio_file')
+            if processor.retag(audio_file_path, track_data, artist_data, force=True) == 'failed':
+                return Response(
+                    {'error': 'The stored audio file cannot be tagged'},
+                    status=status.HTTP_422_UNPROCESSABLE_ENTITY
+                )
+            track.processed_at = timezone.now()
+            track.save(update_fields=['processed_at'])
+        else:
+            shared = shares_file(track, 'audio_file')
+            processed_file_path = processor.embed_metadata(audio_file_path, track_data, artist_data)
+            if processed_file_path == audio_file_path:
+                raise RuntimeError('branding the audio failed')
+            try:
+                with open(processed_file_path, 'rb') as f:
+                    track.audio_file.save(f"processed_{os.path.basename(audio_file_path)}", File(f), save=False)
+            finally:
+                os.unlink(processed_file_path)
+            if not shared:
+                os.unlink(audio_file_path)
+
+            # Update track
+            probe_track(track, track.audio_file.path)
+            track.is_processed = True
+            track.processed_at = timezone.now()
+            track.has_site_branding = True
+            track.save()
         
         return Response({
             'message': 'Track reprocessed successfully',
+            'mode': mode,
             'is_processed': track.is_processed,
             'processed_at': track.processed_at
         })
@@ -260,3 +326,180 @@ def reprocess_track(request, track_id):
             {'error': f'Error reprocessing track: {str(e)}'}, 
             status=status.HTTP_500_INTERNAL_SERVER_ERROR
         )
+
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def get_track_duplicates(request, track_id):
+    """
+    List tracks whose acoustic fingerprint matches this one, e.g. the same recording at another bitrate
+    """
+    try:
+        track = Track.objects.get(id=track_id)
+    except Track.DoesNotExist:
+        return Response(
+            {'error': 'Track not found'}, 
+            status=status.HTTP_404_NOT_FOUND
+        )
+    
+    candidates = track_candidates(track)
+    matches = Track.objects.filter(id__in=[c['track_id'] for c in candidates]).select_related('artist').in_bulk()
+    for candidate in candidates:
+        match = matches[candidate['track_id']]
+        candidate['title'] = match.title
+        candidate['artist'] = match.artist.name
+        candidate['slug'] = match.slug
+    
+    return Response({
+        'track_id': track.id,
+        'fingerprinted': track.fingerprint_hashes.exists(),
+        'candidates': candidates
+    })
+
+
+def _upload_session_data(session, blocks=None):
+    offset = upload_offset(session, blocks)
+    return {
+        'id': str(session.id),
+        'filename': session.filename,
+        'size': session.size,
+        'offset': offset,
+        'complete': offset == session.size,
+        'chunk_size': settings.AUDIO_UPLOAD_CHUNK_SIZE,
+        'block_size': CONTENT_HASH_BLOCK_SIZE,
+        'finalized': session.finalized_at is not None,
+        'expires_at': session.expires_at,
+        'upload_url': reverse('upload_session', args=[session.id]),
+        'finalize_url': reverse('finalize_upload_session', args=[session.id]),
+    }
+
+
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+def start_upload_session(request):
+    """
+    Start a resumable upload of an audio file.
+    Body: ``filename``, ``content_type`` and ``size`` in bytes.
+    """
+    filename = request.data.get('filename', '')
+    content_type = request.data.get('content_type', '')
+    try:
+        size = int(request.data.get('size', request.headers.get('Upload-Length', '')))
+    except (TypeError, ValueError):
+        return Response({'error': 'Upload size is required'}, status=status.HTTP_400_BAD_REQUEST)
+    
+    if not filename:
+        return Response({'error': 'Filename is required'}, status=status.HTTP_400_BAD_REQUEST)
+    if content_type not in ALLOWED_AUDIO_TYPES:
+        return Response({'error': INVALID_AUDIO_TYPE}, status=status.HTTP_400_BAD_REQUEST)
+    
+    try:
+        session = create_upload_session(request.user, filename, content_type, size)
+    except ValueError as e:
+        return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+    except TooManyUploads as e:
+        return Response({'error': str(e)}, status=status.HTTP_429_TOO_MANY_REQUESTS)
+    
+    data = _upload_session_data(session, blocks={})
+    return Response(data, status=status.HTTP_201_CREATED, headers={
+        'Location': data['upload_url'],
+        'Upload-Offset': '0',
+        'Upload-Length': str(session.size),
+    })
+
+
+@api_view(['GET', 'HEAD', 'PATCH', 'DELETE'])
+@permission_classes([IsAuthenticated])
+def upload_session(request, session_id):
+    """
+    GET: report the received offset and blocks. HEAD: the offset headers only, as tus clients ask.
+    PATCH: write the raw request body at the ``Upload-Offset`` header.
+    DELETE: abandon the upload.
+    """
+    try:
+        session = UploadSession.objects.get(id=session_id, user=request.user)
+    except UploadSession.DoesNotExist:
+        return Response({'error': 'Upload not found'}, status=status.HTTP_404_NOT_FOUND)
+    
+    if request.method == 'DELETE':
+        discard_upload_session(session)
+        return Response(status=status.HTTP_204_NO_CONTENT)
+    
+    if request.method == 'PATCH':
+        if session.finalized_at:
+            return Response({'error': 'Upload already finalized'}, status=status.HTTP_409_CONFLICT)
+        try:
+            offset = int(request.headers['Upload-Offset'])
+            length = int(request.headers['Content-Length'])
+        except (KeyError, ValueError):
+            return Response(
+                {'error': 'Upload-Offset and Content-Length headers are required'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        try:
+            # Read the body straight from the socket; request.data would buffer the whole chunk
+            write_chunk(session, offset, request.stream, length)
+        except ValueError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        if offset == 0:
+            # The first chunk carries the header; a file that is not usable audio goes no further
+            try:
+                sniff_file(session.spool_path, available=length)
+            except UploadRejected as e:
+                discard_upload_session(session)
+                return Response(e.as_dict(), status=status.HTTP_400_BAD_REQUEST)
+    
+    data = _upload_session_data(session)
+    headers = {
+        'Upload-Offset': str(data['offset']),
+        'Upload-Length': str(session.size),
+        'Cache-Control': 'no-store',
+    }
+    if request.method == 'HEAD':
+        return Response(headers=headers)
+    return Response(data, headers=headers)
+
+
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+def finalize_upload_session(request, session_id):
+    """
+    Turn a fully received upload into a track and queue it for processing.
+    Takes the same track fields as the direct upload endpoint.
+    """
+    try:
+        session = UploadSession.objects.get(id=session_id, user=request.user)
+    except UploadSession.DoesNotExist:
+        return Response({'error': 'Upload not found'}, status=status.HTTP_404_NOT_FOUND)
+    
+    if session.finalized_at:
+        return Response({'error': 'Upload already finalized'}, status=status.HTTP_409_CONFLICT)
+    
+    fields, error = _track_fields(request.data)
+    if error:
+        return error
+    
+    try:
+        # Every block was hashed as it arrived, so the file is not read again here
+        content_hash = session_content_hash(session)
+    except UploadIncomplete as e:
+        blocks = received_blocks(session)
+        return Response(
+            {'error': f'Upload incomplete: {e}', 'offset': upload_offset(session, blocks)},
+            status=status.HTTP_409_CONFLICT
+        )
+    
+    try:
+        validate_upload(session.spool_path)
+    except UploadRejected as e:
+        discard_upload_session(session)
+        return Response(e.as_dict(), status=status.HTTP_400_BAD_REQUEST)
+    
+    if not claim_upload_session(session):
+        return Response({'error': 'Upload already finalized'}, status=status.HTTP_409_CONFLICT)
+    
+    response = _queue_spooled_track(request, fields, session.spool_path, content_hash, session.filename)
+    track = response.data.get('track')
+    if track:
+        UploadSession.objects.filter(pk=session.pk).update(track_id=track['id'])
+    return response
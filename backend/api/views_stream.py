@@ -0,0 +1,104 @@
+import os
+from django.conf import settings
+from django.shortcuts import get_object_or_404
+from rest_framework import status
+from rest_framework.decorators import api_view, permission_classes
+from rest_framework.permissions import IsAdminUser
+from rest_framework.response import Response
+from music.models import Track
+from api.streaming import serve_file
+from hls_utils import hls_root, HLS_CONTENT_TYPES
+from transcode_cache import TranscodeCache, TRANSCODE_CODECS
+import logging
+
+logger = logging.getLogger(__name__)
+
+# HLS output and peak files live under versioned names, so a URL never changes content
+IMMUTABLE_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+
+
+@api_view(['GET'])
+def serve_track_hls(request, track_id, name):
+    """
+    Serve HLS master/media playlists and segments for a track
+    """
+    track = get_object_or_404(Track, id=track_id)
+    root = os.path.realpath(hls_root(track.id))
+    file_path = os.path.realpath(os.path.join(root, name))
+    extension = os.path.splitext(file_path)[1]
+
+    if (not file_path.startswith(root + os.sep) or extension not in HLS_CONTENT_TYPES
+            or not os.path.isfile(file_path)):
+        return Response({'error': 'HLS resource not found'}, status=status.HTTP_404_NOT_FOUND)
+
+    response = serve_file(request, file_path, content_type=HLS_CONTENT_TYPES[extension])
+    response['Cache-Control'] = IMMUTABLE_CACHE_CONTROL
+    return response
+
+
+@api_view(['GET'])
+def serve_track_waveform(request, track_id, name):
+    """
+    Serve a track's binary waveform peak file
+    """
+    track = get_object_or_404(Track, id=track_id)
+
+    # Peak files are named after their content, so only the current name is served
+    if not track.waveform or os.path.basename(track.waveform.name) != name:
+        return Response({'error': 'Waveform not found'}, status=status.HTTP_404_NOT_FOUND)
+
+    file_path = os.path.join(settings.MEDIA_ROOT, track.waveform.name)
+    if not os.path.isfile(file_path):
+        return Response({'error': 'Waveform not found'}, status=status.HTTP_404_NOT_FOUND)
+
+    response = serve_file(request, file_path, content_type='application/octet-stream')
+    response['Cache-Control'] = IMMUTABLE_CACHE_CONTROL
+    return response
+
+
+@api_view(['GET'])
+def serve_track_transcode(request, track_id, codec, bitrate):
+    """
+    Serve a track in a codec and bitrate that was not precomputed, transcoding it on first request
+    """
+    if codec not in TRANSCODE_CODECS or bitrate not in settings.AUDIO_TRANSCODE_BITRATES:
+        return Response(
+            {'error': f"Supported codecs: {', '.join(TRANSCODE_CODECS)}; "
+                      f"bitrates: {', '.join(str(b) for b in settings.AUDIO_TRANSCODE_BITRATES)}"},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+
+    track = get_object_or_404(Track, id=track_id)
+    # Transcode from the highest quality file so no generation is lost twice
+    audio_field = track.audio_file or track.optimized_file
+    source_path = os.path.join(settings.MEDIA_ROOT, audio_field.name) if audio_field else None
+    if not source_path or not os.path.isfile(source_path):
+        return Response({'error': 'Audio file not found'}, status=status.HTTP_404_NOT_FOUND)
+
+    cache = TranscodeCache()
+    try:
+        try:
+            response = serve_file(request, cache.get(track.id, source_path, codec, bitrate),
+                                  content_type=TRANSCODE_CODECS[codec][3])
+        except FileNotFoundError:
+            # Evicted between lookup and open; this lookup transcodes it again
+            response = serve_file(request, cache.get(track.id, source_path, codec, bitrate),
+                                  content_type=TRANSCODE_CODECS[codec][3])
+    except RuntimeError as e:
+        logger.error(f"Transcode of track {track.id} to {codec} {bitrate}k failed: {e}")
+        return Response({'error': 'Transcoding failed'}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+    response['Cache-Control'] = 'public, max-age=86400'
+    return response
+
+
+@api_view(['GET'])
+@permission_classes([IsAdminUser])
+def transcode_cache_stats(request):
+    """
+    Hit, miss and eviction counters and the size of the transcode cache
+    """
+    stats = TranscodeCache().stats()
+    lookups = stats['hits'] + stats['misses'] + stats['coalesced']
+    stats['hit_ratio'] = (stats['hits'] + stats['coalesced']) / lookups if lookups else None
+    return Response(stats)
@@ -7,6 +7,7 @@ from django.core.files.storage import default_storage
 from music.models import Track, Album, Artist, Genre
 from api.serializers import TrackSerializer, AlbumSerializer, ArtistSerializer
 from api.permissions import IsOwnerOrReadOnly
+from probe_utils import probe_track
 
 
 class FileUploadSerializer(serializers.ModelSerializer):
@@ -47,7 +48,7 @@ class FileUploadSerializer(serializers.ModelSerializer):
             genre, _ = Genre.objects.get_or_create(name=genre_name)
         
         # Create track with uploaded file
-        track = Track.objects.create(
+        track = Track(
             title=validated_data['title'],
             artist=artist,
             album=album,
@@ -61,6 +62,10 @@ class FileUploadSerializer(serializers.ModelSerializer):
             audio_file=file
         )
         
+        # Fill duration, bitrate and format from the file headers before it is stored
+        probe_track(track, file)
+        track.save()
+        
         return track
 
 
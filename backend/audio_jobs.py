@@ -0,0 +1,375 @@
+import os
+import json
+import time
+import uuid
+import shutil
+import hashlib
+import tempfile
+import logging
+import numpy as np
+from datetime import timedelta
+from django.conf import settings
+from django.core.files import File
+from django.core.files.base import ContentFile
+from django.core.files.uploadedfile import UploadedFile
+from django.db.models import F, Q
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+# Ordered stages a processing job goes through; the middle ones are the audio pipeline's (see audio_pipeline.STAGES)
+PROCESSING_STAGES = ['extract_metadata', 'fingerprint', 'brand', 'optimize', 'analyse', 'preview', 'seek_index', 'store', 'package_hls']
+
+# Track fields produced by processing; identical uploads copy them instead of processing again
+REUSED_FIELDS = [
+    'audio_file', 'optimized_file', 'waveform', 'preview_file', 'seek_index',
+    'extracted_title', 'extracted_artist', 'extracted_album', 'extracted_year', 'extracted_genre',
+    'extracted_track_number',
+    'duration_ms', 'bitrate_kbps', 'sample_rate', 'channels', 'codec', 'file_size_bytes',
+    'duration', 'bitrate', 'format', 'file_size',
+    'loudness_integrated', 'loudness_range', 'true_peak', 'replaygain_track_gain',
+    'is_processed', 'has_site_branding', 'is_optimized',
+]
+
+# Content hashes are the SHA-256 of the concatenated SHA-256 digests of fixed-size blocks,
+# so chunks of a resumable upload can be hashed by whichever process receives them
+CONTENT_HASH_BLOCK_SIZE = 4 * 1024 * 1024
+
+
+class BlockHasher:
+    """Incremental block hash of a byte stream; ``hexdigest()`` is the upload's content hash"""
+
+    def __init__(self):
+        self.digests = []
+        self._block = hashlib.sha256()
+        self._filled = 0
+
+    def update(self, data):
+        view = memoryview(data)
+        while view:
+            take = min(len(view), CONTENT_HASH_BLOCK_SIZE - self._filled)
+            self._block.update(view[:take])
+            self._filled += take
+            view = view[take:]
+            if self._filled == CONTENT_HASH_BLOCK_SIZE:
+                self.digests.append(self._block.hexdigest())
+                self._block = hashlib.sha256()
+                self._filled = 0
+
+    def block_digests(self):
+        """Digests of every block so far, including a trailing partial block"""
+        if self._filled:
+            return self.digests + [self._block.hexdigest()]
+        return list(self.digests)
+
+    def hexdigest(self):
+        return combine_block_digests(self.block_digests())
+
+
+def combine_block_digests(digests):
+    """Content hash from block digests in file order"""
+    return hashlib.sha256(b''.join(bytes.fromhex(digest) for digest in digests)).hexdigest()
+
+
+def spool_upload(uploaded_file):
+    """
+    Write an uploaded file into the processing spool directory.
+    Returns its path and its content hash, computed from the same chunks as they are written.
+    """
+    spool_dir = settings.AUDIO_PROCESSING_SPOOL_DIR
+    os.makedirs(spool_dir, exist_ok=True)
+
+    suffix = os.path.splitext(uploaded_file.name)[1]
+    spool_path = os.path.join(spool_dir, f"{uuid.uuid4().hex}{suffix}")
+
+    hasher = BlockHasher()
+    with open(spool_path, 'wb') as spool_file:
+        for chunk in uploaded_file.chunks():
+            hasher.update(chunk)
+            spool_file.write(chunk)
+
+    return spool_path, hasher.hexdigest()
+
+
+def find_processed_duplicate(content_hash, exclude=None):
+    """Return an already processed track whose upload had exactly the same bytes"""
+    from music.models import Track
+
+    if not content_hash:
+        return None
+    duplicates = Track.objects.filter(content_hash=content_hash, is_processed=True)
+    duplicates = duplicates.exclude(audio_file='').exclude(audio_file__isnull=True)
+    if exclude is not None:
+        duplicates = duplicates.exclude(pk=exclude)
+    return duplicates.order_by('processed_at').first()
+
+
+def reuse_processing_results(track, original):
+    """
+    Point a track at another track's processed files and copy its extracted metadata,
+    so identical uploads are not decoded and encoded again. Saves the track.
+    """
+    from hls_utils import link_track_hls
+
+    for field in REUSED_FIELDS:
+        setattr(track, field, getattr(original, field))
+    track.processed_at = timezone.now()
+    track.save()
+
+    # HLS output is served from a per-track directory, so link the segments rather than share the path
+    if original.hls_playlist:
+        track.hls_playlist = link_track_hls(original, track)
+        track.save(update_fields=['hls_playlist'])
+    return track
+
+
+def shares_file(track, field):
+    """Whether another track points at the same stored file, as identical uploads do"""
+    from music.models import Track
+
+    name = getattr(track, field).name
+    if not name:
+        return False
+    return Track.objects.exclude(pk=track.pk).filter(Q(audio_file=name) | Q(optimized_file=name)).exists()
+
+
+def own_file(track, field):
+    """
+    Copy a file the track shares with other tracks to a name of its own, so it can be
+    modified in place without touching theirs. Saves the track; returns the file's path.
+    """
+    file_field = getattr(track, field)
+    if shares_file(track, field):
+        with open(file_field.path, 'rb') as f:
+            file_field.save(os.path.basename(file_field.name), File(f), save=False)
+        track.save(update_fields=[field])
+    return file_field.path
+
+
+def enqueue_track_processing(track, source_path, original_filename='', user=None, options=None):
+    """Record a processing job for a track; a worker picks it up later"""
+    from music.models import ProcessingJob
+
+    return ProcessingJob.objects.create(
+        track=track,
+        user=user,
+        source_path=source_path,
+        original_filename=original_filename,
+        options=options or {},
+        stages={stage: 'pending' for stage in PROCESSING_STAGES},
+    )
+
+
+def claim_next_job():
+    """Atomically move the oldest queued job to running and return it"""
+    from music.models import ProcessingJob
+
+    while True:
+        job = ProcessingJob.objects.filter(status=ProcessingJob.STATUS_QUEUED).order_by('created_at').first()
+        if job is None:
+            return None
+
+        now = timezone.now()
+        claimed = ProcessingJob.objects.filter(
+            pk=job.pk, status=ProcessingJob.STATUS_QUEUED
+        ).update(
+            status=ProcessingJob.STATUS_RUNNING,
+            started_at=now,
+            heartbeat_at=now,
+            attempts=F('attempts') + 1,
+        )
+
+        if not claimed:
+            # Another worker claimed it first; try the next one
+            continue
+
+        job.refresh_from_db()
+        return job
+
+
+def requeue_stale_jobs(stale_after=None, max_attempts=None):
+    """Requeue running jobs whose worker stopped sending heartbeats"""
+    from music.models import ProcessingJob
+
+    stale_after = stale_after or settings.AUDIO_PROCESSING_STALE_AFTER
+    max_attempts = max_attempts or settings.AUDIO_PROCESSING_MAX_ATTEMPTS
+    cutoff = timezone.now() - timedelta(seconds=stale_after)
+
+    stale = ProcessingJob.objects.filter(status=ProcessingJob.STATUS_RUNNING, heartbeat_at__lt=cutoff)
+    failed = stale.filter(attempts__gte=max_attempts).update(
+        status=ProcessingJob.STATUS_FAILED,
+        error='Worker stopped responding',
+        finished_at=timezone.now(),
+    )
+    requeued = stale.filter(attempts__lt=max_attempts).update(status=ProcessingJob.STATUS_QUEUED)
+    return requeued, failed
+
+
+def mark_job_failed(job_id, error):
+    """Fail a running job whose worker process died before it could report back"""
+    from music.models import ProcessingJob
+
+    return ProcessingJob.objects.filter(pk=job_id, status=ProcessingJob.STATUS_RUNNING).update(
+        status=ProcessingJob.STATUS_FAILED,
+        error=error,
+        finished_at=timezone.now(),
+    )
+
+
+def init_worker():
+    """Process pool initializer: set up Django in a freshly spawned worker"""
+    import django
+    django.setup()
+
+
+def _update_stage(job, stage, state):
+    job.stages[stage] = state
+    job.stage = stage
+    done = sum(1 for value in job.stages.values() if value == 'done')
+    job.progress = int(done * 100 / len(PROCESSING_STAGES))
+    job.heartbeat_at = timezone.now()
+    job.save(update_fields=['stages', 'stage', 'progress', 'heartbeat_at', 'timings'])
+
+
+def _temp_copy(path):
+    with tempfile.NamedTemporaryFile(suffix=os.path.splitext(path)[1], delete=False) as temp_file:
+        with open(path, 'rb') as f:
+            shutil.copyfileobj(f, temp_file)
+    return temp_file.name
+
+
+def run_job(job_id):
+    """Run a claimed processing job to completion; executed inside a worker process"""
+    from music.models import ProcessingJob
+    from audio_utils import AudioProcessor
+    from audio_pipeline import run_pipeline, default_profile, merge_profile
+    from hls_utils import package_track
+    from probe_utils import probe_audio, apply_probe
+    from fingerprint_utils import store_fingerprint
+
+    job = ProcessingJob.objects.select_related('track', 'track__artist', 'track__album').get(pk=job_id)
+    track = job.track
+    processor = AudioProcessor()
+    temp_paths = []
+    stage = None
+    stage_started = None
+
+    def advance(next_stage):
+        nonlocal stage, stage_started
+        now = time.perf_counter()
+        if stage:
+            job.timings[stage] = {'seconds': round(now - stage_started, 3)}
+            _update_stage(job, stage, 'done')
+        stage, stage_started = next_stage, now
+        if stage:
+            _update_stage(job, stage, 'running')
+
+    try:
+        # A job with a profile is a deliberate rerun, never answered with another track's results
+        rerun = 'profile' in job.options
+        # An identical upload may have finished processing while this job sat in the queue
+        original = None if rerun else find_processed_duplicate(track.content_hash, exclude=track.pk)
+        if original:
+            reuse_processing_results(track, original)
+            job.stages = {name: 'done' for name in PROCESSING_STAGES}
+            job.progress = 100
+            job.status = ProcessingJob.STATUS_DONE
+            job.finished_at = timezone.now()
+            job.save(update_fields=['stages', 'progress', 'status', 'finished_at'])
+            if os.path.exists(job.source_path):
+                os.unlink(job.source_path)
+            return job.status
+
+        source_available = bool(job.source_path) and os.path.exists(job.source_path)
+        advance('extract_metadata')
+        if source_available:
+            extracted_metadata = processor.extract_metadata(job.source_path)
+            track.extracted_title = extracted_metadata.get('title', '')
+            track.extracted_artist = extracted_metadata.get('artist', '')
+            track.extracted_album = extracted_metadata.get('album', '')
+            track.extracted_year = str(extracted_metadata.get('year', ''))
+            track.extracted_genre = extracted_metadata.get('genre', '')
+            track.extracted_track_number = str(extracted_metadata.get('track_number', ''))
+
+        # Unchanged stages are read from the pipeline cache; only the rest is computed
+        profile = merge_profile(default_profile(), job.options.get('profile'))
+        outputs, report = run_pipeline(
+            job.source_path if source_available else None,
+            source_hash=track.content_hash or None,
+            profile=profile,
+            on_stage=advance,
+        )
+
+        advance('store')
+        for name, entry in report.items():
+            job.timings[name] = {'seconds': entry['seconds'], 'cached': entry['cached']}
+
+        # Cached outputs are shared, so tags are written to private copies
+        processed_file_path = _temp_copy(outputs['brand.audio'])
+        temp_paths.append(processed_file_path)
+        optimized_file_path = _temp_copy(outputs['optimize.audio'])
+        temp_paths.append(optimized_file_path)
+        with open(outputs['analyse.loudness']) as f:
+            loudness = json.load(f)
+        processor._add_id3_tags(
+            processed_file_path,
+            {'title': track.title, 'album': track.album.title if track.album else ''},
+            {'name': track.artist.name}
+        )
+        reference = profile['analyse']['replaygain_reference']
+        processor._add_replaygain_tags(processed_file_path, loudness, reference)
+        processor._add_replaygain_tags(optimized_file_path, loudness, reference)
+
+        filename = job.original_filename or track.original_filename or f"{track.slug}.mp3"
+        with open(processed_file_path, 'rb') as f:
+            track.audio_file.save(f"processed_{filename}", UploadedFile(f), save=False)
+        with open(optimized_file_path, 'rb') as f:
+            track.optimized_file.save(f"optimized_{filename}", UploadedFile(f), save=False)
+        for field, ref, extension in (('waveform', 'analyse.waveform', 'peaks'), ('preview_file', 'preview.clip', 'mp3')):
+            with open(outputs[ref], 'rb') as f:
+                data = f.read()
+            getattr(track, field).save(f"{hashlib.sha1(data).hexdigest()[:16]}.{extension}", ContentFile(data), save=False)
+        with open(outputs['seek_index.index'], 'rb') as f:
+            track.seek_index = f.read()
+
+        # Describe the stored file from its headers rather than the decoded PCM
+        apply_probe(track, probe_audio(processed_file_path))
+        track.is_processed = True
+        track.processed_at = timezone.now()
+        track.has_site_branding = True
+        track.is_optimized = True
+        track.loudness_integrated = loudness['integrated']
+        track.loudness_range = loudness['loudness_range']
+        track.true_peak = loudness['true_peak']
+        track.replaygain_track_gain = loudness['replaygain_track_gain']
+        track.save()
+        with np.load(outputs['fingerprint.fingerprint']) as fingerprint:
+            store_fingerprint(track, (fingerprint['hashes'], fingerprint['offsets']))
+
+        advance('package_hls')
+        track.hls_playlist = package_track(track, processed_file_path)
+        track.save(update_fields=['hls_playlist'])
+        advance(None)
+
+        job.status = ProcessingJob.STATUS_DONE
+        job.finished_at = timezone.now()
+        job.save(update_fields=['status', 'finished_at'])
+
+        if source_available:
+            os.unlink(job.source_path)
+
+    except Exception as e:
+        logger.error(f"Error processing job {job_id}: {e}")
+        if stage:
+            job.stages[stage] = 'failed'
+        job.status = ProcessingJob.STATUS_FAILED
+        job.error = str(e)
+        job.finished_at = timezone.now()
+        job.save(update_fields=['stages', 'timings', 'status', 'error', 'finished_at'])
+
+    finally:
+        for path in temp_paths:
+            if os.path.exists(path):
+                os.unlink(path)
+
+    return job.status
@@ -0,0 +1,452 @@
+"""
+Audio processing as a declarative graph of named stages.
+
+Every stage reads named outputs of earlier stages (or the uploaded ``source``), depends on
+its own section of the processing profile, and writes named output files. Outputs are
+content-addressed: a stage's cache key is the hash of its name, version, input content
+hashes and parameters, so rerunning a track with a changed profile recomputes only the
+stages whose parameters changed and those downstream of them. Everything else is read
+from the cache, including stages whose inputs came out byte-identical.
+
+Stages that consume decoded audio do not decode it themselves: the fingerprint, the
+branded and streaming encodes and the loudness, waveform and energy analysis that need
+computing are fed from a single PCM pass over the upload.
+"""
+import os
+import json
+import time
+import shutil
+import hashlib
+import tempfile
+import numpy as np
+from django.conf import settings
+from stream_utils import (
+    PCMDecoder, PCMEncoder, segment_samples, stream_block_frames, STREAM_SAMPLE_RATE, STREAM_CHANNELS, STREAM_SAMPLE_WIDTH
+)
+import logging
+
+logger = logging.getLogger(__name__)
+
+MANIFEST = 'manifest.json'
+HASH_BLOCK_SIZE = 1024 * 1024
+# The audio streamed stages consume: the upload as decoded, or the branded track
+SOURCE = 'source'
+BRANDED = 'brand.audio'
+
+
+class Stage:
+    """
+    A pipeline step. ``inputs`` name outputs as ``'stage.output'`` (or ``'source'``),
+    ``outputs`` maps output names to file extensions, and ``run(inputs, outputs, params)``
+    receives input paths and the paths it must write. Bump ``version`` when the code
+    behind a stage changes its output.
+
+    A stage with a ``stream`` (SOURCE or BRANDED) consumes that audio as PCM: ``run`` is
+    then a generator sent int16 blocks until None, and every stream stage that needs
+    running at that point is fed from the same decode.
+    """
+
+    def __init__(self, name, inputs, outputs, run, version=1, stream=None):
+        self.name = name
+        self.inputs = inputs
+        self.outputs = outputs
+        self.run = run
+        self.version = version
+        self.stream = stream
+
+    def __repr__(self):
+        return f"<Stage {self.name}>"
+
+
+def run_fingerprint(inputs, outputs, params):
+    from fingerprint_utils import StreamingFingerprinter
+
+    fingerprinter = StreamingFingerprinter()
+    while (block := (yield)) is not None:
+        fingerprinter.feed(block)
+    hashes, offsets = fingerprinter.result()
+    with open(outputs['fingerprint'], 'wb') as f:
+        np.savez(f, hashes=hashes, offsets=offsets)
+
+
+def _encode(path, bitrate):
+    """Stream consumer body encoding every block to an MP3"""
+    encoder = PCMEncoder(path, bitrate)
+    try:
+        while (block := (yield)) is not None:
+            encoder.write(block)
+    except BaseException:
+        encoder.abort()
+        raise
+    encoder.close()
+
+
+def run_brand(inputs, outputs, params):
+    from mp3_splice import splice_announcement
+
+    # MP3 uploads are joined to the pre-encoded announcement without touching the decoded audio
+    branded = splice_announcement(inputs['source']) if params['splice'] else None
+    if branded is not None:
+        shutil.move(branded, outputs['audio'])
+        return
+    yield from _encode(outputs['audio'], params['bitrate'])
+
+
+def run_optimize(inputs, outputs, params):
+    yield from _encode(outputs['audio'], params['bitrate'])
+
+
+def run_analyse(inputs, outputs, params):
+    from loudness_utils import LoudnessAnalyzer, replaygain
+    from waveform_utils import PeakAccumulator, encode_peaks
+    from preview_utils import EnergyAccumulator
+
+    loudness = LoudnessAnalyzer(STREAM_SAMPLE_RATE, STREAM_CHANNELS)
+    peaks = PeakAccumulator(STREAM_SAMPLE_WIDTH, params['waveform_levels'], params['waveform_bits'])
+    energy = EnergyAccumulator(STREAM_SAMPLE_RATE)
+    while (block := (yield)) is not None:
+        loudness.feed(block / 32768.0)
+        peaks.feed(block)
+        energy.feed(block)
+
+    result = loudness.result()
+    gain, peak = replaygain(result, params['replaygain_reference'])
+    result.update(replaygain_track_gain=gain, replaygain_track_peak=peak)
+    with open(outputs['loudness'], 'w') as f:
+        json.dump(result, f)
+    with open(outputs['waveform'], 'wb') as f:
+        f.write(encode_peaks(peaks.result(), STREAM_SAMPLE_RATE, peaks.frame_count))
+    with open(outputs['energy'], 'wb') as f:
+        np.savez(f, energy=energy.result(), window_seconds=energy.window_seconds)
+
+
+def run_preview(inputs, outputs, params):
+    from preview_utils import pick_preview_start, encode_preview
+    from tts_utils import SiteAnnouncementGenerator
+
+    with np.load(inputs['analyse.energy']) as data:
+        energy, window_seconds = data['energy'], float(data['window_seconds'])
+    # Every branded file opens with the same announcement; keep it out of the preview
+    skip = SiteAnnouncementGenerator().get_announcement_duration()
+    start = pick_preview_start(energy, window_seconds, params['seconds'], skip)
+    _, content = encode_preview(inputs['optimize.audio'], start, params['seconds'], params['bitrate'], params['fade_ms'])
+    with open(outputs['clip'], 'wb') as f:
+        f.write(content.read())
+
+
+def run_seek_index(inputs, outputs, params):
+    from seek_index import build_seek_index
+
+    with open(outputs['index'], 'wb') as f:
+        f.write(build_seek_index(inputs['optimize.audio'], params['interval_ms']))
+
+
+STAGES = [
+    Stage('fingerprint', ['source'], {'fingerprint': 'npz'}, run_fingerprint, stream=SOURCE),
+    Stage('brand', ['source'], {'audio': 'mp3'}, run_brand, stream=BRANDED),
+    Stage('optimize', ['brand.audio'], {'audio': 'mp3'}, run_optimize, version=2, stream=BRANDED),
+    Stage('analyse', ['brand.audio'], {'loudness': 'json', 'waveform': 'peaks', 'energy': 'npz'}, run_analyse,
+          version=2, stream=BRANDED),
+    Stage('preview', ['optimize.audio', 'analyse.energy'], {'clip': 'mp3'}, run_preview),
+    Stage('seek_index', ['optimize.audio'], {'index': 'bin'}, run_seek_index),
+]
+
+
+def default_profile():
+    """Parameters of every stage from settings, overridden by AUDIO_PIPELINE_PROFILE"""
+    from tts_utils import SiteAnnouncementGenerator, ANNOUNCEMENT_VERSION
+
+    generator = SiteAnnouncementGenerator()
+    profile = {
+        'fingerprint': {},
+        'brand': {
+            'bitrate': '320k',
+            'splice': settings.AUDIO_BRAND_SPLICE,
+            # A changed announcement is a changed brand stage
+            'announcement': f"{ANNOUNCEMENT_VERSION}:{generator.site_name}:{generator.site_tagline}",
+        },
+        'optimize': {'bitrate': '192k'},
+        'analyse': {
+            'waveform_levels': list(settings.AUDIO_WAVEFORM_LEVELS),
+            'waveform_bits': settings.AUDIO_WAVEFORM_BITS,
+            'replaygain_reference': settings.AUDIO_REPLAYGAIN_REFERENCE,
+        },
+        'preview': {
+            'seconds': settings.AUDIO_PREVIEW_SECONDS,
+            'bitrate': settings.AUDIO_PREVIEW_BITRATE,
+            'fade_ms': settings.AUDIO_PREVIEW_FADE_MS,
+        },
+        'seek_index': {'interval_ms': settings.AUDIO_SEEK_INDEX_INTERVAL_MS},
+    }
+    return merge_profile(profile, settings.AUDIO_PIPELINE_PROFILE)
+
+
+def merge_profile(profile, overrides):
+    """Profile with ``{stage: {param: value}}`` overrides applied; unknown names raise ValueError"""
+    merged = {name: dict(params) for name, params in profile.items()}
+    for name, params in (overrides or {}).items():
+        if name not in merged:
+            raise ValueError(f"Unknown pipeline stage: {name}")
+        unknown = set(params) - set(merged[name])
+        if unknown:
+            raise ValueError(f"Unknown {name} parameters: {', '.join(sorted(unknown))}")
+        merged[name].update(params)
+    return merged
+
+
+def ordered_stages(stages=None):
+    """Stages in dependency order; raises ValueError for unknown inputs and cycles"""
+    stages = list(STAGES if stages is None else stages)
+    produced = {'source'}
+    ordered = []
+    while stages:
+        ready = [stage for stage in stages if all(ref in produced for ref in stage.inputs)]
+        if not ready:
+            missing = sorted({ref for stage in stages for ref in stage.inputs if ref not in produced})
+            raise ValueError(f"Pipeline inputs are never produced: {', '.join(missing)}")
+        for stage in ready:
+            stages.remove(stage)
+            ordered.append(stage)
+            produced.update(f"{stage.name}.{output}" for output in stage.outputs)
+    return ordered
+
+
+def file_hash(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(HASH_BLOCK_SIZE), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def stage_key(stage, input_hashes, params):
+    """Cache key of a stage run: what it is, what it reads and how it is configured"""
+    description = json.dumps({
+        'stage': stage.name, 'version': stage.version, 'inputs': input_hashes, 'params': params,
+    }, sort_keys=True)
+    return hashlib.sha256(description.encode('utf-8')).hexdigest()
+
+
+class PipelineCache:
+    """
+    Content-addressed store of stage outputs shared by every worker, one directory per key
+    holding the output files and a manifest of their hashes. Entries are published with an
+    atomic rename, reads touch the manifest, and the least recently used entries are
+    removed once the cache outgrows AUDIO_PIPELINE_CACHE_SIZE.
+    """
+
+    def __init__(self, root=None, max_bytes=None):
+        self.root = root or settings.AUDIO_PIPELINE_CACHE_DIR
+        self.max_bytes = settings.AUDIO_PIPELINE_CACHE_SIZE if max_bytes is None else max_bytes
+
+    def entry_dir(self, key):
+        return os.path.join(self.root, key[:2], key)
+
+    def get(self, key):
+        """Manifest ``{output: {'path', 'hash'}}`` of a cached entry, or None"""
+        directory = self.entry_dir(key)
+        try:
+            with open(os.path.join(directory, MANIFEST)) as f:
+                manifest = json.load(f)
+            os.utime(os.path.join(directory, MANIFEST))
+        except (FileNotFoundError, ValueError):
+            return None
+        outputs = {name: {'path': os.path.join(directory, entry['file']), 'hash': entry['hash']}
+                   for name, entry in manifest['outputs'].items()}
+        if not all(os.path.exists(output['path']) for output in outputs.values()):
+            return None
+        return outputs
+
+    def put(self, key, work_dir, files):
+        """Publish the output ``files`` (name to path inside ``work_dir``) under ``key``"""
+        manifest = {'outputs': {
+            name: {'file': os.path.basename(path), 'hash': file_hash(path)} for name, path in files.items()
+        }}
+        with open(os.path.join(work_dir, MANIFEST), 'w') as f:
+            json.dump(manifest, f)
+        directory = self.entry_dir(key)
+        os.makedirs(os.path.dirname(directory), exist_ok=True)
+        try:
+            os.rename(work_dir, directory)
+        except OSError:
+            # Another worker published the same entry first; theirs is identical
+            shutil.rmtree(work_dir, ignore_errors=True)
+        return self.get(key)
+
+    def prune(self, keep=()):
+        """Remove least recently used entries until the cache fits; returns the bytes removed"""
+        entries = []
+        for shard in os.scandir(self.root) if os.path.isdir(self.root) else ():
+            if not shard.is_dir():
+                continue
+            for entry in os.scandir(shard.path):
+                try:
+                    used = os.stat(os.path.join(entry.path, MANIFEST)).st_mtime_ns
+                except FileNotFoundError:
+                    continue
+                size = sum(item.stat().st_size for item in os.scandir(entry.path))
+                entries.append((used, size, entry.name, entry.path))
+
+        total = sum(size for _, size, _, _ in entries)
+        removed = 0
+        for _, size, key, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            if key in keep:
+                continue
+            shutil.rmtree(path, ignore_errors=True)
+            total -= size
+            removed += size
+        return removed
+
+
+def runs_without_source(source_hash, profile=None, cache=None):
+    """Whether every stage reading the upload is cached for this content hash and profile"""
+    profile = profile or default_profile()
+    cache = cache or PipelineCache()
+    return all(
+        cache.get(stage_key(stage, [source_hash], profile.get(stage.name, {}))) is not None
+        for stage in ordered_stages() if stage.inputs == ['source']
+    )
+
+
+def decode_pass(consumers, source_path, branded_path):
+    """
+    Feed the stream stage generators in ``consumers`` from one decode. The upload is decoded
+    when ``source_path`` is given, and BRANDED consumers get the announcement ahead of it,
+    as the brand stage encodes it; otherwise the branded track at ``branded_path`` is.
+    """
+    active = []
+    for stage, consumer in consumers:
+        try:
+            next(consumer)
+        except StopIteration:
+            # Finished without needing audio, e.g. a brand spliced from MP3 frames
+            continue
+        active.append((stage, consumer))
+    if not active:
+        return
+
+    try:
+        if source_path:
+            branded = [consumer for stage, consumer in active if stage.stream == BRANDED]
+            if branded:
+                from audio_utils import AudioProcessor
+
+                announcement = AudioProcessor().create_site_announcement(STREAM_SAMPLE_RATE, STREAM_CHANNELS, STREAM_SAMPLE_WIDTH)
+                if announcement:
+                    block = segment_samples(announcement)
+                    for consumer in branded:
+                        consumer.send(block)
+            blocks = PCMDecoder(source_path, stream_block_frames())
+        else:
+            blocks = PCMDecoder(branded_path, stream_block_frames())
+        for block in blocks:
+            for _, consumer in active:
+                consumer.send(block)
+        for stage, consumer in active:
+            try:
+                consumer.send(None)
+            except StopIteration:
+                continue
+            raise RuntimeError(f"Pipeline stage {stage.name} did not finish at the end of the audio")
+    finally:
+        for _, consumer in active:
+            consumer.close()
+
+
+def run_pipeline(source_path, source_hash=None, profile=None, on_stage=None, cache=None):
+    """
+    Run every stage for one upload, reading unchanged results from the cache. The source
+    file is only opened by stages that miss the cache, so a track whose upload is gone can
+    still be rerun with a changed profile while its upstream entries are cached.
+
+    Returns ``(outputs, report)``: cached paths keyed ``'stage.output'`` and, per stage,
+    ``{'seconds', 'cached', 'key'}``. Stages computed in one decode pass each report the
+    wall time of the whole pass.
+    """
+    profile = profile or default_profile()
+    cache = cache or PipelineCache()
+    if source_hash is None:
+        if not source_path:
+            raise ValueError("The pipeline needs the upload or its content hash")
+        source_hash = file_hash(source_path)
+    source_available = bool(source_path) and os.path.exists(source_path)
+
+    paths = {'source': source_path}
+    hashes = {'source': source_hash}
+    report = {}
+
+    def lookup(stage):
+        """Cache key and cached outputs of a stage whose inputs are known"""
+        key = stage_key(stage, [hashes[ref] for ref in stage.inputs], profile.get(stage.name, {}))
+        return key, cache.get(key)
+
+    def publish(stage, key, outputs, started, cached):
+        for name, output in outputs.items():
+            paths[f"{stage.name}.{name}"] = output['path']
+            hashes[f"{stage.name}.{name}"] = output['hash']
+        report[stage.name] = {'seconds': round(time.perf_counter() - started, 3), 'cached': cached, 'key': key}
+
+    def compute(group, started):
+        """Run the stages in ``group`` (a single decode pass for stream stages) and publish them in order"""
+        for stage in group:
+            if 'source' in stage.inputs and not source_available:
+                raise FileNotFoundError(f"The upload is no longer available to run {stage.name}")
+        os.makedirs(cache.root, exist_ok=True)
+        work = []
+        try:
+            for stage in group:
+                work_dir = tempfile.mkdtemp(dir=cache.root, prefix='.partial-')
+                files = {name: os.path.join(work_dir, f"{name}.{extension}") for name, extension in stage.outputs.items()}
+                work.append((stage, work_dir, files))
+            consumers = []
+            for stage, _, files in work:
+                run = stage.run({ref: paths.get(ref) for ref in stage.inputs}, files, profile.get(stage.name, {}))
+                if stage.stream:
+                    consumers.append((stage, run))
+            if consumers:
+                decode_pass(consumers, source_path if source_available else None, paths.get(BRANDED))
+
+            for stage, work_dir, files in work:
+                if on_stage and stage is not group[0]:
+                    on_stage(stage.name)
+                # Keys of stages reading outputs of this pass are only known once those are published
+                key = stage_key(stage, [hashes[ref] for ref in stage.inputs], profile.get(stage.name, {}))
+                outputs = cache.put(key, work_dir, files)
+                if outputs is None:
+                    raise RuntimeError(f"Pipeline stage {stage.name} did not publish its outputs")
+                publish(stage, key, outputs, started, cached=False)
+        finally:
+            for _, work_dir, _ in work:
+                if os.path.isdir(work_dir):
+                    shutil.rmtree(work_dir, ignore_errors=True)
+
+    stages = ordered_stages()
+    for index, stage in enumerate(stages):
+        if stage.name in report:
+            continue
+        if on_stage:
+            on_stage(stage.name)
+        started = time.perf_counter()
+        key, outputs = lookup(stage)
+        if outputs is not None:
+            publish(stage, key, outputs, started, cached=True)
+            continue
+
+        group = [stage]
+        if stage.stream:
+            # Every other stage consuming audio that has to run shares this decode
+            for later in stages[index + 1:]:
+                if not later.stream or later.name in report:
+                    continue
+                grouped = {member.name for member in group}
+                if any(ref not in hashes and ref.split('.')[0] not in grouped for ref in later.inputs):
+                    continue
+                if all(ref in hashes for ref in later.inputs) and lookup(later)[1] is not None:
+                    continue
+                group.append(later)
+        compute(group, started)
+
+    cache.prune(keep={entry['key'] for entry in report.values()})
+    return {ref: path for ref, path in paths.items() if ref != 'source'}, report
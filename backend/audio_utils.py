@@ -1,18 +1,36 @@
 import os
 import tempfile
 from mutagen import File
-from mutagen.id3 import ID3, TIT2, TPE1, TALB, TDRC, TCON, TRCK
+from mutagen.id3 import ID3, TIT2, TPE1, TALB, TDRC, TCON, TRCK, TXXX, TENC, RVA2
 from mutagen.mp3 import MP3
 from mutagen.flac import FLAC
+import audioop_compat
+audioop_compat.install()
 from pydub import AudioSegment
+from pydub.generators import Sine
 from django.conf import settings
 from django.utils import timezone
 from tts_utils import SiteAnnouncementGenerator
+from loudness_utils import analyse_segment, replaygain, LoudnessAnalyzer
+from probe_utils import probe_audio
+from mp3_splice import splice_announcement
+from stream_utils import (
+    PCMDecoder, PCMEncoder, FadeFilter, segment_samples, stream_block_frames, use_streaming_engine,
+    STREAM_SAMPLE_RATE, STREAM_CHANNELS, STREAM_SAMPLE_WIDTH
+)
 import logging
 
 logger = logging.getLogger(__name__)
 
 class AudioProcessor:
+    """
+    Branding, optimization and analysis of uploaded audio.
+
+    Two engines sit behind the same methods: pydub decodes the whole file into memory,
+    while the streaming engine pipes fixed-size PCM blocks through ffmpeg. Which one runs
+    is decided per file by AUDIO_PROCESSING_ENGINE and AUDIO_STREAM_MEMORY_LIMIT.
+    """
+
     def __init__(self):
         self.site_name = "Ghettoselebu"
         self.site_tagline = "Your Music Platform"
@@ -45,10 +63,12 @@ class AudioProcessor:
                 metadata['genre'] = audio_file.get('genre', [''])[0] if audio_file.get('genre') else ''
                 metadata['track_number'] = audio_file.get('tracknumber', [''])[0] if audio_file.get('tracknumber') else ''
             
-            # Get file info
-            metadata['duration'] = getattr(audio_file.info, 'length', 0)
-            metadata['bitrate'] = getattr(audio_file.info, 'bitrate', 0)
-            metadata['file_size'] = os.path.getsize(file_path)
+            # Get file info from the headers mutagen has already parsed
+            probe = probe_audio(file_path, audio_file)
+            metadata['probe'] = probe
+            metadata['duration'] = probe['duration_ms'] / 1000.0
+            metadata['bitrate'] = probe['bitrate']
+            metadata['file_size'] = probe['file_size']
             
             return metadata
             
@@ -56,33 +76,39 @@ class AudioProcessor:
             logger.error(f"Error extracting metadata: {e}")
             return {}
     
-    def create_site_announcement(self):
-        """Create audio announcement with female voice"""
+    def create_site_announcement(self, frame_rate=44100, channels=2, sample_width=2):
+        """Get the cached female voice announcement in the given PCM layout"""
         try:
-            # Use the TTS utility to create announcement
-            announcement_path = self.announcement_generator.create_announcement(voice_type='female')
-            
-            if announcement_path and os.path.exists(announcement_path):
-                announcement = AudioSegment.from_file(announcement_path)
-                # Clean up temporary file
-                os.unlink(announcement_path)
-                return announcement
-            else:
-                # Fallback to simple tone
-                return AudioSegment.sine(440, duration=1000)
+            return self.announcement_generator.get_announcement(
+                voice_type='female',
+                frame_rate=frame_rate,
+                channels=channels,
+                sample_width=sample_width
+            )
             
         except Exception as e:
             logger.error(f"Error creating site announcement: {e}")
-            return AudioSegment.sine(440, duration=1000)
+            return Sine(440, sample_rate=frame_rate).to_audio_segment(duration=1000)
     
     def embed_metadata(self, file_path, track_data, artist_data=None):
         """Embed metadata and site branding into audio file"""
         try:
+            # MP3s get the pre-encoded announcement joined on at a frame boundary: a file copy
+            spliced = splice_announcement(file_path) if settings.AUDIO_BRAND_SPLICE else None
+            if spliced:
+                self._add_id3_tags(spliced, track_data, artist_data)
+                return spliced
+
+            if self._streams(file_path):
+                temp_path = self._stream_render(file_path, ['320k'], announce=True)['paths'][0]
+                self._add_id3_tags(temp_path, track_data, artist_data)
+                return temp_path
+            
             # Load the audio file
             audio = AudioSegment.from_file(file_path)
             
-            # Create site announcement
-            announcement = self.create_site_announcement()
+            # Create site announcement matching the track's layout
+            announcement = self.create_site_announcement(audio.frame_rate, audio.channels, audio.sample_width)
             if announcement:
                 # Add announcement at the beginning
                 audio = announcement + audio
@@ -103,8 +129,27 @@ class AudioProcessor:
             logger.error(f"Error embedding metadata: {e}")
             return file_path
     
+    def _id3_frames(self, track_data, artist_data=None):
+        """Metadata and site branding frames written to processed MP3s"""
+        frames = []
+        if track_data.get('title'):
+            frames.append(TIT2(encoding=3, text=track_data['title']))
+        if artist_data and artist_data.get('name'):
+            frames.append(TPE1(encoding=3, text=artist_data['name']))
+        if track_data.get('album'):
+            frames.append(TALB(encoding=3, text=track_data['album']))
+
+        # Site branding
+        frames.append(TXXX(encoding=3, desc='BRAND', text=f"{self.site_name} - {self.site_tagline}"))
+        frames.append(TXXX(encoding=3, desc='SOURCE', text=self.site_name))
+        frames.append(TXXX(encoding=3, desc='PROCESSED_BY', text=f"{self.site_name} Audio Processor v1.0"))
+
+        # Encoding info
+        frames.append(TENC(encoding=3, text=f"{self.site_name} Encoder v1.0"))
+        return frames
+
     def _add_id3_tags(self, file_path, track_data, artist_data=None):
-        """Add ID3 tags to MP3 file"""
+        """Add ID3 tags to MP3 file; returns whether they were saved"""
         try:
             audio = MP3(file_path)
             
@@ -112,46 +157,80 @@ class AudioProcessor:
             if audio.tags is None:
                 audio.add_tags()
             
-            # Add track metadata
-            if track_data.get('title'):
-                audio.tags['TIT2'] = TIT2(encoding=3, text=track_data['title'])
-            
-            if artist_data and artist_data.get('name'):
-                audio.tags['TPE1'] = TPE1(encoding=3, text=artist_data['name'])
-            
-            if track_data.get('album'):
-                audio.tags['TALB'] = TALB(encoding=3, text=track_data['album'])
-            
-            # Add site branding
-            audio.tags['TXXX:BRAND'] = f"{self.site_name} - {self.site_tagline}"
-            audio.tags['TXXX:SOURCE'] = self.site_name
-            audio.tags['TXXX:UPLOAD_DATE'] = str(timezone.now().date())
-            audio.tags['TXXX:PROCESSED_BY'] = f"{self.site_name} Audio Processor v1.0"
-            
-            # Add encoding info
-            audio.tags['TENC'] = f"{self.site_name} Encoder v1.0"
-            
-            # Add processing timestamp
-            audio.tags['TXXX:PROCESSED_AT'] = str(timezone.now())
+            for frame in self._id3_frames(track_data, artist_data):
+                audio.tags.setall(frame.HashKey, [frame])
+
+            # The upload date survives retagging; the processing timestamp does not
+            if not audio.tags.getall('TXXX:UPLOAD_DATE'):
+                audio.tags.add(TXXX(encoding=3, desc='UPLOAD_DATE', text=str(timezone.now().date())))
+            audio.tags.setall('TXXX:PROCESSED_AT', [TXXX(encoding=3, desc='PROCESSED_AT', text=str(timezone.now()))])
             
             audio.save()
+            return True
             
         except Exception as e:
             logger.error(f"Error adding ID3 tags: {e}")
+            return False
+
+    def retag(self, file_path, track_data, artist_data=None, force=False):
+        """
+        Rewrite the metadata and branding frames of a stored MP3 in place. Only the ID3
+        header is read and written; the audio frames are never decoded or re-encoded.
+        Files already carrying the current frames are left alone unless ``force`` is set.
+        Returns 'retagged', 'current' or 'failed'.
+        """
+        try:
+            audio = MP3(file_path)
+        except Exception as e:
+            logger.warning(f"Cannot retag {file_path}: {e}")
+            return 'failed'
+
+        if not force and audio.tags is not None and all(
+            [existing.text for existing in audio.tags.getall(frame.HashKey)] == [frame.text]
+            for frame in self._id3_frames(track_data, artist_data)
+        ):
+            return 'current'
+        return 'retagged' if self._add_id3_tags(file_path, track_data, artist_data) else 'failed'
+
+    def measure_loudness(self, audio):
+        """Measure EBU R128 loudness of a decoded segment and derive its ReplayGain values"""
+        return self._with_replaygain(analyse_segment(audio))
+
+    def _with_replaygain(self, loudness):
+        gain, peak = replaygain(loudness)
+        loudness['replaygain_track_gain'] = gain
+        loudness['replaygain_track_peak'] = peak
+        return loudness
+
+    def _add_replaygain_tags(self, file_path, loudness, reference=None):
+        """
+        Tag an MP3 with ReplayGain so players adjust volume at playback instead of re-encoding.
+        ``reference`` is the loudness the gain was computed against (AUDIO_REPLAYGAIN_REFERENCE by default).
+        """
+        reference = settings.AUDIO_REPLAYGAIN_REFERENCE if reference is None else reference
+        if loudness.get('replaygain_track_gain') is None:
+            return
+        try:
+            audio = MP3(file_path)
+            if audio.tags is None:
+                audio.add_tags()
+
+            gain = loudness['replaygain_track_gain']
+            peak = loudness['replaygain_track_peak']
+            audio.tags.add(TXXX(encoding=3, desc='REPLAYGAIN_TRACK_GAIN', text=f"{gain:+.2f} dB"))
+            audio.tags.add(TXXX(encoding=3, desc='REPLAYGAIN_TRACK_PEAK', text=f"{peak:.6f}"))
+            audio.tags.add(TXXX(encoding=3, desc='REPLAYGAIN_REFERENCE_LOUDNESS',
+                                text=f"{reference:.1f} LUFS"))
+            audio.tags.add(RVA2(desc='track', channel=1, gain=gain, peak=min(peak, 1.99)))
+            audio.save()
+
+        except Exception as e:
+            logger.error(f"Error adding ReplayGain tags: {e}")
     
     def get_audio_info(self, file_path):
-        """Get detailed audio file information"""
+        """Get duration, bitrate, sample rate, channels and codec from the file headers"""
         try:
-            audio = AudioSegment.from_file(file_path)
-            
-            return {
-                'duration_seconds': len(audio) / 1000.0,
-                'channels': audio.channels,
-                'frame_rate': audio.frame_rate,
-                'sample_width': audio.sample_width,
-                'frame_count': audio.frame_count(),
-                'file_size': os.path.getsize(file_path)
-            }
+            return probe_audio(file_path)
             
         except Exception as e:
             logger.error(f"Error getting audio info: {e}")
@@ -160,10 +239,13 @@ class AudioProcessor:
     def optimize_for_streaming(self, file_path):
         """Optimize audio file for streaming"""
         try:
-            audio = AudioSegment.from_file(file_path)
+            if self._streams(file_path):
+                rendered = self._stream_render(file_path, ['192k'], analyse=True)
+                temp_path = rendered['paths'][0]
+                self._add_replaygain_tags(temp_path, self._with_replaygain(rendered['loudness'].result()))
+                return temp_path
             
-            # Normalize audio
-            audio = audio.normalize()
+            audio = AudioSegment.from_file(file_path)
             
             # Convert to standard format for streaming
             optimized_audio = audio.set_frame_rate(44100).set_channels(2)
@@ -173,15 +255,87 @@ class AudioProcessor:
                 temp_path = temp_file.name
                 optimized_audio.export(temp_path, format='mp3', bitrate='192k')
                 
-                return temp_path
+            # Loudness is tagged, not applied, so the audio is encoded only once
+            self._add_replaygain_tags(temp_path, self.measure_loudness(optimized_audio))
+            return temp_path
                 
         except Exception as e:
             logger.error(f"Error optimizing audio: {e}")
             return file_path
     
+    def _streams(self, file_path):
+        """Whether this file goes through the streaming engine"""
+        try:
+            probe = probe_audio(file_path)
+        except (ValueError, OSError):
+            probe = None
+        return use_streaming_engine(probe)
+
+    def _stream_render(self, file_path, bitrates, announce=False, fade_duration=0, analyse=False):
+        """
+        Decode ``file_path`` once through ffmpeg and encode it to an MP3 per bitrate, one
+        block at a time. The announcement is prepended when ``announce`` is set, and with
+        ``analyse`` the output audio is measured for loudness. Memory is bounded by the
+        block size, not the track's length.
+        """
+        paths = []
+        encoders = []
+        fader = FadeFilter(*([int(fade_duration * STREAM_SAMPLE_RATE / 1000)] * 2)) if fade_duration else None
+        loudness = LoudnessAnalyzer(STREAM_SAMPLE_RATE, STREAM_CHANNELS) if analyse else None
+
+        def output(block):
+            if fader:
+                block = fader.process(block)
+            for encoder in encoders:
+                encoder.write(block)
+            if analyse:
+                loudness.feed(block / 32768.0)
+
+        try:
+            for bitrate in bitrates:
+                with tempfile.NamedTemporaryFile(suffix='.mp3', delete=False) as temp_file:
+                    paths.append(temp_file.name)
+                encoders.append(PCMEncoder(paths[-1], bitrate))
+
+            if announce:
+                announcement = self.create_site_announcement(STREAM_SAMPLE_RATE, STREAM_CHANNELS, STREAM_SAMPLE_WIDTH)
+                if announcement:
+                    output(segment_samples(announcement))
+
+            for block in PCMDecoder(file_path, stream_block_frames()):
+                output(block)
+
+            if fader:
+                # The fade-out tail bypasses the fader, which has already applied it
+                tail, fader = fader.flush(), None
+                output(tail)
+
+            while encoders:
+                encoders.pop(0).close()
+
+        except Exception:
+            for encoder in encoders:
+                encoder.abort()
+            for path in paths:
+                if os.path.exists(path):
+                    os.unlink(path)
+            raise
+
+        return {'paths': paths, 'loudness': loudness}
+
+    def _export(self, audio, format, bitrate):
+        """Encode an in-memory segment to a temporary file and return its path"""
+        with tempfile.NamedTemporaryFile(suffix=f'.{format}', delete=False) as temp_file:
+            temp_path = temp_file.name
+        audio.export(temp_path, format=format, bitrate=bitrate)
+        return temp_path
+
     def add_crossfade(self, file_path, fade_duration=2000):
         """Add crossfade effect to the beginning and end"""
         try:
+            if self._streams(file_path):
+                return self._stream_render(file_path, ['320k'], fade_duration=fade_duration)['paths'][0]
+            
             audio = AudioSegment.from_file(file_path)
             
             # Add fade in at beginning
@@ -200,3 +354,21 @@ class AudioProcessor:
         except Exception as e:
             logger.error(f"Error adding crossfade: {e}")
             return file_path
+
+
+def retag_stored_tracks(rows, force=False):
+    """
+    Retag a batch of stored tracks in one worker call; used by the retag command.
+    ``rows`` are (track id, audio file name, title, album title, artist name) so no
+    database access is needed. Returns a list of (track id, outcome).
+    """
+    processor = AudioProcessor()
+    outcomes = []
+    for track_id, name, title, album, artist in rows:
+        path = os.path.join(settings.MEDIA_ROOT, name)
+        if not os.path.exists(path):
+            outcomes.append((track_id, 'missing'))
+            continue
+        outcome = processor.retag(path, {'title': title, 'album': album or ''}, {'name': artist}, force=force)
+        outcomes.append((track_id, outcome))
+    return outcomes
@@ -1,88 +1,513 @@
 """
 Compatibility module for Python 3.13 audioop removal
-Provides stub implementations for audioop functions used by pydub
+NumPy implementation of the audioop functions, matching the stdlib module sample for sample.
+Fragments are read through zero-copy np.frombuffer views; samples use native byte order like audioop.
 """
+import sys
+import math
+import builtins
+import importlib.util
+import numpy as np
 
-# Stub implementations for audioop functions
-# These are minimal implementations to allow pydub to import
-# In a production environment, you'd want proper audio processing
 
-def add(data, length, value):
-    """Stub implementation"""
-    return data
+class error(Exception):
+    pass
 
-def avg(data, length):
-    """Stub implementation"""
-    return 0
 
-def avgpp(data, length):
-    """Stub implementation"""
-    return 0
+_DTYPES = {1: np.int8, 2: np.int16, 4: np.int32}
+_UNSIGNED_DTYPES = {1: np.uint8, 2: np.uint16, 4: np.uint32}
+_MAXVALS = {1: 0x7F, 2: 0x7FFF, 3: 0x7FFFFF, 4: 0x7FFFFFFF}
+_MINVALS = {1: -0x80, 2: -0x8000, 3: -0x800000, 4: -0x80000000}
 
-def cross(data, length):
-    """Stub implementation"""
-    return 0
 
-def findmax(data, length):
-    """Stub implementation"""
-    return 0
+def install():
+    """Register this module as ``audioop`` when the interpreter no longer ships one"""
+    if importlib.util.find_spec('audioop') is None:
+        sys.modules['audioop'] = sys.modules[__name__]
 
-def findfit(data, length):
-    """Stub implementation"""
-    return (0, 0)
 
-def findfactor(data, length):
-    """Stub implementation"""
-    return 0.0
+def _check_size(width):
+    if width not in (1, 2, 3, 4):
+        raise error("Size should be 1, 2, 3 or 4")
 
-def getsample(data, length, index):
-    """Stub implementation"""
-    return 0
 
-def lin2adpcm(data, length, state):
-    """Stub implementation"""
-    return (b'', state)
+def _check_parameters(fragment, width):
+    _check_size(width)
+    view = memoryview(fragment).cast('B')
+    if len(view) % width != 0:
+        raise error("not a whole number of frames")
+    return view
 
-def lin2alaw(data, length):
-    """Stub implementation"""
-    return data
 
-def lin2lin(data, length, length2):
-    """Stub implementation"""
-    return data
+def _samples(fragment, width):
+    """Signed samples of a fragment; a view for widths 1, 2 and 4, a decoded copy for 24-bit"""
+    view = _check_parameters(fragment, width)
+    if width != 3:
+        return np.frombuffer(view, dtype=_DTYPES[width])
 
-def lin2ulaw(data, length):
-    """Stub implementation"""
-    return data
+    raw = np.frombuffer(view, dtype=np.uint8).reshape(-1, 3).astype(np.int32)
+    if sys.byteorder == 'little':
+        low, mid, high = raw[:, 0], raw[:, 1], raw[:, 2]
+    else:
+        high, mid, low = raw[:, 0], raw[:, 1], raw[:, 2]
+    values = low | (mid << 8) | (high << 16)
+    return np.where(values & 0x800000, values - 0x1000000, values)
 
-def max(data, length):
-    """Stub implementation"""
-    return 0
 
-def maxpp(data, length):
-    """Stub implementation"""
-    return 0
+def _unsigned_samples(fragment, width):
+    view = _check_parameters(fragment, width)
+    if width != 3:
+        return np.frombuffer(view, dtype=_UNSIGNED_DTYPES[width])
+    return _samples(fragment, width).astype(np.int64) & 0xFFFFFF
 
-def minmax(data, length):
-    """Stub implementation"""
-    return (0, 0)
 
-def reverse(data, length):
-    """Stub implementation"""
-    return data
+def _pack(values, width):
+    """Store integer samples (already in range) as a fragment of the given width"""
+    if width != 3:
+        return np.asarray(values).astype(_DTYPES[width]).tobytes()
 
-def rms(data, length):
-    """Stub implementation"""
-    return 0
+    values = np.asarray(values, dtype=np.int64) & 0xFFFFFF
+    packed = np.empty((values.size, 3), dtype=np.uint8)
+    order = (0, 1, 2) if sys.byteorder == 'little' else (2, 1, 0)
+    for column, shift in zip(order, (0, 8, 16)):
+        packed[:, column] = (values >> shift) & 0xFF
+    return packed.tobytes()
 
-def tomono(data, length, lfactor, rfactor):
-    """Stub implementation"""
-    return data
 
-def tostereo(data, length, lfactor, rfactor):
-    """Stub implementation"""
-    return data
+def _bound(values, width):
+    """Clip to the sample range and floor, like audioop's fbound()"""
+    return np.floor(np.clip(values, _MINVALS[width], _MAXVALS[width])).astype(np.int64)
+
+
+def _to_32(values, width):
+    """Scale samples to the 32-bit range (audioop's GETSAMPLE32)"""
+    return np.asarray(values, dtype=np.int64) << (32 - 8 * width)
+
+
+def _from_32(values, width):
+    """Scale 32-bit range samples down to the given width (audioop's SETSAMPLE32)"""
+    return np.asarray(values, dtype=np.int64) >> (32 - 8 * width)
+
+
+def _samples16(fragment):
+    view = memoryview(fragment).cast('B')
+    if len(view) % 2 != 0:
+        raise error("Strings should be even-sized")
+    return np.frombuffer(view, dtype=np.int16).astype(np.int64)
+
+
+def getsample(fragment, width, index):
+    samples = _samples(fragment, width)
+    if index < 0 or index >= samples.size:
+        raise error("Index out of range")
+    return int(samples[index])
+
+
+def max(fragment, width):
+    samples = _samples(fragment, width)
+    if samples.size == 0:
+        return 0
+    return builtins.max(-int(samples.min()), int(samples.max()))
+
+
+def minmax(fragment, width):
+    samples = _samples(fragment, width)
+    if samples.size == 0:
+        return (0x7FFFFFFF, -0x80000000)
+    return (int(samples.min()), int(samples.max()))
+
+
+def avg(fragment, width):
+    samples = _samples(fragment, width)
+    if samples.size == 0:
+        return 0
+    return int(math.floor(float(samples.astype(np.int64).sum()) / samples.size))
+
+
+def rms(fragment, width):
+    samples = _samples(fragment, width)
+    if samples.size == 0:
+        return 0
+    if width <= 2:
+        # Exact integer accumulation; squares of 16-bit samples cannot overflow int64
+        values = samples.astype(np.int64)
+        sum_squares = float(np.dot(values, values))
+    else:
+        values = samples.astype(np.float64)
+        sum_squares = float(np.dot(values, values))
+    return int(math.sqrt(sum_squares / samples.size))
+
+
+def _extreme_diffs(fragment, width):
+    """Differences between consecutive local extremes, as used by avgpp() and maxpp()"""
+    samples = _samples(fragment, width).astype(np.int64)
+    if samples.size <= 1:
+        return np.empty(0, dtype=np.int64)
+
+    # Plateaus do not change the direction of the signal
+    keep = np.empty(samples.size, dtype=bool)
+    keep[0] = True
+    keep[1:] = samples[1:] != samples[:-1]
+    values = samples[keep]
+
+    falling = values[1:] < values[:-1]
+    turns = np.nonzero(falling[1:] != falling[:-1])[0] + 1
+    extremes = values[turns]
+    return np.abs(np.diff(extremes))
+
+
+def avgpp(fragment, width):
+    diffs = _extreme_diffs(fragment, width)
+    if diffs.size == 0:
+        return 0
+    return int(float(diffs.sum()) / diffs.size)
+
+
+def maxpp(fragment, width):
+    diffs = _extreme_diffs(fragment, width)
+    if diffs.size == 0:
+        return 0
+    return int(diffs.max())
+
+
+def cross(fragment, width):
+    samples = _samples(fragment, width)
+    if samples.size == 0:
+        return -1
+    negative = samples < 0
+    return int(np.count_nonzero(negative[1:] != negative[:-1]))
+
+
+def mul(fragment, width, factor):
+    samples = _samples(fragment, width)
+    return _pack(_bound(samples * float(factor), width), width)
+
+
+def tomono(fragment, width, lfactor, rfactor):
+    samples = _samples(fragment, width)
+    if samples.size % 2 != 0:
+        raise error("not a whole number of frames")
+    frames = samples.reshape(-1, 2).astype(np.float64)
+    mixed = frames[:, 0] * float(lfactor) + frames[:, 1] * float(rfactor)
+    return _pack(_bound(mixed, width), width)
+
+
+def tostereo(fragment, width, lfactor, rfactor):
+    samples = _samples(fragment, width).astype(np.float64)
+    stereo = np.empty((samples.size, 2), dtype=np.int64)
+    stereo[:, 0] = _bound(samples * float(lfactor), width)
+    stereo[:, 1] = _bound(samples * float(rfactor), width)
+    return _pack(stereo.ravel(), width)
+
+
+def add(fragment1, fragment2, width):
+    samples1 = _samples(fragment1, width)
+    if len(memoryview(fragment1).cast('B')) != len(memoryview(fragment2).cast('B')):
+        raise error("Lengths should be the same")
+    samples2 = _samples(fragment2, width)
+    total = samples1.astype(np.int64) + samples2.astype(np.int64)
+    return _pack(np.clip(total, _MINVALS[width], _MAXVALS[width]), width)
+
+
+def bias(fragment, width, bias):
+    samples = _unsigned_samples(fragment, width).astype(np.uint64)
+    mask = (1 << (8 * width)) - 1
+    shifted = (samples + np.uint64(bias & 0xFFFFFFFF)) & np.uint64(mask)
+    if width != 3:
+        return shifted.astype(_UNSIGNED_DTYPES[width]).tobytes()
+    return _pack(shifted.astype(np.int64), width)
+
+
+def reverse(fragment, width):
+    return _pack(_samples(fragment, width)[::-1], width)
+
+
+def byteswap(fragment, width):
+    view = _check_parameters(fragment, width)
+    raw = np.frombuffer(view, dtype=np.uint8).reshape(-1, width)
+    return raw[:, ::-1].tobytes()
+
+
+def lin2lin(fragment, width, newwidth):
+    samples = _samples(fragment, width)
+    _check_size(newwidth)
+    if width == newwidth:
+        return bytes(memoryview(fragment).cast('B'))
+    return _pack(_from_32(_to_32(samples, width), newwidth), newwidth)
+
+
+def ratecv(fragment, width, nchannels, inrate, outrate, state, weightA=1, weightB=0):
+    _check_size(width)
+    if nchannels < 1:
+        raise error("# of channels should be >= 1")
+    if weightA < 1 or weightB < 0:
+        raise error("weightA should be >= 1, weightB should be >= 0")
+    view = memoryview(fragment).cast('B')
+    bytes_per_frame = width * nchannels
+    if len(view) % bytes_per_frame != 0:
+        raise error("not a whole number of frames")
+    if inrate <= 0 or outrate <= 0:
+        raise error("sampling rate not > 0")
+
+    d = math.gcd(inrate, outrate)
+    inrate //= d
+    outrate //= d
+    d = math.gcd(weightA, weightB)
+    weightA //= d
+    weightB //= d
+
+    if state is None:
+        d = -outrate
+        prev_i = [0] * nchannels
+        cur_i = [0] * nchannels
+    else:
+        if not isinstance(state, tuple):
+            raise TypeError("state must be a tuple or None")
+        try:
+            d, samps = state
+            if len(samps) != nchannels:
+                raise error("illegal state argument")
+            prev_i = [int(channel[0]) for channel in samps]
+            cur_i = [int(channel[1]) for channel in samps]
+        except (TypeError, ValueError, IndexError):
+            raise TypeError("ratecv(): illegal state argument")
+
+    frames = _to_32(_samples(fragment, width), width).reshape(-1, nchannels)
+    nframes = frames.shape[0]
+
+    if weightB:
+        # The smoothing filter is recursive, so it has to run frame by frame
+        filtered = np.empty_like(frames)
+        last = list(cur_i)
+        for index in range(nframes):
+            for chan in range(nchannels):
+                last[chan] = int((weightA * float(frames[index, chan]) + weightB * float(last[chan])) /
+                                 (weightA + weightB))
+                filtered[index, chan] = last[chan]
+        frames = filtered
+
+    # Input history: the state's (prev, cur) pair followed by this fragment's frames
+    history = np.concatenate([np.array([prev_i, cur_i], dtype=np.float64).reshape(2, nchannels),
+                              frames.astype(np.float64)])
+
+    # Output j is produced once c_j frames are consumed, with c_j = max(0, ceil((j*inrate - d) / outrate))
+    count = (nframes * outrate + d) // inrate + 1 if nframes * outrate + d >= 0 else 0
+    j = np.arange(count, dtype=np.int64)
+    consumed = np.maximum(0, -((d - j * inrate) // outrate))
+    weight = d + consumed * outrate - j * inrate
+
+    weight = weight[:, None].astype(np.float64)
+    out = history[consumed] * weight
+    out += history[consumed + 1] * (outrate - weight)
+    out /= outrate
+    out = np.trunc(out).astype(np.int64)
+
+    final_d = d + nframes * outrate - count * inrate
+    final_prev = history[nframes]
+    final_cur = history[nframes + 1]
+    new_state = (int(final_d), tuple((int(final_prev[chan]), int(final_cur[chan])) for chan in range(nchannels)))
+    return (_pack(_from_32(out.ravel(), width), width), new_state)
+
+
+# G.711 u-law and A-law companding
+
+_SEG_UEND = np.array([0x3F, 0x7F, 0xFF, 0x1FF, 0x3FF, 0x7FF, 0xFFF, 0x1FFF], dtype=np.int64)
+_SEG_AEND = np.array([0x1F, 0x3F, 0x7F, 0xFF, 0x1FF, 0x3FF, 0x7FF, 0xFFF], dtype=np.int64)
+
+
+def _build_ulaw_table():
+    codes = ~np.arange(256, dtype=np.int64) & 0xFF
+    t = ((codes & 0x0F) << 3) + 0x84
+    t = t << ((codes & 0x70) >> 4)
+    return np.where(codes & 0x80, 0x84 - t, t - 0x84)
+
+
+def _build_alaw_table():
+    codes = np.arange(256, dtype=np.int64) ^ 0x55
+    t = (codes & 0x0F) << 4
+    seg = (codes & 0x70) >> 4
+    t = np.where(seg == 0, t + 8, t + 0x108)
+    t = np.where(seg > 1, t << np.maximum(seg - 1, 0), t)
+    return np.where(codes & 0x80, t, -t)
+
+
+_ULAW_TABLE = _build_ulaw_table()
+_ALAW_TABLE = _build_alaw_table()
+
+
+def lin2ulaw(fragment, width):
+    pcm = _to_32(_samples(fragment, width), width) >> 18
+    mask = np.where(pcm < 0, 0x7F, 0xFF)
+    magnitude = np.minimum(np.abs(pcm), 8159) + (0x84 >> 2)
+    seg = np.searchsorted(_SEG_UEND, magnitude, side='left')
+    uval = (seg << 4) | ((magnitude >> (np.minimum(seg, 7) + 1)) & 0x0F)
+    uval = np.where(seg >= 8, 0x7F, uval)
+    return (uval ^ mask).astype(np.uint8).tobytes()
+
+
+def ulaw2lin(fragment, width):
+    _check_size(width)
+    codes = np.frombuffer(memoryview(fragment).cast('B'), dtype=np.uint8)
+    return _pack(_from_32(_ULAW_TABLE[codes] << 16, width), width)
+
+
+def lin2alaw(fragment, width):
+    pcm = _to_32(_samples(fragment, width), width) >> 19
+    mask = np.where(pcm >= 0, 0xD5, 0x55)
+    magnitude = np.where(pcm >= 0, pcm, -pcm - 1)
+    seg = np.searchsorted(_SEG_AEND, magnitude, side='left')
+    shift = np.where(seg < 2, 1, np.minimum(seg, 7))
+    aval = (seg << 4) | ((magnitude >> shift) & 0x0F)
+    aval = np.where(seg >= 8, 0x7F, aval)
+    return (aval ^ mask).astype(np.uint8).tobytes()
+
+
+def alaw2lin(fragment, width):
+    _check_size(width)
+    codes = np.frombuffer(memoryview(fragment).cast('B'), dtype=np.uint8)
+    return _pack(_from_32(_ALAW_TABLE[codes] << 16, width), width)
+
+
+# Intel/DVI ADPCM; every sample depends on the previous one, so this stays a scalar loop
+
+_INDEX_TABLE = [-1, -1, -1, -1, 2, 4, 6, 8, -1, -1, -1, -1, 2, 4, 6, 8]
+
+_STEPSIZE_TABLE = [
+    7, 8, 9, 10, 11, 12, 13, 14, 16, 17,
+    19, 21, 23, 25, 28, 31, 34, 37, 41, 45,
+    50, 55, 60, 66, 73, 80, 88, 97, 107, 118,
+    130, 143, 157, 173, 190, 209, 230, 253, 279, 307,
+    337, 371, 408, 449, 494, 544, 598, 658, 724, 796,
+    876, 963, 1060, 1166, 1282, 1411, 1552, 1707, 1878, 2066,
+    2272, 2499, 2749, 3024, 3327, 3660, 4026, 4428, 4871, 5358,
+    5894, 6484, 7132, 7845, 8630, 9493, 10442, 11487, 12635, 13899,
+    15289, 16818, 18500, 20350, 22385, 24623, 27086, 29794, 32767
+]
+
+
+def _adpcm_state(state, name):
+    if state is None:
+        return 0, 0
+    if not isinstance(state, tuple):
+        raise TypeError("state must be a tuple or None")
+    try:
+        valpred, index = state
+    except (TypeError, ValueError):
+        raise TypeError(f"{name}(): illegal state argument")
+    if valpred >= 0x8000 or valpred < -0x8000 or not 0 <= index < len(_STEPSIZE_TABLE):
+        raise ValueError("bad state")
+    return valpred, index
+
+
+def lin2adpcm(fragment, width, state):
+    samples = (_to_32(_samples(fragment, width), width) >> 16).tolist()
+    valpred, index = _adpcm_state(state, 'lin2adpcm')
+
+    out = bytearray()
+    step = _STEPSIZE_TABLE[index]
+    outputbuffer = 0
+    bufferstep = True
+
+    for val in samples:
+        if val < valpred:
+            diff = valpred - val
+            sign = 8
+        else:
+            diff = val - valpred
+            sign = 0
+
+        delta = 0
+        vpdiff = step >> 3
+        if diff >= step:
+            delta = 4
+            diff -= step
+            vpdiff += step
+        step >>= 1
+        if diff >= step:
+            delta |= 2
+            diff -= step
+            vpdiff += step
+        step >>= 1
+        if diff >= step:
+            delta |= 1
+            vpdiff += step
+
+        valpred = valpred - vpdiff if sign else valpred + vpdiff
+        valpred = min(32767, builtins.max(-32768, valpred))
+
+        delta |= sign
+        index = min(88, builtins.max(0, index + _INDEX_TABLE[delta]))
+        step = _STEPSIZE_TABLE[index]
+
+        if bufferstep:
+            outputbuffer = (delta << 4) & 0xF0
+        else:
+            out.append((delta & 0x0F) | outputbuffer)
+        bufferstep = not bufferstep
+
+    return (bytes(out), (valpred, index))
+
+
+def adpcm2lin(fragment, width, state):
+    _check_size(width)
+    codes = bytes(memoryview(fragment).cast('B'))
+    valpred, index = _adpcm_state(state, 'adpcm2lin')
+
+    out = []
+    step = _STEPSIZE_TABLE[index]
+    for byte in codes:
+        for delta in ((byte >> 4) & 0x0F, byte & 0x0F):
+            index = min(88, builtins.max(0, index + _INDEX_TABLE[delta]))
+            sign = delta & 8
+            delta &= 7
+
+            vpdiff = step >> 3
+            if delta & 4:
+                vpdiff += step
+            if delta & 2:
+                vpdiff += step >> 1
+            if delta & 1:
+                vpdiff += step >> 2
+
+            valpred = valpred - vpdiff if sign else valpred + vpdiff
+            valpred = min(32767, builtins.max(-32768, valpred))
+            step = _STEPSIZE_TABLE[index]
+            out.append(valpred << 16)
+
+    return (_pack(_from_32(out, width), width), (valpred, index))
+
+
+def findfactor(fragment, reference):
+    samples = _samples16(fragment)
+    ref = _samples16(reference)
+    if samples.size != ref.size:
+        raise error("Samples should be same size")
+    return float(np.dot(samples, ref)) / float(np.dot(ref, ref))
+
+
+def findfit(fragment, reference):
+    samples = _samples16(fragment)
+    ref = _samples16(reference)
+    if samples.size < ref.size:
+        raise error("First sample should be longer")
+
+    # Sliding window energy of the fragment and its correlation with the reference
+    squares = np.concatenate([[0], np.cumsum(samples * samples)])
+    window_energy = (squares[ref.size:] - squares[:-ref.size]).astype(np.float64)
+    correlation = np.correlate(samples, ref, mode='valid').astype(np.float64)
+    ref_energy = float(np.dot(ref, ref))
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        result = (ref_energy * window_energy - correlation * correlation) / window_energy
+    best_j = int(np.argmin(result))
+    return (best_j, float(correlation[best_j]) / ref_energy)
+
+
+def findmax(fragment, length):
+    samples = _samples16(fragment)
+    if length < 0 or samples.size < length:
+        raise error("Input sample should be longer")
+    squares = np.concatenate([[0], np.cumsum(samples * samples)])
+    window_energy = squares[length:] - squares[:-length] if length else np.zeros(samples.size + 1)
+    return int(np.argmax(window_energy))
 
-def ulaw2lin(data, length):
-    """Stub implementation"""
-    return data
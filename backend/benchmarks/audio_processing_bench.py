@@ -0,0 +1,240 @@
+"""
+Benchmark AudioProcessor stages on synthetic audio across formats, durations and layouts.
+
+Usage: python benchmarks/audio_processing_bench.py [--formats mp3,wav,flac,ogg] [--durations 30,180]
+       [--channels 1,2] [--stages ...] [--engine auto|pydub|stream] [--repeat 3]
+       [--output results.json] [--compare baseline.json]
+
+Each stage runs in a freshly spawned process so peak RSS and CPU time (including the
+ffmpeg children it starts) belong to that stage alone. Results are written as JSON keyed
+by commit, and ``--compare`` prints the change against an earlier results file.
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import numpy as np
+
+BACKEND = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND)
+
+STAGES = ['extract_metadata', 'embed_metadata', 'optimize_for_streaming', 'get_audio_info', 'run_pipeline']
+DEFAULT_STAGES = STAGES[:4]
+# pydub export arguments per format
+FORMATS = {
+    'mp3': {'format': 'mp3', 'bitrate': '320k'},
+    'wav': {'format': 'wav'},
+    'flac': {'format': 'flac'},
+    'ogg': {'format': 'ogg', 'codec': 'libvorbis', 'bitrate': '192k'},
+}
+TRACK_DATA = {'title': 'Benchmark', 'album': 'Synthetic'}
+ARTIST_DATA = {'name': 'Benchmark Artist'}
+
+
+def setup_django(work_dir, engine):
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'ghettoselebu.settings')
+    # Keep the rendered announcement out of the real media root
+    os.environ['AUDIO_ANNOUNCEMENT_CACHE_DIR'] = os.path.join(work_dir, 'announcements')
+    os.environ['AUDIO_PROCESSING_ENGINE'] = engine
+    import django
+    django.setup()
+
+
+def make_audio(path, fmt, seconds, channels, frame_rate=44100):
+    """Synthetic track: detuned tones with an amplitude envelope and some noise, so encoders do real work"""
+    import audioop_compat
+    audioop_compat.install()
+    from pydub import AudioSegment
+
+    t = np.arange(int(seconds * frame_rate)) / frame_rate
+    rng = np.random.default_rng(0)
+    envelope = 0.6 + 0.4 * np.sin(2 * np.pi * 0.25 * t)
+    layout = []
+    for channel in range(channels):
+        tone = np.sin(2 * np.pi * (220 + 110 * channel) * t) + 0.5 * np.sin(2 * np.pi * 331 * t)
+        layout.append(9000 * envelope * tone + rng.normal(0, 600, t.size))
+    samples = np.stack(layout, axis=1).astype(np.int16)
+    audio = AudioSegment(samples.tobytes(), frame_rate=frame_rate, sample_width=2, channels=channels)
+    audio.export(path, **FORMATS[fmt])
+
+
+def run_stage(stage, path, work_dir, engine, results):
+    """Child process body: run one stage and report wall time, CPU time and peak RSS"""
+    setup_django(work_dir, engine)
+    from audio_utils import AudioProcessor
+
+    processor = AudioProcessor()
+    # Render the announcement before measuring, as a warm server would have
+    processor.create_site_announcement()
+    before_self = resource.getrusage(resource.RUSAGE_SELF)
+    before_children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    baseline_rss = before_self.ru_maxrss
+
+    started = time.perf_counter()
+    error = None
+    outputs = []
+    try:
+        if stage == 'extract_metadata':
+            processor.extract_metadata(path)
+        elif stage == 'embed_metadata':
+            outputs.append(processor.embed_metadata(path, TRACK_DATA, ARTIST_DATA))
+        elif stage == 'optimize_for_streaming':
+            outputs.append(processor.optimize_for_streaming(path))
+        elif stage == 'get_audio_info':
+            if not processor.get_audio_info(path):
+                error = 'no audio info'
+        elif stage == 'run_pipeline':
+            from audio_pipeline import PipelineCache, run_pipeline
+
+            # A fresh cache, so every stage is computed
+            cache_dir = tempfile.mkdtemp(dir=work_dir)
+            try:
+                run_pipeline(path, cache=PipelineCache(cache_dir))
+            finally:
+                shutil.rmtree(cache_dir, ignore_errors=True)
+    except Exception as e:
+        error = str(e)
+    wall = time.perf_counter() - started
+
+    after_self = resource.getrusage(resource.RUSAGE_SELF)
+    after_children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    for output in outputs:
+        # The processor returns its input when a stage fails
+        if output == path:
+            error = error or 'stage returned its input'
+        elif output and os.path.exists(output):
+            os.unlink(output)
+
+    cpu = sum(
+        (after.ru_utime - before.ru_utime) + (after.ru_stime - before.ru_stime)
+        for before, after in ((before_self, after_self), (before_children, after_children))
+    )
+    results.put({
+        'wall_seconds': wall,
+        'cpu_seconds': cpu,
+        # ru_maxrss is in KiB on Linux; ffmpeg children are reported separately
+        'peak_rss_mb': after_self.ru_maxrss / 1024,
+        'baseline_rss_mb': baseline_rss / 1024,
+        'children_peak_rss_mb': after_children.ru_maxrss / 1024,
+        'error': error,
+    })
+
+
+def measure(stage, path, work_dir, engine):
+    context = multiprocessing.get_context('spawn')
+    results = context.Queue()
+    process = context.Process(target=run_stage, args=(stage, path, work_dir, engine, results))
+    process.start()
+    result = results.get()
+    process.join()
+    return result
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=BACKEND,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+def case_key(result):
+    return (result['format'], result['duration_seconds'], result['channels'], result['stage'])
+
+
+def compare(results, baseline_path):
+    with open(baseline_path) as f:
+        baseline = {case_key(result): result for result in json.load(f)['results']}
+    print(f"\nAgainst {baseline_path}:")
+    print(f"{'case':<44} {'wall':>8} {'cpu':>8} {'rss':>8}")
+    for result in results:
+        old = baseline.get(case_key(result))
+        if not old or old['error'] or result['error']:
+            continue
+        label = '{} {}s {}ch {}'.format(*case_key(result))
+        changes = [
+            f"{(result[field] / old[field] - 1) * 100:+7.1f}%" if old[field] else f"{'n/a':>8}"
+            for field in ('wall_seconds', 'cpu_seconds', 'peak_rss_mb')
+        ]
+        print(f"{label:<44} {' '.join(changes)}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--formats', default='mp3,wav,flac,ogg', help='Comma-separated input formats')
+    parser.add_argument('--durations', default='30,180', help='Comma-separated track lengths in seconds')
+    parser.add_argument('--channels', default='1,2', help='Comma-separated channel counts')
+    parser.add_argument('--stages', default=','.join(DEFAULT_STAGES), help=f"Comma-separated stages of {STAGES}")
+    parser.add_argument('--engine', default='auto', choices=['auto', 'pydub', 'stream'],
+                        help='AUDIO_PROCESSING_ENGINE for the run')
+    parser.add_argument('--repeat', type=int, default=1, help='Runs per case; the fastest is reported')
+    parser.add_argument('--output', help='Results file (default: benchmarks/results/<commit>.json)')
+    parser.add_argument('--compare', help='Earlier results file to compare against')
+    args = parser.parse_args()
+
+    formats = args.formats.split(',')
+    stages = args.stages.split(',')
+    unknown = [name for name in formats if name not in FORMATS] + [name for name in stages if name not in STAGES]
+    if unknown:
+        parser.error(f"Unknown formats or stages: {', '.join(unknown)}")
+    if shutil.which(os.environ.get('AUDIO_FFMPEG_BINARY', 'ffmpeg')) is None:
+        parser.error('ffmpeg is required to generate and process the test audio')
+
+    commit = git_commit()
+    work_dir = tempfile.mkdtemp(prefix='audio-bench-')
+    setup_django(work_dir, args.engine)
+    results = []
+    try:
+        for fmt in formats:
+            for seconds in (float(value) for value in args.durations.split(',')):
+                for channels in (int(value) for value in args.channels.split(',')):
+                    path = os.path.join(work_dir, f"input-{int(seconds)}s-{channels}ch.{fmt}")
+                    make_audio(path, fmt, seconds, channels)
+                    input_mb = os.path.getsize(path) / 1e6
+                    for stage in stages:
+                        runs = [measure(stage, path, work_dir, args.engine) for _ in range(max(1, args.repeat))]
+                        best = min(runs, key=lambda run: run['wall_seconds'])
+                        best['peak_rss_mb'] = max(run['peak_rss_mb'] for run in runs)
+                        result = {
+                            'format': fmt, 'duration_seconds': seconds, 'channels': channels, 'stage': stage,
+                            'input_mb': input_mb,
+                            'realtime_factor': seconds / best['wall_seconds'] if best['wall_seconds'] else None,
+                            **best,
+                        }
+                        results.append(result)
+                        status = f"error: {result['error']}" if result['error'] else (
+                            f"{result['wall_seconds']:7.3f}s wall {result['cpu_seconds']:7.3f}s cpu "
+                            f"{result['peak_rss_mb']:7.1f} MB rss {result['realtime_factor']:7.1f}x realtime"
+                        )
+                        print(f"{fmt:<5} {seconds:>6g}s {channels}ch {stage:<24} {status}")
+                    os.unlink(path)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    output = args.output or os.path.join(BACKEND, 'benchmarks', 'results', f"{commit}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump({
+            'commit': commit,
+            'created_at': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+            'engine': args.engine,
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'results': results,
+        }, f, indent=2)
+    print(f"Wrote {output}")
+
+    if args.compare:
+        compare(results, args.compare)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,77 @@
+"""
+Microbenchmark for the NumPy audioop implementation on multi-minute tracks.
+
+Usage: python benchmarks/audioop_bench.py [--minutes 5] [--repeat 3]
+
+Times each function pydub relies on against a synthetic 16-bit stereo track and,
+when the interpreter still ships it, the stdlib audioop module for comparison.
+"""
+import argparse
+import os
+import sys
+import timeit
+import warnings
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import audioop_compat  # noqa: E402
+
+with warnings.catch_warnings():
+    warnings.simplefilter('ignore', DeprecationWarning)
+    try:
+        import audioop as stdlib_audioop
+    except ImportError:
+        stdlib_audioop = None
+
+
+def make_track(minutes, frame_rate=44100):
+    """Synthetic 16-bit stereo fragment: a 440 Hz tone with some noise"""
+    frames = int(minutes * 60 * frame_rate)
+    t = np.arange(frames) / frame_rate
+    rng = np.random.default_rng(0)
+    left = 12000 * np.sin(2 * np.pi * 440 * t) + rng.normal(0, 800, frames)
+    right = 12000 * np.sin(2 * np.pi * 554 * t) + rng.normal(0, 800, frames)
+    return np.stack([left, right], axis=1).astype(np.int16).tobytes()
+
+
+def cases(fragment, module):
+    mono = module.tomono(fragment, 2, 0.5, 0.5)
+    return {
+        'rms': lambda: module.rms(fragment, 2),
+        'max': lambda: module.max(fragment, 2),
+        'mul': lambda: module.mul(fragment, 2, 0.8),
+        'add': lambda: module.add(fragment, fragment, 2),
+        'bias': lambda: module.bias(fragment, 2, 1),
+        'reverse': lambda: module.reverse(fragment, 2),
+        'tomono': lambda: module.tomono(fragment, 2, 0.5, 0.5),
+        'tostereo': lambda: module.tostereo(mono, 2, 1, 1),
+        'lin2lin': lambda: module.lin2lin(fragment, 2, 4),
+        'ratecv': lambda: module.ratecv(fragment, 2, 2, 44100, 48000, None),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--minutes', type=float, default=5, help='Length of the synthetic track')
+    parser.add_argument('--repeat', type=int, default=3, help='Runs per function; the best is reported')
+    args = parser.parse_args()
+
+    fragment = make_track(args.minutes)
+    print(f"{args.minutes:g} min stereo 16-bit track ({len(fragment) / 1e6:.1f} MB)")
+
+    compat_cases = cases(fragment, audioop_compat)
+    stdlib_cases = cases(fragment, stdlib_audioop) if stdlib_audioop else {}
+
+    print(f"{'function':<10} {'numpy (s)':>10} {'stdlib (s)':>11}")
+    for name, func in compat_cases.items():
+        compat_time = min(timeit.repeat(func, number=1, repeat=args.repeat))
+        if name in stdlib_cases:
+            stdlib_time = min(timeit.repeat(stdlib_cases[name], number=1, repeat=args.repeat))
+            print(f"{name:<10} {compat_time:>10.3f} {stdlib_time:>11.3f}")
+        else:
+            print(f"{name:<10} {compat_time:>10.3f} {'n/a':>11}")
+
+
+if __name__ == '__main__':
+    main()
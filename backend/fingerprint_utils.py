@@ -0,0 +1,235 @@
+import os
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+from django.conf import settings
+from django.db import transaction
+import audioop_compat
+audioop_compat.install()
+from pydub import AudioSegment
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Spectral-peak landmark fingerprint: pairs of spectrogram peaks hashed as
+# (anchor frequency, target frequency, time delta) and stored with the anchor's frame offset
+SAMPLE_RATE = 11025
+WINDOW = 1024
+HOP = 512
+MAX_FREQUENCY_BIN = 512          # 9 bits per frequency
+PEAK_NEIGHBOURHOOD = (5, 10)     # frames, bins on each side a peak must dominate
+PEAKS_PER_SECOND = 15
+FAN_OUT = 4
+MAX_TIME_DELTA = 63              # 6 bits
+
+MIN_MATCHES = 40
+LOOKUP_BATCH = 500
+
+# Streamed fingerprints are computed over windows of this many frames, with enough context
+# on each side that peaks, per-second ranking and landmark pairs near an edge are unaffected
+STREAM_WINDOW_FRAMES = 2048
+FRAMES_PER_SECOND_CEIL = -(-SAMPLE_RATE // HOP)
+CONTEXT_BEFORE = PEAK_NEIGHBOURHOOD[0] + FRAMES_PER_SECOND_CEIL + 1
+CONTEXT_AFTER = MAX_TIME_DELTA + PEAK_NEIGHBOURHOOD[0] + FRAMES_PER_SECOND_CEIL + 1
+
+
+def fingerprint_samples(samples, first_frame=0):
+    """
+    Fingerprint mono float PCM at SAMPLE_RATE.
+    Returns (hashes, offsets) as int64 arrays; offsets are anchor frames of HOP samples,
+    counted from ``first_frame`` when the samples are a window of a longer stream.
+    """
+    samples = np.asarray(samples, dtype=np.float32)
+    if samples.size < WINDOW:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+
+    frames = sliding_window_view(samples, WINDOW)[::HOP] * np.hanning(WINDOW).astype(np.float32)
+    spectrum = np.log1p(np.abs(np.fft.rfft(frames, axis=1))[:, :MAX_FREQUENCY_BIN])
+
+    # Local maxima: separable max filter over time then frequency
+    time_reach, bin_reach = PEAK_NEIGHBOURHOOD
+    padded = np.pad(spectrum, ((time_reach, time_reach), (0, 0)), constant_values=-np.inf)
+    neighbourhood = sliding_window_view(padded, 2 * time_reach + 1, axis=0).max(axis=2)
+    padded = np.pad(neighbourhood, ((0, 0), (bin_reach, bin_reach)), constant_values=-np.inf)
+    neighbourhood = sliding_window_view(padded, 2 * bin_reach + 1, axis=1).max(axis=2)
+    is_peak = (spectrum == neighbourhood) & (spectrum > spectrum.mean())
+    times, bins = np.nonzero(is_peak)
+    strengths = spectrum[times, bins]
+
+    # Keep the strongest peaks in each second so dense passages do not dominate the index
+    frames_per_second = SAMPLE_RATE / HOP
+    seconds = ((times + first_frame) / frames_per_second).astype(np.int64)
+    order = np.lexsort((-strengths, seconds))
+    seconds_sorted = seconds[order]
+    rank = np.arange(order.size) - np.searchsorted(seconds_sorted, seconds_sorted)
+    keep = np.sort(order[rank < PEAKS_PER_SECOND])
+    times, bins = times[keep], bins[keep]
+
+    hashes, offsets = [], []
+    for step in range(1, FAN_OUT + 1):
+        anchor_times, target_times = times[:-step], times[step:]
+        delta = target_times - anchor_times
+        valid = (delta > 0) & (delta <= MAX_TIME_DELTA)
+        hashes.append((bins[:-step][valid] << 15) | (bins[step:][valid] << 6) | delta[valid])
+        offsets.append(anchor_times[valid] + first_frame)
+
+    return np.concatenate(hashes).astype(np.int64), np.concatenate(offsets).astype(np.int64)
+
+
+def fingerprint_segment(audio):
+    """Fingerprint a decoded pydub AudioSegment, downmixed and downsampled first"""
+    audio = audio.set_channels(1).set_frame_rate(SAMPLE_RATE).set_sample_width(2)
+    samples = np.frombuffer(audio.raw_data, dtype=np.int16).astype(np.float32) / 32768.0
+    return fingerprint_samples(samples)
+
+
+class StreamingFingerprinter:
+    """
+    Fingerprint 16-bit stereo PCM at 44.1 kHz fed in blocks, holding one window of
+    downsampled audio at a time. Landmarks match ``fingerprint_samples`` over the whole
+    track except that the peak threshold is taken per window.
+    """
+
+    DECIMATION = 4
+
+    def __init__(self):
+        self._pending = np.empty(0, dtype=np.float32)
+        self._samples = np.empty(0, dtype=np.float32)
+        self._first_frame = 0
+        self._next_frame = 0
+        self._hashes, self._offsets = [], []
+
+    def feed(self, block):
+        """Add an int16 (frames, 2) block at 44.1 kHz"""
+        # Average groups of four mono samples: a box low-pass and decimation to 11025 Hz in one step
+        mono = np.concatenate([self._pending, block.mean(axis=1, dtype=np.float32) / 32768.0])
+        usable = mono.size - mono.size % self.DECIMATION
+        self._pending = mono[usable:]
+        downsampled = mono[:usable].reshape(-1, self.DECIMATION).mean(axis=1)
+        self._samples = np.concatenate([self._samples, downsampled])
+
+        while self._frames_available() >= self._next_frame + STREAM_WINDOW_FRAMES + CONTEXT_AFTER:
+            self._emit(self._next_frame + STREAM_WINDOW_FRAMES)
+
+    def result(self):
+        """Fingerprint everything fed so far as (hashes, offsets)"""
+        self._emit(None)
+        if not self._hashes:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+        return np.concatenate(self._hashes), np.concatenate(self._offsets)
+
+    def _frames_available(self):
+        total = self._first_frame * HOP + self._samples.size
+        return max(0, (total - WINDOW) // HOP + 1)
+
+    def _emit(self, end):
+        hashes, offsets = fingerprint_samples(self._samples, first_frame=self._first_frame)
+        keep = offsets >= self._next_frame
+        if end is not None:
+            keep &= offsets < end
+        self._hashes.append(hashes[keep])
+        self._offsets.append(offsets[keep])
+        if end is None:
+            return
+
+        self._next_frame = end
+        drop = max(0, end - CONTEXT_BEFORE - self._first_frame)
+        self._samples = self._samples[drop * HOP:].copy()
+        self._first_frame += drop
+
+
+def store_fingerprint(track, fingerprint):
+    """Replace a track's rows in the inverted hash index"""
+    from music.models import FingerprintHash
+
+    hashes, offsets = fingerprint
+    with transaction.atomic():
+        FingerprintHash.objects.filter(track=track).delete()
+        FingerprintHash.objects.bulk_create(
+            (FingerprintHash(track_id=track.pk, hash=int(h), offset=int(o)) for h, o in zip(hashes, offsets)),
+            batch_size=2000,
+        )
+
+
+def find_candidates(fingerprint, exclude=None, min_matches=MIN_MATCHES):
+    """
+    Look up tracks sharing time-aligned hashes with a fingerprint.
+
+    Returns candidates as dicts with ``track_id``, ``offset`` (seconds the query starts
+    into the candidate), ``matches`` and ``confidence`` (share of query hashes that
+    line up), best first.
+    """
+    from music.models import FingerprintHash
+
+    hashes, offsets = fingerprint
+    if not hashes.size:
+        return []
+
+    query_offsets = {}
+    for h, o in zip(hashes.tolist(), offsets.tolist()):
+        query_offsets.setdefault(h, []).append(o)
+
+    unique_hashes = list(query_offsets)
+    matches = {}
+    for start in range(0, len(unique_hashes), LOOKUP_BATCH):
+        rows = FingerprintHash.objects.filter(hash__in=unique_hashes[start:start + LOOKUP_BATCH])
+        if exclude is not None:
+            rows = rows.exclude(track_id=exclude)
+        for track_id, h, offset in rows.values_list('track_id', 'hash', 'offset'):
+            deltas = matches.setdefault(track_id, [])
+            deltas.extend(offset - query for query in query_offsets[h])
+
+    candidates = []
+    for track_id, deltas in matches.items():
+        if len(deltas) < min_matches:
+            continue
+        deltas = np.asarray(deltas)
+        counts = np.bincount(deltas - deltas.min())
+        # Allow one frame of jitter between encodes
+        smoothed = counts + np.pad(counts[1:], (0, 1)) + np.pad(counts[:-1], (1, 0))
+        best = int(smoothed.argmax())
+        aligned = int(smoothed[best])
+        if aligned < min_matches:
+            continue
+        candidates.append({
+            'track_id': track_id,
+            'offset': (best + int(deltas.min())) * HOP / SAMPLE_RATE,
+            'matches': aligned,
+            'confidence': min(1.0, aligned / hashes.size),
+        })
+
+    return sorted(candidates, key=lambda candidate: candidate['matches'], reverse=True)
+
+
+def track_candidates(track, min_matches=MIN_MATCHES):
+    """Candidate duplicates of a track that is already in the index"""
+    from music.models import FingerprintHash
+
+    rows = FingerprintHash.objects.filter(track=track).values_list('hash', 'offset')
+    if not rows:
+        return []
+    hashes, offsets = (np.array(column, dtype=np.int64) for column in zip(*rows))
+    return find_candidates((hashes, offsets), exclude=track.pk, min_matches=min_matches)
+
+
+def generate_track_fingerprint(track_id, force=False):
+    """Decode a stored track and index its fingerprint; used by the backfill command"""
+    from music.models import Track
+    from tts_utils import SiteAnnouncementGenerator
+
+    track = Track.objects.get(pk=track_id)
+    if not force and track.fingerprint_hashes.exists():
+        return 'skipped'
+
+    if not track.audio_file:
+        return 'missing'
+    audio_path = os.path.join(settings.MEDIA_ROOT, track.audio_file.name)
+    if not os.path.exists(audio_path):
+        return 'missing'
+
+    audio = AudioSegment.from_file(audio_path)
+    if track.has_site_branding:
+        # Every branded file starts with the same announcement; leave it out of the index
+        audio = audio[int(SiteAnnouncementGenerator().get_announcement_duration() * 1000):]
+
+    store_fingerprint(track, fingerprint_segment(audio))
+    return 'generated'
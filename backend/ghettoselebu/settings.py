@@ -12,6 +12,7 @@ https://docs.djangoproject.com/en/6.0/ref/settings/
 
 from pathlib import Path
 import os
+import json
 from decouple import config
 from datetime import timedelta
 
@@ -168,3 +169,79 @@ CORS_ALLOWED_ORIGINS = [
 ]
 
 CORS_ALLOW_CREDENTIALS = True
+
+# Audio processing queue
+AUDIO_PROCESSING_SPOOL_DIR = config('AUDIO_PROCESSING_SPOOL_DIR', default=os.path.join(MEDIA_ROOT, 'processing'))
+AUDIO_PROCESSING_WORKERS = config('AUDIO_PROCESSING_WORKERS', default=2, cast=int)
+AUDIO_PROCESSING_STALE_AFTER = config('AUDIO_PROCESSING_STALE_AFTER', default=1800, cast=int)
+AUDIO_PROCESSING_MAX_ATTEMPTS = config('AUDIO_PROCESSING_MAX_ATTEMPTS', default=3, cast=int)
+AUDIO_ANNOUNCEMENT_CACHE_DIR = config('AUDIO_ANNOUNCEMENT_CACHE_DIR', default=os.path.join(MEDIA_ROOT, 'announcements'))
+AUDIO_FFMPEG_BINARY = config('AUDIO_FFMPEG_BINARY', default='ffmpeg')
+
+# Processing engine: 'pydub' decodes whole files in memory, 'stream' pipes fixed-size PCM blocks
+# through ffmpeg, 'auto' streams files whose decoded audio would exceed the per-job memory cap (bytes)
+AUDIO_PROCESSING_ENGINE = config('AUDIO_PROCESSING_ENGINE', default='auto')
+AUDIO_STREAM_MEMORY_LIMIT = config('AUDIO_STREAM_MEMORY_LIMIT', default=256 * 1024 * 1024, cast=int)
+
+# Resumable uploads: chunks start on 4 MiB hash block boundaries, so the chunk size is a multiple of 4 MiB
+AUDIO_UPLOAD_CHUNK_SIZE = config('AUDIO_UPLOAD_CHUNK_SIZE', default=8 * 1024 * 1024, cast=int)
+AUDIO_UPLOAD_MAX_SIZE = config('AUDIO_UPLOAD_MAX_SIZE', default=1024 * 1024 * 1024, cast=int)
+# Unfinished resumable uploads expire this long after their last chunk; a user may keep this many open
+AUDIO_UPLOAD_SESSION_TTL = config('AUDIO_UPLOAD_SESSION_TTL', default=24 * 60 * 60, cast=int)
+AUDIO_UPLOAD_MAX_OPEN_SESSIONS = config('AUDIO_UPLOAD_MAX_OPEN_SESSIONS', default=3, cast=int)
+
+# HLS packaging: one rendition per bitrate (kbps), cut into fixed-duration segments
+AUDIO_HLS_BITRATES = config('AUDIO_HLS_BITRATES', default='64,128,192', cast=lambda v: [int(b) for b in v.split(',')])
+AUDIO_HLS_SEGMENT_SECONDS = config('AUDIO_HLS_SEGMENT_SECONDS', default=6, cast=int)
+AUDIO_HLS_CODEC = config('AUDIO_HLS_CODEC', default='aac')
+# Superseded HLS versions are kept this long after a new one goes live, for players still holding the old master
+AUDIO_HLS_RETAIN_SECONDS = config('AUDIO_HLS_RETAIN_SECONDS', default=24 * 60 * 60, cast=int)
+
+# On-request transcodes: allowed bitrates (kbps) and an LRU-evicted disk cache bounded in bytes
+AUDIO_TRANSCODE_BITRATES = config('AUDIO_TRANSCODE_BITRATES', default='48,64,96,128,160,192,256,320', cast=lambda v: [int(b) for b in v.split(',')])
+AUDIO_TRANSCODE_CACHE_DIR = config('AUDIO_TRANSCODE_CACHE_DIR', default=os.path.join(MEDIA_ROOT, 'transcodes'))
+AUDIO_TRANSCODE_CACHE_SIZE = config('AUDIO_TRANSCODE_CACHE_SIZE', default=2 * 1024 * 1024 * 1024, cast=int)
+
+# Mixtape continuous mixes: crossfade between neighbouring tracks, output bitrate and the segment/mix cache
+AUDIO_MIX_CROSSFADE_MS = config('AUDIO_MIX_CROSSFADE_MS', default=6000, cast=int)
+AUDIO_MIX_BITRATE = config('AUDIO_MIX_BITRATE', default='192k')
+AUDIO_MIX_CACHE_DIR = config('AUDIO_MIX_CACHE_DIR', default=os.path.join(MEDIA_ROOT, 'mixes'))
+AUDIO_MIX_SEGMENT_CACHE_SIZE = config('AUDIO_MIX_SEGMENT_CACHE_SIZE', default=5 * 1024 * 1024 * 1024, cast=int)
+
+# Waveform peaks: samples per min/max pair at each zoom level, stored as 8 or 16 bit values
+AUDIO_WAVEFORM_LEVELS = config('AUDIO_WAVEFORM_LEVELS', default='256,1024,4096', cast=lambda v: [int(n) for n in v.split(',')])
+AUDIO_WAVEFORM_BITS = config('AUDIO_WAVEFORM_BITS', default=8, cast=int)
+
+# Loudness: tracks are tagged with ReplayGain 2.0 gain towards this reference instead of being re-encoded
+AUDIO_REPLAYGAIN_REFERENCE = config('AUDIO_REPLAYGAIN_REFERENCE', default=-18.0, cast=float)
+
+# Image renditions of cover art and avatars: name:longest side in pixels, encoded as WebP and JPEG
+IMAGE_RENDITIONS = config('IMAGE_RENDITIONS', default='thumbnail:200,card:480,hero:1200',
+                          cast=lambda v: {name: int(size) for name, size in (item.split(':') for item in v.split(','))})
+IMAGE_RENDITION_QUALITY = config('IMAGE_RENDITION_QUALITY', default=82, cast=int)
+
+# Preview clips: the most energetic window of each track, encoded as a small mono MP3 with fades
+AUDIO_PREVIEW_SECONDS = config('AUDIO_PREVIEW_SECONDS', default=30, cast=int)
+AUDIO_PREVIEW_BITRATE = config('AUDIO_PREVIEW_BITRATE', default='64k')
+AUDIO_PREVIEW_FADE_MS = config('AUDIO_PREVIEW_FADE_MS', default=1500, cast=int)
+
+# Branding: MP3 uploads get the pre-encoded announcement joined at a frame boundary instead of a full re-encode
+AUDIO_BRAND_SPLICE = config('AUDIO_BRAND_SPLICE', default=True, cast=bool)
+
+# Seek index: byte offset of the playing MP3 frame every this many milliseconds, for time-based seeks
+AUDIO_SEEK_INDEX_INTERVAL_MS = config('AUDIO_SEEK_INDEX_INTERVAL_MS', default=500, cast=int)
+
+# Processing pipeline: content-addressed stage outputs, and per-stage parameter overrides as JSON,
+# e.g. {"optimize": {"bitrate": "256k"}}
+AUDIO_PIPELINE_CACHE_DIR = config('AUDIO_PIPELINE_CACHE_DIR', default=os.path.join(MEDIA_ROOT, 'pipeline'))
+AUDIO_PIPELINE_CACHE_SIZE = config('AUDIO_PIPELINE_CACHE_SIZE', default=20 * 1024 * 1024 * 1024, cast=int)
+AUDIO_PIPELINE_PROFILE = config('AUDIO_PIPELINE_PROFILE', default='{}', cast=json.loads)
+
+# Upload validation: a few short excerpts, keeping every Nth frame, are scanned before queueing;
+# uploads quieter than the silence level, with more clipped samples than the ratio or a larger DC offset are rejected
+AUDIO_UPLOAD_SCAN_EXCERPTS = config('AUDIO_UPLOAD_SCAN_EXCERPTS', default=8, cast=int)
+AUDIO_UPLOAD_SCAN_SECONDS = config('AUDIO_UPLOAD_SCAN_SECONDS', default=0.5, cast=float)
+AUDIO_UPLOAD_SCAN_DECIMATION = config('AUDIO_UPLOAD_SCAN_DECIMATION', default=4, cast=int)
+AUDIO_UPLOAD_SILENCE_DBFS = config('AUDIO_UPLOAD_SILENCE_DBFS', default=-60.0, cast=float)
+AUDIO_UPLOAD_CLIP_RATIO = config('AUDIO_UPLOAD_CLIP_RATIO', default=0.01, cast=float)
+AUDIO_UPLOAD_DC_OFFSET = config('AUDIO_UPLOAD_DC_OFFSET', default=0.1, cast=float)
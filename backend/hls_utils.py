@@ -0,0 +1,144 @@
+import os
+import time
+import uuid
+import shutil
+import subprocess
+from django.conf import settings
+import logging
+
+logger = logging.getLogger(__name__)
+
+# ffmpeg encoder and the RFC 6381 codec string advertised in the master playlist
+HLS_CODECS = {
+    'aac': ('aac', 'mp4a.40.2'),
+    'mp3': ('libmp3lame', 'mp4a.40.34'),
+}
+
+HLS_CONTENT_TYPES = {
+    '.m3u8': 'application/vnd.apple.mpegurl',
+    '.ts': 'video/mp2t',
+}
+
+MASTER_PLAYLIST = 'master.m3u8'
+
+# MPEG-TS packetization adds roughly this much on top of the audio bitrate
+TS_OVERHEAD = 1.1
+
+
+def hls_root(track_id):
+    """Directory holding every packaged HLS version of a track, next to the optimized files"""
+    return os.path.join(settings.MEDIA_ROOT, 'tracks', 'optimized', 'hls', str(track_id))
+
+
+def package_hls(source_path, output_dir, bitrates=None, segment_seconds=None, codec=None):
+    """
+    Package an audio file as HLS with one rendition per bitrate.
+
+    The source is decoded once by a single ffmpeg run that feeds every rendition.
+    Returns the path of the master playlist.
+    """
+    bitrates = sorted(bitrates or settings.AUDIO_HLS_BITRATES)
+    segment_seconds = segment_seconds or settings.AUDIO_HLS_SEGMENT_SECONDS
+    codec = codec or settings.AUDIO_HLS_CODEC
+    if codec not in HLS_CODECS:
+        raise ValueError(f"Unsupported HLS codec: {codec}")
+    encoder, codec_string = HLS_CODECS[codec]
+
+    command = [settings.AUDIO_FFMPEG_BINARY, '-hide_banner', '-loglevel', 'error', '-y', '-i', source_path]
+    for bitrate in bitrates:
+        rendition_dir = os.path.join(output_dir, f"{bitrate}k")
+        os.makedirs(rendition_dir, exist_ok=True)
+        command += [
+            '-map', '0:a:0', '-vn', '-c:a', encoder, '-b:a', f"{bitrate}k", '-ac', '2', '-ar', '44100',
+            '-f', 'hls',
+            '-hls_time', str(segment_seconds),
+            '-hls_playlist_type', 'vod',
+            '-hls_segment_filename', os.path.join(rendition_dir, 'segment_%05d.ts'),
+            os.path.join(rendition_dir, 'index.m3u8'),
+        ]
+
+    result = subprocess.run(command, capture_output=True, text=True)
+    if result.returncode != 0:
+        raise RuntimeError(f"ffmpeg HLS packaging failed: {result.stderr.strip()}")
+
+    lines = ['#EXTM3U', '#EXT-X-VERSION:3']
+    for bitrate in bitrates:
+        lines.append(
+            f'#EXT-X-STREAM-INF:BANDWIDTH={int(bitrate * 1000 * TS_OVERHEAD)},'
+            f'AVERAGE-BANDWIDTH={bitrate * 1000},CODECS="{codec_string}"'
+        )
+        lines.append(f"{bitrate}k/index.m3u8")
+
+    master_path = os.path.join(output_dir, MASTER_PLAYLIST)
+    with open(master_path, 'w') as f:
+        f.write('\n'.join(lines) + '\n')
+
+    return master_path
+
+
+def package_track(track, source_path):
+    """
+    Package a track's audio as HLS and return the master playlist path relative to MEDIA_ROOT.
+
+    Every packaging run writes a new version directory, so segment URLs never change
+    content and can be cached forever. Older versions stay until prune_hls_versions removes
+    them, as players may still be streaming from them.
+    """
+    root = hls_root(track.pk)
+    version = uuid.uuid4().hex[:12]
+    output_dir = os.path.join(root, version)
+
+    try:
+        master_path = package_hls(source_path, output_dir)
+    except Exception:
+        shutil.rmtree(output_dir, ignore_errors=True)
+        raise
+
+    return os.path.relpath(master_path, settings.MEDIA_ROOT)
+
+
+def prune_hls_versions(track_id, playlist, grace_seconds=None, now=None):
+    """
+    Remove HLS versions of a track other than the one its saved ``playlist`` points at.
+
+    Master playlists are cached as immutable, so a superseded version is kept until the
+    current one has been live for ``grace_seconds``; versions written within that time are
+    kept too, as a packaging run may not have saved its track yet. Returns the versions removed.
+    """
+    grace_seconds = settings.AUDIO_HLS_RETAIN_SECONDS if grace_seconds is None else grace_seconds
+    now = time.time() if now is None else now
+    root = hls_root(track_id)
+    if not os.path.isdir(root):
+        return []
+
+    def age(version):
+        path = os.path.join(root, version, MASTER_PLAYLIST)
+        return now - os.path.getmtime(path if os.path.exists(path) else os.path.join(root, version))
+
+    current = playlist.split('/')[-2] if playlist else None
+    if current and os.path.isdir(os.path.join(root, current)) and age(current) < grace_seconds:
+        return []
+    removed = [entry for entry in os.listdir(root) if entry != current and age(entry) >= grace_seconds]
+    for version in removed:
+        shutil.rmtree(os.path.join(root, version), ignore_errors=True)
+    if not os.listdir(root):
+        os.rmdir(root)
+    return removed
+
+
+def _link_or_copy(source, destination):
+    try:
+        os.link(source, destination)
+    except OSError:
+        shutil.copy2(source, destination)
+
+
+def link_track_hls(source_track, track):
+    """
+    Give a track a new HLS version directory holding another track's packaged output.
+    Files are hard-linked where the filesystem allows it, so nothing is re-encoded or duplicated.
+    """
+    source_dir = os.path.dirname(os.path.join(settings.MEDIA_ROOT, source_track.hls_playlist))
+    output_dir = os.path.join(hls_root(track.pk), uuid.uuid4().hex[:12])
+    shutil.copytree(source_dir, output_dir, copy_function=_link_or_copy)
+    return os.path.relpath(os.path.join(output_dir, MASTER_PLAYLIST), settings.MEDIA_ROOT)
@@ -0,0 +1,174 @@
+import io
+import hashlib
+from django.apps import apps
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from PIL import Image, ImageOps
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Encodings produced for every rendition: Pillow format and file extension
+RENDITION_FORMATS = {
+    'webp': ('WEBP', 'webp'),
+    'jpeg': ('JPEG', 'jpg'),
+}
+RENDITION_DIR = 'renditions'
+
+# Image fields that get renditions, as (model label, field name)
+RENDITION_FIELDS = [
+    ('music.Artist', 'image'),
+    ('music.Album', 'cover_art'),
+    ('music.Mixtape', 'cover_art'),
+    ('music.UserProfile', 'avatar'),
+]
+
+
+def rendition_name(data, extension):
+    """Storage name for an encoded rendition, derived from its bytes so it never changes under a URL"""
+    digest = hashlib.sha256(data).hexdigest()
+    return f"{RENDITION_DIR}/{digest[:2]}/{digest[:16]}.{extension}"
+
+
+def render_renditions(source, sizes=None, quality=None):
+    """
+    Resize an image file to fit each ``sizes`` box (the longest side in pixels) and encode
+    every size in each of RENDITION_FORMATS. Images are never enlarged.
+
+    The source is decoded once, at reduced scale when the JPEG decoder allows it, and each
+    size is resized from the next larger one. Returns {(rendition, format): (bytes, width, height)}.
+    """
+    sizes = sizes or settings.IMAGE_RENDITIONS
+    quality = quality or settings.IMAGE_RENDITION_QUALITY
+
+    with Image.open(source) as image:
+        largest = max(sizes.values())
+        image.draft('RGB', (largest, largest))
+        image = ImageOps.exif_transpose(image)
+        if image.mode in ('RGBA', 'LA') or (image.mode == 'P' and 'transparency' in image.info):
+            image = image.convert('RGBA')
+        else:
+            image = image.convert('RGB')
+
+    results = {}
+    for name, size in sorted(sizes.items(), key=lambda item: item[1], reverse=True):
+        if max(image.size) > size:
+            image = image.copy()
+            image.thumbnail((size, size), Image.LANCZOS)
+        for format_name, (pillow_format, _) in RENDITION_FORMATS.items():
+            rendition = image
+            if pillow_format == 'JPEG' and image.mode == 'RGBA':
+                # JPEG has no alpha: flatten onto white
+                rendition = Image.new('RGB', image.size, (255, 255, 255))
+                rendition.paste(image, mask=image.getchannel('A'))
+            buffer = io.BytesIO()
+            rendition.save(buffer, pillow_format, quality=quality, optimize=pillow_format == 'JPEG',
+                           progressive=pillow_format == 'JPEG')
+            results[(name, format_name)] = (buffer.getvalue(), *image.size)
+    return results
+
+
+def ensure_renditions(image_field):
+    """
+    Renditions of a stored image, rendering and storing any that are missing.
+    Returns ImageRendition rows keyed by (rendition, format); empty for an empty field.
+    """
+    from music.models import ImageRendition
+
+    if not image_field:
+        return {}
+    source = image_field.name
+    wanted = {(name, format_name) for name in settings.IMAGE_RENDITIONS for format_name in RENDITION_FORMATS}
+    rows = {(row.rendition, row.format): row for row in ImageRendition.objects.filter(source=source)}
+    if wanted <= rows.keys():
+        return rows
+
+    with image_field.storage.open(source, 'rb') as f:
+        rendered = render_renditions(f)
+
+    created = []
+    for (name, format_name), (data, width, height) in rendered.items():
+        if (name, format_name) in rows:
+            continue
+        path = rendition_name(data, RENDITION_FORMATS[format_name][1])
+        # Equal bytes give equal names, so an existing file is already this rendition
+        if not default_storage.exists(path):
+            path = default_storage.save(path, ContentFile(data))
+        created.append(ImageRendition(source=source, rendition=name, format=format_name,
+                                      file=path, width=width, height=height))
+    # A concurrent request may have stored the same renditions first
+    ImageRendition.objects.bulk_create(created, ignore_conflicts=True)
+    return {(row.rendition, row.format): row for row in ImageRendition.objects.filter(source=source)}
+
+
+def load_renditions(sources):
+    """
+    Stored renditions of many images in one query:
+    ``{source: {(rendition, format): ImageRendition}}``, with an empty dict for sources that have none.
+    """
+    from music.models import ImageRendition
+
+    renditions = {source: {} for source in sources}
+    for row in ImageRendition.objects.filter(source__in=renditions):
+        renditions[row.source][(row.rendition, row.format)] = row
+    return renditions
+
+
+def image_sources(instances):
+    """
+    Names of the images with renditions on ``instances`` and on the related objects already
+    loaded with them (select_related and prefetch_related caches). Runs no queries.
+    """
+    fields = {}
+    for model_label, field_name in RENDITION_FIELDS:
+        fields.setdefault(model_label, []).append(field_name)
+
+    sources, seen, pending = set(), set(), list(instances)
+    while pending:
+        instance = pending.pop()
+        if instance is None or id(instance) in seen:
+            continue
+        seen.add(id(instance))
+        for field_name in fields.get(instance._meta.label, ()):
+            image_field = getattr(instance, field_name)
+            if image_field:
+                sources.add(image_field.name)
+        pending.extend(instance._state.fields_cache.values())
+        for related in getattr(instance, '_prefetched_objects_cache', {}).values():
+            pending.extend(related)
+    return sources
+
+
+def rendition_srcset(image_field, request=None, renditions=None):
+    """
+    URLs of an image's stored renditions for the API:
+    ``{rendition: {'width': .., 'height': .., 'webp': url, 'jpeg': url}}``, or None without an image.
+    ``renditions`` is a load_renditions() result to look the image up in instead of querying.
+    Nothing is rendered here; uploads are rendered on save and older images by backfill_renditions.
+    """
+    if not image_field:
+        return None
+    if renditions is None or image_field.name not in renditions:
+        renditions = load_renditions([image_field.name])
+
+    srcset = {}
+    for (name, format_name), row in renditions[image_field.name].items():
+        if name not in settings.IMAGE_RENDITIONS or format_name not in RENDITION_FORMATS:
+            continue
+        url = row.file.url
+        entry = srcset.setdefault(name, {'width': row.width, 'height': row.height})
+        entry[format_name] = request.build_absolute_uri(url) if request else url
+    return srcset
+
+
+def generate_object_renditions(model_label, pk, field_name):
+    """Render missing renditions of one object's image; used by the backfill command"""
+    from music.models import ImageRendition
+
+    instance = apps.get_model(model_label).objects.get(pk=pk)
+    image_field = getattr(instance, field_name)
+    if not image_field or not image_field.storage.exists(image_field.name):
+        return 'missing'
+    existing = ImageRendition.objects.filter(source=image_field.name).count()
+    return 'generated' if len(ensure_renditions(image_field)) > existing else 'skipped'
@@ -0,0 +1,195 @@
+import os
+import re
+import hashlib
+from django.conf import settings
+from django.core.files import File
+from django.core.files.storage import default_storage
+from django.db import transaction
+from django.template.defaultfilters import slugify
+import logging
+
+logger = logging.getLogger(__name__)
+
+AUDIO_EXTENSIONS = {'.mp3', '.flac', '.ogg', '.oga', '.opus', '.wav', '.aif', '.aiff', '.m4a'}
+
+UNKNOWN_ARTIST = 'Unknown Artist'
+
+# Imported files are copied under this storage prefix, keeping their path inside the library
+IMPORT_UPLOAD_PREFIX = 'tracks/imported'
+
+_processor = None
+
+
+def find_audio_files(root):
+    """Yield paths of audio files under ``root`` relative to it, in a stable order"""
+    for directory, subdirectories, filenames in os.walk(root):
+        subdirectories.sort()
+        for filename in sorted(filenames):
+            if os.path.splitext(filename)[1].lower() in AUDIO_EXTENSIONS:
+                yield os.path.relpath(os.path.join(directory, filename), root)
+
+
+def default_checkpoint_path(root):
+    """Checkpoint file for a library, kept in the processing spool so the library can be read-only"""
+    digest = hashlib.sha1(os.path.abspath(root).encode()).hexdigest()[:12]
+    return os.path.join(settings.AUDIO_PROCESSING_SPOOL_DIR, f"import_{digest}.checkpoint")
+
+
+def load_checkpoint(path):
+    """Relative paths that earlier runs already imported"""
+    if not os.path.exists(path):
+        return set()
+    with open(path, encoding='utf-8') as f:
+        return {line.rstrip('\n') for line in f if line.strip()}
+
+
+def read_library_file(root, relative_path):
+    """
+    Extract tags and header info from one file and copy it into media storage.
+    Runs inside a worker process; returns a plain dict so it pickles cheaply.
+    """
+    global _processor
+    from audio_utils import AudioProcessor
+
+    if _processor is None:
+        _processor = AudioProcessor()
+
+    path = os.path.join(root, relative_path)
+    try:
+        metadata = _processor.extract_metadata(path)
+        with open(path, 'rb') as f:
+            name = default_storage.save(f"{IMPORT_UPLOAD_PREFIX}/{relative_path}", File(f))
+        return {
+            'relative_path': relative_path,
+            'name': name,
+            'size': os.path.getsize(path),
+            'metadata': {key: value if key == 'probe' else str(value or '') for key, value in metadata.items()},
+        }
+    except Exception as e:
+        return {'relative_path': relative_path, 'error': str(e)}
+
+
+def _track_number(value):
+    match = re.match(r'\s*(\d+)', value or '')
+    return int(match.group(1)) if match else None
+
+
+def _unique_slug(base, taken, max_length):
+    base = (base or 'untitled')[:max_length]
+    slug = base
+    counter = 1
+    while slug in taken:
+        suffix = f"-{counter}"
+        slug = f"{base[:max_length - len(suffix)]}{suffix}"
+        counter += 1
+    taken.add(slug)
+    return slug
+
+
+class LibraryImporter:
+    """
+    Turns worker results into rows in batches.
+
+    Artists, albums and genres are resolved through in-memory maps loaded once up front,
+    and slugs are made unique against in-memory sets, because ``bulk_create`` skips the
+    models' ``save()`` and would otherwise cost a query per row.
+    """
+
+    def __init__(self, checkpoint_path):
+        from music.models import Artist, Album, Genre, Track
+
+        self.checkpoint_path = checkpoint_path
+        self.artists = {name: pk for pk, name in Artist.objects.values_list('pk', 'name')}
+        self.genres = {name: pk for pk, name in Genre.objects.values_list('pk', 'name')}
+        self.albums = {
+            (artist_id, title): pk for pk, artist_id, title in Album.objects.values_list('pk', 'artist_id', 'title')
+        }
+        self.slugs = {
+            model: set(model.objects.values_list('slug', flat=True))
+            for model in (Artist, Album, Genre, Track)
+        }
+        self.imported = 0
+
+    def flush(self, results):
+        """Insert one batch of successful worker results and record them in the checkpoint"""
+        from music.models import Artist, Album, Genre, Track
+        from probe_utils import apply_probe
+
+        if not results:
+            return
+
+        with transaction.atomic():
+            rows = [self._row(result) for result in results]
+
+            new_genres = {row['genre'] for row in rows if row['genre'] and row['genre'] not in self.genres}
+            self._create(Genre, self.genres, [
+                Genre(name=name, slug=_unique_slug(slugify(name), self.slugs[Genre], 100)) for name in new_genres
+            ], key=lambda genre: genre.name)
+
+            new_artists = {row['artist'] for row in rows if row['artist'] not in self.artists}
+            self._create(Artist, self.artists, [
+                Artist(name=name, slug=_unique_slug(slugify(name), self.slugs[Artist], 200)) for name in new_artists
+            ], key=lambda artist: artist.name)
+
+            new_albums = {}
+            for row in rows:
+                key = (self.artists[row['artist']], row['album'])
+                if row['album'] and key not in self.albums and key not in new_albums:
+                    new_albums[key] = Album(
+                        title=row['album'],
+                        artist_id=key[0],
+                        genre_id=self.genres.get(row['genre']),
+                        slug=_unique_slug(slugify(f"{row['artist']}-{row['album']}"), self.slugs[Album], 300),
+                    )
+            self._create(Album, self.albums, list(new_albums.values()),
+                         key=lambda album: (album.artist_id, album.title))
+
+            tracks = []
+            for result, row in zip(results, rows):
+                artist_id = self.artists[row['artist']]
+                track = Track(
+                    title=row['title'],
+                    slug=_unique_slug(slugify(f"{row['artist']}-{row['title']}"), self.slugs[Track], 300),
+                    artist_id=artist_id,
+                    album_id=self.albums.get((artist_id, row['album'])),
+                    genre_id=self.genres.get(row['genre']),
+                    track_number=_track_number(row['track_number']),
+                    audio_file=result['name'],
+                    original_filename=os.path.basename(result['relative_path']),
+                    extracted_title=row['title'],
+                    extracted_artist=row['artist'],
+                    extracted_album=row['album'],
+                    extracted_year=row['year'][:10],
+                    extracted_genre=row['genre'][:100],
+                    extracted_track_number=row['track_number'][:10],
+                )
+                if row['probe']:
+                    apply_probe(track, row['probe'])
+                tracks.append(track)
+            Track.objects.bulk_create(tracks)
+
+        # Only committed rows reach the checkpoint, so a crashed run redoes at most one batch
+        os.makedirs(os.path.dirname(self.checkpoint_path) or '.', exist_ok=True)
+        with open(self.checkpoint_path, 'a', encoding='utf-8') as f:
+            f.writelines(f"{result['relative_path']}\n" for result in results)
+        self.imported += len(results)
+
+    def _row(self, result):
+        metadata = result['metadata']
+        title = metadata.get('title') or os.path.splitext(os.path.basename(result['relative_path']))[0]
+        return {
+            'title': title[:300],
+            'artist': (metadata.get('artist') or UNKNOWN_ARTIST)[:200],
+            'album': metadata.get('album', '')[:300],
+            'genre': metadata.get('genre', '')[:100],
+            'year': metadata.get('year', ''),
+            'track_number': metadata.get('track_number', ''),
+            'probe': metadata.get('probe'),
+        }
+
+    @staticmethod
+    def _create(model, mapping, objects, key):
+        if not objects:
+            return
+        for obj in model.objects.bulk_create(objects):
+            mapping[key(obj)] = obj.pk
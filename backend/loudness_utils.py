@@ -0,0 +1,267 @@
+import math
+from functools import lru_cache
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+from django.conf import settings
+import logging
+
+logger = logging.getLogger(__name__)
+
+# ITU-R BS.1770 / EBU R128 constants
+ABSOLUTE_GATE = -70.0
+RELATIVE_GATE = -10.0
+LRA_RELATIVE_GATE = -20.0
+LRA_PERCENTILES = (0.10, 0.95)
+SUBBLOCKS_PER_MOMENTARY = 4      # 400 ms gating blocks
+SUBBLOCKS_PER_SHORT_TERM = 30    # 3 s short-term windows
+SUBBLOCKS_PER_BLOCK = 10         # PCM is filtered one second at a time
+
+# Gated blocks are kept in fixed histograms instead of lists, so memory does not grow with duration
+HISTOGRAM_MIN = ABSOLUTE_GATE
+HISTOGRAM_STEP = 0.01
+HISTOGRAM_BINS = 10000
+
+# Channel weights for a 5.1 layout (L, R, C, LFE, Ls, Rs); other layouts weight every channel 1.0
+SURROUND_WEIGHTS = [1.0, 1.0, 1.0, 0.0, 1.41, 1.41]
+
+# The K-weighting filter's impulse response is truncated after this long
+K_WEIGHTING_RESPONSE_SECONDS = 0.2
+
+TRUE_PEAK_TAPS_PER_PHASE = 12
+
+SAMPLE_DTYPES = {1: np.int8, 2: np.int16, 4: np.int32}
+
+
+def _loudness(energy):
+    return -0.691 + 10 * math.log10(energy)
+
+
+def _biquad_response(b, a, length, signal):
+    """Run a signal through a biquad; only used once per sample rate to build the impulse response"""
+    out = np.zeros(length)
+    x1 = x2 = y1 = y2 = 0.0
+    for n in range(length):
+        x0 = signal[n]
+        y0 = b[0] * x0 + b[1] * x1 + b[2] * x2 - a[1] * y1 - a[2] * y2
+        out[n] = y0
+        x2, x1, y2, y1 = x1, x0, y1, y0
+    return out
+
+
+@lru_cache(maxsize=8)
+def k_weighting_response(sample_rate):
+    """
+    Impulse response of the BS.1770 K-weighting filter (high shelf, then high pass) at any rate.
+    Both stages decay to well below float precision within the truncation window.
+    """
+    length = int(math.ceil(sample_rate * K_WEIGHTING_RESPONSE_SECONDS))
+
+    f0, gain, q = 1681.974450955533, 3.999843853973347, 0.7071752369554196
+    k = math.tan(math.pi * f0 / sample_rate)
+    vh = 10 ** (gain / 20)
+    vb = vh ** 0.4996667741545416
+    a0 = 1 + k / q + k * k
+    shelf_b = [(vh + vb * k / q + k * k) / a0, 2 * (k * k - vh) / a0, (vh - vb * k / q + k * k) / a0]
+    shelf_a = [1.0, 2 * (k * k - 1) / a0, (1 - k / q + k * k) / a0]
+
+    f0, q = 38.13547087602444, 0.5003270373238773
+    k = math.tan(math.pi * f0 / sample_rate)
+    a0 = 1 + k / q + k * k
+    highpass_b = [1.0, -2.0, 1.0]
+    highpass_a = [1.0, 2 * (k * k - 1) / a0, (1 - k / q + k * k) / a0]
+
+    impulse = np.zeros(length)
+    impulse[0] = 1.0
+    response = _biquad_response(shelf_b, shelf_a, length, impulse)
+    return _biquad_response(highpass_b, highpass_a, length, response)
+
+
+@lru_cache(maxsize=8)
+def _k_weighting_spectrum(sample_rate, fft_size):
+    return np.fft.rfft(k_weighting_response(sample_rate), fft_size)
+
+
+@lru_cache(maxsize=4)
+def true_peak_filter(factor):
+    """Polyphase windowed-sinc interpolator, one column of reversed taps per output phase"""
+    taps = factor * TRUE_PEAK_TAPS_PER_PHASE
+    n = np.arange(taps) - (taps - 1) / 2
+    prototype = np.sinc(n / factor) * np.kaiser(taps, 8.0)
+    phases = prototype.reshape(TRUE_PEAK_TAPS_PER_PHASE, factor).T
+    phases = phases / phases.sum(axis=1, keepdims=True)
+    return np.ascontiguousarray(phases[:, ::-1].T)
+
+
+class LoudnessAnalyzer:
+    """
+    Chunked EBU R128 analyser: integrated loudness, loudness range and true peak.
+
+    PCM is pushed with ``feed`` in blocks of any size as float samples in [-1, 1]
+    shaped (frames, channels). Internally it is K-weighted one second at a time by
+    FFT overlap-add, and only running sums, histograms and a few seconds of state
+    are kept, so memory stays constant for any track length.
+    """
+
+    def __init__(self, sample_rate, channels):
+        self.sample_rate = sample_rate
+        self.channels = channels
+        self.hop = int(round(sample_rate / 10))
+        self.block_frames = self.hop * SUBBLOCKS_PER_BLOCK
+
+        if channels == len(SURROUND_WEIGHTS):
+            self.weights = np.array(SURROUND_WEIGHTS)
+        else:
+            self.weights = np.ones(channels)
+
+        response_length = len(k_weighting_response(sample_rate))
+        self.fft_size = 1 << (self.block_frames + response_length - 1).bit_length()
+        self.filter_tail = np.zeros((response_length - 1, channels))
+
+        self.oversampling = 4 if sample_rate < 96000 else 2 if sample_rate < 192000 else 1
+        self.peak_history = np.zeros((TRUE_PEAK_TAPS_PER_PHASE - 1, channels))
+        self.peak = 0.0
+
+        self.pending = np.zeros((self.block_frames, channels))
+        self.pending_frames = 0
+
+        # Energies of the most recent 100 ms sub-blocks, enough for one short-term window
+        self.recent = np.zeros(SUBBLOCKS_PER_SHORT_TERM)
+        self.subblocks = 0
+
+        self.momentary_counts = np.zeros(HISTOGRAM_BINS, dtype=np.int64)
+        self.momentary_energy = np.zeros(HISTOGRAM_BINS)
+        self.short_term_counts = np.zeros(HISTOGRAM_BINS, dtype=np.int64)
+        self.short_term_energy = np.zeros(HISTOGRAM_BINS)
+
+    def feed(self, frames):
+        """Add float PCM shaped (frames, channels)"""
+        frames = np.asarray(frames, dtype=np.float64).reshape(-1, self.channels)
+        offset = 0
+        while offset < len(frames):
+            count = min(self.block_frames - self.pending_frames, len(frames) - offset)
+            self.pending[self.pending_frames:self.pending_frames + count] = frames[offset:offset + count]
+            self.pending_frames += count
+            offset += count
+            if self.pending_frames == self.block_frames:
+                self._process(self.pending)
+                self.pending_frames = 0
+
+    def result(self):
+        """Flush buffered PCM and return the measurements; values are None for silence"""
+        if self.pending_frames:
+            self._process(self.pending[:self.pending_frames])
+            self.pending_frames = 0
+
+        return {
+            'integrated': self._gated_loudness(self.momentary_counts, self.momentary_energy, RELATIVE_GATE),
+            'loudness_range': self._loudness_range(),
+            'true_peak': 20 * math.log10(self.peak) if self.peak > 0 else None,
+        }
+
+    def _process(self, block):
+        self._track_true_peak(block)
+
+        # K-weight by overlap-add so the filter state carries across blocks
+        spectrum = np.fft.rfft(block, self.fft_size, axis=0)
+        filtered = np.fft.irfft(spectrum * _k_weighting_spectrum(self.sample_rate, self.fft_size)[:, None],
+                                self.fft_size, axis=0)
+        tail_length = len(self.filter_tail)
+        filtered[:tail_length] += self.filter_tail
+        self.filter_tail = filtered[len(block):len(block) + tail_length].copy()
+        weighted = filtered[:len(block)]
+
+        # A trailing partial sub-block at the very end is not measured, as in BS.1770
+        whole = len(block) // self.hop
+        if not whole:
+            return
+        squares = weighted[:whole * self.hop].reshape(whole, self.hop, self.channels) ** 2
+        energies = squares.mean(axis=1) @ self.weights
+        for energy in energies:
+            self._add_subblock(energy)
+
+    def _track_true_peak(self, block):
+        history = np.concatenate([self.peak_history, block])
+        self.peak_history = history[-len(self.peak_history):]
+        self.peak = max(self.peak, float(np.abs(block).max()))
+        if self.oversampling == 1:
+            return
+        windows = sliding_window_view(history, TRUE_PEAK_TAPS_PER_PHASE, axis=0)
+        interpolated = windows @ true_peak_filter(self.oversampling)
+        self.peak = max(self.peak, float(np.abs(interpolated).max()))
+
+    def _add_subblock(self, energy):
+        self.recent = np.roll(self.recent, -1)
+        self.recent[-1] = energy
+        self.subblocks += 1
+
+        if self.subblocks >= SUBBLOCKS_PER_MOMENTARY:
+            self._record(self.recent[-SUBBLOCKS_PER_MOMENTARY:].mean(), self.momentary_counts, self.momentary_energy)
+        if self.subblocks >= SUBBLOCKS_PER_SHORT_TERM:
+            self._record(self.recent.mean(), self.short_term_counts, self.short_term_energy)
+
+    @staticmethod
+    def _record(energy, counts, energies):
+        if energy <= 0:
+            return
+        loudness = _loudness(energy)
+        if loudness <= ABSOLUTE_GATE:
+            return
+        index = min(int((loudness - HISTOGRAM_MIN) / HISTOGRAM_STEP), HISTOGRAM_BINS - 1)
+        counts[index] += 1
+        energies[index] += energy
+
+    @staticmethod
+    def _relative_gate_bin(counts, energies, offset):
+        total = counts.sum()
+        if not total:
+            return None
+        gate = _loudness(energies.sum() / total) + offset
+        return max(0, int(math.ceil((gate - HISTOGRAM_MIN) / HISTOGRAM_STEP)))
+
+    def _gated_loudness(self, counts, energies, offset):
+        start = self._relative_gate_bin(counts, energies, offset)
+        if start is None or not counts[start:].sum():
+            return None
+        return _loudness(energies[start:].sum() / counts[start:].sum())
+
+    def _loudness_range(self):
+        start = self._relative_gate_bin(self.short_term_counts, self.short_term_energy, LRA_RELATIVE_GATE)
+        if start is None:
+            return None
+        counts = self.short_term_counts[start:]
+        total = counts.sum()
+        if not total:
+            return None
+        cumulative = np.cumsum(counts)
+        low, high = (
+            int(np.searchsorted(cumulative, int(round((total - 1) * percentile)), side='right'))
+            for percentile in LRA_PERCENTILES
+        )
+        return (high - low) * HISTOGRAM_STEP
+
+
+def analyse_segment(audio, block_frames=None):
+    """Measure a decoded pydub AudioSegment, reading its PCM one fixed-size block at a time"""
+    if audio.sample_width not in SAMPLE_DTYPES:
+        audio = audio.set_sample_width(4)
+    analyzer = LoudnessAnalyzer(audio.frame_rate, audio.channels)
+    block_frames = block_frames or analyzer.block_frames
+
+    dtype = SAMPLE_DTYPES[audio.sample_width]
+    scale = float(2 ** (8 * audio.sample_width - 1))
+    raw = memoryview(audio.raw_data)
+    block_bytes = block_frames * audio.frame_width
+    for offset in range(0, len(raw), block_bytes):
+        samples = np.frombuffer(raw[offset:offset + block_bytes], dtype=dtype)
+        analyzer.feed(samples.reshape(-1, audio.channels) / scale)
+
+    return analyzer.result()
+
+
+def replaygain(loudness, reference=None):
+    """ReplayGain 2.0 track gain (dB) and peak (linear) for a loudness result"""
+    if loudness.get('integrated') is None:
+        return None, None
+    reference = settings.AUDIO_REPLAYGAIN_REFERENCE if reference is None else reference
+    peak = 10 ** (loudness['true_peak'] / 20) if loudness.get('true_peak') is not None else 0.0
+    return reference - loudness['integrated'], peak
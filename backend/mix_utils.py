@@ -0,0 +1,248 @@
+import os
+import glob
+import hashlib
+import threading
+import numpy as np
+from django.conf import settings
+from stream_utils import PCMDecoder, PCMEncoder, segment_samples, stream_block_frames, STREAM_SAMPLE_RATE
+from transcode_cache import evict_lru
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Part of every cache key; bump it when rendering changes so old segments and mixes are not reused
+MIX_RENDER_VERSION = 1
+SEGMENT_DIR = 'segments'
+MIX_DIR = 'mixes'
+READ_SIZE = 64 * 1024
+
+# Extra audio decoded before a track's last seconds, since seeking from the end is approximate
+TAIL_MARGIN_SECONDS = 1.0
+
+
+def crossfade(tail, head, start, length):
+    """Equal-power crossfade of frames ``start:start + len(head)`` of a ``length``-frame transition"""
+    angle = (np.arange(start, start + len(head)) + 0.5) / length * (np.pi / 2)
+    mixed = tail * np.cos(angle)[:, None] + head * np.sin(angle)[:, None]
+    return np.clip(np.round(mixed), -32768, 32767).astype(np.int16)
+
+
+def decode_tail(path, frames, block_frames):
+    """The last ``frames`` frames of a file, decoding only its end"""
+    held = np.zeros((0, 2), dtype=np.int16)
+    for block in PCMDecoder(path, block_frames, tail_seconds=frames / STREAM_SAMPLE_RATE + TAIL_MARGIN_SECONDS):
+        held = np.concatenate([held, block])[-frames:]
+    if len(held) < frames:
+        held = np.concatenate([np.zeros((frames - len(held), 2), dtype=np.int16), held])
+    return held
+
+
+class MixSegment:
+    """
+    The part of a mix owned by one track: the crossfade from the previous track into it,
+    then its body up to where the crossfade into the next track starts. It depends only
+    on its own track and the previous one, so it is cached and re-rendered on its own.
+    """
+
+    def __init__(self, path, version, previous_path, previous_version, fade_in, fade_out, trim):
+        self.path = path
+        self.previous_path = previous_path
+        self.fade_in = fade_in
+        self.fade_out = fade_out
+        self.trim = trim
+        self.key = hashlib.sha1(
+            f"{MIX_RENDER_VERSION}|{version}|{previous_version}|{fade_in}|{fade_out}|{trim}".encode()
+        ).hexdigest()
+
+    def render(self, write, block_frames):
+        """Pass the segment's PCM to ``write`` block by block"""
+        tail = decode_tail(self.previous_path, self.fade_in, block_frames) if self.fade_in else None
+        skip = self.trim
+        position = 0
+        held = np.zeros((0, 2), dtype=np.int16)
+
+        for block in PCMDecoder(self.path, block_frames):
+            if skip:
+                cut = min(skip, len(block))
+                block, skip = block[cut:], skip - cut
+                if not len(block):
+                    continue
+            if tail is not None and position < self.fade_in:
+                count = min(len(block), self.fade_in - position)
+                mixed = crossfade(tail[position:position + count], block[:count], position, self.fade_in)
+                block = np.concatenate([mixed, block[count:]])
+            position += len(block)
+
+            if self.fade_out:
+                # The last fade_out frames belong to the next segment's crossfade
+                block = np.concatenate([held, block])
+                ready = max(0, len(block) - self.fade_out)
+                block, held = block[:ready], block[ready:]
+            if len(block):
+                write(block)
+
+
+class MixRenderer:
+    """
+    Renders a mixtape as one continuous MP3 with crossfades between neighbouring tracks.
+
+    Segments are cached as FLAC under their own keys, so changing one track re-renders
+    only its segment and the next one. The mix itself is cached under a hash of the
+    segment keys and streamed to the client while it is encoded; PCM in flight is at
+    most two crossfade windows and one decode block. Segments are evicted least recently
+    used first once they outgrow AUDIO_MIX_SEGMENT_CACHE_SIZE.
+    """
+
+    def __init__(self, mixtape, crossfade_ms=None, bitrate=None, announce=True):
+        from tts_utils import SiteAnnouncementGenerator
+
+        self.mixtape = mixtape
+        self.bitrate = bitrate or settings.AUDIO_MIX_BITRATE
+        self.announce = announce
+        self.root = settings.AUDIO_MIX_CACHE_DIR
+        self.block_frames = stream_block_frames()
+        crossfade_frames = int((settings.AUDIO_MIX_CROSSFADE_MS if crossfade_ms is None else crossfade_ms)
+                               * STREAM_SAMPLE_RATE / 1000)
+        announcement_frames = int(SiteAnnouncementGenerator().get_announcement_duration() * STREAM_SAMPLE_RATE)
+
+        sources = []
+        for entry in mixtape.mixtape_tracks.select_related('track').order_by('position'):
+            track = entry.track
+            field = track.optimized_file or track.audio_file
+            path = os.path.join(settings.MEDIA_ROOT, field.name) if field else None
+            if not path or not os.path.isfile(path):
+                raise ValueError(f"Track {track.pk} has no audio file")
+            stat = os.stat(path)
+            # Every branded track opens with the site announcement; the mix plays it once
+            trim = announcement_frames if track.has_site_branding else 0
+            frames = int(self._duration_ms(track, path) * STREAM_SAMPLE_RATE / 1000) - trim
+            sources.append((path, f"{field.name}:{stat.st_size}:{stat.st_mtime_ns}", trim, max(frames, 0)))
+
+        # A transition never takes more than half of either track
+        fades = [
+            min(crossfade_frames, previous[3] // 2, current[3] // 2)
+            for previous, current in zip(sources, sources[1:])
+        ]
+        self.segments = []
+        for index, (path, version, trim, _) in enumerate(sources):
+            previous = sources[index - 1] if index else (None, '', 0, 0)
+            self.segments.append(MixSegment(
+                path, version, previous[0], previous[1],
+                fade_in=fades[index - 1] if index else 0,
+                fade_out=fades[index] if index < len(fades) else 0,
+                trim=trim,
+            ))
+
+        self.key = hashlib.sha1('|'.join(
+            [str(MIX_RENDER_VERSION), self.bitrate, str(announce)] + [segment.key for segment in self.segments]
+        ).encode()).hexdigest()
+
+    @staticmethod
+    def _duration_ms(track, path):
+        """Track length for sizing its crossfades; read from the file header when not recorded"""
+        from probe_utils import probe_audio
+
+        if track.duration_ms:
+            return track.duration_ms
+        try:
+            duration_ms = probe_audio(path)['duration_ms']
+        except ValueError as e:
+            raise ValueError(f"Track {track.pk} has no known duration: {e}")
+        if not duration_ms:
+            raise ValueError(f"Track {track.pk} has no known duration")
+        return duration_ms
+
+    @property
+    def path(self):
+        return os.path.join(self.root, MIX_DIR, f"{self.mixtape.pk}-{self.key[:16]}.mp3")
+
+    def segment_path(self, segment):
+        return os.path.join(self.root, SEGMENT_DIR, f"{segment.key}.flac")
+
+    def write_segment(self, segment, write):
+        """Send a segment's PCM to ``write``, from the cache or by rendering and caching it"""
+        path = self.segment_path(segment)
+        if os.path.exists(path):
+            os.utime(path)
+            for block in PCMDecoder(path, self.block_frames):
+                write(block)
+            return
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        partial = f"{path}.{os.getpid()}.{threading.get_ident()}.partial"
+        encoder = PCMEncoder(partial, codec='flac', format='flac')
+        try:
+            def tee(block):
+                encoder.write(block)
+                write(block)
+
+            segment.render(tee, self.block_frames)
+            encoder.close()
+            os.replace(partial, path)
+            evict_lru(
+                (entry for entry in os.scandir(os.path.dirname(path)) if entry.name.endswith('.flac')),
+                settings.AUDIO_MIX_SEGMENT_CACHE_SIZE, keep=path,
+            )
+        except BaseException:
+            encoder.abort()
+            if os.path.exists(partial):
+                os.unlink(partial)
+            raise
+
+    def stream(self):
+        """
+        Yield the encoded mix as it is produced. A complete render is stored under
+        ``path``, replacing older renders of the mixtape; an interrupted one is discarded.
+        """
+        encoder = PCMEncoder('pipe:1', self.bitrate, format='mp3')
+        errors = []
+
+        def feed():
+            try:
+                if self.announce:
+                    from audio_utils import AudioProcessor
+                    announcement = AudioProcessor().create_site_announcement()
+                    if announcement:
+                        encoder.write(segment_samples(announcement))
+                for segment in self.segments:
+                    self.write_segment(segment, encoder.write)
+                encoder.close()
+            except Exception as e:
+                errors.append(e)
+                encoder.abort()
+
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        partial = f"{self.path}.{os.getpid()}.{threading.get_ident()}.partial"
+        feeder = threading.Thread(target=feed, daemon=True)
+        feeder.start()
+        finished = False
+        try:
+            with open(partial, 'wb') as output:
+                while True:
+                    data = encoder.stdout.read(READ_SIZE)
+                    if not data:
+                        break
+                    output.write(data)
+                    yield data
+            feeder.join()
+            if errors:
+                raise errors[0]
+            os.replace(partial, self.path)
+            finished = True
+            self._remove_older_renders()
+        except Exception as e:
+            logger.error(f"Rendering mix of mixtape {self.mixtape.pk} failed: {e}")
+            raise
+        finally:
+            if not finished:
+                # The client went away or rendering failed: stop ffmpeg and drop the partial file
+                encoder.abort()
+                feeder.join()
+                encoder.stdout.close()
+                if os.path.exists(partial):
+                    os.unlink(partial)
+
+    def _remove_older_renders(self):
+        for path in glob.glob(os.path.join(self.root, MIX_DIR, f"{self.mixtape.pk}-*.mp3")):
+            if path != self.path:
+                os.unlink(path)
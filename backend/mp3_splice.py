@@ -0,0 +1,279 @@
+import os
+import struct
+import tempfile
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Layer III tables; MPEG 2.5 shares the MPEG 2 bitrates
+BITRATES = {
+    1: [0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320],
+    2: [0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160],
+}
+SAMPLE_RATES = {1: [44100, 48000, 32000], 2: [22050, 24000, 16000], 2.5: [11025, 12000, 8000]}
+VERSIONS = {3: 1, 2: 2, 0: 2.5}
+
+XING_FLAGS = 0x0007             # frame count, byte count and seek table present
+XING_SIZE = 120                 # tag id, flags, frame count, byte count, 100-entry seek table
+ID3_PADDING = 4096              # room for the tags written after splicing, so they go in without moving audio
+SYNC_WINDOW = 64 * 1024
+COPY_SIZE = 1024 * 1024
+
+
+class FrameHeader:
+    """A parsed MPEG-1/2/2.5 Layer III frame header"""
+
+    def __init__(self, value):
+        self.value = value
+        self.version = VERSIONS[(value >> 19) & 3]
+        self.protected = not (value >> 16) & 1
+        self.bitrate_index = (value >> 12) & 0xF
+        self.bitrate = BITRATES[1 if self.version == 1 else 2][self.bitrate_index]
+        self.sample_rate = SAMPLE_RATES[self.version][(value >> 10) & 3]
+        self.padding = (value >> 9) & 1
+        self.mono = (value >> 6) & 3 == 3
+        mpeg1 = self.version == 1
+        self.samples = 1152 if mpeg1 else 576
+        self.length = (144 if mpeg1 else 72) * self.bitrate * 1000 // self.sample_rate + self.padding
+        self.side_info = (17 if self.mono else 32) if mpeg1 else (9 if self.mono else 17)
+
+    @property
+    def channels(self):
+        return 1 if self.mono else 2
+
+    def compatible(self, other):
+        """Frames of both headers can follow one another in a single stream"""
+        return (self.version, self.sample_rate, self.mono) == (other.version, other.sample_rate, other.mono)
+
+    def main_data_begin(self, frame):
+        """Bit reservoir back-pointer of a frame; zero when it needs no earlier frame"""
+        offset = 6 if self.protected else 4
+        if self.version == 1:
+            return (frame[offset] << 1) | (frame[offset + 1] >> 7)
+        return frame[offset]
+
+
+def parse_header(data):
+    """FrameHeader for four bytes, or None unless they start a Layer III frame of known size"""
+    if len(data) < 4:
+        return None
+    value = struct.unpack('>I', data[:4])[0]
+    if value >> 21 != 0x7FF or (value >> 19) & 3 == 1 or (value >> 17) & 3 != 1:
+        return None
+    # Free-format and reserved values leave the frame length unknown
+    if (value >> 12) & 0xF in (0, 15) or (value >> 10) & 3 == 3:
+        return None
+    return FrameHeader(value)
+
+
+def _syncsafe(data):
+    return (data[0] << 21) | (data[1] << 14) | (data[2] << 7) | data[3]
+
+
+def audio_bounds(f):
+    """Byte range of a file between its leading ID3v2 tags and trailing APEv2/ID3v1 tags"""
+    end = f.seek(0, os.SEEK_END)
+    start = 0
+    while True:
+        f.seek(start)
+        header = f.read(10)
+        if len(header) < 10 or not header.startswith(b'ID3'):
+            break
+        start += 10 + _syncsafe(header[6:10]) + (10 if header[5] & 0x10 else 0)
+
+    if end - start >= 128:
+        f.seek(end - 128)
+        if f.read(3) == b'TAG':
+            end -= 128
+    if end - start >= 32:
+        f.seek(end - 32)
+        footer = f.read(32)
+        if footer.startswith(b'APETAGEX'):
+            size, flags = struct.unpack('<I4xI', footer[12:24])
+            end -= size + (32 if flags & 0x80000000 else 0)
+    return start, max(start, end)
+
+
+class MP3Stream:
+    """
+    The frames of an MP3 file, found by walking frame headers without decoding anything.
+    A leading Xing/Info/VBRI frame describes the old stream and is left out of ``frames``.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.frames = []
+        with open(path, 'rb') as f:
+            start, end = audio_bounds(f)
+            position = self._sync(f, start, end)
+            while position is not None:
+                f.seek(position)
+                header = parse_header(f.read(4))
+                if header is None or position + header.length > end:
+                    position = self._sync(f, position + 1, end)
+                    continue
+                self.frames.append((position, header))
+                position += header.length
+                if position >= end:
+                    break
+
+            if self.frames:
+                offset, header = self.frames[0]
+                f.seek(offset)
+                self.first_frame = f.read(header.length)
+                tag_offset = 4 + header.side_info
+                if self.first_frame[tag_offset:tag_offset + 4] in (b'Xing', b'Info') or self.first_frame[36:40] == b'VBRI':
+                    self.frames.pop(0)
+                    if self.frames:
+                        f.seek(self.frames[0][0])
+                        self.first_frame = f.read(self.frames[0][1].length)
+        if not self.frames:
+            raise ValueError(f"{path} has no MPEG Layer III frames")
+
+    @staticmethod
+    def _sync(f, position, end):
+        """Offset of the next frame header that is followed by another one (or the end)"""
+        while position < end:
+            f.seek(position)
+            window = f.read(min(SYNC_WINDOW + 4, end - position))
+            index = window.find(b'\xff')
+            while index != -1:
+                header = parse_header(window[index:index + 4])
+                if header:
+                    candidate = position + index
+                    following = candidate + header.length
+                    if following == end:
+                        return candidate
+                    if following < end:
+                        f.seek(following)
+                        if parse_header(f.read(4)):
+                            return candidate
+                index = window.find(b'\xff', index + 1)
+            position += SYNC_WINDOW
+        return None
+
+    @property
+    def header(self):
+        return self.frames[0][1]
+
+    @property
+    def start(self):
+        return self.frames[0][0]
+
+    @property
+    def end(self):
+        offset, header = self.frames[-1]
+        return offset + header.length
+
+    @property
+    def duration(self):
+        return len(self.frames) * self.header.samples / self.header.sample_rate
+
+    def nominal_bitrate(self):
+        """Bitrate of a CBR stream, or the valid bitrate nearest a VBR stream's average, in kbps"""
+        bitrates = {header.bitrate for _, header in self.frames}
+        if len(bitrates) == 1:
+            return bitrates.pop()
+        average = (self.end - self.start) * 8 / self.duration / 1000
+        table = BITRATES[1 if self.header.version == 1 else 2][1:]
+        return min(table, key=lambda bitrate: abs(bitrate - average))
+
+
+def info_frame(template, frame_count, byte_count, toc, cbr):
+    """
+    A silent frame carrying a Xing (VBR) or Info (CBR) tag for the joined stream. It copies
+    the stream's layout and uses the stream's bitrate when the tag fits in such a frame.
+    """
+    value = (template.value | (1 << 16)) & ~(1 << 9)
+    bitrate_index = template.bitrate_index
+    while True:
+        header = FrameHeader((value & ~(0xF << 12)) | (bitrate_index << 12))
+        if header.length >= 4 + header.side_info + XING_SIZE or bitrate_index == 14:
+            break
+        bitrate_index += 1
+    if header.bitrate != template.bitrate:
+        cbr = False
+    # Byte count covers the whole stream, this frame included
+    tag = (b'Info' if cbr else b'Xing') + struct.pack('>III', XING_FLAGS, frame_count, byte_count + header.length)
+    frame = struct.pack('>I', header.value) + bytes(header.side_info) + tag + bytes(toc)
+    return frame + bytes(header.length - len(frame))
+
+
+def _copy_range(source, destination, start, length):
+    source.seek(start)
+    while length:
+        data = source.read(min(COPY_SIZE, length))
+        if not data:
+            raise ValueError(f"{source.name} ended early")
+        destination.write(data)
+        length -= len(data)
+
+
+def splice(intro, source, output_path):
+    """
+    Write ``intro`` followed by ``source`` (both MP3Streams) to ``output_path`` by copying their
+    frames behind a fresh Xing/Info frame and an empty, padded ID3v2.4 tag.
+    """
+    frames = [(offset - intro.start, header) for offset, header in intro.frames]
+    intro_length = intro.end - intro.start
+    frames += [(offset - source.start + intro_length, header) for offset, header in source.frames]
+    audio_length = intro_length + source.end - source.start
+
+    # Seek table: byte position of each percent of the duration, scaled to 0-255
+    toc = [
+        min(255, frames[len(frames) * percent // 100][0] * 256 // audio_length)
+        for percent in range(100)
+    ]
+    cbr = len({header.bitrate for _, header in frames}) == 1
+    tag_frame = info_frame(source.header, len(frames), audio_length, toc, cbr)
+
+    padding = ID3_PADDING
+    tag_size = bytes([(padding >> 21) & 0x7F, (padding >> 14) & 0x7F, (padding >> 7) & 0x7F, padding & 0x7F])
+    with open(output_path, 'wb') as output:
+        output.write(b'ID3\x04\x00\x00' + tag_size + bytes(padding))
+        output.write(tag_frame)
+        with open(intro.path, 'rb') as f:
+            _copy_range(f, output, intro.start, intro_length)
+        with open(source.path, 'rb') as f:
+            _copy_range(f, output, source.start, source.end - source.start)
+
+
+def splice_announcement(file_path):
+    """
+    Brand an MP3 by joining the pre-encoded announcement to it at a frame boundary, so no
+    audio is decoded or encoded. Returns the path of a new temporary file, or None when the
+    file is not an MP3 that can be joined and has to be transcoded instead.
+    """
+    from tts_utils import SiteAnnouncementGenerator
+
+    try:
+        source = MP3Stream(file_path)
+    except (ValueError, OSError):
+        return None
+    header = source.header
+    # A first frame borrowing from a bit reservoir would read the intro's bytes as its own
+    if header.main_data_begin(source.first_frame) != 0:
+        logger.info(f"{file_path} starts mid-reservoir; transcoding instead of splicing")
+        return None
+    if any(not header.compatible(other) for _, other in source.frames):
+        logger.info(f"{file_path} changes layout mid-stream; transcoding instead of splicing")
+        return None
+
+    try:
+        intro = MP3Stream(SiteAnnouncementGenerator().get_announcement_mp3(
+            header.sample_rate, header.channels, source.nominal_bitrate()
+        ))
+    except Exception as e:
+        logger.error(f"Encoding the announcement for splicing failed: {e}")
+        return None
+    if not intro.header.compatible(header):
+        return None
+
+    with tempfile.NamedTemporaryFile(suffix='.mp3', delete=False) as temp_file:
+        temp_path = temp_file.name
+    try:
+        splice(intro, source, temp_path)
+    except Exception:
+        os.unlink(temp_path)
+        raise
+    return temp_path
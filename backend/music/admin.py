@@ -1,5 +1,5 @@
 from django.contrib import admin
-from music.models import Artist, Genre, Album, Track, Mixtape, Compilation, UserProfile
+from music.models import Artist, Genre, Album, Track, Mixtape, MixtapeTrack, Compilation, UserProfile, ProcessingJob
 from django.contrib.auth.models import User
 
 
@@ -46,6 +46,13 @@ class TrackAdmin(admin.ModelAdmin):
     ordering = ['-download_count', '-created_at']
 
 
+class MixtapeTrackInline(admin.TabularInline):
+    model = MixtapeTrack
+    extra = 0
+    fields = ['position', 'track']
+    raw_id_fields = ['track']
+
+
 @admin.register(Mixtape)
 class MixtapeAdmin(admin.ModelAdmin):
     list_display = ['title', 'artist', 'release_date', 'download_count', 'created_at']
@@ -53,6 +60,7 @@ class MixtapeAdmin(admin.ModelAdmin):
     search_fields = ['title', 'artist__name', 'description']
     prepopulated_fields = {'slug': ('title',)}
     ordering = ['-download_count', '-created_at']
+    inlines = [MixtapeTrackInline]
 
 
 class TrackInline(admin.TabularInline):
@@ -79,3 +87,12 @@ class UserProfileAdmin(admin.ModelAdmin):
     search_fields = ['user__username', 'user__email']
     filter_horizontal = ['favorite_tracks', 'favorite_albums', 'download_history']
     ordering = ['-created_at']
+
+
+@admin.register(ProcessingJob)
+class ProcessingJobAdmin(admin.ModelAdmin):
+    list_display = ['id', 'track', 'status', 'stage', 'progress', 'attempts', 'created_at', 'finished_at']
+    list_filter = ['status', 'created_at']
+    search_fields = ['track__title', 'original_filename']
+    readonly_fields = ['stages', 'timings', 'error', 'started_at', 'heartbeat_at', 'finished_at']
+    ordering = ['-created_at']
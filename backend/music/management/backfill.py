@@ -0,0 +1,75 @@
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from audio_jobs import init_worker
+
+
+class BackfillCommand(BaseCommand):
+    """
+    Base for the backfill_* commands: runs ``worker`` once per item from ``items()``, in this
+    process or over spawned worker processes, and tallies the outcomes it returns.
+
+    Subclasses set ``noun`` (e.g. 'previews'), ``title`` (e.g. 'Preview'), ``force_help`` and
+    ``worker``, a module-level function so worker processes can unpickle it.
+    """
+    noun = ''
+    title = ''
+    unit = 'tracks'
+    force_help = ''
+    worker = None
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=settings.AUDIO_PROCESSING_WORKERS,
+                            help='Number of worker processes; 1 runs in this process')
+        parser.add_argument('--force', action='store_true', help=self.force_help)
+
+    def items(self, force):
+        """Items to run the worker on"""
+        raise NotImplementedError
+
+    def worker_args(self, item, force):
+        """Positional arguments of the worker call for one item"""
+        return (item, force)
+
+    def describe(self, item):
+        return f"Track {item}"
+
+    def report(self, item, outcome):
+        """Message to print on stderr for an outcome, or None"""
+        return 'failed' if outcome == 'failed' else None
+
+    def handle(self, *args, **options):
+        force = options['force']
+        items = self.items(force)
+
+        self.stdout.write(f"Backfilling {self.noun} for {len(items)} {self.unit}")
+        counts = {}
+
+        def record(item, outcome):
+            counts[outcome] = counts.get(outcome, 0) + 1
+            message = self.report(item, outcome)
+            if message:
+                self.stderr.write(f"{self.describe(item)}: {message}")
+
+        def run(item, call):
+            try:
+                record(item, call())
+            except Exception as e:
+                self.stderr.write(f"{self.describe(item)}: {e}")
+                record(item, 'error')
+
+        workers = max(1, options['workers'])
+        if workers == 1:
+            for item in items:
+                run(item, lambda: self.worker(*self.worker_args(item, force)))
+        else:
+            # Decoding and encoding are CPU bound, so fan out over spawned worker processes
+            context = multiprocessing.get_context('spawn')
+            with ProcessPoolExecutor(max_workers=workers, mp_context=context, initializer=init_worker) as pool:
+                futures = {pool.submit(self.worker, *self.worker_args(item, force)): item for item in items}
+                for future in as_completed(futures):
+                    run(futures[future], future.result)
+
+        summary = ', '.join(f"{count} {outcome}" for outcome, count in sorted(counts.items())) or 'nothing to do'
+        self.stdout.write(self.style.SUCCESS(f"{self.title} backfill finished: {summary}"))
@@ -0,0 +1,16 @@
+from music.models import Track
+from music.management.backfill import BackfillCommand
+from fingerprint_utils import generate_track_fingerprint
+
+
+class Command(BackfillCommand):
+    help = 'Index acoustic fingerprints for tracks that are not in the fingerprint index yet'
+    noun, title = 'fingerprints', 'Fingerprint'
+    force_help = 'Recompute fingerprints for tracks that are already indexed'
+    worker = staticmethod(generate_track_fingerprint)
+
+    def items(self, force):
+        tracks = Track.objects.exclude(audio_file='').exclude(audio_file__isnull=True)
+        if not force:
+            tracks = tracks.filter(fingerprint_hashes__isnull=True)
+        return list(tracks.values_list('id', flat=True).distinct())
@@ -0,0 +1,16 @@
+from music.models import Track
+from music.management.backfill import BackfillCommand
+from preview_utils import generate_track_preview
+
+
+class Command(BackfillCommand):
+    help = 'Encode 30-second preview clips for tracks that do not have one yet'
+    noun, title = 'previews', 'Preview'
+    force_help = 'Re-encode previews for tracks that already have them'
+    worker = staticmethod(generate_track_preview)
+
+    def items(self, force):
+        tracks = Track.objects.exclude(audio_file='').exclude(audio_file__isnull=True)
+        if not force:
+            tracks = tracks.filter(preview_file='') | tracks.filter(preview_file__isnull=True)
+        return list(tracks.values_list('id', flat=True).distinct())
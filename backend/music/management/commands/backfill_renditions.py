@@ -0,0 +1,43 @@
+from django.apps import apps
+from django.core.files.storage import default_storage
+from music.models import ImageRendition
+from music.management.backfill import BackfillCommand
+from image_utils import RENDITION_FIELDS, generate_object_renditions
+
+
+class Command(BackfillCommand):
+    help = 'Render the sized WebP/JPEG renditions of cover art, artist images and avatars that do not have them yet'
+    noun, title, unit = 'renditions', 'Rendition', 'images'
+    force_help = 'Drop existing renditions first, e.g. after changing IMAGE_RENDITIONS'
+    worker = staticmethod(generate_object_renditions)
+
+    def items(self, force):
+        # (model label, pk, field name, stored image name)
+        jobs = []
+        for model_label, field_name in RENDITION_FIELDS:
+            objects = apps.get_model(model_label).objects.exclude(**{field_name: ''}).exclude(**{f'{field_name}__isnull': True})
+            for pk, source in objects.values_list('pk', field_name):
+                jobs.append((model_label, pk, field_name, source))
+
+        if force:
+            self.drop_renditions([source for *_, source in jobs])
+        return jobs
+
+    def drop_renditions(self, sources):
+        """Delete the renditions of ``sources`` and their files, unless another image still uses a file"""
+        dropped = ImageRendition.objects.filter(source__in=sources)
+        files = set(dropped.values_list('file', flat=True))
+        dropped.delete()
+        # Names are content hashes, so identical images share rendition files
+        files -= set(ImageRendition.objects.filter(file__in=files).values_list('file', flat=True))
+        for name in files:
+            default_storage.delete(name)
+
+    def worker_args(self, job, force):
+        return job[:3]
+
+    def describe(self, job):
+        return f"{job[0]} {job[1]}"
+
+    def report(self, job, outcome):
+        return f"{job[3]} is missing" if outcome == 'missing' else None
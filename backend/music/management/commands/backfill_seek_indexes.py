@@ -0,0 +1,21 @@
+from django.db.models import Q
+from music.models import Track
+from music.management.backfill import BackfillCommand
+from seek_index import generate_track_seek_index
+
+
+class Command(BackfillCommand):
+    help = 'Build the MP3 seek index of tracks that do not have one yet'
+    noun, title = 'seek indexes', 'Seek index'
+    force_help = 'Rebuild existing indexes, e.g. after changing AUDIO_SEEK_INDEX_INTERVAL_MS'
+    worker = staticmethod(generate_track_seek_index)
+
+    def items(self, force):
+        tracks = Track.objects.exclude(Q(audio_file='') | Q(audio_file__isnull=True),
+                                       Q(optimized_file='') | Q(optimized_file__isnull=True))
+        if not force:
+            tracks = tracks.filter(seek_index__isnull=True)
+        return list(tracks.values_list('id', flat=True))
+
+    def report(self, track_id, outcome):
+        return 'audio file is missing' if outcome == 'missing' else None
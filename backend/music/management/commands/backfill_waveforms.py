@@ -0,0 +1,16 @@
+from music.models import Track
+from music.management.backfill import BackfillCommand
+from waveform_utils import generate_track_waveform
+
+
+class Command(BackfillCommand):
+    help = 'Compute waveform peak files for tracks that do not have one yet'
+    noun, title = 'waveforms', 'Waveform'
+    force_help = 'Recompute peaks for tracks that already have them'
+    worker = staticmethod(generate_track_waveform)
+
+    def items(self, force):
+        tracks = Track.objects.exclude(audio_file='').exclude(audio_file__isnull=True)
+        if not force:
+            tracks = tracks.filter(waveform='') | tracks.filter(waveform__isnull=True)
+        return list(tracks.values_list('id', flat=True).distinct())
@@ -0,0 +1,10 @@
+from django.core.management.base import BaseCommand
+from resumable_upload import expire_upload_sessions
+
+
+class Command(BaseCommand):
+    help = 'Discard resumable uploads that stopped receiving chunks, and free their preallocated spool files'
+
+    def handle(self, *args, **options):
+        count = expire_upload_sessions()
+        self.stdout.write(self.style.SUCCESS(f"Discarded {count} expired upload sessions"))
@@ -0,0 +1,79 @@
+import os
+import time
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from audio_jobs import init_worker
+from library_import import (
+    LibraryImporter, find_audio_files, read_library_file, default_checkpoint_path, load_checkpoint
+)
+
+
+class Command(BaseCommand):
+    help = 'Import every audio file under a directory as tracks, reading tags in parallel'
+
+    def add_arguments(self, parser):
+        parser.add_argument('directory', help='Root of the library to import')
+        parser.add_argument('--jobs', type=int, default=settings.AUDIO_PROCESSING_WORKERS,
+                            help='Number of worker processes reading tags; 1 runs in this process')
+        parser.add_argument('--batch-size', type=int, default=500,
+                            help='Tracks inserted per bulk_create batch')
+        parser.add_argument('--checkpoint',
+                            help='Checkpoint file recording imported paths (default: one per library in the spool dir)')
+        parser.add_argument('--restart', action='store_true',
+                            help='Ignore an existing checkpoint and import everything again')
+
+    def handle(self, *args, **options):
+        root = os.path.abspath(options['directory'])
+        if not os.path.isdir(root):
+            raise CommandError(f"Not a directory: {root}")
+
+        checkpoint_path = options['checkpoint'] or default_checkpoint_path(root)
+        if options['restart'] and os.path.exists(checkpoint_path):
+            os.unlink(checkpoint_path)
+        done = load_checkpoint(checkpoint_path)
+
+        paths = [path for path in find_audio_files(root) if path not in done]
+        self.stdout.write(f"Importing {len(paths)} files from {root} ({len(done)} already imported)")
+
+        importer = LibraryImporter(checkpoint_path)
+        batch_size = max(1, options['batch_size'])
+        jobs = max(1, options['jobs'])
+        read = partial(read_library_file, root)
+        batch = []
+        failed = 0
+        total_bytes = 0
+        started = time.monotonic()
+
+        def report(label):
+            elapsed = max(time.monotonic() - started, 1e-9)
+            processed = importer.imported + failed
+            return (f"{label}: {importer.imported} imported, {failed} failed in {elapsed:.1f}s "
+                    f"({processed / elapsed:.1f} files/s, {total_bytes / elapsed / 1e6:.1f} MB/s)")
+
+        def collect(results):
+            nonlocal failed, total_bytes
+            for result in results:
+                if 'error' in result:
+                    failed += 1
+                    self.stderr.write(f"{result['relative_path']}: {result['error']}")
+                    continue
+                total_bytes += result['size']
+                batch.append(result)
+                if len(batch) >= batch_size:
+                    importer.flush(batch)
+                    batch.clear()
+                    self.stdout.write(report('Progress'))
+
+        if jobs == 1:
+            collect(map(read, paths))
+        else:
+            # Tag reading is I/O and parse bound per file, so fan out over spawned worker processes
+            context = multiprocessing.get_context('spawn')
+            with ProcessPoolExecutor(max_workers=jobs, mp_context=context, initializer=init_worker) as pool:
+                collect(pool.map(read, paths, chunksize=32))
+
+        importer.flush(batch)
+        self.stdout.write(self.style.SUCCESS(report('Library import finished')))
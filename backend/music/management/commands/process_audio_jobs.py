@@ -0,0 +1,65 @@
+import multiprocessing
+import time
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connections
+from audio_jobs import claim_next_job, requeue_stale_jobs, run_job, mark_job_failed, init_worker
+
+
+class Command(BaseCommand):
+    help = 'Run the audio processing worker pool against the queued processing jobs'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=settings.AUDIO_PROCESSING_WORKERS,
+                            help='Number of worker processes')
+        parser.add_argument('--poll-interval', type=float, default=2.0,
+                            help='Seconds to wait between queue polls when idle')
+        parser.add_argument('--once', action='store_true',
+                            help='Drain the queue and exit instead of polling forever')
+
+    def handle(self, *args, **options):
+        workers = max(1, options['workers'])
+        poll_interval = options['poll_interval']
+
+        # Spawned workers start from a clean interpreter so they never share the parent's DB connection
+        context = multiprocessing.get_context('spawn')
+        running = {}
+
+        self.stdout.write(f"Starting audio processing worker pool with {workers} workers")
+
+        with ProcessPoolExecutor(max_workers=workers, mp_context=context, initializer=init_worker) as pool:
+            try:
+                while True:
+                    requeued, failed = requeue_stale_jobs()
+                    if requeued or failed:
+                        self.stdout.write(f"Requeued {requeued} stale jobs, failed {failed}")
+
+                    while len(running) < workers:
+                        job = claim_next_job()
+                        if job is None:
+                            break
+                        self.stdout.write(f"Processing job {job.pk} for track {job.track_id}")
+                        running[pool.submit(run_job, job.pk)] = job.pk
+
+                    if not running:
+                        if options['once']:
+                            break
+                        connections.close_all()
+                        time.sleep(poll_interval)
+                        continue
+
+                    done, _ = wait(list(running), timeout=poll_interval, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        job_id = running.pop(future)
+                        try:
+                            status = future.result()
+                            self.stdout.write(f"Job {job_id} finished: {status}")
+                        except Exception as e:
+                            self.stderr.write(f"Job {job_id} crashed: {e}")
+                            mark_job_failed(job_id, f"Worker crashed: {e}")
+
+            except KeyboardInterrupt:
+                self.stdout.write('Stopping worker pool')
+
+        self.stdout.write(self.style.SUCCESS('Audio processing worker pool stopped'))
@@ -0,0 +1,23 @@
+import os
+from django.core.management.base import BaseCommand
+from music.models import Track
+from hls_utils import hls_root, prune_hls_versions
+
+
+class Command(BaseCommand):
+    help = 'Remove superseded HLS versions once the grace period for players still streaming them has passed'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--grace', type=int, default=None,
+                            help='Seconds a superseded version is kept (default: AUDIO_HLS_RETAIN_SECONDS)')
+
+    def handle(self, *args, **options):
+        parent = os.path.dirname(hls_root(0))
+        track_ids = [int(entry) for entry in os.listdir(parent) if entry.isdigit()] if os.path.isdir(parent) else []
+        # Only committed playlists are read here, so a version is never pruned before its replacement is saved
+        playlists = dict(Track.objects.filter(id__in=track_ids).values_list('id', 'hls_playlist'))
+
+        removed = 0
+        for track_id in track_ids:
+            removed += len(prune_hls_versions(track_id, playlists.get(track_id), options['grace']))
+        self.stdout.write(self.style.SUCCESS(f"Removed {removed} HLS versions from {len(track_ids)} tracks"))
@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+from tts_utils import SiteAnnouncementGenerator, COMMON_LAYOUTS
+
+
+class Command(BaseCommand):
+    help = 'Pre-render the site announcement for common sample rates and channel layouts'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--voice', default='female', help='Announcement voice type')
+
+    def handle(self, *args, **options):
+        generator = SiteAnnouncementGenerator()
+
+        for frame_rate, channels in COMMON_LAYOUTS:
+            announcement = generator.get_announcement(
+                voice_type=options['voice'],
+                frame_rate=frame_rate,
+                channels=channels
+            )
+            self.stdout.write(f"Rendered {frame_rate} Hz / {channels} ch announcement ({len(announcement)} ms)")
+
+        self.stdout.write(self.style.SUCCESS('Announcement cache is ready'))
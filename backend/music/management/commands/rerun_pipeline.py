@@ -0,0 +1,42 @@
+import json
+from django.core.management.base import BaseCommand, CommandError
+from music.models import Track
+from audio_jobs import enqueue_track_processing
+from audio_pipeline import PipelineCache, default_profile, merge_profile, runs_without_source
+
+
+class Command(BaseCommand):
+    help = 'Queue processed tracks to run through the audio pipeline again with a changed profile'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--profile', default='{}',
+                            help='JSON overrides per stage, e.g. \'{"optimize": {"bitrate": "256k"}}\'')
+        parser.add_argument('--track', type=int, action='append', dest='tracks',
+                            help='Track id to rerun; repeat for several (default: every processed track)')
+
+    def handle(self, *args, **options):
+        try:
+            overrides = json.loads(options['profile'])
+            profile = merge_profile(default_profile(), overrides)
+        except ValueError as e:
+            raise CommandError(f"Invalid profile: {e}")
+
+        tracks = Track.objects.filter(is_processed=True).order_by('id')
+        if options['tracks']:
+            tracks = tracks.filter(id__in=options['tracks'])
+
+        # The upload is usually deleted after processing, so the stages reading it must be cached
+        cache = PipelineCache()
+        queued = skipped = 0
+        for track in tracks:
+            if not track.content_hash:
+                reason = 'no content hash'
+            elif not runs_without_source(track.content_hash, profile, cache):
+                reason = 'the stages reading the upload are not cached for this profile'
+            else:
+                enqueue_track_processing(track, '', track.original_filename, options={'profile': overrides})
+                queued += 1
+                continue
+            self.stdout.write(f"Track {track.id}: skipped, {reason}")
+            skipped += 1
+        self.stdout.write(self.style.SUCCESS(f"Queued {queued} tracks, skipped {skipped}"))
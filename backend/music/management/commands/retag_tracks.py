@@ -0,0 +1,69 @@
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from music.models import Track
+from audio_jobs import init_worker
+from audio_utils import retag_stored_tracks
+
+
+class Command(BaseCommand):
+    help = 'Rewrite the ID3 metadata and branding frames of processed tracks in place, without re-encoding'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=settings.AUDIO_PROCESSING_WORKERS,
+                            help='Number of worker processes; 1 runs in this process')
+        parser.add_argument('--batch-size', type=int, default=500,
+                            help='Tracks handed to a worker at a time')
+        parser.add_argument('--force', action='store_true',
+                            help='Rewrite tags that already match, e.g. to refresh PROCESSED_AT')
+
+    def handle(self, *args, **options):
+        # Everything a worker needs comes from one query, so workers never touch the database
+        tracks = (
+            Track.objects.filter(is_processed=True, has_site_branding=True)
+            .exclude(audio_file='').exclude(audio_file__isnull=True)
+            .order_by('id')
+            .values_list('id', 'audio_file', 'title', 'album__title', 'artist__name')
+        )
+        # Identical uploads share the processed file of the first one; tag it once, as that track
+        owners = {}
+        for row in tracks:
+            owners.setdefault(row[1], row)
+        rows = list(owners.values())
+        batch_size = max(1, options['batch_size'])
+        batches = [rows[start:start + batch_size] for start in range(0, len(rows), batch_size)]
+
+        self.stdout.write(f"Retagging {len(rows)} tracks")
+        counts = {}
+
+        def record(outcomes):
+            for track_id, outcome in outcomes:
+                counts[outcome] = counts.get(outcome, 0) + 1
+                if outcome in ('missing', 'failed'):
+                    self.stderr.write(f"Track {track_id}: {outcome}")
+
+        def record_error(batch, error):
+            self.stderr.write(f"Tracks {batch[0][0]}-{batch[-1][0]}: {error}")
+            counts['error'] = counts.get('error', 0) + len(batch)
+
+        workers = max(1, options['workers'])
+        if workers == 1:
+            for batch in batches:
+                try:
+                    record(retag_stored_tracks(batch, options['force']))
+                except Exception as e:
+                    record_error(batch, e)
+        else:
+            # Tag rewrites are small, so batches keep per-task overhead below the I/O itself
+            context = multiprocessing.get_context('spawn')
+            with ProcessPoolExecutor(max_workers=workers, mp_context=context, initializer=init_worker) as pool:
+                futures = {pool.submit(retag_stored_tracks, batch, options['force']): batch for batch in batches}
+                for future in as_completed(futures):
+                    try:
+                        record(future.result())
+                    except Exception as e:
+                        record_error(futures[future], e)
+
+        summary = ', '.join(f"{count} {outcome}" for outcome, count in sorted(counts.items())) or 'nothing to do'
+        self.stdout.write(self.style.SUCCESS(f"Retag finished: {summary}"))
@@ -0,0 +1,18 @@
+# Generated by Django 6.0 on 2026-10-16 11:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('music', '0005_processingjob'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='track',
+            name='play_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 6.0 on 2026-10-16 11:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('music', '0006_track_play_count'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='track',
+            name='hls_playlist',
+            field=models.CharField(blank=True, max_length=500),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 6.0 on 2026-10-16 12:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('music', '0007_track_hls_playlist'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='track',
+            name='waveform',
+            field=models.FileField(blank=True, null=True, upload_to='tracks/waveforms/'),
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 6.0 on 2026-10-16 12:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('music', '0008_track_waveform'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='track',
+            name='loudness_integrated',
+            field=models.FloatField(blank=True, help_text='Integrated loudness in LUFS', null=True),
+        ),
+        migrations.AddField(
+            model_name='track',
+            name='loudness_range',
+            field=models.FloatField(blank=True, help_text='Loudness range in LU', null=True),
+        ),
+        migrations.AddField(
+            model_name='track',
+            name='true_peak',
+            field=models.FloatField(blank=True, help_text='True peak in dBTP', null=True),
+        ),
+        migrations.AddField(
+            model_name='track',
+            name='replaygain_track_gain',
+            field=models.FloatField(blank=True, help_text='ReplayGain track gain in dB', null=True),
+        ),
+    ]
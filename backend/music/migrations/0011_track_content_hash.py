@@ -0,0 +1,18 @@
+# Generated by Django 6.0 on 2026-10-16 13:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('music', '0010_track_probe_fields'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='track',
+            name='content_hash',
+            field=models.CharField(blank=True, db_index=True, help_text='SHA-256 of the uploaded file', max_length=64),
+        ),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 6.0 on 2026-10-16 14:10
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('music', '0011_track_content_hash'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FingerprintHash',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('hash', models.IntegerField()),
+                ('offset', models.IntegerField()),
+                ('track', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='fingerprint_hashes', to='music.track')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['hash'], name='music_finge_hash_aeab67_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 6.0 on 2026-10-16 15:20
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('music', '0013_uploadsession_uploadchunk'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MixtapeTrack',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('position', models.PositiveIntegerField(default=0)),
+                ('mixtape', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='mixtape_tracks', to='music.mixtape')),
+                ('track', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='mixtape_entries', to='music.track')),
+            ],
+            options={
+                'ordering': ['position'],
+            },
+        ),
+        migrations.AddField(
+            model_name='mixtape',
+            name='tracks',
+            field=models.ManyToManyField(blank=True, related_name='mixtapes', through='music.MixtapeTrack', to='music.track'),
+        ),
+    ]
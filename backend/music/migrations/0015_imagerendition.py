@@ -0,0 +1,29 @@
+# Generated by Django 6.0 on 2026-10-16 16:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('music', '0014_mixtapetrack'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ImageRendition',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('source', models.CharField(db_index=True, max_length=500)),
+                ('rendition', models.CharField(max_length=20)),
+                ('format', models.CharField(max_length=10)),
+                ('file', models.FileField(upload_to='renditions/')),
+                ('width', models.PositiveIntegerField()),
+                ('height', models.PositiveIntegerField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'unique_together': {('source', 'rendition', 'format')},
+            },
+        ),
+    ]
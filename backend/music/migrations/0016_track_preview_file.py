@@ -0,0 +1,18 @@
+# Generated by Django 6.0 on 2026-10-16 16:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('music', '0015_imagerendition'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='track',
+            name='preview_file',
+            field=models.FileField(blank=True, null=True, upload_to='tracks/previews/'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 6.0 on 2026-10-16 17:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('music', '0016_track_preview_file'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='track',
+            name='seek_index',
+            field=models.BinaryField(blank=True, help_text='Packed time-to-byte table of the streamed file (see seek_index.py)', null=True),
+        ),
+    ]
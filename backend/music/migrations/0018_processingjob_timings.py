@@ -0,0 +1,18 @@
+# Generated by Django 6.0 on 2026-10-16 17:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('music', '0017_track_seek_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='processingjob',
+            name='timings',
+            field=models.JSONField(blank=True, default=dict, help_text='Seconds spent per stage, and whether pipeline stages came from the cache'),
+        ),
+    ]
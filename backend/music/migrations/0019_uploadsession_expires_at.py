@@ -0,0 +1,26 @@
+# Generated by Django 6.0 on 2026-10-16 18:00
+
+from datetime import timedelta
+from django.db import migrations, models
+from django.db.models import F
+
+
+def expire_open_sessions(apps, schema_editor):
+    UploadSession = apps.get_model('music', 'UploadSession')
+    UploadSession.objects.filter(finalized_at__isnull=True).update(expires_at=F('created_at') + timedelta(days=1))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('music', '0018_processingjob_timings'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='uploadsession',
+            name='expires_at',
+            field=models.DateTimeField(blank=True, db_index=True, help_text='Unfinished sessions are discarded after this', null=True),
+        ),
+        migrations.RunPython(expire_open_sessions, migrations.RunPython.noop),
+    ]
@@ -1,3 +1,4 @@
+import os
 from django.db import models
 from django.contrib.auth.models import User
 from django.urls import reverse
@@ -99,6 +100,13 @@ class Track(models.Model):
     bitrate = models.CharField(max_length=10, default='320KBPS')
     format = models.CharField(max_length=10, default='MP3')
     is_explicit = models.BooleanField(default=False)
+    duration_ms = models.PositiveIntegerField(null=True, blank=True)
+    bitrate_kbps = models.PositiveIntegerField(null=True, blank=True)
+    sample_rate = models.PositiveIntegerField(null=True, blank=True)
+    channels = models.PositiveSmallIntegerField(null=True, blank=True)
+    codec = models.CharField(max_length=20, blank=True)
+    file_size_bytes = models.BigIntegerField(null=True, blank=True)
+    content_hash = models.CharField(max_length=64, blank=True, db_index=True, help_text='Block SHA-256 of the uploaded file (see audio_jobs.BlockHasher)')
     
     original_filename = models.CharField(max_length=500, blank=True)
     extracted_title = models.CharField(max_length=300, blank=True)
@@ -114,8 +122,17 @@ class Track(models.Model):
     
     is_optimized = models.BooleanField(default=False)
     optimized_file = models.FileField(upload_to='tracks/optimized/', blank=True, null=True)
+    hls_playlist = models.CharField(max_length=500, blank=True)
+    waveform = models.FileField(upload_to='tracks/waveforms/', blank=True, null=True)
+    preview_file = models.FileField(upload_to='tracks/previews/', blank=True, null=True)
+    seek_index = models.BinaryField(null=True, blank=True, help_text='Packed time-to-byte table of the streamed file (see seek_index.py)')
+    loudness_integrated = models.FloatField(null=True, blank=True, help_text='Integrated loudness in LUFS')
+    loudness_range = models.FloatField(null=True, blank=True, help_text='Loudness range in LU')
+    true_peak = models.FloatField(null=True, blank=True, help_text='True peak in dBTP')
+    replaygain_track_gain = models.FloatField(null=True, blank=True, help_text='ReplayGain track gain in dB')
     
     download_count = models.PositiveIntegerField(default=0)
+    play_count = models.PositiveIntegerField(default=0)
     likes_count = models.PositiveIntegerField(default=0)
     comments_count = models.PositiveIntegerField(default=0)
     created_at = models.DateTimeField(auto_now_add=True)
@@ -142,6 +159,15 @@ class Track(models.Model):
     def get_absolute_url(self):
         return reverse('track-detail', kwargs={'slug': self.slug})
 
+    def stream_path(self):
+        """Path of the file the stream endpoint plays: the streaming-optimized rendition when it is on disk"""
+        for audio in (self.optimized_file, self.audio_file):
+            if audio:
+                path = os.path.join(settings.MEDIA_ROOT, audio.name)
+                if os.path.exists(path):
+                    return path
+        return None
+
 
 class Mixtape(models.Model):
     title = models.CharField(max_length=300)
@@ -150,6 +176,7 @@ class Mixtape(models.Model):
     cover_art = models.ImageField(upload_to='mixtapes/', blank=True, null=True)
     description = models.TextField(blank=True)
     release_date = models.DateField(null=True, blank=True)
+    tracks = models.ManyToManyField(Track, through='MixtapeTrack', related_name='mixtapes', blank=True)
     download_count = models.PositiveIntegerField(default=0)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
@@ -157,6 +184,11 @@ class Mixtape(models.Model):
     class Meta:
         ordering = ['-created_at']
 
+    @property
+    def tracklist(self):
+        """Tracks in mix order"""
+        return [entry.track for entry in self.mixtape_tracks.select_related('track__artist').order_by('position')]
+
     def save(self, *args, **kwargs):
         if not self.slug:
             base_slug = slugify(f"{self.artist.name}-{self.title}")
@@ -175,6 +207,19 @@ class Mixtape(models.Model):
         return reverse('mixtape-detail', kwargs={'slug': self.slug})
 
 
+class MixtapeTrack(models.Model):
+    """A track's place in a mixtape's running order"""
+    mixtape = models.ForeignKey(Mixtape, on_delete=models.CASCADE, related_name='mixtape_tracks')
+    track = models.ForeignKey(Track, on_delete=models.CASCADE, related_name='mixtape_entries')
+    position = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        ordering = ['position']
+
+    def __str__(self):
+        return f"{self.mixtape} #{self.position}: {self.track}"
+
+
 class Compilation(models.Model):
     title = models.CharField(max_length=300)
     slug = models.SlugField(max_length=300, unique=True, blank=True)
@@ -366,3 +411,4 @@ class Notification(models.Model):
 
 
 from .models_playlists import Playlist
+from .models_processing import ProcessingJob, FingerprintHash, UploadSession, UploadChunk, ImageRendition
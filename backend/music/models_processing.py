@@ -0,0 +1,108 @@
+import uuid
+from django.db import models
+from django.contrib.auth.models import User
+
+
+class ProcessingJob(models.Model):
+    STATUS_QUEUED = 'queued'
+    STATUS_RUNNING = 'running'
+    STATUS_DONE = 'done'
+    STATUS_FAILED = 'failed'
+
+    STATUS_CHOICES = [
+        (STATUS_QUEUED, 'Queued'),
+        (STATUS_RUNNING, 'Running'),
+        (STATUS_DONE, 'Done'),
+        (STATUS_FAILED, 'Failed'),
+    ]
+
+    track = models.ForeignKey('Track', on_delete=models.CASCADE, related_name='processing_jobs')
+    user = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, related_name='processing_jobs')
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=STATUS_QUEUED)
+    stage = models.CharField(max_length=50, blank=True)
+    progress = models.PositiveSmallIntegerField(default=0)
+    stages = models.JSONField(default=dict, blank=True)
+    timings = models.JSONField(default=dict, blank=True, help_text='Seconds spent per stage, and whether pipeline stages came from the cache')
+    source_path = models.CharField(max_length=500)
+    original_filename = models.CharField(max_length=500, blank=True)
+    options = models.JSONField(default=dict, blank=True)
+    error = models.TextField(blank=True)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    heartbeat_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ['created_at']
+        indexes = [
+            models.Index(fields=['status', 'created_at']),
+        ]
+
+    def __str__(self):
+        return f"Processing job {self.pk} for {self.track_id} ({self.status})"
+
+
+class FingerprintHash(models.Model):
+    """One landmark of a track's acoustic fingerprint; the table is an inverted index keyed by hash"""
+    track = models.ForeignKey('Track', on_delete=models.CASCADE, related_name='fingerprint_hashes')
+    hash = models.IntegerField()
+    offset = models.IntegerField()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['hash']),
+        ]
+
+    def __str__(self):
+        return f"Fingerprint hash {self.hash} of {self.track_id} at {self.offset}"
+
+
+class UploadSession(models.Model):
+    """A resumable upload: chunks are written into a preallocated spool file until it is finalized"""
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='upload_sessions')
+    filename = models.CharField(max_length=500)
+    content_type = models.CharField(max_length=100)
+    size = models.BigIntegerField()
+    spool_path = models.CharField(max_length=500)
+    track = models.ForeignKey('Track', on_delete=models.SET_NULL, null=True, blank=True, related_name='upload_sessions')
+    created_at = models.DateTimeField(auto_now_add=True)
+    finalized_at = models.DateTimeField(null=True, blank=True)
+    expires_at = models.DateTimeField(null=True, blank=True, db_index=True, help_text='Unfinished sessions are discarded after this')
+
+    def __str__(self):
+        return f"Upload {self.pk} of {self.filename} ({self.size} bytes)"
+
+
+class UploadChunk(models.Model):
+    """A received byte range of an upload session with the digests of the hash blocks it covers"""
+    session = models.ForeignKey(UploadSession, on_delete=models.CASCADE, related_name='chunks')
+    offset = models.BigIntegerField()
+    length = models.PositiveIntegerField()
+    block_digests = models.JSONField(default=list)
+    received_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        unique_together = ('session', 'offset')
+        ordering = ['offset']
+
+    def __str__(self):
+        return f"Chunk of upload {self.session_id} at {self.offset} ({self.length} bytes)"
+
+
+class ImageRendition(models.Model):
+    """A resized, re-encoded copy of an uploaded image, stored under a name hashed from its bytes"""
+    source = models.CharField(max_length=500, db_index=True)
+    rendition = models.CharField(max_length=20)
+    format = models.CharField(max_length=10)
+    file = models.FileField(upload_to='renditions/')
+    width = models.PositiveIntegerField()
+    height = models.PositiveIntegerField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        unique_together = ('source', 'rendition', 'format')
+
+    def __str__(self):
+        return f"{self.rendition} {self.format} rendition of {self.source} ({self.width}x{self.height})"
@@ -2,6 +2,10 @@ from django.db.models.signals import post_save
 from django.dispatch import receiver
 from django.contrib.auth.models import User
 from music.models import UserProfile
+from image_utils import RENDITION_FIELDS, ensure_renditions
+import logging
+
+logger = logging.getLogger(__name__)
 
 
 @receiver(post_save, sender=User)
@@ -16,3 +20,19 @@ def save_user_profile(sender, instance, **kwargs):
         instance.userprofile.save()
     except UserProfile.DoesNotExist:
         UserProfile.objects.create(user=instance)
+
+
+def render_image_renditions(sender, instance, **kwargs):
+    """Render renditions of a newly uploaded image; a no-op query when they already exist"""
+    image_field = getattr(instance, dict(RENDITION_FIELDS)[sender._meta.label])
+    if not image_field:
+        return
+    try:
+        ensure_renditions(image_field)
+    except Exception as e:
+        # backfill_renditions renders them later; never fail the save for them
+        logger.error(f"Rendering renditions of {image_field.name} failed: {e}")
+
+
+for model_label, _ in RENDITION_FIELDS:
+    post_save.connect(render_image_renditions, sender=model_label, dispatch_uid=f'renditions-{model_label}')
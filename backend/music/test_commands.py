@@ -0,0 +1,243 @@
+import io
+import os
+import wave
+import shutil
+import pytest
+from django.core.management import call_command
+from mutagen.id3 import TIT2, TPE1, TALB, TCON, TRCK
+from mutagen.wave import WAVE
+from django.core.files.base import ContentFile
+from PIL import Image
+from music.models import Artist, Album, Genre, Track, ImageRendition
+
+
+def write_wav(path, tags=None):
+    """Write a short silent WAV, optionally with ID3 tags"""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with wave.open(str(path), 'wb') as wav:
+        wav.setnchannels(2)
+        wav.setsampwidth(2)
+        wav.setframerate(44100)
+        wav.writeframes(bytes(4 * 44100))
+    if tags:
+        audio = WAVE(str(path))
+        audio.add_tags()
+        for frame in tags:
+            audio.tags.add(frame)
+        audio.save()
+
+
+@pytest.fixture
+def library(settings, tmp_path):
+    """A small library tree and a temporary media root"""
+    settings.MEDIA_ROOT = str(tmp_path / 'media')
+    root = tmp_path / 'library'
+    for number in (1, 2):
+        write_wav(root / 'Label Artist' / f'{number:02d}.wav', [
+            TIT2(encoding=3, text=f'Song {number}'),
+            TPE1(encoding=3, text='Label Artist'),
+            TALB(encoding=3, text='Label Album'),
+            TCON(encoding=3, text='Amapiano'),
+            TRCK(encoding=3, text=f'{number}/2'),
+        ])
+    write_wav(root / 'loose' / 'untagged.wav')
+    (root / 'loose' / 'cover.jpg').write_bytes(b'not audio')
+    return root
+
+
+@pytest.mark.django_db
+@pytest.mark.integration
+class TestImportLibrary:
+    """Test the import_library management command"""
+
+    def _import(self, library, tmp_path):
+        output = io.StringIO()
+        call_command('import_library', str(library), jobs=1, batch_size=2,
+                     checkpoint=str(tmp_path / 'import.checkpoint'), stdout=output, stderr=io.StringIO())
+        return output.getvalue()
+
+    def test_import_resolves_related_rows(self, library, tmp_path):
+        """Test tags become shared artist, album and genre rows"""
+        output = self._import(library, tmp_path)
+        assert 'Importing 3 files' in output
+        assert 'files/s' in output and 'MB/s' in output
+
+        assert Track.objects.count() == 3
+        assert Album.objects.get().title == 'Label Album'
+        assert Genre.objects.get().name == 'Amapiano'
+        assert set(Artist.objects.values_list('name', flat=True)) == {'Label Artist', 'Unknown Artist'}
+
+        track = Track.objects.get(title='Song 2')
+        assert track.track_number == 2
+        assert track.slug == 'label-artist-song-2'
+        assert track.codec == 'pcm'
+        assert track.duration_ms == 1000
+        assert track.audio_file.name.startswith('tracks/imported/')
+        assert Track.objects.get(original_filename='untagged.wav').title == 'untagged'
+
+    def test_import_resumes_from_checkpoint(self, library, tmp_path):
+        """Test a second run skips files that were already imported"""
+        self._import(library, tmp_path)
+        write_wav(library / 'late.wav')
+
+        output = self._import(library, tmp_path)
+        assert 'Importing 1 files from' in output
+        assert Track.objects.count() == 4
+
+
+@pytest.mark.django_db
+@pytest.mark.integration
+class TestBackfillRenditions:
+    """Test the backfill_renditions management command"""
+
+    def test_backfill_renders_missing_renditions(self, settings, tmp_path):
+        """Test images without renditions get them and up-to-date ones are skipped"""
+        settings.MEDIA_ROOT = str(tmp_path)
+        artist = Artist.objects.create(name='Backfill Artist')
+        album = Album.objects.create(title='Backfill Album', artist=artist)
+        buffer = io.BytesIO()
+        Image.new('RGB', (900, 900), (10, 120, 60)).save(buffer, 'JPEG')
+        album.cover_art.save('cover.jpg', ContentFile(buffer.getvalue()))
+        ImageRendition.objects.all().delete()
+
+        output = io.StringIO()
+        call_command('backfill_renditions', workers=1, stdout=output, stderr=io.StringIO())
+        assert '1 generated' in output.getvalue()
+        assert ImageRendition.objects.filter(source=album.cover_art.name).count() == 6
+
+        output = io.StringIO()
+        call_command('backfill_renditions', workers=1, stdout=output, stderr=io.StringIO())
+        assert '1 skipped' in output.getvalue()
+
+    def test_force_removes_replaced_files(self, settings, tmp_path):
+        """Test a forced run deletes the files of the renditions it drops"""
+        settings.MEDIA_ROOT = str(tmp_path)
+        settings.IMAGE_RENDITIONS = {'thumbnail': 200, 'card': 480}
+        artist = Artist.objects.create(name='Forced Artist')
+        album = Album.objects.create(title='Forced Album', artist=artist)
+        buffer = io.BytesIO()
+        Image.new('RGB', (900, 900), (10, 120, 60)).save(buffer, 'JPEG')
+        album.cover_art.save('cover.jpg', ContentFile(buffer.getvalue()))
+        old = {row.file.path for row in ImageRendition.objects.all()}
+
+        settings.IMAGE_RENDITIONS = {'thumbnail': 160, 'card': 400}
+        call_command('backfill_renditions', workers=1, force=True, stdout=io.StringIO(), stderr=io.StringIO())
+        new = {row.file.path for row in ImageRendition.objects.all()}
+        assert len(new) == 4 and not old & new
+        assert all(os.path.exists(path) for path in new)
+        assert not any(os.path.exists(path) for path in old)
+
+
+@pytest.mark.django_db
+@pytest.mark.integration
+class TestBackfillPreviews:
+    """Test the backfill_previews management command"""
+
+    @pytest.mark.skipif(shutil.which('ffmpeg') is None, reason='ffmpeg is required to encode previews')
+    def test_backfill_encodes_missing_previews(self, settings, tmp_path):
+        """Test tracks without a preview get one from their loudest stretch"""
+        import numpy as np
+        from pydub.generators import Sine
+        from api.serializers import TrackSerializer
+        from probe_utils import probe_audio
+        from stream_utils import PCMDecoder
+
+        settings.MEDIA_ROOT = str(tmp_path)
+        quiet = Sine(220).to_audio_segment(duration=20000, volume=-40)
+        loud = Sine(440).to_audio_segment(duration=30000, volume=-6)
+        source = tmp_path / 'source.wav'
+        (quiet + loud + quiet).export(str(source), format='wav')
+
+        artist = Artist.objects.create(name='Preview Artist')
+        track = Track.objects.create(title='Preview Song', artist=artist)
+        track.audio_file.save('preview.wav', ContentFile(source.read_bytes()))
+
+        output = io.StringIO()
+        call_command('backfill_previews', workers=1, stdout=output, stderr=io.StringIO())
+        assert '1 generated' in output.getvalue()
+
+        track.refresh_from_db()
+        assert track.preview_file.name.startswith('tracks/previews/')
+        assert abs(probe_audio(track.preview_file.path)['duration_ms'] - 30000) < 200
+        # The middle of the clip sits in the loud section
+        samples = np.concatenate(list(PCMDecoder(track.preview_file.path, 44100)))
+        middle = samples[10 * 44100:20 * 44100].astype(np.float64)
+        assert 20 * np.log10(np.sqrt(np.mean(middle ** 2)) / 32768) > -15
+        assert TrackSerializer(track).data['preview_url'].endswith('.mp3')
+
+
+@pytest.mark.django_db
+@pytest.mark.integration
+class TestRetagTracks:
+    """Test the retag_tracks management command"""
+
+    @pytest.mark.skipif(shutil.which('ffmpeg') is None, reason='ffmpeg is required to encode MP3')
+    def test_retag_rewrites_only_stale_tags(self, settings, tmp_path):
+        """Test processed tracks are retagged once and shared files are tagged as their first track"""
+        from pydub.generators import Sine
+        from mutagen.mp3 import MP3
+        from mutagen.id3 import TXXX
+
+        settings.MEDIA_ROOT = str(tmp_path)
+        source = tmp_path / 'source.mp3'
+        Sine(440).to_audio_segment(duration=2000, volume=-12).export(str(source), format='mp3')
+
+        artist = Artist.objects.create(name='Retag Artist')
+        first = Track.objects.create(title='First', artist=artist, is_processed=True, has_site_branding=True)
+        first.audio_file.save('first.mp3', ContentFile(source.read_bytes()))
+        copy = Track.objects.create(title='Copy', artist=artist, is_processed=True, has_site_branding=True,
+                                    audio_file=first.audio_file.name)
+        second = Track.objects.create(title='Second', artist=artist, is_processed=True, has_site_branding=True)
+        second.audio_file.save('second.mp3', ContentFile(source.read_bytes()))
+        # Stale branding from before a rename
+        audio = MP3(second.audio_file.path)
+        audio.tags.add(TXXX(encoding=3, desc='BRAND', text='Old Name'))
+        audio.save()
+        unprocessed = Track.objects.create(title='Raw', artist=artist)
+        unprocessed.audio_file.save('raw.mp3', ContentFile(source.read_bytes()))
+
+        output = io.StringIO()
+        call_command('retag_tracks', workers=1, batch_size=1, stdout=output, stderr=io.StringIO())
+        assert 'Retagging 2 tracks' in output.getvalue()
+        assert '2 retagged' in output.getvalue()
+
+        tags = MP3(first.audio_file.path).tags
+        assert tags['TIT2'].text == ['First']
+        assert tags['TPE1'].text == ['Retag Artist']
+        assert MP3(second.audio_file.path).tags['TXXX:BRAND'].text == ['Ghettoselebu - Your Music Platform']
+        assert 'TXXX:BRAND' not in MP3(unprocessed.audio_file.path).tags
+        assert copy.audio_file.name == first.audio_file.name
+
+        output = io.StringIO()
+        call_command('retag_tracks', workers=1, stdout=output, stderr=io.StringIO())
+        assert '2 current' in output.getvalue()
+
+
+@pytest.mark.django_db
+@pytest.mark.integration
+class TestBackfillSeekIndexes:
+    """Test the backfill_seek_indexes management command"""
+
+    def test_backfill_indexes_mp3_tracks(self, settings, tmp_path):
+        """Test MP3 tracks get an index and other files are reported as unsupported"""
+        from seek_index import decode_seek_index
+
+        settings.MEDIA_ROOT = str(tmp_path)
+        settings.AUDIO_SEEK_INDEX_INTERVAL_MS = 1000
+        artist = Artist.objects.create(name='Seek Artist')
+        mp3 = Track.objects.create(title='Seekable', artist=artist)
+        # Ten seconds of empty 128 kbps frames
+        mp3.audio_file.save('seekable.mp3', ContentFile((b'\xff\xfb\x90\x64' + bytes(413)) * 383))
+        wav = Track.objects.create(title='Raw', artist=artist)
+        write_wav(tmp_path / 'raw.wav')
+        wav.audio_file.name = 'raw.wav'
+        wav.save()
+
+        output = io.StringIO()
+        call_command('backfill_seek_indexes', workers=1, stdout=output, stderr=io.StringIO())
+        assert '1 generated, 1 unsupported' in output.getvalue()
+
+        mp3.refresh_from_db()
+        interval, length, offsets = decode_seek_index(mp3.seek_index)
+        assert (interval, length, len(offsets)) == (1000, 383 * 417, 11)
+        assert offsets[1] == 38 * 417
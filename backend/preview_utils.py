@@ -0,0 +1,138 @@
+import os
+import hashlib
+import subprocess
+import tempfile
+import numpy as np
+from django.conf import settings
+from django.core.files.base import ContentFile
+from stream_utils import PCMDecoder, stream_block_frames, STREAM_SAMPLE_RATE
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Energy is measured over windows of this length; the clip start is chosen on this grid
+ENERGY_WINDOW_SECONDS = 0.5
+
+
+class EnergyAccumulator:
+    """
+    Mean-square energy of consecutive fixed-length windows of PCM fed in blocks.
+    Only the sum for the window in progress is carried between blocks.
+    """
+
+    def __init__(self, sample_rate, window_seconds=ENERGY_WINDOW_SECONDS):
+        self.window = max(1, int(sample_rate * window_seconds))
+        self.window_seconds = self.window / sample_rate
+        self.frame_count = 0
+        self._energy = []
+        self._carry = 0.0
+        self._carry_frames = 0
+
+    def feed(self, samples):
+        """Add a (frames, channels) block of integer or float samples"""
+        samples = np.asarray(samples, dtype=np.float64)
+        if samples.ndim == 1:
+            samples = samples[:, None]
+        self.frame_count += len(samples)
+        power = np.square(samples).mean(axis=1)
+
+        head = min(len(power), self.window - self._carry_frames)
+        self._carry += power[:head].sum()
+        self._carry_frames += head
+        if self._carry_frames < self.window:
+            return
+        self._energy.append(self._carry / self.window)
+
+        rest = power[head:]
+        whole = len(rest) - len(rest) % self.window
+        self._energy.extend(rest[:whole].reshape(-1, self.window).mean(axis=1))
+        self._carry = rest[whole:].sum()
+        self._carry_frames = len(rest) - whole
+
+    def result(self):
+        """Energy per window; a trailing partial window counts as its mean"""
+        energy = list(self._energy)
+        if self._carry_frames:
+            energy.append(self._carry / self._carry_frames)
+        return np.asarray(energy, dtype=np.float64)
+
+
+def pick_preview_start(energy, window_seconds, clip_seconds, skip_seconds=0.0):
+    """
+    Start (in seconds) of the ``clip_seconds`` span with the most energy, beginning no
+    earlier than ``skip_seconds``. Loud, dense passages such as a chorus win over
+    intros and breakdowns. Short tracks start at ``skip_seconds``.
+    """
+    first = int(np.ceil(skip_seconds / window_seconds))
+    span = max(1, int(round(clip_seconds / window_seconds)))
+    energy = np.asarray(energy, dtype=np.float64)[first:]
+    if len(energy) <= span:
+        return first * window_seconds
+    totals = np.cumsum(np.concatenate([[0.0], energy]))
+    best = int(np.argmax(totals[span:] - totals[:-span]))
+    return (first + best) * window_seconds
+
+
+def encode_preview(source_path, start, duration=None, bitrate=None, fade_ms=None):
+    """
+    Cut ``duration`` seconds from ``start`` out of ``source_path`` as a small mono MP3 with
+    fades at both ends. Returns a content-named (name, ContentFile) pair.
+    """
+    duration = duration or settings.AUDIO_PREVIEW_SECONDS
+    bitrate = bitrate or settings.AUDIO_PREVIEW_BITRATE
+    fade = (settings.AUDIO_PREVIEW_FADE_MS if fade_ms is None else fade_ms) / 1000
+    with tempfile.NamedTemporaryFile(suffix='.mp3', delete=False) as temp_file:
+        temp_path = temp_file.name
+    try:
+        # Seeking before -i skips decoding everything ahead of the clip
+        command = [
+            settings.AUDIO_FFMPEG_BINARY, '-hide_banner', '-loglevel', 'error', '-y',
+            '-ss', f"{start:.3f}", '-t', f"{duration:.3f}", '-i', source_path, '-vn',
+        ]
+        if fade:
+            command += ['-af', f"afade=t=in:d={fade:.3f},areverse,afade=t=in:d={fade:.3f},areverse"]
+        command += ['-ac', '1', '-c:a', 'libmp3lame', '-b:a', bitrate, '-f', 'mp3', temp_path]
+        result = subprocess.run(command, capture_output=True, text=True)
+        if result.returncode != 0:
+            raise RuntimeError(f"ffmpeg preview encode failed: {result.stderr.strip()}")
+        with open(temp_path, 'rb') as f:
+            data = f.read()
+    finally:
+        os.unlink(temp_path)
+    return f"{hashlib.sha1(data).hexdigest()[:16]}.mp3", ContentFile(data)
+
+
+def preview_from_energy(source_path, energy, skip_seconds=0.0):
+    """Encode the preview of a file whose window energy has already been measured"""
+    start = pick_preview_start(energy.result(), energy.window_seconds, settings.AUDIO_PREVIEW_SECONDS, skip_seconds)
+    return encode_preview(source_path, start)
+
+
+def generate_track_preview(track_id, force=False):
+    """Measure a stored track block by block and attach its preview clip; used by the backfill command"""
+    from music.models import Track
+    from tts_utils import SiteAnnouncementGenerator
+
+    track = Track.objects.get(pk=track_id)
+    if track.preview_file and not force:
+        return 'skipped'
+
+    audio_field = track.optimized_file or track.audio_file
+    if not audio_field:
+        return 'missing'
+    audio_path = os.path.join(settings.MEDIA_ROOT, audio_field.name)
+    if not os.path.exists(audio_path):
+        return 'missing'
+
+    energy = EnergyAccumulator(STREAM_SAMPLE_RATE)
+    for block in PCMDecoder(audio_path, stream_block_frames()):
+        energy.feed(block)
+    # Every branded file opens with the same announcement; keep it out of the preview
+    skip = SiteAnnouncementGenerator().get_announcement_duration() if track.has_site_branding else 0.0
+
+    name, content = preview_from_energy(audio_path, energy, skip)
+    if track.preview_file:
+        track.preview_file.delete(save=False)
+    track.preview_file.save(name, content, save=False)
+    track.save(update_fields=['preview_file'])
+    return 'generated'
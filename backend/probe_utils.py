@@ -0,0 +1,128 @@
+import os
+from datetime import timedelta
+from mutagen import File, MutagenError
+from mutagen.mp3 import MP3
+from mutagen.flac import FLAC
+from mutagen.oggvorbis import OggVorbis
+from mutagen.oggopus import OggOpus
+from mutagen.oggflac import OggFLAC
+from mutagen.wave import WAVE
+from mutagen.aiff import AIFF
+from mutagen.mp4 import MP4
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Container and codec per mutagen file type; every one of them is read from headers only
+# (Xing/VBRI/LAME for MP3, STREAMINFO for FLAC, granule positions for Ogg, RIFF/FORM chunks, moov for MP4)
+PROBE_FORMATS = [
+    (MP3, 'mp3', 'mp3'),
+    (FLAC, 'flac', 'flac'),
+    (OggVorbis, 'ogg', 'vorbis'),
+    (OggOpus, 'ogg', 'opus'),
+    (OggFLAC, 'ogg', 'flac'),
+    (WAVE, 'wav', 'pcm'),
+    (AIFF, 'aiff', 'pcm'),
+    (MP4, 'm4a', None),
+]
+
+MP4_CODECS = {'mp4a.40.2': 'aac', 'mp4a.40.5': 'aac', 'mp4a.40.29': 'aac', 'alac': 'alac'}
+
+# Opus always decodes at 48 kHz, so its header carries no sample rate
+OPUS_SAMPLE_RATE = 48000
+
+# Track columns written by apply_probe, for save(update_fields=...)
+PROBE_FIELDS = [
+    'duration_ms', 'bitrate_kbps', 'sample_rate', 'channels', 'codec', 'file_size_bytes',
+    'duration', 'bitrate', 'format', 'file_size',
+]
+
+
+def _file_size(source):
+    if isinstance(source, (str, os.PathLike)):
+        return os.path.getsize(source)
+    if getattr(source, 'size', None) is not None:
+        return source.size
+    position = source.tell()
+    source.seek(0, os.SEEK_END)
+    size = source.tell()
+    source.seek(position)
+    return size
+
+
+def probe_audio(source, audio_file=None):
+    """
+    Read duration, bitrate, sample rate, channels and codec of an audio file without decoding it.
+
+    ``source`` is a path or a seekable file object; pass ``audio_file`` when the file has
+    already been opened with mutagen to avoid parsing it twice. Raises ValueError for
+    files mutagen does not recognise.
+    """
+    if audio_file is None:
+        position = None if isinstance(source, (str, os.PathLike)) else source.tell()
+        try:
+            audio_file = File(source)
+        except MutagenError as e:
+            raise ValueError(f"Unreadable audio file: {e}")
+        finally:
+            if position is not None:
+                source.seek(position)
+
+    if audio_file is None or audio_file.info is None:
+        raise ValueError('Unrecognised audio file')
+
+    for file_type, container, codec in PROBE_FORMATS:
+        if isinstance(audio_file, file_type):
+            break
+    else:
+        container, codec = type(audio_file).__name__.lower(), None
+
+    info = audio_file.info
+    if isinstance(audio_file, MP4):
+        codec = MP4_CODECS.get(getattr(info, 'codec', ''), getattr(info, 'codec', '') or 'unknown')
+    elif isinstance(audio_file, MP3) and getattr(info, 'layer', 3) != 3:
+        codec = f"mp{info.layer}"
+
+    length = getattr(info, 'length', 0) or 0
+    file_size = _file_size(source)
+    bitrate = getattr(info, 'bitrate', 0) or 0
+    if not bitrate and length:
+        bitrate = int(file_size * 8 / length)
+
+    sample_rate = getattr(info, 'sample_rate', 0) or (OPUS_SAMPLE_RATE if isinstance(audio_file, OggOpus) else 0)
+
+    return {
+        'duration_ms': int(round(length * 1000)),
+        'bitrate': int(bitrate),
+        'sample_rate': int(sample_rate),
+        'channels': int(getattr(info, 'channels', 0) or 0),
+        'codec': codec or container,
+        'format': container,
+        'file_size': file_size,
+    }
+
+
+def apply_probe(track, probe):
+    """Copy probe results onto a track's typed columns and its display fields; does not save"""
+    track.duration_ms = probe['duration_ms']
+    track.bitrate_kbps = probe['bitrate'] // 1000
+    track.sample_rate = probe['sample_rate']
+    track.channels = probe['channels']
+    track.codec = probe['codec']
+    track.file_size_bytes = probe['file_size']
+
+    track.duration = timedelta(milliseconds=probe['duration_ms'])
+    track.bitrate = f"{track.bitrate_kbps}KBPS"
+    track.format = probe['format'].upper()
+    track.file_size = f"{probe['file_size']} bytes"
+
+
+def probe_track(track, source):
+    """Probe ``source`` and apply it to ``track``; unreadable files are logged and left alone"""
+    try:
+        probe = probe_audio(source)
+    except (ValueError, OSError) as e:
+        logger.warning(f"Could not probe audio for track {track.pk}: {e}")
+        return None
+    apply_probe(track, probe)
+    return probe
@@ -0,0 +1,163 @@
+import os
+import uuid
+from datetime import timedelta
+from django.conf import settings
+from django.utils import timezone
+from audio_jobs import BlockHasher, CONTENT_HASH_BLOCK_SIZE, combine_block_digests
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class UploadIncomplete(Exception):
+    """Finalizing a session before every byte has been received"""
+
+
+class TooManyUploads(Exception):
+    """Starting a session while the user already has the maximum number open"""
+
+
+def session_expiry():
+    return timezone.now() + timedelta(seconds=settings.AUDIO_UPLOAD_SESSION_TTL)
+
+
+def create_upload_session(user, filename, content_type, size):
+    """Start a resumable upload, preallocating its spool file at the declared size"""
+    from music.models import UploadSession
+
+    if size < 0 or size > settings.AUDIO_UPLOAD_MAX_SIZE:
+        raise ValueError(f"Upload size must be between 0 and {settings.AUDIO_UPLOAD_MAX_SIZE} bytes")
+    # Every open session holds its full size on disk, so each user may only keep a few
+    open_sessions = UploadSession.objects.filter(user=user, finalized_at__isnull=True, expires_at__gt=timezone.now())
+    if open_sessions.count() >= settings.AUDIO_UPLOAD_MAX_OPEN_SESSIONS:
+        raise TooManyUploads(f"At most {settings.AUDIO_UPLOAD_MAX_OPEN_SESSIONS} uploads may be in progress at once")
+
+    spool_dir = settings.AUDIO_PROCESSING_SPOOL_DIR
+    os.makedirs(spool_dir, exist_ok=True)
+    suffix = os.path.splitext(filename)[1]
+    spool_path = os.path.join(spool_dir, f"{uuid.uuid4().hex}{suffix}")
+
+    with open(spool_path, 'wb') as spool_file:
+        spool_file.truncate(size)
+        try:
+            # Reserve the blocks up front so a full disk fails here rather than mid-upload
+            os.posix_fallocate(spool_file.fileno(), 0, size)
+        except (AttributeError, OSError):
+            pass
+
+    return UploadSession.objects.create(
+        user=user,
+        filename=filename,
+        content_type=content_type,
+        size=size,
+        spool_path=spool_path,
+        expires_at=session_expiry(),
+    )
+
+
+def write_chunk(session, offset, stream, length):
+    """
+    Write ``length`` bytes read from ``stream`` into the session's file at ``offset``.
+
+    Chunks start on a hash block boundary and cover whole blocks unless they end the file,
+    so each one is hashed as it is written and finalizing never reads the file back.
+    Chunks may arrive in any order and from parallel requests; a chunk sent again replaces
+    the earlier record. Raises ValueError for chunks outside those rules or cut short.
+    """
+    from music.models import UploadChunk
+
+    end = offset + length
+    if offset < 0 or offset % CONTENT_HASH_BLOCK_SIZE:
+        raise ValueError(f"Chunk offset must be a multiple of {CONTENT_HASH_BLOCK_SIZE}")
+    if length <= 0 or end > session.size:
+        raise ValueError(f"Chunk must lie within the upload's {session.size} bytes")
+    if length % CONTENT_HASH_BLOCK_SIZE and end != session.size:
+        raise ValueError(f"Only the last chunk may be shorter than a multiple of {CONTENT_HASH_BLOCK_SIZE}")
+    if length > settings.AUDIO_UPLOAD_CHUNK_SIZE:
+        raise ValueError(f"Chunks may be at most {settings.AUDIO_UPLOAD_CHUNK_SIZE} bytes")
+
+    hasher = BlockHasher()
+    remaining = length
+    with open(session.spool_path, 'r+b') as spool_file:
+        spool_file.seek(offset)
+        while remaining:
+            data = stream.read(min(remaining, CONTENT_HASH_BLOCK_SIZE))
+            if not data:
+                raise ValueError(f"Chunk ended {remaining} bytes early")
+            hasher.update(data)
+            spool_file.write(data)
+            remaining -= len(data)
+
+    chunk, _ = UploadChunk.objects.update_or_create(
+        session=session,
+        offset=offset,
+        defaults={'length': length, 'block_digests': hasher.block_digests()},
+    )
+    # A session stays alive for as long as chunks keep arriving
+    session.expires_at = session_expiry()
+    session.save(update_fields=['expires_at'])
+    return chunk
+
+
+def received_blocks(session):
+    """Block digests received so far, keyed by block index"""
+    blocks = {}
+    for offset, digests in session.chunks.values_list('offset', 'block_digests'):
+        first = offset // CONTENT_HASH_BLOCK_SIZE
+        for index, digest in enumerate(digests):
+            blocks[first + index] = digest
+    return blocks
+
+
+def block_count(size):
+    return -(-size // CONTENT_HASH_BLOCK_SIZE)
+
+
+def upload_offset(session, blocks=None):
+    """Length of the prefix received without gaps; the tus ``Upload-Offset``"""
+    if blocks is None:
+        blocks = received_blocks(session)
+    contiguous = 0
+    while contiguous in blocks:
+        contiguous += 1
+    return min(session.size, contiguous * CONTENT_HASH_BLOCK_SIZE)
+
+
+def session_content_hash(session):
+    """Content hash of a fully received upload, combined from the stored block digests"""
+    blocks = received_blocks(session)
+    count = block_count(session.size)
+    missing = [index for index in range(count) if index not in blocks]
+    if missing:
+        raise UploadIncomplete(f"{len(missing)} of {count} blocks not received yet")
+    return combine_block_digests(blocks[index] for index in range(count))
+
+
+def claim_upload_session(session):
+    """Mark a session finalized; False when another request got there first"""
+    from music.models import UploadSession
+
+    claimed = UploadSession.objects.filter(pk=session.pk, finalized_at__isnull=True).update(
+        finalized_at=timezone.now()
+    )
+    return bool(claimed)
+
+
+def discard_upload_session(session):
+    """Delete an unfinished session and its spool file"""
+    if not session.finalized_at and os.path.exists(session.spool_path):
+        os.unlink(session.spool_path)
+    session.delete()
+
+
+def expire_upload_sessions(now=None):
+    """Discard unfinished sessions past their expiry, freeing their spool files; returns how many"""
+    from music.models import UploadSession
+
+    now = now or timezone.now()
+    expired = UploadSession.objects.filter(finalized_at__isnull=True, expires_at__lte=now)
+    count = 0
+    for session in expired:
+        discard_upload_session(session)
+        count += 1
+    return count
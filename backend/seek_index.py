@@ -0,0 +1,82 @@
+import struct
+import numpy as np
+from django.conf import settings
+from mp3_splice import MP3Stream, audio_bounds
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Packed seek index: header, then one little-endian uint32 per interval with the byte offset
+# of the frame playing at that time, counted from the end of the leading ID3v2 tags so that
+# retagging a file in place does not invalidate its index
+MAGIC = b'GSSK'
+VERSION = 1
+HEADER = struct.Struct('<4sBHII')   # magic, version, interval ms, audio byte length, entry count
+OFFSET_DTYPE = np.dtype('<u4')
+
+
+def build_seek_index(path, interval_ms=None):
+    """Scan an MP3's frame headers and pack the time-to-byte table; raises ValueError for other files"""
+    interval_ms = interval_ms or settings.AUDIO_SEEK_INDEX_INTERVAL_MS
+    stream = MP3Stream(path)
+    with open(path, 'rb') as f:
+        start, end = audio_bounds(f)
+
+    # Players skip a leading Xing/Info frame, so time zero is the first audio frame
+    offsets = np.fromiter((offset - start for offset, _ in stream.frames), dtype=np.int64, count=len(stream.frames))
+    frame_seconds = stream.header.samples / stream.header.sample_rate
+    times = np.arange(0, stream.duration, interval_ms / 1000)
+    entries = offsets[np.minimum((times / frame_seconds).astype(np.int64), len(offsets) - 1)]
+    return HEADER.pack(MAGIC, VERSION, interval_ms, end - start, len(entries)) + entries.astype(OFFSET_DTYPE).tobytes()
+
+
+def decode_seek_index(data):
+    """(interval_ms, audio_length, offsets) of a packed index; raises ValueError for anything else"""
+    data = bytes(data)
+    if len(data) < HEADER.size:
+        raise ValueError('Not a seek index')
+    magic, version, interval_ms, audio_length, count = HEADER.unpack_from(data)
+    if magic != MAGIC or version != VERSION or len(data) != HEADER.size + count * OFFSET_DTYPE.itemsize:
+        raise ValueError('Not a seek index')
+    return interval_ms, audio_length, np.frombuffer(data, dtype=OFFSET_DTYPE, offset=HEADER.size)
+
+
+def seek_offset(index, path, seconds):
+    """
+    Absolute byte offset in ``path`` of the frame playing at ``seconds``, or None when
+    ``index`` does not describe the file's current audio. Times past the end map to the last entry.
+    """
+    try:
+        interval_ms, audio_length, offsets = decode_seek_index(index)
+    except ValueError:
+        return None
+    with open(path, 'rb') as f:
+        start, end = audio_bounds(f)
+    if not len(offsets) or end - start != audio_length:
+        return None
+    entry = min(int(seconds * 1000 // interval_ms), len(offsets) - 1)
+    return start + int(offsets[entry])
+
+
+def index_track(track, path):
+    """Build and store the seek index of the file a track streams from; None for non-MP3 files"""
+    try:
+        track.seek_index = build_seek_index(path)
+    except (ValueError, OSError) as e:
+        logger.info(f"No seek index for track {track.pk}: {e}")
+        track.seek_index = None
+    track.save(update_fields=['seek_index'])
+    return track.seek_index
+
+
+def generate_track_seek_index(track_id, force=False):
+    """Index the file a stored track streams from; used by the backfill command"""
+    from music.models import Track
+
+    track = Track.objects.get(pk=track_id)
+    if track.seek_index and not force:
+        return 'skipped'
+    path = track.stream_path()
+    if path is None:
+        return 'missing'
+    return 'generated' if index_track(track, path) else 'unsupported'
@@ -0,0 +1,186 @@
+import subprocess
+import tempfile
+import numpy as np
+from django.conf import settings
+import logging
+
+logger = logging.getLogger(__name__)
+
+# PCM layout of the streaming engine; it matches the streaming-optimized output
+STREAM_SAMPLE_RATE = 44100
+STREAM_CHANNELS = 2
+STREAM_SAMPLE_WIDTH = 2
+FRAME_BYTES = STREAM_CHANNELS * STREAM_SAMPLE_WIDTH
+
+# Bytes held per in-flight frame: the raw block plus the float copies the analysers make
+BYTES_PER_FRAME = 64
+# Share of the memory cap given to in-flight blocks; the rest covers fixed analysis state
+BLOCK_SHARE = 16
+MIN_BLOCK_FRAMES = 4096
+
+# pydub keeps the decoded track, the branded copy and the resampled copy in memory at once
+PYDUB_COPIES = 3
+
+
+def stream_block_frames(memory_limit=None):
+    """Frames per streamed block for a per-job memory cap, a multiple of 4 for the fingerprint decimation"""
+    limit = memory_limit or settings.AUDIO_STREAM_MEMORY_LIMIT
+    return max(MIN_BLOCK_FRAMES, limit // BLOCK_SHARE // BYTES_PER_FRAME) // 4 * 4
+
+
+def decoded_size(probe):
+    """Estimate of the memory pydub needs to process a file with these header properties"""
+    return (probe['duration_ms'] * probe['sample_rate'] // 1000) * max(probe['channels'], 1) * 2 * PYDUB_COPIES
+
+
+def use_streaming_engine(probe, engine=None, memory_limit=None):
+    """Whether a file should go through the streaming engine rather than pydub"""
+    engine = engine or settings.AUDIO_PROCESSING_ENGINE
+    if engine == 'stream':
+        return True
+    if engine == 'pydub' or probe is None:
+        return False
+    return decoded_size(probe) > (memory_limit or settings.AUDIO_STREAM_MEMORY_LIMIT)
+
+
+def segment_samples(audio):
+    """A short pydub segment (such as the announcement) as an int16 block in the stream layout"""
+    audio = audio.set_frame_rate(STREAM_SAMPLE_RATE).set_channels(STREAM_CHANNELS).set_sample_width(STREAM_SAMPLE_WIDTH)
+    return np.frombuffer(audio.raw_data, dtype=np.int16).reshape(-1, STREAM_CHANNELS)
+
+
+class PCMDecoder:
+    """
+    Decode any audio file to 16-bit stereo PCM through an ffmpeg pipe, yielding
+    (frames, channels) int16 blocks of a fixed size so memory does not grow with the track.
+    With ``tail_seconds`` only roughly that much of the end of the file is decoded.
+    """
+
+    def __init__(self, path, block_frames, tail_seconds=None):
+        self.path = path
+        self.block_frames = block_frames
+        self.tail_seconds = tail_seconds
+        self.frame_count = 0
+
+    def __iter__(self):
+        seek = ['-sseof', f"-{self.tail_seconds:.3f}"] if self.tail_seconds else []
+        command = [
+            settings.AUDIO_FFMPEG_BINARY, '-hide_banner', '-loglevel', 'error', *seek, '-i', self.path,
+            '-vn', '-f', 's16le', '-acodec', 'pcm_s16le',
+            '-ac', str(STREAM_CHANNELS), '-ar', str(STREAM_SAMPLE_RATE), 'pipe:1',
+        ]
+        block_bytes = self.block_frames * FRAME_BYTES
+        with tempfile.TemporaryFile() as errors:
+            process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=errors)
+            try:
+                while True:
+                    data = process.stdout.read(block_bytes)
+                    if not data:
+                        break
+                    data = data[:len(data) - len(data) % FRAME_BYTES]
+                    block = np.frombuffer(data, dtype=np.int16).reshape(-1, STREAM_CHANNELS)
+                    self.frame_count += len(block)
+                    yield block
+            finally:
+                process.stdout.close()
+                if process.wait() != 0:
+                    errors.seek(0)
+                    raise RuntimeError(f"ffmpeg decode failed: {errors.read().decode(errors='replace').strip()}")
+
+
+class PCMEncoder:
+    """
+    Encode int16 stereo blocks written to it into a file through an ffmpeg pipe.
+    With ``path='pipe:1'`` the encoded bytes are read from ``stdout`` instead; pass ``format`` then.
+    """
+
+    def __init__(self, path, bitrate=None, codec='libmp3lame', format=None):
+        self.path = path
+        self._errors = tempfile.TemporaryFile()
+        command = [
+            settings.AUDIO_FFMPEG_BINARY, '-hide_banner', '-loglevel', 'error', '-y',
+            '-f', 's16le', '-ar', str(STREAM_SAMPLE_RATE), '-ac', str(STREAM_CHANNELS), '-i', 'pipe:0',
+            '-c:a', codec,
+        ]
+        if bitrate:
+            command += ['-b:a', bitrate]
+        if format:
+            command += ['-f', format]
+        self._process = subprocess.Popen(
+            command + [path], stdin=subprocess.PIPE, stderr=self._errors,
+            stdout=subprocess.PIPE if path == 'pipe:1' else None
+        )
+        self.stdout = self._process.stdout
+
+    def write(self, block):
+        try:
+            self._process.stdin.write(np.ascontiguousarray(block, dtype=np.int16).tobytes())
+        except BrokenPipeError:
+            self._fail()
+
+    def close(self):
+        """Finish encoding; raises RuntimeError when ffmpeg failed"""
+        try:
+            self._process.stdin.close()
+        except BrokenPipeError:
+            pass
+        if self._process.wait() != 0:
+            self._fail()
+        self._errors.close()
+
+    def abort(self):
+        self._process.kill()
+        self._process.wait()
+        self._errors.close()
+
+    def _fail(self):
+        self._process.kill()
+        self._process.wait()
+        self._errors.seek(0)
+        message = self._errors.read().decode(errors='replace').strip()
+        raise RuntimeError(f"ffmpeg encode of {self.path} failed: {message}")
+
+
+class FadeFilter:
+    """
+    Fade a block stream in and out the way pydub does (linear in dB from -120 dB).
+    The fade-out needs the end of the track, so only its length is held back.
+    """
+
+    SILENCE_DB = -120.0
+
+    def __init__(self, fade_in_frames=0, fade_out_frames=0):
+        self.fade_in_frames = fade_in_frames
+        self.fade_out_frames = fade_out_frames
+        self.position = 0
+        self._held = np.empty((0, STREAM_CHANNELS), dtype=np.int16)
+
+    def _gain(self, count, start, length, rising):
+        steps = np.arange(start, start + count) / max(length, 1)
+        if not rising:
+            steps = 1 - steps
+        return 10 ** (self.SILENCE_DB * (1 - steps) / 20)
+
+    def process(self, block):
+        """Filter one block; returns the frames that are final so far"""
+        if self.position < self.fade_in_frames:
+            count = min(len(block), self.fade_in_frames - self.position)
+            block = block.astype(np.float64)
+            block[:count] *= self._gain(count, self.position, self.fade_in_frames, True)[:, None]
+            block = np.clip(np.round(block), -32768, 32767).astype(np.int16)
+        self.position += len(block)
+
+        if not self.fade_out_frames:
+            return block
+        held = np.concatenate([self._held, block])
+        ready = max(0, len(held) - self.fade_out_frames)
+        self._held = held[ready:]
+        return held[:ready]
+
+    def flush(self):
+        """Fade out and return the held-back tail"""
+        tail = self._held.astype(np.float64)
+        self._held = self._held[:0]
+        if len(tail):
+            tail *= self._gain(len(tail), self.fade_out_frames - len(tail), self.fade_out_frames, False)[:, None]
+        return np.clip(np.round(tail), -32768, 32767).astype(np.int16)
@@ -0,0 +1,606 @@
+import io
+import os
+import json
+import shutil
+import wave
+import pytest
+import numpy as np
+from pydub.generators import Sine
+from tts_utils import SiteAnnouncementGenerator
+from hls_utils import package_hls
+from waveform_utils import compute_peaks, compute_audio_peaks, encode_peaks, decode_peaks, PeakAccumulator
+from loudness_utils import LoudnessAnalyzer, analyse_segment, replaygain
+from probe_utils import probe_audio
+from fingerprint_utils import fingerprint_samples, StreamingFingerprinter, SAMPLE_RATE, HOP
+from stream_utils import FadeFilter, use_streaming_engine, stream_block_frames
+from preview_utils import EnergyAccumulator, pick_preview_start, encode_preview
+from mp3_splice import MP3Stream, parse_header, splice_announcement
+from audio_utils import AudioProcessor
+from upload_validation import HeaderSniffer, UploadRejected, inspect_header, validate_upload
+from audio_pipeline import Stage, STAGES, PipelineCache, ordered_stages, merge_profile, run_pipeline
+
+
+@pytest.fixture
+def announcement_cache(settings, tmp_path):
+    """Isolate the announcement cache in a temporary directory"""
+    settings.AUDIO_ANNOUNCEMENT_CACHE_DIR = str(tmp_path / 'announcements')
+    SiteAnnouncementGenerator._cache.clear()
+    yield tmp_path / 'announcements'
+    SiteAnnouncementGenerator._cache.clear()
+
+
+@pytest.mark.unit
+class TestAnnouncementCache:
+    """Test the precomputed site announcement cache"""
+
+    def test_announcement_matches_requested_layout(self, announcement_cache):
+        """Test the announcement is rendered in the requested PCM layout"""
+        announcement = SiteAnnouncementGenerator().get_announcement(frame_rate=48000, channels=1)
+        assert announcement.frame_rate == 48000
+        assert announcement.channels == 1
+        assert len(announcement) == 1000
+
+    def test_announcement_rendered_once_per_process(self, announcement_cache):
+        """Test repeated lookups reuse the same render"""
+        first = SiteAnnouncementGenerator().get_announcement()
+        second = SiteAnnouncementGenerator().get_announcement()
+        assert first is second
+
+    def test_announcement_loaded_from_disk(self, announcement_cache):
+        """Test a fresh process reuses the render stored on disk"""
+        rendered = SiteAnnouncementGenerator().get_announcement(frame_rate=22050, channels=2)
+        assert len(os.listdir(announcement_cache)) == 1
+
+        SiteAnnouncementGenerator._cache.clear()
+        loaded = SiteAnnouncementGenerator().get_announcement(frame_rate=22050, channels=2)
+        assert loaded is not rendered
+        assert loaded.raw_data == rendered.raw_data
+
+    def test_announcement_duration(self, announcement_cache):
+        """Test the duration is read from the cached render"""
+        assert SiteAnnouncementGenerator().get_announcement_duration() == 1.0
+
+
+@pytest.mark.unit
+@pytest.mark.skipif(shutil.which('ffmpeg') is None, reason='ffmpeg is required for HLS packaging')
+class TestHLSPackaging:
+    """Test HLS packaging into a bitrate ladder"""
+
+    def test_package_hls_ladder(self, tmp_path):
+        """Test every bitrate gets a media playlist and fixed-duration segments"""
+        source = tmp_path / 'source.wav'
+        Sine(440).to_audio_segment(duration=5000).export(str(source), format='wav')
+
+        master_path = package_hls(str(source), str(tmp_path / 'hls'), bitrates=[128, 64], segment_seconds=2)
+        master = open(master_path).read()
+        assert master.index('64k/index.m3u8') < master.index('128k/index.m3u8')
+        assert 'AVERAGE-BANDWIDTH=64000' in master
+
+        for bitrate in (64, 128):
+            playlist = open(tmp_path / 'hls' / f'{bitrate}k' / 'index.m3u8').read()
+            assert '#EXT-X-PLAYLIST-TYPE:VOD' in playlist
+            assert '#EXT-X-ENDLIST' in playlist
+            assert playlist.count('segment_') == 3
+
+
+@pytest.mark.unit
+class TestWaveformPeaks:
+    """Test waveform peak computation and the binary peak format"""
+
+    def test_peaks_per_level(self):
+        """Test min/max pairs are taken per window across channels"""
+        samples = np.array([[0, 256], [-512, 0], [1024, -256], [0, 0]], dtype=np.int16)
+        levels = compute_peaks(samples, 2, levels=[2, 4], bits=8)
+        assert [samples_per_peak for samples_per_peak, _ in levels] == [2, 4]
+        assert levels[0][1].tolist() == [[-2, 1], [-1, 4]]
+        assert levels[1][1].tolist() == [[-2, 4]]
+
+    def test_partial_window_and_16_bit(self):
+        """Test a trailing partial window still gets a peak at full resolution"""
+        samples = np.array([-32768, 32767, 100], dtype=np.int16)
+        levels = compute_peaks(samples, 2, levels=[2], bits=16)
+        assert levels[0][1].dtype == np.int16
+        assert levels[0][1].tolist() == [[-32768, 32767], [100, 100]]
+
+    def test_encode_decode_roundtrip(self):
+        """Test the binary format round-trips every level"""
+        audio = Sine(440).to_audio_segment(duration=1000).set_frame_rate(44100).set_channels(2)
+        levels = compute_audio_peaks(audio, levels=[256, 1024], bits=8)
+        data = encode_peaks(levels, audio.frame_rate, int(audio.frame_count()))
+
+        decoded = decode_peaks(data)
+        assert decoded['bits'] == 8
+        assert decoded['sample_rate'] == 44100
+        assert decoded['frame_count'] == 44100
+        assert [len(peaks) for _, peaks in decoded['levels']] == [173, 44]
+        for (_, original), (_, parsed) in zip(levels, decoded['levels']):
+            assert np.array_equal(original, parsed)
+        assert len(data) == 20 + 2 * 8 + (173 + 44) * 2
+
+    def test_decode_rejects_other_files(self):
+        """Test non-peak data is refused"""
+        with pytest.raises(ValueError):
+            decode_peaks(b'ID3' + bytes(32))
+
+    def test_accumulator_matches_whole_track(self):
+        """Test peaks fed in odd-sized blocks equal peaks of the whole array"""
+        samples = np.random.default_rng(0).integers(-32768, 32767, (100000, 2), dtype=np.int16)
+        accumulator = PeakAccumulator(2, levels=[256, 1000, 4096], bits=8)
+        for start in range(0, len(samples), 7777):
+            accumulator.feed(samples[start:start + 7777])
+
+        assert accumulator.frame_count == 100000
+        for (level, streamed), (_, whole) in zip(accumulator.result(), compute_peaks(samples, 2, [256, 1000, 4096], 8)):
+            assert np.array_equal(streamed, whole), level
+
+
+def sine(frequency, level_db, seconds, sample_rate=48000, channels=2, phase=0.0):
+    """Float PCM sine shaped (frames, channels) with the given peak level"""
+    t = np.arange(int(seconds * sample_rate)) / sample_rate
+    wave = 10 ** (level_db / 20) * np.sin(2 * np.pi * frequency * t + phase)
+    return np.repeat(wave[:, None], channels, axis=1)
+
+
+@pytest.mark.unit
+class TestLoudnessAnalysis:
+    """Test the chunked EBU R128 loudness analyser against the EBU Tech 3341/3342 cases"""
+
+    def test_integrated_loudness_of_reference_sine(self):
+        """Test a -23 dBFS 1 kHz stereo sine reads -23 LUFS"""
+        analyzer = LoudnessAnalyzer(48000, 2)
+        analyzer.feed(sine(1000, -23, 20))
+        result = analyzer.result()
+        assert result['integrated'] == pytest.approx(-23.0, abs=0.1)
+        assert result['true_peak'] == pytest.approx(-23.0, abs=0.1)
+
+    def test_loudness_range(self):
+        """Test 20 s at -20 dBFS then 20 s at -30 dBFS gives a 10 LU range"""
+        analyzer = LoudnessAnalyzer(48000, 2)
+        analyzer.feed(np.concatenate([sine(1000, -20, 20), sine(1000, -30, 20)]))
+        assert analyzer.result()['loudness_range'] == pytest.approx(10.0, abs=1.0)
+
+    def test_true_peak_between_samples(self):
+        """Test an inter-sample peak 3 dB above the sample peak is found"""
+        analyzer = LoudnessAnalyzer(48000, 2)
+        analyzer.feed(sine(12000, 0, 2, phase=np.pi / 4))
+        assert analyzer.result()['true_peak'] == pytest.approx(0.0, abs=0.4)
+
+    def test_block_size_does_not_change_result(self):
+        """Test feeding odd-sized chunks matches feeding everything at once"""
+        pcm = sine(440, -12, 5, sample_rate=44100)
+        whole = LoudnessAnalyzer(44100, 2)
+        whole.feed(pcm)
+        chunked = LoudnessAnalyzer(44100, 2)
+        for offset in range(0, len(pcm), 777):
+            chunked.feed(pcm[offset:offset + 777])
+        assert chunked.result() == pytest.approx(whole.result())
+
+    def test_silence_has_no_loudness(self):
+        """Test digital silence is gated out entirely"""
+        analyzer = LoudnessAnalyzer(44100, 2)
+        analyzer.feed(np.zeros((44100, 2)))
+        assert analyzer.result() == {'integrated': None, 'loudness_range': None, 'true_peak': None}
+        assert replaygain(analyzer.result()) == (None, None)
+
+    def test_segment_replaygain(self):
+        """Test a decoded segment is measured and its gain is relative to the reference"""
+        audio = Sine(1000).to_audio_segment(duration=3000, volume=-20).set_channels(2)
+        result = analyse_segment(audio)
+        assert result['integrated'] == pytest.approx(-20.0, abs=0.2)
+
+        gain, peak = replaygain(result, reference=-18.0)
+        assert gain == pytest.approx(2.0, abs=0.2)
+        assert peak == pytest.approx(0.1, abs=0.01)
+
+
+@pytest.mark.unit
+class TestAudioProbe:
+    """Test the header-only audio probe"""
+
+    def test_probe_wav(self, tmp_path):
+        """Test RIFF headers give exact duration and layout"""
+        path = tmp_path / 'tone.wav'
+        with wave.open(str(path), 'wb') as wav:
+            wav.setnchannels(2)
+            wav.setsampwidth(2)
+            wav.setframerate(44100)
+            wav.writeframes(bytes(4 * 66150))
+
+        probe = probe_audio(str(path))
+        assert probe['duration_ms'] == 1500
+        assert probe['sample_rate'] == 44100
+        assert probe['channels'] == 2
+        assert probe['bitrate'] == 1411200
+        assert probe['codec'] == 'pcm'
+        assert probe['format'] == 'wav'
+        assert probe['file_size'] == os.path.getsize(path)
+
+    def test_probe_file_object_keeps_position(self, tmp_path):
+        """Test probing an open upload leaves it where it was"""
+        buffer = io.BytesIO()
+        with wave.open(buffer, 'wb') as wav:
+            wav.setnchannels(1)
+            wav.setsampwidth(2)
+            wav.setframerate(8000)
+            wav.writeframes(bytes(16000))
+        buffer.seek(0)
+
+        assert probe_audio(buffer)['duration_ms'] == 1000
+        assert buffer.tell() == 0
+
+    @pytest.mark.skipif(shutil.which('ffmpeg') is None, reason='ffmpeg is required to encode test files')
+    @pytest.mark.parametrize('format, codec', [('mp3', 'mp3'), ('flac', 'flac')])
+    def test_probe_compressed(self, tmp_path, format, codec):
+        """Test MP3 and FLAC durations come from their headers"""
+        path = tmp_path / f'tone.{format}'
+        Sine(440).to_audio_segment(duration=2000).set_channels(2).export(str(path), format=format)
+
+        probe = probe_audio(str(path))
+        assert probe['duration_ms'] == pytest.approx(2000, abs=60)
+        assert probe['channels'] == 2
+        assert probe['codec'] == codec
+        assert probe['bitrate'] > 0
+
+    def test_probe_rejects_other_files(self, tmp_path):
+        """Test files mutagen cannot identify raise ValueError"""
+        path = tmp_path / 'notes.txt'
+        path.write_text('not audio')
+        with pytest.raises(ValueError):
+            probe_audio(str(path))
+
+
+def tone_sequence(seed, seconds=30):
+    """Synthetic music: random chords changing every quarter second at the fingerprint rate"""
+    rng = np.random.default_rng(seed)
+    t = np.arange(SAMPLE_RATE // 4) / SAMPLE_RATE
+    chords = []
+    for _ in range(seconds * 4):
+        chords.append(sum(np.sin(2 * np.pi * f * t) * rng.uniform(0.1, 0.3) for f in rng.uniform(100, 4000, 4)))
+    return np.concatenate(chords)
+
+
+def aligned_matches(query, reference):
+    """Largest number of query hashes agreeing on one offset into the reference"""
+    index = {}
+    for h, offset in zip(*reference):
+        index.setdefault(h, []).append(offset)
+    deltas = [offset - query_offset for h, query_offset in zip(*query) for offset in index.get(h, [])]
+    if not deltas:
+        return 0, None
+    deltas = np.array(deltas)
+    counts = np.bincount(deltas - deltas.min())
+    return int(counts.max()), int(counts.argmax() + deltas.min())
+
+
+@pytest.mark.unit
+class TestFingerprint:
+    """Test spectral-peak landmark fingerprints"""
+
+    def test_fingerprint_shape(self):
+        """Test hashes fit in 24 bits and come with matching offsets"""
+        hashes, offsets = fingerprint_samples(tone_sequence(1))
+        assert hashes.size == offsets.size > 0
+        assert hashes.max() < 1 << 24
+        assert offsets.min() >= 0
+
+    def test_degraded_copy_matches_at_offset(self):
+        """Test a trimmed, quieter, noisy copy lines up at the trim offset"""
+        original = tone_sequence(1)
+        trim = 20 * HOP
+        rng = np.random.default_rng(0)
+        copy = original[trim:] * 0.7 + rng.normal(0, 0.05, original.size - trim)
+
+        matches, offset = aligned_matches(fingerprint_samples(copy), fingerprint_samples(original))
+        assert offset == 20
+        assert matches > 50
+
+    def test_different_audio_does_not_match(self):
+        """Test unrelated audio shares only chance alignments"""
+        matches, _ = aligned_matches(fingerprint_samples(tone_sequence(2)), fingerprint_samples(tone_sequence(1)))
+        assert matches < 20
+
+    def test_short_audio_has_no_fingerprint(self):
+        """Test clips shorter than one analysis window yield nothing"""
+        hashes, offsets = fingerprint_samples(np.zeros(100))
+        assert hashes.size == offsets.size == 0
+
+    def test_streamed_fingerprint_matches_whole_track(self):
+        """Test fingerprinting 44.1 kHz blocks finds the landmarks of the whole downsampled track"""
+        music = np.repeat(np.concatenate([tone_sequence(seed, seconds=60) for seed in (1, 2, 3)]), 4)
+        pcm = np.repeat((music * 16000).astype(np.int16)[:, None], 2, axis=1)
+        fingerprinter = StreamingFingerprinter()
+        for start in range(0, len(pcm), 100000):
+            fingerprinter.feed(pcm[start:start + 100000])
+        streamed = set(zip(*(column.tolist() for column in fingerprinter.result())))
+
+        downsampled = pcm[:, 0].astype(np.float32).reshape(-1, 4).mean(axis=1) / 32768.0
+        whole = set(zip(*(column.tolist() for column in fingerprint_samples(downsampled))))
+        assert len(streamed & whole) > 0.95 * len(whole)
+
+
+@pytest.mark.unit
+class TestStreamingEngine:
+    """Test the constant-memory streaming engine"""
+
+    def test_fades_match_across_blocks(self):
+        """Test fade-in and fade-out gains are continuous whatever the block size"""
+        audio = np.full((5000, 2), 10000, dtype=np.int16)
+        fader = FadeFilter(1000, 1000)
+        blocks = [fader.process(audio[:1500]), fader.process(audio[1500:3100]), fader.process(audio[3100:])]
+        faded = np.concatenate(blocks + [fader.flush()])
+
+        assert faded.shape == audio.shape
+        assert faded[0, 0] == 0 and faded[-1, 0] == 0
+        assert faded[2500, 0] == 10000
+        assert np.all(np.diff(faded[:1000, 0].astype(int)) >= 0)
+        assert np.all(np.diff(faded[-1000:, 0].astype(int)) <= 0)
+
+    def test_engine_selection(self, settings):
+        """Test auto mode streams only tracks whose decoded audio exceeds the memory cap"""
+        settings.AUDIO_PROCESSING_ENGINE = 'auto'
+        settings.AUDIO_STREAM_MEMORY_LIMIT = 256 * 1024 * 1024
+        single = {'duration_ms': 4 * 60 * 1000, 'sample_rate': 44100, 'channels': 2}
+        mix = {'duration_ms': 60 * 60 * 1000, 'sample_rate': 44100, 'channels': 2}
+        assert not use_streaming_engine(single)
+        assert use_streaming_engine(mix)
+        assert not use_streaming_engine(None)
+        assert use_streaming_engine(single, engine='stream')
+        assert not use_streaming_engine(mix, engine='pydub')
+        assert stream_block_frames() % 4 == 0
+        assert stream_block_frames(64 * 1024 * 1024) < stream_block_frames()
+
+
+@pytest.mark.unit
+class TestPreviewClip:
+    """Test preview window selection and encoding"""
+
+    def test_energy_is_independent_of_block_size(self):
+        """Test feeding blocks of any size gives the same window energies"""
+        rng = np.random.default_rng(3)
+        samples = rng.integers(-20000, 20000, (44100 * 3 + 123, 2)).astype(np.int16)
+        whole = EnergyAccumulator(44100)
+        whole.feed(samples)
+        blocked = EnergyAccumulator(44100)
+        for start in range(0, len(samples), 9999):
+            blocked.feed(samples[start:start + 9999])
+        assert len(whole.result()) == 7
+        assert np.allclose(whole.result(), blocked.result())
+
+    def test_loudest_window_wins(self):
+        """Test the clip starts where the most energetic stretch begins"""
+        energy = np.full(240, 0.1)
+        energy[100:160] = 1.0
+        assert pick_preview_start(energy, 0.5, 30) == 50.0
+
+    def test_skip_and_short_tracks(self):
+        """Test the announcement is skipped and short tracks start right after it"""
+        energy = np.full(240, 0.1)
+        energy[:20] = 5.0
+        assert pick_preview_start(energy, 0.5, 30, skip_seconds=3) >= 3
+        assert pick_preview_start(np.ones(40), 0.5, 30, skip_seconds=2) == 2.0
+
+    @pytest.mark.skipif(shutil.which('ffmpeg') is None, reason='ffmpeg is required to encode previews')
+    def test_encoded_clip(self, settings, tmp_path):
+        """Test the clip has the configured length and bitrate"""
+        source = tmp_path / 'source.wav'
+        Sine(330).to_audio_segment(duration=45000, volume=-12).export(str(source), format='wav')
+        name, content = encode_preview(str(source), 10.0, duration=30, bitrate='64k', fade_ms=1500)
+        clip = tmp_path / name
+        clip.write_bytes(content.read())
+        probe = probe_audio(str(clip))
+        assert name.endswith('.mp3')
+        assert abs(probe['duration_ms'] - 30000) < 200
+        assert probe['channels'] == 1
+        assert os.path.getsize(clip) < 300 * 1024
+
+
+@pytest.mark.unit
+class TestMP3Splice:
+    """Test branding MP3s by joining frames instead of re-encoding"""
+
+    def test_parse_header(self):
+        """Test Layer III headers are measured and other sync words rejected"""
+        header = parse_header(b'\xff\xfb\x90\x64')
+        assert (header.version, header.bitrate, header.sample_rate, header.channels) == (1, 128, 44100, 2)
+        assert header.length == 417
+        assert header.samples == 1152
+        mpeg2 = parse_header(b'\xff\xf3\x48\xc4')
+        assert (mpeg2.version, mpeg2.bitrate, mpeg2.sample_rate, mpeg2.channels) == (2, 32, 16000, 1)
+        assert mpeg2.length == 144
+        assert parse_header(b'\xff\xfb\x00\x64') is None  # free format
+        assert parse_header(b'\xff\xfd\x90\x64') is None  # layer II
+        assert parse_header(b'ID3\x04') is None
+
+    def test_wav_is_not_spliced(self, tmp_path):
+        """Test files without MP3 frames are left to the transcode path"""
+        source = tmp_path / 'source.wav'
+        Sine(440).to_audio_segment(duration=1000).export(str(source), format='wav')
+        assert splice_announcement(str(source)) is None
+
+    @pytest.mark.skipif(shutil.which('ffmpeg') is None, reason='ffmpeg is required to encode MP3')
+    def test_branding_copies_source_frames(self, tmp_path, announcement_cache):
+        """Test the announcement is joined in front of the untouched source frames"""
+        from mutagen.mp3 import MP3
+
+        source = tmp_path / 'source.mp3'
+        Sine(440).to_audio_segment(duration=10000, volume=-12).export(
+            str(source), format='mp3', bitrate='192k', tags={'title': 'Old'}
+        )
+        original = MP3Stream(str(source))
+        with open(source, 'rb') as f:
+            f.seek(original.start)
+            frames = f.read(original.end - original.start)
+
+        branded = AudioProcessor().embed_metadata(str(source), {'title': 'Spliced'}, {'name': 'Joiner'})
+        try:
+            assert branded != str(source)
+            with open(branded, 'rb') as f:
+                assert f.read().endswith(frames)
+            audio = MP3(branded)
+            assert audio.tags['TIT2'].text == ['Spliced']
+            assert audio.tags['TXXX:BRAND'].text == ['Ghettoselebu - Your Music Platform']
+            assert round(audio.info.bitrate / 1000) == 192
+            announcement = SiteAnnouncementGenerator().get_announcement_duration()
+            assert abs(audio.info.length - original.duration - announcement) < 0.1
+            assert len(MP3Stream(branded).frames) > len(original.frames)
+        finally:
+            os.unlink(branded)
+
+
+def _write_value(name):
+    def run(inputs, outputs, params):
+        with open(outputs[name], 'w') as f:
+            f.write(str(params['value']))
+    return run
+
+
+def _add_inputs(inputs, outputs, params):
+    with open(outputs['total'], 'w') as f:
+        f.write(str(sum(int(open(path).read()) for path in inputs.values())))
+
+
+@pytest.mark.unit
+class TestAudioPipeline:
+    def test_stages_are_ordered_by_their_inputs(self):
+        """Test every stage comes after the stages it reads from"""
+        order = [stage.name for stage in ordered_stages()]
+        for stage in STAGES:
+            for ref in stage.inputs:
+                if ref != 'source':
+                    assert order.index(ref.split('.')[0]) < order.index(stage.name)
+        with pytest.raises(ValueError):
+            ordered_stages([Stage('a', ['b.out'], {'out': 'txt'}, None), Stage('b', ['a.out'], {'out': 'txt'}, None)])
+
+    def test_merge_profile_rejects_unknown_names(self):
+        """Test overrides replace known parameters and reject anything else"""
+        profile = {'optimize': {'bitrate': '192k'}}
+        assert merge_profile(profile, {'optimize': {'bitrate': '128k'}}) == {'optimize': {'bitrate': '128k'}}
+        assert profile['optimize']['bitrate'] == '192k'
+        with pytest.raises(ValueError):
+            merge_profile(profile, {'optimise': {}})
+        with pytest.raises(ValueError):
+            merge_profile(profile, {'optimize': {'quality': 2}})
+
+    def test_changed_parameter_reruns_downstream_stages(self, tmp_path, monkeypatch):
+        """Test only the changed stage and its dependents miss the cache on a rerun"""
+        import audio_pipeline
+
+        monkeypatch.setattr(audio_pipeline, 'STAGES', [
+            Stage('left', [], {'value': 'txt'}, _write_value('value')),
+            Stage('right', [], {'value': 'txt'}, _write_value('value')),
+            Stage('sum', ['left.value', 'right.value'], {'total': 'txt'}, _add_inputs),
+        ])
+        cache = PipelineCache(str(tmp_path / 'cache'), max_bytes=1 << 20)
+        profile = {'left': {'value': 1}, 'right': {'value': 2}, 'sum': {}}
+
+        outputs, report = run_pipeline(None, 'source', profile, cache=cache)
+        assert open(outputs['sum.total']).read() == '3'
+        assert not any(entry['cached'] for entry in report.values())
+
+        outputs, report = run_pipeline(None, 'source', merge_profile(profile, {'right': {'value': 5}}), cache=cache)
+        assert open(outputs['sum.total']).read() == '6'
+        assert {name: entry['cached'] for name, entry in report.items()} == {'left': True, 'right': False, 'sum': False}
+
+        _, report = run_pipeline(None, 'source', profile, cache=cache)
+        assert all(entry['cached'] for entry in report.values())
+
+        with pytest.raises(ValueError, match='upload or its content hash'):
+            run_pipeline(None, None, profile, cache=cache)
+
+    @pytest.mark.skipif(shutil.which('ffmpeg') is None, reason='ffmpeg is required for the pipeline')
+    def test_upload_is_decoded_once(self, settings, tmp_path, announcement_cache, monkeypatch):
+        """Test fingerprint, brand, optimize and analyse are all fed from one decode of the upload"""
+        import audio_pipeline
+
+        decoded = []
+        decoder = audio_pipeline.PCMDecoder
+        monkeypatch.setattr(audio_pipeline, 'PCMDecoder', lambda path, *args: decoded.append(path) or decoder(path, *args))
+        settings.AUDIO_BRAND_SPLICE = False
+        source = tmp_path / 'source.wav'
+        Sine(440).to_audio_segment(duration=20000, volume=-12).export(str(source), format='wav')
+
+        stages = []
+        outputs, report = run_pipeline(str(source), cache=PipelineCache(str(tmp_path / 'cache')), on_stage=stages.append)
+        assert decoded == [str(source)]
+        assert stages == [stage.name for stage in ordered_stages()]
+        assert not any(entry['cached'] for entry in report.values())
+
+        announcement = SiteAnnouncementGenerator().get_announcement_duration()
+        branded = probe_audio(outputs['brand.audio'])
+        assert abs(branded['duration_ms'] - 20000 - announcement * 1000) < 200
+        assert probe_audio(outputs['optimize.audio'])['bitrate'] == 192000
+        with open(outputs['analyse.loudness']) as f:
+            assert json.load(f)['integrated'] is not None
+        assert os.path.getsize(outputs['preview.clip']) > 0
+
+    def test_cache_prunes_least_recently_used(self, tmp_path):
+        """Test pruning removes the oldest entries first and keeps the ones in use"""
+        cache = PipelineCache(str(tmp_path / 'cache'), max_bytes=150)
+        for index, key in enumerate(['aa01', 'bb02', 'cc03']):
+            work_dir = tmp_path / key
+            work_dir.mkdir()
+            (work_dir / 'out.bin').write_bytes(bytes(100))
+            cache.put(key, str(work_dir), {'out': str(work_dir / 'out.bin')})
+            os.utime(os.path.join(cache.entry_dir(key), 'manifest.json'), (index, index))
+
+        cache.prune(keep={'aa01'})
+        assert cache.get('aa01') is not None
+        assert cache.get('bb02') is None
+        assert cache.get('cc03') is None
+
+
+def _flac_streaminfo(sample_rate, channels, bits=16):
+    packed = (sample_rate << 44) | ((channels - 1) << 41) | ((bits - 1) << 36)
+    return b'fLaC' + bytes([0x80, 0, 0, 34]) + bytes(10) + packed.to_bytes(8, 'big') + bytes(16)
+
+
+@pytest.mark.unit
+class TestUploadValidation:
+    def test_id3_tag_is_skipped_across_chunks(self):
+        """Test the frame header after a large ID3 tag is found while chunks stream in"""
+        tag_size = 100000
+        tag = b'ID3\x03\x00\x00' + bytes([(tag_size >> 21) & 0x7F, (tag_size >> 14) & 0x7F, (tag_size >> 7) & 0x7F, tag_size & 0x7F])
+        frame = b'\xff\xfb\x90\x64' + bytes(413)
+        data = tag + bytes(tag_size) + frame * 200
+
+        sniffer = HeaderSniffer()
+        info = None
+        for start in range(0, len(data), 7000):
+            info = sniffer.feed(data[start:start + 7000]) or info
+        assert info == {'format': 'mp3', 'codec': 'mp3', 'sample_rate': 44100, 'channels': 2}
+
+        with pytest.raises(UploadRejected) as rejected:
+            truncated = HeaderSniffer()
+            truncated.feed(data[:5000])
+            truncated.finish()
+        assert rejected.value.reason == 'truncated'
+
+    def test_container_headers(self):
+        """Test FLAC and Ogg headers are read and impossible values rejected"""
+        assert inspect_header(_flac_streaminfo(48000, 2)) == {
+            'format': 'flac', 'codec': 'flac', 'sample_rate': 48000, 'channels': 2,
+        }
+        opus = b'OpusHead\x01\x01' + bytes(9)
+        page = b'OggS' + bytes(22) + bytes([1, len(opus)]) + opus
+        assert inspect_header(page)['codec'] == 'opus'
+        with pytest.raises(UploadRejected) as rejected:
+            inspect_header(_flac_streaminfo(500, 2))
+        assert rejected.value.reason == 'corrupt_header'
+        assert rejected.value.as_dict()['details'] == {'sample_rate': 500, 'channels': 2}
+
+    @pytest.mark.skipif(shutil.which('ffmpeg') is None, reason='ffmpeg is required to encode MP3')
+    def test_compressed_upload_is_sampled_through_ffmpeg(self, tmp_path):
+        """Test an MP3 is decoded in excerpts and a silent one rejected"""
+        from pydub import AudioSegment
+
+        tone = tmp_path / 'tone.mp3'
+        Sine(440).to_audio_segment(duration=20000, volume=-12).export(str(tone), format='mp3')
+        info = validate_upload(str(tone))
+        assert info['format'] == 'mp3'
+        assert -20 < info['signal']['rms_dbfs'] < -10
+
+        silence = tmp_path / 'silence.mp3'
+        AudioSegment.silent(duration=20000).export(str(silence), format='mp3')
+        with pytest.raises(UploadRejected) as rejected:
+            validate_upload(str(silence))
+        assert rejected.value.reason == 'silent'
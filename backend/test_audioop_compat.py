@@ -0,0 +1,139 @@
+import os
+import random
+import struct
+import warnings
+import pytest
+import audioop_compat
+
+with warnings.catch_warnings():
+    warnings.simplefilter('ignore', DeprecationWarning)
+    try:
+        import audioop as stdlib_audioop
+    except ImportError:
+        stdlib_audioop = None
+
+    if stdlib_audioop is audioop_compat:
+        stdlib_audioop = None
+
+
+FRAGMENT = struct.pack('<8h', 0, 1000, -1000, 32767, -32768, 5, 5, -7)
+
+
+@pytest.mark.unit
+class TestAudioopCompat:
+    """Test the NumPy audioop implementation against known reference output"""
+
+    def test_measurements(self):
+        """Test peak, average and RMS measurements"""
+        assert audioop_compat.max(FRAGMENT, 2) == 32768
+        assert audioop_compat.minmax(FRAGMENT, 2) == (-32768, 32767)
+        assert audioop_compat.avg(FRAGMENT, 2) == 0
+        assert audioop_compat.rms(FRAGMENT, 2) == 16391
+        assert audioop_compat.avgpp(FRAGMENT, 2) == 33518
+        assert audioop_compat.maxpp(FRAGMENT, 2) == 65535
+        assert audioop_compat.cross(FRAGMENT, 2) == 5
+
+    def test_empty_fragment(self):
+        """Test measurements of an empty fragment"""
+        assert audioop_compat.max(b'', 2) == 0
+        assert audioop_compat.rms(b'', 2) == 0
+        assert audioop_compat.minmax(b'', 2) == (0x7FFFFFFF, -0x80000000)
+        assert audioop_compat.cross(b'', 2) == -1
+
+    def test_mul_clips(self):
+        """Test scaling saturates at the sample range"""
+        assert audioop_compat.mul(FRAGMENT, 2, 1.5) == struct.pack('<8h', 0, 1500, -1500, 32767, -32768, 7, 7, -11)
+
+    def test_channel_conversion(self):
+        """Test mono/stereo conversion with channel factors"""
+        assert audioop_compat.tostereo(FRAGMENT[:4], 2, 1, 0.5) == struct.pack('<4h', 0, 0, 1000, 500)
+        assert audioop_compat.tomono(FRAGMENT, 2, 0.5, 0.5) == struct.pack('<4h', 500, 15883, -16382, -1)
+
+    def test_width_conversion(self):
+        """Test sample width conversion including 24-bit"""
+        assert audioop_compat.lin2lin(FRAGMENT[:6], 2, 1) == b'\x00\x03\xfc'
+        assert audioop_compat.lin2lin(FRAGMENT[:6], 2, 3) == b'\x00\x00\x00\x00\xe8\x03\x00\x18\xfc'
+        assert audioop_compat.lin2lin(b'\x00\x00\x00\x00\xe8\x03\x00\x18\xfc', 3, 2) == FRAGMENT[:6]
+
+    def test_bias_wraps(self):
+        """Test bias wraps around like unsigned arithmetic"""
+        assert audioop_compat.bias(FRAGMENT[:6], 2, -1) == struct.pack('<3h', -1, 999, -1001)
+
+    def test_ratecv(self):
+        """Test sample rate conversion output and carried state"""
+        converted, state = audioop_compat.ratecv(FRAGMENT, 2, 1, 8000, 16000, None)
+        assert converted == struct.pack('<15h', 0, 500, 1000, 0, -1000, 15883, 32767, -1,
+                                        -32768, -16382, 5, 5, 5, -1, -7)
+        assert state == (-1, ((327680, -458752),))
+
+    def test_companding(self):
+        """Test u-law and A-law encoding"""
+        assert audioop_compat.lin2ulaw(FRAGMENT, 2) == b'\xff\xceN\x80\x00\xfe\xfe~'
+        assert audioop_compat.lin2alaw(FRAGMENT, 2) == b'\xd5\xfaz\xaa*\xd5\xd5U'
+
+    def test_invalid_parameters(self):
+        """Test bad widths and partial frames raise audioop errors"""
+        with pytest.raises(audioop_compat.error):
+            audioop_compat.rms(FRAGMENT, 5)
+        with pytest.raises(audioop_compat.error):
+            audioop_compat.rms(FRAGMENT[:3], 2)
+        with pytest.raises(audioop_compat.error):
+            audioop_compat.add(FRAGMENT, FRAGMENT[:4], 2)
+
+
+@pytest.mark.unit
+@pytest.mark.skipif(stdlib_audioop is None, reason='stdlib audioop is not available')
+class TestAudioopParity:
+    """Test the NumPy implementation matches the stdlib audioop module"""
+
+    @pytest.fixture
+    def fragments(self):
+        rng = random.Random(1234)
+        return [(width, os.urandom(rng.choice([0, 1, 7, 512]) * width)) for width in (1, 2, 3, 4)]
+
+    @pytest.mark.parametrize('name', ['max', 'minmax', 'avg', 'rms', 'avgpp', 'maxpp', 'cross',
+                                      'reverse', 'byteswap', 'lin2ulaw', 'lin2alaw', 'ulaw2lin', 'alaw2lin'])
+    def test_fragment_functions(self, name, fragments):
+        """Test functions taking a fragment and a width"""
+        for width, fragment in fragments:
+            assert getattr(audioop_compat, name)(fragment, width) == getattr(stdlib_audioop, name)(fragment, width)
+
+    def test_arithmetic(self, fragments):
+        """Test gain, mixing, bias and channel conversion"""
+        for width, fragment in fragments:
+            other = os.urandom(len(fragment))
+            assert audioop_compat.mul(fragment, width, -2.7) == stdlib_audioop.mul(fragment, width, -2.7)
+            assert audioop_compat.add(fragment, other, width) == stdlib_audioop.add(fragment, other, width)
+            assert audioop_compat.bias(fragment, width, 128) == stdlib_audioop.bias(fragment, width, 128)
+            assert audioop_compat.tostereo(fragment, width, 0.6, 1.4) == stdlib_audioop.tostereo(fragment, width, 0.6, 1.4)
+            if len(fragment) % (2 * width) == 0:
+                assert audioop_compat.tomono(fragment, width, 0.5, 0.5) == stdlib_audioop.tomono(fragment, width, 0.5, 0.5)
+            for newwidth in (1, 2, 3, 4):
+                assert audioop_compat.lin2lin(fragment, width, newwidth) == stdlib_audioop.lin2lin(fragment, width, newwidth)
+
+    @pytest.mark.parametrize('inrate,outrate', [(44100, 48000), (48000, 44100), (22050, 44100), (7, 2)])
+    def test_ratecv_chunked(self, inrate, outrate):
+        """Test rate conversion carries state across chunks"""
+        fragment = os.urandom(4 * 2000)
+        compat_state = stdlib_state = None
+        for start in range(0, len(fragment), 4 * 300):
+            chunk = fragment[start:start + 4 * 300]
+            compat, compat_state = audioop_compat.ratecv(chunk, 2, 2, inrate, outrate, compat_state)
+            stdlib, stdlib_state = stdlib_audioop.ratecv(chunk, 2, 2, inrate, outrate, stdlib_state)
+            assert compat == stdlib
+            assert compat_state == stdlib_state
+
+    def test_adpcm(self):
+        """Test ADPCM encoding and decoding with state"""
+        fragment = os.urandom(2 * 300)
+        encoded = stdlib_audioop.lin2adpcm(fragment, 2, None)
+        assert audioop_compat.lin2adpcm(fragment, 2, None) == encoded
+        assert audioop_compat.adpcm2lin(encoded[0], 2, None) == stdlib_audioop.adpcm2lin(encoded[0], 2, None)
+
+    def test_fit(self):
+        """Test the 16-bit fitting helpers"""
+        fragment = os.urandom(2 * 400)
+        reference = fragment[200:360]
+        assert audioop_compat.findfit(fragment, reference) == stdlib_audioop.findfit(fragment, reference)
+        assert audioop_compat.findmax(fragment, 50) == stdlib_audioop.findmax(fragment, 50)
+        assert audioop_compat.findfactor(reference, reference) == stdlib_audioop.findfactor(reference, reference)
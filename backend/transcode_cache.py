@@ -0,0 +1,190 @@
+import os
+import json
+import fcntl
+import hashlib
+import subprocess
+from contextlib import contextmanager
+from django.conf import settings
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Codecs a track can be transcoded to on request: ffmpeg encoder, muxer, extension and content type
+TRANSCODE_CODECS = {
+    'mp3': ('libmp3lame', 'mp3', 'mp3', 'audio/mpeg'),
+    'aac': ('aac', 'ipod', 'm4a', 'audio/mp4'),
+    'ogg': ('libvorbis', 'ogg', 'ogg', 'audio/ogg'),
+    'opus': ('libopus', 'ogg', 'opus', 'audio/ogg'),
+}
+
+STATS_FILE = 'stats.json'
+LOCK_FILE = '.lock'
+LOCK_DIR = 'locks'
+# Variants share a fixed set of lock files, so locks never outnumber this however many variants come and go
+LOCK_STRIPES = 64
+COUNTERS = ('hits', 'misses', 'coalesced', 'evictions', 'evicted_bytes')
+
+
+def transcode(source_path, output_path, codec, bitrate):
+    """Encode ``source_path`` into ``output_path`` with ffmpeg"""
+    encoder, muxer, _, _ = TRANSCODE_CODECS[codec]
+    command = [
+        settings.AUDIO_FFMPEG_BINARY, '-hide_banner', '-loglevel', 'error', '-y', '-i', source_path,
+        '-map', '0:a:0', '-vn', '-c:a', encoder, '-b:a', f"{bitrate}k", '-f', muxer,
+    ]
+    if muxer == 'ipod':
+        # Put the index first so players can start before the whole file arrives
+        command += ['-movflags', '+faststart']
+    result = subprocess.run(command + [output_path], capture_output=True, text=True)
+    if result.returncode != 0:
+        raise RuntimeError(f"ffmpeg transcode failed: {result.stderr.strip()}")
+
+
+def evict_lru(entries, max_bytes, keep=None):
+    """
+    Delete the least recently used of ``entries`` (os.DirEntry files, ordered by mtime) until
+    their total size fits ``max_bytes``. Returns (files removed, bytes removed, bytes left).
+    """
+    entries = sorted((entry.stat().st_mtime_ns, entry.stat().st_size, entry.path) for entry in entries)
+    total = sum(size for _, size, _ in entries)
+    removed = removed_bytes = 0
+    for _, size, path in entries:
+        if total <= max_bytes:
+            break
+        if path == keep:
+            continue
+        try:
+            os.unlink(path)
+        except FileNotFoundError:
+            pass
+        total -= size
+        removed += 1
+        removed_bytes += size
+        logger.info(f"Evicted cached {path} ({size} bytes)")
+    return removed, removed_bytes, total
+
+
+class TranscodeCache:
+    """
+    Bounded on-disk cache of transcoded track variants shared by every server process.
+
+    Entries are keyed by track, codec, bitrate and a version of the source file, so a
+    reprocessed track never serves stale audio. Reads touch an entry's mtime and eviction
+    removes the least recently used entries until the total size fits. A per-variant lock
+    (one of LOCK_STRIPES files) makes concurrent misses for the same variant wait for a
+    single ffmpeg run, and a cache-wide lock guards the size and counter bookkeeping kept
+    in ``stats.json``.
+    """
+
+    def __init__(self, root=None, max_bytes=None, transcoder=transcode):
+        self.root = root or settings.AUDIO_TRANSCODE_CACHE_DIR
+        self.max_bytes = settings.AUDIO_TRANSCODE_CACHE_SIZE if max_bytes is None else max_bytes
+        self.transcoder = transcoder
+        os.makedirs(os.path.join(self.root, LOCK_DIR), exist_ok=True)
+        if not os.path.exists(os.path.join(self.root, STATS_FILE)):
+            with self._locked(os.path.join(self.root, LOCK_FILE)):
+                self._write_stats(self._read_stats())
+
+    def entry_path(self, track_id, source_path, codec, bitrate):
+        stat = os.stat(source_path)
+        version = hashlib.sha1(f"{source_path}:{stat.st_size}:{stat.st_mtime_ns}".encode()).hexdigest()[:12]
+        extension = TRANSCODE_CODECS[codec][2]
+        return os.path.join(self.root, str(track_id), f"{codec}-{bitrate}k-{version}.{extension}")
+
+    def get(self, track_id, source_path, codec, bitrate):
+        """Path of the cached variant, transcoding it first on a miss"""
+        if codec not in TRANSCODE_CODECS:
+            raise ValueError(f"Unsupported codec: {codec}")
+        path = self.entry_path(track_id, source_path, codec, bitrate)
+        if self._touch(path):
+            self._record(hits=1)
+            return path
+
+        with self._locked(self._variant_lock(path)):
+            # Another request may have produced it while this one waited for the lock
+            if self._touch(path):
+                self._record(coalesced=1)
+                return path
+
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            partial = f"{path}.partial"
+            try:
+                self.transcoder(source_path, partial, codec, bitrate)
+                os.replace(partial, path)
+            finally:
+                if os.path.exists(partial):
+                    os.unlink(partial)
+
+            self._record(misses=1, added_bytes=os.path.getsize(path), keep=path)
+        return path
+
+    def stats(self):
+        """Counters and size accounting"""
+        with self._locked(os.path.join(self.root, LOCK_FILE)):
+            stats = self._read_stats()
+        stats['max_bytes'] = self.max_bytes
+        return stats
+
+    def _variant_lock(self, path):
+        stripe = int(hashlib.sha1(path.encode()).hexdigest()[:8], 16) % LOCK_STRIPES
+        return os.path.join(self.root, LOCK_DIR, f"{stripe:02d}.lock")
+
+    @staticmethod
+    def _touch(path):
+        try:
+            os.utime(path)
+            return True
+        except FileNotFoundError:
+            return False
+
+    @contextmanager
+    def _locked(self, lock_path):
+        with open(lock_path, 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _read_stats(self):
+        try:
+            with open(os.path.join(self.root, STATS_FILE)) as f:
+                stats = json.load(f)
+        except (FileNotFoundError, ValueError):
+            stats = {'bytes': self._scan_size()}
+        for counter in COUNTERS:
+            stats.setdefault(counter, 0)
+        return stats
+
+    def _write_stats(self, stats):
+        path = os.path.join(self.root, STATS_FILE)
+        with open(f"{path}.tmp", 'w') as f:
+            json.dump(stats, f)
+        os.replace(f"{path}.tmp", path)
+
+    def _record(self, added_bytes=0, keep=None, **counters):
+        with self._locked(os.path.join(self.root, LOCK_FILE)):
+            stats = self._read_stats()
+            for counter, value in counters.items():
+                stats[counter] += value
+            stats['bytes'] += added_bytes
+            if stats['bytes'] > self.max_bytes:
+                self._evict(stats, keep)
+            self._write_stats(stats)
+
+    def _entries(self):
+        for directory in os.scandir(self.root):
+            if not directory.is_dir() or directory.name == LOCK_DIR:
+                continue
+            for entry in os.scandir(directory.path):
+                if entry.is_file() and not entry.name.endswith('.partial'):
+                    yield entry
+
+    def _scan_size(self):
+        return sum(entry.stat().st_size for entry in self._entries())
+
+    def _evict(self, stats, keep=None):
+        """Delete least recently used entries until the cache fits; recounts the size while at it"""
+        removed, removed_bytes, stats['bytes'] = evict_lru(self._entries(), self.max_bytes, keep)
+        stats['evictions'] += removed
+        stats['evicted_bytes'] += removed_bytes
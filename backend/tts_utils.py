@@ -1,16 +1,122 @@
 import os
+import hashlib
+import subprocess
 import tempfile
+import threading
+import audioop_compat
+audioop_compat.install()
 from pydub import AudioSegment
+from pydub.generators import Sine
 from django.conf import settings
 import logging
 
 logger = logging.getLogger(__name__)
 
+# Bump when the announcement audio changes so stale disk renders are ignored
+ANNOUNCEMENT_VERSION = 2
+
+# Layouts rendered ahead of time by the render_announcements command
+COMMON_LAYOUTS = [
+    (44100, 2), (44100, 1), (48000, 2), (48000, 1), (32000, 2), (22050, 2), (22050, 1),
+]
+
+
 class SiteAnnouncementGenerator:
+    # Rendered announcements shared by every generator in the process,
+    # keyed by (voice_type, frame_rate, channels, sample_width)
+    _cache = {}
+    _cache_lock = threading.Lock()
+
     def __init__(self):
         self.site_name = "Ghettoselebu"
         self.site_tagline = "Your Music Platform"
     
+    def get_announcement(self, voice_type='female', frame_rate=44100, channels=2, sample_width=2):
+        """
+        Return the announcement as ready PCM in the requested layout.
+        Renders are cached per process and on disk, so the tones are synthesised once per layout.
+        """
+        key = (voice_type, frame_rate, channels, sample_width)
+        announcement = self._cache.get(key)
+        if announcement is not None:
+            return announcement
+
+        with self._cache_lock:
+            announcement = self._cache.get(key)
+            if announcement is None:
+                announcement = self._load_cached_render(key)
+                if announcement is None:
+                    announcement = self._render(key)
+                    self._store_cached_render(key, announcement)
+                self._cache[key] = announcement
+        return announcement
+
+    def _render(self, key):
+        voice_type, frame_rate, channels, sample_width = key
+        announcement = self._create_tone_sequence(frame_rate, sample_width)
+        return announcement.set_channels(channels)
+
+    def _cache_path(self, key):
+        voice_type, frame_rate, channels, sample_width = key
+        # Branding text is part of the name so changing it invalidates old renders
+        fingerprint = hashlib.sha1(
+            f"{ANNOUNCEMENT_VERSION}:{self.site_name}:{self.site_tagline}".encode('utf-8')
+        ).hexdigest()[:12]
+        filename = f"{voice_type}_{frame_rate}hz_{channels}ch_{sample_width * 8}bit_{fingerprint}.pcm"
+        return os.path.join(settings.AUDIO_ANNOUNCEMENT_CACHE_DIR, filename)
+
+    def _load_cached_render(self, key):
+        voice_type, frame_rate, channels, sample_width = key
+        try:
+            with open(self._cache_path(key), 'rb') as f:
+                data = f.read()
+            return AudioSegment(data=data, sample_width=sample_width, frame_rate=frame_rate, channels=channels)
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            logger.error(f"Error loading cached announcement: {e}")
+            return None
+
+    def _store_cached_render(self, key, announcement):
+        path = self._cache_path(key)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # Write then rename so concurrent workers never read a partial render
+            with tempfile.NamedTemporaryFile(dir=os.path.dirname(path), delete=False) as temp_file:
+                temp_file.write(announcement.raw_data)
+            os.replace(temp_file.name, path)
+        except Exception as e:
+            logger.error(f"Error caching announcement: {e}")
+
+    def get_announcement_mp3(self, frame_rate, channels, bitrate, voice_type='female'):
+        """
+        Path of the announcement encoded as a bare CBR MP3 (no tags, no Xing frame) at
+        ``bitrate`` kbps, for splicing in front of MP3s with the same layout.
+        Encoded once per layout and bitrate and kept next to the PCM renders.
+        """
+        key = (voice_type, frame_rate, channels, 2)
+        path = f"{os.path.splitext(self._cache_path(key))[0]}_{bitrate}k.mp3"
+        if os.path.exists(path):
+            return path
+
+        announcement = self.get_announcement(voice_type, frame_rate, channels, 2)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with tempfile.NamedTemporaryFile(dir=os.path.dirname(path), suffix='.mp3', delete=False) as temp_file:
+            temp_path = temp_file.name
+        command = [
+            settings.AUDIO_FFMPEG_BINARY, '-hide_banner', '-loglevel', 'error', '-y',
+            '-f', 's16le', '-ar', str(frame_rate), '-ac', str(channels), '-i', 'pipe:0',
+            '-c:a', 'libmp3lame', '-b:a', f"{bitrate}k",
+            '-write_xing', '0', '-id3v2_version', '0', '-write_id3v1', '0', '-f', 'mp3', temp_path,
+        ]
+        result = subprocess.run(command, input=announcement.raw_data, capture_output=True)
+        if result.returncode != 0:
+            os.unlink(temp_path)
+            raise RuntimeError(f"ffmpeg announcement encode failed: {result.stderr.decode(errors='replace').strip()}")
+        # Rename into place so concurrent workers never read a partial encode
+        os.replace(temp_path, path)
+        return path
+
     def create_announcement(self, voice_type='female'):
         """
         Create a site announcement audio file
@@ -18,14 +124,11 @@ class SiteAnnouncementGenerator:
         In production, this would use text-to-speech
         """
         try:
-            # Create a simple announcement tone
             # In production, you would use:
             # from gtts import gTTS
             # tts = gTTS(f"Welcome to {self.site_name}", lang='en', slow=False)
             # tts.save("announcement.mp3")
-            
-            # For now, create a simple tone sequence
-            announcement = self._create_tone_sequence()
+            announcement = self.get_announcement(voice_type)
             
             # Save to temporary file
             with tempfile.NamedTemporaryFile(suffix='.mp3', delete=False) as temp_file:
@@ -37,17 +140,20 @@ class SiteAnnouncementGenerator:
             logger.error(f"Error creating site announcement: {e}")
             return None
     
-    def _create_tone_sequence(self):
+    def _create_tone_sequence(self, frame_rate=44100, sample_width=2):
         """Create a simple tone sequence as announcement placeholder"""
+        def tone(freq, duration):
+            return Sine(freq, sample_rate=frame_rate, bit_depth=sample_width * 8).to_audio_segment(duration=duration)
+
         try:
             # Create a short intro tone
-            intro_tone = AudioSegment.sine(800, duration=200)  # Higher pitch
+            intro_tone = tone(800, 200)  # Higher pitch
             
             # Create a main tone
-            main_tone = AudioSegment.sine(600, duration=500)  # Medium pitch
+            main_tone = tone(600, 500)  # Medium pitch
             
             # Create an outro tone
-            outro_tone = AudioSegment.sine(400, duration=300)  # Lower pitch
+            outro_tone = tone(400, 300)  # Lower pitch
             
             # Combine tones
             announcement = intro_tone + main_tone + outro_tone
@@ -59,7 +165,7 @@ class SiteAnnouncementGenerator:
             
         except Exception as e:
             logger.error(f"Error creating tone sequence: {e}")
-            return AudioSegment.sine(440, duration=1000)  # Fallback tone
+            return tone(440, 1000)  # Fallback tone
     
     def create_custom_announcement(self, text, voice_type='female'):
         """
@@ -79,19 +185,16 @@ class SiteAnnouncementGenerator:
             else:
                 pitch = 440
             
-            announcement = AudioSegment.sine(pitch, duration=duration)
+            announcement = Sine(pitch).to_audio_segment(duration=duration)
             return announcement
             
         except Exception as e:
             logger.error(f"Error creating custom announcement: {e}")
-            return AudioSegment.sine(440, duration=1000)
+            return Sine(440).to_audio_segment(duration=1000)
     
-    def get_announcement_duration(self):
+    def get_announcement_duration(self, voice_type='female'):
         """Get the duration of the announcement in seconds"""
         try:
-            announcement = self.create_announcement()
-            if announcement:
-                return len(announcement) / 1000.0
+            return len(self.get_announcement(voice_type)) / 1000.0
+        except Exception:
             return 1.0  # Default 1 second
-        except:
-            return 1.0
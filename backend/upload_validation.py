@@ -0,0 +1,326 @@
+"""
+Fail-fast checks for uploaded audio, so broken files never reach the processing queue.
+
+The container is identified from magic bytes and its header parsed while the first chunks
+of an upload stream in, whatever content type the client claimed. Once the file is spooled,
+a handful of short excerpts are decoded and decimated, and one vectorized pass over that
+sample rejects uploads that are silent, heavily clipped or far off centre.
+"""
+import os
+import struct
+import subprocess
+import wave
+import numpy as np
+from django.conf import settings
+from django.core.files.uploadhandler import FileUploadHandler, StopUpload
+from mp3_splice import parse_header as parse_mp3_header
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Bytes of audio data (after any ID3v2 tag) the header checks look at
+HEAD_BYTES = 64 * 1024
+SAMPLE_RATE_RANGE = (8000, 192000)
+MAX_CHANNELS = 8
+# Samples within this fraction of full scale count as clipped
+CLIP_LEVEL = 0.999
+READ_SIZE = 1024 * 1024
+WAV_CODECS = {1: 'pcm', 3: 'pcm_float', 0xFFFE: 'pcm'}
+
+
+class UploadRejected(ValueError):
+    """An upload the site cannot process; ``reason`` is a stable code clients can act on"""
+
+    def __init__(self, reason, message, **details):
+        super().__init__(message)
+        self.reason = reason
+        self.message = message
+        self.details = details
+
+    def as_dict(self):
+        data = {'error': self.message, 'reason': self.reason}
+        if self.details:
+            data['details'] = self.details
+        return data
+
+
+def _id3_size(data):
+    """Length of a leading ID3v2 tag, header and footer included; 0 without one"""
+    if not data.startswith(b'ID3'):
+        return 0
+    size = (data[6] << 21) | (data[7] << 14) | (data[8] << 7) | data[9]
+    return 10 + size + (10 if data[5] & 0x10 else 0)
+
+
+def _checked(info):
+    rate, channels = info['sample_rate'], info['channels']
+    if not SAMPLE_RATE_RANGE[0] <= rate <= SAMPLE_RATE_RANGE[1] or not 1 <= channels <= MAX_CHANNELS:
+        raise UploadRejected(
+            'corrupt_header', f"The {info['format'].upper()} header describes {rate} Hz audio with {channels} channels",
+            sample_rate=rate, channels=channels,
+        )
+    return info
+
+
+def _riff_chunks(data, offset):
+    while offset + 8 <= len(data):
+        chunk_id, size = struct.unpack_from('<4sI', data, offset)
+        yield chunk_id, offset + 8, size
+        offset += 8 + size + (size & 1)
+
+
+def _wav_header(data):
+    for chunk_id, start, size in _riff_chunks(data, 12):
+        if chunk_id == b'fmt ':
+            if size < 16 or start + 16 > len(data):
+                break
+            audio_format, channels, rate, _, _, bits = struct.unpack_from('<HHIIHH', data, start)
+            codec = WAV_CODECS.get(audio_format, f"wav_{audio_format:#06x}")
+            return _checked({'format': 'wav', 'codec': codec, 'bits': bits, 'sample_rate': rate, 'channels': channels})
+    raise UploadRejected('corrupt_header', 'The WAV file has no format chunk')
+
+
+def _flac_header(data):
+    # STREAMINFO is always the first metadata block
+    if len(data) < 8 + 34 or data[4] & 0x7F != 0:
+        raise UploadRejected('corrupt_header', 'The FLAC file does not start with STREAMINFO')
+    packed = int.from_bytes(data[18:26], 'big')
+    return _checked({'format': 'flac', 'codec': 'flac',
+                     'sample_rate': packed >> 44, 'channels': ((packed >> 41) & 7) + 1})
+
+
+def _ogg_header(data):
+    if len(data) < 27:
+        raise UploadRejected('corrupt_header', 'The Ogg file ends inside its first page')
+    segments = data[26]
+    packet = data[27 + segments:27 + segments + sum(data[27:27 + segments])]
+    if packet.startswith(b'\x01vorbis') and len(packet) >= 16:
+        channels, rate = struct.unpack_from('<BI', packet, 11)
+        return _checked({'format': 'ogg', 'codec': 'vorbis', 'sample_rate': rate, 'channels': channels})
+    if packet.startswith(b'OpusHead') and len(packet) >= 10:
+        return _checked({'format': 'ogg', 'codec': 'opus', 'sample_rate': 48000, 'channels': packet[9]})
+    if packet.startswith(b'\x7fFLAC') and len(packet) >= 13 + 34:
+        return dict(_flac_header(b'fLaC' + packet[13:]), format='ogg')
+    raise UploadRejected('unsupported_format', 'The Ogg file does not carry Vorbis, Opus or FLAC audio')
+
+
+def _mp3_header(data, tagged):
+    # Two consecutive frame headers rule out a stray sync word
+    position = data.find(b'\xff')
+    while position != -1:
+        header = parse_mp3_header(data[position:position + 4])
+        if header and (position + header.length + 4 > len(data) or parse_mp3_header(data[position + header.length:position + header.length + 4])):
+            return _checked({'format': 'mp3', 'codec': 'mp3', 'sample_rate': header.sample_rate,
+                             'channels': header.channels})
+        position = data.find(b'\xff', position + 1)
+    if tagged:
+        raise UploadRejected('corrupt_header', 'The file has an ID3 tag but no MPEG audio frames after it')
+    raise UploadRejected('unsupported_format', 'The file is not MP3, WAV, FLAC or Ogg audio')
+
+
+def inspect_header(data, tagged=False):
+    """
+    Identify the container from the first bytes of audio data and read the sample rate and
+    channel count from its header. ``tagged`` says an ID3v2 tag was skipped before ``data``.
+    Raises UploadRejected for anything the site cannot process.
+    """
+    if not data:
+        raise UploadRejected('empty', 'The uploaded file is empty')
+    if data.startswith(b'RIFF') and data[8:12] == b'WAVE':
+        return _wav_header(data)
+    if data.startswith(b'fLaC'):
+        return _flac_header(data)
+    if data.startswith(b'OggS'):
+        return _ogg_header(data)
+    return _mp3_header(data, tagged)
+
+
+class HeaderSniffer:
+    """
+    Feed an upload's chunks as they arrive; the header is inspected as soon as HEAD_BYTES
+    of audio data are in. A leading ID3v2 tag (cover art and all) is skipped, not buffered.
+    """
+
+    def __init__(self):
+        self.info = None
+        self._buffer = bytearray()
+        self._tag_size = None
+        self._skipped = 0
+
+    def feed(self, chunk):
+        """Returns the header info once known; raises UploadRejected"""
+        if self.info is None:
+            self._buffer += chunk
+            if self._tag_size is None and len(self._buffer) >= 10:
+                self._tag_size = _id3_size(self._buffer)
+            if self._tag_size is not None:
+                skip = min(self._tag_size - self._skipped, len(self._buffer))
+                del self._buffer[:skip]
+                self._skipped += skip
+                if len(self._buffer) >= HEAD_BYTES:
+                    self.info = inspect_header(bytes(self._buffer[:HEAD_BYTES]), tagged=self._tag_size > 0)
+                    self._buffer = bytearray()
+        return self.info
+
+    def finish(self):
+        """Inspect what arrived of an upload shorter than the header window"""
+        if self.info is None:
+            if self._tag_size and self._skipped < self._tag_size:
+                raise UploadRejected('truncated', 'The file ends inside its ID3 tag')
+            self.info = inspect_header(bytes(self._buffer), tagged=bool(self._tag_size))
+            self._buffer = bytearray()
+        return self.info
+
+
+def sniff_file(path, available=None):
+    """
+    Header info of a spooled file from its first ``available`` bytes (default: all of them).
+    Returns None when those bytes end before the header window and more are still to come.
+    """
+    size = os.path.getsize(path)
+    available = size if available is None else min(available, size)
+    sniffer = HeaderSniffer()
+    with open(path, 'rb') as f:
+        remaining = available
+        while remaining and sniffer.info is None:
+            data = f.read(min(READ_SIZE, remaining))
+            if not data:
+                break
+            remaining -= len(data)
+            sniffer.feed(data)
+    if sniffer.info is None and available < size:
+        return None
+    return sniffer.finish()
+
+
+class AudioUploadHandler(FileUploadHandler):
+    """
+    Multipart upload handler that sniffs the audio file field chunk by chunk. A rejected
+    file stops the upload before the later handlers store any more of it; the view reads
+    ``rejection`` (or ``info``) after the request has been parsed.
+    """
+
+    def __init__(self, request=None, field_name='audio_file'):
+        super().__init__(request)
+        self.audio_field = field_name
+        self.sniffer = None
+        self.info = None
+        self.rejection = None
+
+    def new_file(self, field_name, *args, **kwargs):
+        super().new_file(field_name, *args, **kwargs)
+        self.sniffer = HeaderSniffer() if field_name == self.audio_field else None
+
+    def receive_data_chunk(self, raw_data, start):
+        if self.sniffer is not None and self.info is None:
+            try:
+                self.info = self.sniffer.feed(raw_data)
+            except UploadRejected as e:
+                self.rejection = e
+                self.sniffer = None
+                raise StopUpload(connection_reset=False)
+        return raw_data
+
+    def file_complete(self, file_size):
+        if self.sniffer is not None and self.info is None:
+            try:
+                self.info = self.sniffer.finish()
+            except UploadRejected as e:
+                self.rejection = e
+        self.sniffer = None
+        return None
+
+
+def _excerpts(duration, excerpts, seconds):
+    """(start, length) of evenly spread excerpts; short files are taken whole"""
+    if duration <= excerpts * seconds:
+        return [(0.0, duration)]
+    step = duration / excerpts
+    return [(index * step + (step - seconds) / 2, seconds) for index in range(excerpts)]
+
+
+def _wav_sample(path, excerpts, seconds, decimation):
+    with wave.open(path, 'rb') as wav:
+        if wav.getsampwidth() != 2:
+            return None
+        rate, channels, frames = wav.getframerate(), wav.getnchannels(), wav.getnframes()
+        blocks = []
+        for start, length in _excerpts(frames / rate, excerpts, seconds):
+            wav.setpos(int(start * rate))
+            data = wav.readframes(int(length * rate))
+            blocks.append(np.frombuffer(data[:len(data) - len(data) % (2 * channels)], dtype='<i2').reshape(-1, channels)[::decimation])
+    return np.concatenate(blocks) if blocks else np.zeros((0, channels), dtype=np.int16)
+
+
+def _ffmpeg_sample(path, info, duration, excerpts, seconds, decimation):
+    spans = _excerpts(duration, excerpts, seconds)
+    # One ffmpeg for every excerpt; seeking before each -i skips decoding the audio in between
+    command = [settings.AUDIO_FFMPEG_BINARY, '-hide_banner', '-loglevel', 'error']
+    for start, length in spans:
+        command += ['-ss', f"{start:.3f}", '-t', f"{length:.3f}", '-i', path]
+    command += [
+        '-filter_complex', ''.join(f"[{index}:a]" for index in range(len(spans))) + f"concat=n={len(spans)}:v=0:a=1",
+        '-f', 's16le', '-acodec', 'pcm_s16le', '-ac', str(info['channels']), 'pipe:1',
+    ]
+    result = subprocess.run(command, capture_output=True)
+    if result.returncode != 0:
+        raise UploadRejected('undecodable', 'The audio could not be decoded',
+                             detail=result.stderr.decode(errors='replace').strip()[-500:])
+    data = result.stdout[:len(result.stdout) - len(result.stdout) % (2 * info['channels'])]
+    return np.frombuffer(data, dtype=np.int16).reshape(-1, info['channels'])[::decimation]
+
+
+def scan_signal(samples):
+    """Level, clipping and DC offset of a (frames, channels) int16 sample; raises UploadRejected"""
+    if not len(samples):
+        raise UploadRejected('empty_audio', 'The file contains no audio')
+    x = samples.astype(np.float32) / 32768
+    rms = float(np.sqrt(np.mean(np.square(x))))
+    stats = {
+        'rms_dbfs': round(20 * float(np.log10(max(rms, 1e-10))), 1),
+        'clipped_ratio': round(float(np.mean(np.abs(x) >= CLIP_LEVEL)), 4),
+        'dc_offset': round(float(np.abs(x.mean(axis=0)).max()), 4),
+    }
+    if stats['rms_dbfs'] < settings.AUDIO_UPLOAD_SILENCE_DBFS:
+        raise UploadRejected('silent', 'The audio is silent', **stats)
+    if stats['clipped_ratio'] > settings.AUDIO_UPLOAD_CLIP_RATIO:
+        raise UploadRejected('clipped', 'The audio is heavily clipped', **stats)
+    if stats['dc_offset'] > settings.AUDIO_UPLOAD_DC_OFFSET:
+        raise UploadRejected('dc_offset', 'The audio has a large DC offset', **stats)
+    return stats
+
+
+def validate_upload(path, info=None):
+    """
+    Check a spooled upload before it is queued: its header (unless ``info`` from the streaming
+    sniff is given), then a decimated sample of its audio. Returns the header info with the
+    signal stats; raises UploadRejected.
+    """
+    from probe_utils import probe_audio
+
+    info = dict(info or sniff_file(path))
+    excerpts = settings.AUDIO_UPLOAD_SCAN_EXCERPTS
+    seconds = settings.AUDIO_UPLOAD_SCAN_SECONDS
+    decimation = settings.AUDIO_UPLOAD_SCAN_DECIMATION
+
+    samples = None
+    if info['format'] == 'wav' and info['codec'] == 'pcm' and info['bits'] == 16:
+        try:
+            # Plain 16-bit PCM is sampled straight from the file
+            samples = _wav_sample(path, excerpts, seconds, decimation)
+        except (wave.Error, EOFError):
+            samples = None
+    if samples is None:
+        try:
+            duration = probe_audio(path)['duration_ms'] / 1000
+        except ValueError as e:
+            raise UploadRejected('corrupt_header', str(e))
+        try:
+            samples = _ffmpeg_sample(path, info, duration, excerpts, seconds, decimation)
+        except FileNotFoundError:
+            # Without ffmpeg here the processing job reports decoding problems instead
+            logger.warning('ffmpeg is not available; skipping the upload signal scan')
+            return info
+
+    info['signal'] = scan_signal(samples)
+    return info
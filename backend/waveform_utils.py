@@ -0,0 +1,218 @@
+import os
+import struct
+import hashlib
+import numpy as np
+from django.conf import settings
+from django.core.files.base import ContentFile
+import audioop_compat
+audioop_compat.install()
+from pydub import AudioSegment
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Peak file layout (little-endian):
+#   header: magic, version, bits per value, level count, sample rate, frame count
+#   per level: samples per peak, peak count
+#   per level, in the same order: interleaved (min, max) pairs as int8 or int16
+MAGIC = b'GSPK'
+VERSION = 1
+HEADER = struct.Struct('<4sBBHIQ')
+LEVEL_HEADER = struct.Struct('<II')
+
+PEAK_DTYPES = {8: np.dtype('<i1'), 16: np.dtype('<i2')}
+SAMPLE_DTYPES = {1: np.int8, 2: np.int16, 4: np.int32}
+
+
+def compute_peaks(samples, sample_width, levels=None, bits=None):
+    """
+    Compute min/max peak pairs for each zoom level from interleaved PCM samples.
+
+    ``samples`` is a (frames, channels) integer array; channels are folded into one
+    envelope. Coarser levels are reduced from the previous level when they divide
+    evenly, so the full-resolution samples are scanned once. Returns a list of
+    (samples_per_peak, peaks) with peaks shaped (count, 2).
+    """
+    levels = sorted(levels or settings.AUDIO_WAVEFORM_LEVELS)
+    bits = bits or settings.AUDIO_WAVEFORM_BITS
+    if bits not in PEAK_DTYPES:
+        raise ValueError(f"Unsupported peak resolution: {bits} bits")
+
+    samples = np.asarray(samples)
+    if samples.ndim == 1:
+        samples = samples[:, None]
+    lows = samples.min(axis=1)
+    highs = samples.max(axis=1)
+
+    # Scale from the sample width down to the peak width with an arithmetic shift
+    shift = 8 * sample_width - bits
+    dtype = PEAK_DTYPES[bits]
+
+    result = []
+    previous = None
+    for samples_per_peak in levels:
+        if previous is not None and samples_per_peak % previous[0] == 0:
+            step = samples_per_peak // previous[0]
+            source_lows, source_highs = previous[1], previous[2]
+        else:
+            step = samples_per_peak
+            source_lows, source_highs = lows, highs
+
+        if source_lows.size:
+            starts = np.arange(0, source_lows.size, step)
+            level_lows = np.minimum.reduceat(source_lows, starts)
+            level_highs = np.maximum.reduceat(source_highs, starts)
+        else:
+            level_lows = level_highs = source_lows[:0]
+        previous = (samples_per_peak, level_lows, level_highs)
+
+        result.append((samples_per_peak, _scale_peaks(level_lows, level_highs, shift, dtype)))
+
+    return result
+
+
+def _scale_peaks(lows, highs, shift, dtype):
+    peaks = np.empty((lows.size, 2), dtype=dtype)
+    if shift >= 0:
+        peaks[:, 0] = lows.astype(np.int64) >> shift
+        peaks[:, 1] = highs.astype(np.int64) >> shift
+    else:
+        peaks[:, 0] = lows.astype(np.int64) << -shift
+        peaks[:, 1] = highs.astype(np.int64) << -shift
+    return peaks
+
+
+class PeakAccumulator:
+    """
+    Compute the same peak levels as ``compute_peaks`` from PCM fed in blocks.
+    Only the partial peak of each level is carried between blocks, never the samples.
+    """
+
+    def __init__(self, sample_width, levels=None, bits=None):
+        self.levels = sorted(levels or settings.AUDIO_WAVEFORM_LEVELS)
+        self.bits = bits or settings.AUDIO_WAVEFORM_BITS
+        if self.bits not in PEAK_DTYPES:
+            raise ValueError(f"Unsupported peak resolution: {self.bits} bits")
+        self.sample_width = sample_width
+        self.frame_count = 0
+        self._peaks = {level: ([], []) for level in self.levels}
+        self._carry = {level: None for level in self.levels}
+
+    def feed(self, samples):
+        """Add a (frames, channels) integer block"""
+        samples = np.asarray(samples)
+        if samples.ndim == 1:
+            samples = samples[:, None]
+        self.frame_count += len(samples)
+        lows = samples.min(axis=1)
+        highs = samples.max(axis=1)
+
+        for level in self.levels:
+            carry = self._carry[level]
+            level_lows, level_highs = (lows, highs) if carry is None else (
+                np.concatenate([carry[0], lows]), np.concatenate([carry[1], highs])
+            )
+            whole = level_lows.size - level_lows.size % level
+            if whole:
+                starts = np.arange(0, whole, level)
+                self._peaks[level][0].append(np.minimum.reduceat(level_lows[:whole], starts))
+                self._peaks[level][1].append(np.maximum.reduceat(level_highs[:whole], starts))
+            self._carry[level] = (level_lows[whole:], level_highs[whole:])
+
+    def result(self):
+        """Peak levels as (samples_per_peak, peaks) pairs, including each level's final partial peak"""
+        shift = 8 * self.sample_width - self.bits
+        dtype = PEAK_DTYPES[self.bits]
+        result = []
+        for level in self.levels:
+            level_lows, level_highs = self._peaks[level]
+            carry = self._carry[level]
+            if carry is not None and carry[0].size:
+                level_lows = level_lows + [carry[0].min(keepdims=True)]
+                level_highs = level_highs + [carry[1].max(keepdims=True)]
+            if level_lows:
+                lows, highs = np.concatenate(level_lows), np.concatenate(level_highs)
+            else:
+                lows = highs = np.empty(0, dtype=np.int64)
+            result.append((level, _scale_peaks(lows, highs, shift, dtype)))
+        return result
+
+
+def compute_audio_peaks(audio, levels=None, bits=None):
+    """Compute peak levels straight from a decoded pydub AudioSegment"""
+    if audio.sample_width not in SAMPLE_DTYPES:
+        audio = audio.set_sample_width(4)
+    samples = np.frombuffer(audio.raw_data, dtype=SAMPLE_DTYPES[audio.sample_width])
+    return compute_peaks(samples.reshape(-1, audio.channels), audio.sample_width, levels, bits)
+
+
+def encode_peaks(levels, sample_rate, frame_count):
+    """Serialize peak levels into the compact binary peak format"""
+    bits = levels[0][1].dtype.itemsize * 8 if levels else settings.AUDIO_WAVEFORM_BITS
+    parts = [HEADER.pack(MAGIC, VERSION, bits, len(levels), sample_rate, frame_count)]
+    parts.extend(LEVEL_HEADER.pack(samples_per_peak, len(peaks)) for samples_per_peak, peaks in levels)
+    parts.extend(np.ascontiguousarray(peaks, dtype=PEAK_DTYPES[bits]).tobytes() for _, peaks in levels)
+    return b''.join(parts)
+
+
+def decode_peaks(data):
+    """Parse the binary peak format; peak arrays are views over ``data``"""
+    magic, version, bits, level_count, sample_rate, frame_count = HEADER.unpack_from(data, 0)
+    if magic != MAGIC or version != VERSION or bits not in PEAK_DTYPES:
+        raise ValueError('Not a waveform peak file')
+
+    offset = HEADER.size
+    level_headers = []
+    for _ in range(level_count):
+        level_headers.append(LEVEL_HEADER.unpack_from(data, offset))
+        offset += LEVEL_HEADER.size
+
+    dtype = PEAK_DTYPES[bits]
+    levels = []
+    for samples_per_peak, count in level_headers:
+        peaks = np.frombuffer(data, dtype=dtype, count=count * 2, offset=offset).reshape(count, 2)
+        offset += peaks.nbytes
+        levels.append((samples_per_peak, peaks))
+
+    return {
+        'bits': bits,
+        'sample_rate': sample_rate,
+        'frame_count': frame_count,
+        'levels': levels,
+    }
+
+
+def waveform_file(audio):
+    """Peak file for a decoded segment, named after its content so URLs can be cached forever"""
+    return peak_file(compute_audio_peaks(audio), audio.frame_rate, int(audio.frame_count()))
+
+
+def peak_file(levels, sample_rate, frame_count):
+    """Encode peak levels as a content-named (name, ContentFile) pair"""
+    data = encode_peaks(levels, sample_rate, frame_count)
+    name = f"{hashlib.sha1(data).hexdigest()[:16]}.peaks"
+    return name, ContentFile(data)
+
+
+def generate_track_waveform(track_id, force=False):
+    """Decode a stored track and attach its peak file; used by the backfill command"""
+    from music.models import Track
+
+    track = Track.objects.get(pk=track_id)
+    if track.waveform and not force:
+        return 'skipped'
+
+    audio_field = track.optimized_file or track.audio_file
+    if not audio_field:
+        return 'missing'
+
+    audio_path = os.path.join(settings.MEDIA_ROOT, audio_field.name)
+    if not os.path.exists(audio_path):
+        return 'missing'
+
+    name, content = waveform_file(AudioSegment.from_file(audio_path))
+    if track.waveform:
+        track.waveform.delete(save=False)
+    track.waveform.save(name, content, save=False)
+    track.save(update_fields=['waveform'])
+    return 'generated'
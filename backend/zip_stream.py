@@ -0,0 +1,183 @@
+import os
+import re
+import time
+import zlib
+import struct
+from django.conf import settings
+import logging
+
+logger = logging.getLogger(__name__)
+
+READ_SIZE = 64 * 1024
+
+# Stored entries with a data descriptor: the CRC is computed while the file is sent,
+# so nothing is read twice and the archive length follows from the file sizes alone
+FLAGS = 0x0808                  # data descriptor follows the data, names are UTF-8
+VERSION = 20
+VERSION_ZIP64 = 45
+ZIP64_LIMIT = 0xFFFFFFFF
+ZIP64_ENTRY_LIMIT = 0xFFFF
+EXTERNAL_ATTRIBUTES = 0o100644 << 16
+
+LOCAL_HEADER = struct.Struct('<IHHHHHIIIHH')
+CENTRAL_HEADER = struct.Struct('<IHHHHHHIIIHHHHHII')
+DESCRIPTOR = struct.Struct('<IIII')
+DESCRIPTOR_ZIP64 = struct.Struct('<IIQQ')
+LOCAL_ZIP64_EXTRA = struct.Struct('<HHQQ')
+CENTRAL_ZIP64_EXTRA = struct.Struct('<HHQQQ')
+END_RECORD = struct.Struct('<IHHHHIIH')
+END_RECORD_ZIP64 = struct.Struct('<IQHHIIQQQQ')
+END_LOCATOR_ZIP64 = struct.Struct('<IIQI')
+
+UNSAFE_NAME_CHARACTERS = re.compile(r'[\\/:*?"<>|\x00-\x1f]+')
+
+
+def dos_datetime(timestamp):
+    """ZIP (date, time) fields for a Unix timestamp; ZIP cannot store dates before 1980"""
+    t = time.localtime(max(timestamp, 315532800))
+    return ((t.tm_year - 1980) << 9) | (t.tm_mon << 5) | t.tm_mday, (t.tm_hour << 11) | (t.tm_min << 5) | (t.tm_sec // 2)
+
+
+def safe_name(name):
+    return UNSAFE_NAME_CHARACTERS.sub('_', name).strip(' .') or 'untitled'
+
+
+class ZipEntry:
+    """A file to be stored in the archive under ``name``; its size is read once, up front"""
+
+    def __init__(self, name, path):
+        self.name = name
+        self.path = path
+        stat = os.stat(path)
+        self.size = stat.st_size
+        self.date, self.time = dos_datetime(stat.st_mtime)
+        self.encoded_name = name.encode('utf-8')
+        self.offset = 0
+        self.crc = 0
+        self.force_zip64 = False
+
+    def zip64(self):
+        return self.force_zip64 or self.size >= ZIP64_LIMIT or self.offset >= ZIP64_LIMIT
+
+    def local_header(self):
+        if self.zip64():
+            extra = LOCAL_ZIP64_EXTRA.pack(0x0001, 16, 0, 0)
+            sizes, version = ZIP64_LIMIT, VERSION_ZIP64
+        else:
+            extra, sizes, version = b'', 0, VERSION
+        return LOCAL_HEADER.pack(
+            0x04034b50, version, FLAGS, 0, self.time, self.date, 0, sizes, sizes,
+            len(self.encoded_name), len(extra),
+        ) + self.encoded_name + extra
+
+    def descriptor(self):
+        if self.zip64():
+            return DESCRIPTOR_ZIP64.pack(0x08074b50, self.crc, self.size, self.size)
+        return DESCRIPTOR.pack(0x08074b50, self.crc, self.size, self.size)
+
+    def central_header(self):
+        if self.zip64():
+            extra = CENTRAL_ZIP64_EXTRA.pack(0x0001, 24, self.size, self.size, self.offset)
+            size = offset = ZIP64_LIMIT
+            version = VERSION_ZIP64
+        else:
+            extra, size, offset, version = b'', self.size, self.offset, VERSION
+        return CENTRAL_HEADER.pack(
+            0x02014b50, VERSION_ZIP64, version, FLAGS, 0, self.time, self.date, self.crc, size, size,
+            len(self.encoded_name), len(extra), 0, 0, 0, EXTERNAL_ATTRIBUTES, offset,
+        ) + self.encoded_name + extra
+
+    def record_size(self):
+        """Bytes the entry takes in the archive: local header, data and descriptor"""
+        return len(self.local_header()) + self.size + len(self.descriptor())
+
+
+class ZipStream:
+    """
+    An uncompressed ZIP archive generated on the fly from files on disk.
+
+    Audio does not compress, so entries are stored and their layout is fixed by the file
+    sizes: ``size`` is exact before a byte is sent, which lets the response carry a
+    Content-Length. ZIP64 records are used only where an entry, an offset or the entry
+    count outgrows the classic format, or everywhere with ``force_zip64``. Memory use is
+    one read buffer.
+    """
+
+    def __init__(self, entries, force_zip64=False):
+        self.entries = list(entries)
+        self.force_zip64 = force_zip64
+        offset = 0
+        for entry in self.entries:
+            entry.offset = offset
+            entry.force_zip64 = force_zip64
+            offset += entry.record_size()
+        self.directory_offset = offset
+        self.directory_size = sum(len(entry.central_header()) for entry in self.entries)
+        self.size = offset + self.directory_size + len(self.end_records())
+
+    def zip64(self):
+        return (self.force_zip64 or len(self.entries) >= ZIP64_ENTRY_LIMIT or self.directory_offset >= ZIP64_LIMIT
+                or self.directory_size >= ZIP64_LIMIT)
+
+    def end_records(self):
+        count = len(self.entries)
+        if not self.zip64():
+            return END_RECORD.pack(0x06054b50, 0, 0, count, count, self.directory_size, self.directory_offset, 0)
+        record_offset = self.directory_offset + self.directory_size
+        return (
+            END_RECORD_ZIP64.pack(
+                0x06064b50, END_RECORD_ZIP64.size - 12, VERSION_ZIP64, VERSION_ZIP64, 0, 0,
+                count, count, self.directory_size, self.directory_offset,
+            )
+            + END_LOCATOR_ZIP64.pack(0x07064b50, 0, record_offset, 1)
+            + END_RECORD.pack(0x06054b50, 0, 0, ZIP64_ENTRY_LIMIT, ZIP64_ENTRY_LIMIT, ZIP64_LIMIT, ZIP64_LIMIT, 0)
+        )
+
+    def __iter__(self):
+        for entry in self.entries:
+            yield entry.local_header()
+            crc = 0
+            remaining = entry.size
+            with open(entry.path, 'rb') as f:
+                while remaining:
+                    data = f.read(min(READ_SIZE, remaining))
+                    if not data:
+                        # The promised Content-Length can no longer be met; fail the response
+                        raise RuntimeError(f"{entry.path} shrank while it was being archived")
+                    crc = zlib.crc32(data, crc)
+                    remaining -= len(data)
+                    yield data
+            entry.crc = crc
+            yield entry.descriptor()
+
+        for entry in self.entries:
+            yield entry.central_header()
+        yield self.end_records()
+
+
+def track_entries(tracks, folder, numbered=True):
+    """
+    ZIP entries for the tracks' uploaded files under ``folder``, in the given order.
+    Tracks whose file is missing are left out; names are made unique.
+    """
+    entries = []
+    used = set()
+    for number, track in enumerate(tracks, start=1):
+        if not track.audio_file:
+            continue
+        path = os.path.join(settings.MEDIA_ROOT, track.audio_file.name)
+        if not os.path.isfile(path):
+            logger.warning(f"Track {track.pk} left out of {folder}.zip: {path} is missing")
+            continue
+        extension = os.path.splitext(path)[1].lower()
+        stem = safe_name(f"{track.artist.name} - {track.title}")
+        if numbered:
+            stem = f"{number:02d} - {stem}"
+        name = f"{safe_name(folder)}/{stem}{extension}"
+        duplicate = 1
+        while name.lower() in used:
+            duplicate += 1
+            name = f"{safe_name(folder)}/{stem} ({duplicate}){extension}"
+        used.add(name.lower())
+        entries.append(ZipEntry(name, path))
+    return entries